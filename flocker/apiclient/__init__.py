@@ -7,10 +7,12 @@ This may eventually be a standalone package.
 """
 
 from ._client import (
-    IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetState,
-    DatasetAlreadyExists, FlockerClient, Lease, LeaseAlreadyHeld,
+    IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetChanges,
+    DatasetState, DatasetStateListing, DatasetAlreadyExists, DatasetNotFound,
+    FlockerClient, Lease, LeaseAlreadyHeld, connection_pool,
 )
 
 __all__ = ["IFlockerAPIV1Client", "FakeFlockerClient", "Dataset",
-           "DatasetState", "DatasetAlreadyExists", "FlockerClient",
-           "Lease", "LeaseAlreadyHeld"]
+           "DatasetChanges", "DatasetState", "DatasetStateListing",
+           "DatasetAlreadyExists", "DatasetNotFound", "FlockerClient", "Lease",
+           "LeaseAlreadyHeld", "connection_pool"]
@@ -12,14 +12,15 @@ from pytz import UTC
 
 from zope.interface import Interface, implementer
 
-from pyrsistent import PClass, field, pmap_field, pmap
+from pyrsistent import PClass, field, pmap_field, pmap, pvector_field
 
 from eliot import ActionType, Field
 from eliot.twisted import DeferredContext
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import Deferred, succeed, fail
 from twisted.python.filepath import FilePath
-from twisted.web.http import CREATED, OK, CONFLICT
+from twisted.web.client import HTTPConnectionPool
+from twisted.web.http import CREATED, OK, CONFLICT, NOT_FOUND, NOT_MODIFIED
 
 from treq import json_content, content
 
@@ -39,6 +40,39 @@ _LOG_HTTP_REQUEST = ActionType(
 
 NoneType = type(None)
 
+# How many seconds to ask the server to hold a watch request for before
+# giving up and asking again:
+_WATCH_WAIT = 30
+
+# The default limits of a pool of persistent connections to the control
+# service: how many idle connections to keep and for how many seconds.
+DEFAULT_MAX_PERSISTENT_CONNECTIONS = 4
+DEFAULT_PERSISTENT_CONNECTION_TIMEOUT = 120
+
+
+def connection_pool(reactor,
+                    max_connections=DEFAULT_MAX_PERSISTENT_CONNECTIONS,
+                    timeout=DEFAULT_PERSISTENT_CONNECTION_TIMEOUT):
+    """
+    Create a pool of persistent connections for ``FlockerClient``.
+
+    Reusing connections saves a TCP connection and a TLS handshake, with
+    verification of both parties' certificates, on all but the first of
+    a series of requests.  A pool can be shared by several clients.
+
+    :param reactor: Reactor to use for connections.
+    :param int max_connections: The maximum number of idle connections to
+        keep open.
+    :param timeout: The number of seconds after which an idle connection
+        is closed.
+
+    :return: ``HTTPConnectionPool``.
+    """
+    pool = HTTPConnectionPool(reactor, persistent=True)
+    pool.maxPersistentPerHost = max_connections
+    pool.cachedConnectionTimeout = timeout
+    return pool
+
 
 class Dataset(PClass):
     """
@@ -74,6 +108,33 @@ class DatasetState(PClass):
     path = field(type=(FilePath, NoneType), mandatory=True)
 
 
+class DatasetStateListing(PClass):
+    """
+    The state of all the datasets in the cluster at one time.
+
+    :attr version: An opaque identifier of this version of the cluster
+        state, for passing to ``watch_datasets_state``, or ``None`` if the
+        server doesn't identify versions.  The state can't be watched then
+        and callers must poll it instead, waiting between requests.
+    :attr datasets: The ``DatasetState`` of each dataset.
+    """
+    version = field(mandatory=True)
+    datasets = pvector_field(DatasetState)
+
+
+class DatasetChanges(PClass):
+    """
+    The datasets changed by ``update_datasets``.
+
+    :attr created: The ``Dataset`` of each dataset created.
+    :attr moved: The ``Dataset`` of each dataset moved.
+    :attr deleted: The ``Dataset`` of each dataset deleted.
+    """
+    created = pvector_field(Dataset)
+    moved = pvector_field(Dataset)
+    deleted = pvector_field(Dataset)
+
+
 class Lease(PClass):
     """
     A lease on a dataset.
@@ -94,6 +155,12 @@ class DatasetAlreadyExists(Exception):
     """
 
 
+class DatasetNotFound(Exception):
+    """
+    No dataset with the given ID exists.
+    """
+
+
 class LeaseAlreadyHeld(Exception):
     """
     A lease exists for the specified dataset ID on a different node.
@@ -142,6 +209,22 @@ class IFlockerAPIV1Client(Interface):
         been deleted, after the configuration has been updated.
         """
 
+    def update_datasets(create=(), move=pmap(), delete=()):
+        """
+        Create, move and delete many datasets as a single change to the
+        configuration.  Either all of the changes are made or none are.
+
+        :param create: Iterable of ``Dataset`` to create.
+        :param move: Mapping from the UUID of each dataset to move to the
+            UUID of the node where it should manifest.
+        :param delete: Iterable of the UUIDs of datasets to delete.
+
+        :return: ``Deferred`` that fires after the configuration has been
+            updated with the resulting ``DatasetChanges``, or errbacking
+            with ``DatasetAlreadyExists`` or, if a dataset to move or delete
+            doesn't exist, ``DatasetNotFound``.
+        """
+
     def list_datasets_configuration():
         """
         Return the configured datasets, excluding any datasets that
@@ -157,6 +240,20 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with iterable of ``DatasetState``.
         """
 
+    def watch_datasets_state(version=None):
+        """
+        Return the actual datasets in the cluster once they have changed.
+
+        :param version: ``None`` to return the current datasets straight
+            away.  Otherwise the ``version`` of an earlier
+            ``DatasetStateListing``, to wait until the state differs from
+            that one.  Since a ``None`` version returns straight away,
+            callers watching for a change must wait before asking again if
+            a listing has no version.
+
+        :return: ``Deferred`` firing with a ``DatasetStateListing``.
+        """
+
     def acquire_lease(dataset_id, node_uuid, expires):
         """
         Acquire a lease on a dataset on a given node.
@@ -202,6 +299,8 @@ class FakeFlockerClient(object):
     def __init__(self):
         self._configured_datasets = pmap()
         self._leases = LeasesModel()
+        self._state_version = 0
+        self._state_watchers = []
         self.synchronize_state()
 
     def create_dataset(self, primary, maximum_size=None, dataset_id=None,
@@ -229,12 +328,48 @@ class FakeFlockerClient(object):
             [dataset_id, "primary"], primary)
         return succeed(self._configured_datasets[dataset_id])
 
+    def update_datasets(self, create=(), move=pmap(), delete=()):
+        configured = self._configured_datasets.evolver()
+        created = []
+        for dataset in create:
+            if dataset.dataset_id in configured:
+                return fail(DatasetAlreadyExists())
+            configured[dataset.dataset_id] = dataset
+            created.append(dataset)
+        moved = []
+        for dataset_id, primary in move.items():
+            if dataset_id not in configured:
+                return fail(DatasetNotFound())
+            configured[dataset_id] = configured[dataset_id].set(
+                primary=primary)
+            moved.append(configured[dataset_id])
+        deleted = []
+        for dataset_id in delete:
+            if dataset_id not in configured:
+                return fail(DatasetNotFound())
+            deleted.append(configured[dataset_id])
+            configured.remove(dataset_id)
+        self._configured_datasets = configured.persistent()
+        return succeed(
+            DatasetChanges(created=created, moved=moved, deleted=deleted))
+
     def list_datasets_configuration(self):
         return succeed(self._configured_datasets.values())
 
     def list_datasets_state(self):
         return succeed(self._state_datasets)
 
+    def _state_listing(self):
+        return DatasetStateListing(
+            version=self._state_version, datasets=self._state_datasets)
+
+    def watch_datasets_state(self, version=None):
+        if version != self._state_version:
+            return succeed(self._state_listing())
+        watching = Deferred()
+        self._state_watchers.append(watching)
+        return watching
+
     def synchronize_state(self):
         """
         Copy configuration into state.
@@ -246,6 +381,10 @@ class FakeFlockerClient(object):
                 maximum_size=dataset.maximum_size,
                 path=FilePath(b"/flocker").child(bytes(dataset.dataset_id)))
             for dataset in self._configured_datasets.values()]
+        self._state_version += 1
+        watchers, self._state_watchers = self._state_watchers, []
+        for watching in watchers:
+            watching.callback(self._state_listing())
 
     def acquire_lease(self, dataset_id, node_uuid, expires):
         try:
@@ -291,7 +430,7 @@ class FlockerClient(object):
     A client for the Flocker V1 REST API.
     """
     def __init__(self, reactor, host, port,
-                 ca_cluster_path, cert_path, key_path):
+                 ca_cluster_path, cert_path, key_path, pool=None):
         """
         :param reactor: Reactor to use for connections.
         :param bytes host: Host to connect to.
@@ -299,9 +438,12 @@ class FlockerClient(object):
         :param FilePath ca_cluster_path: Path to cluster's CA certificate.
         :param FilePath cert_path: Path to user certificate.
         :param FilePath key_path: Path to user private key.
+        :param pool: The ``HTTPConnectionPool`` to use (see
+            ``connection_pool``), or ``None`` to make a new connection for
+            each request.
         """
         self._treq = treq_with_authentication(reactor, ca_cluster_path,
-                                              cert_path, key_path)
+                                              cert_path, key_path, pool)
         self._base_url = b"https://%s:%d/v1" % (host, port)
 
     def _request(self, method, path, body, success_codes, error_codes=None):
@@ -318,6 +460,26 @@ class FlockerClient(object):
 
         :return: ``Deferred`` firing with decoded JSON.
         """
+        request = self._request_with_headers(
+            method, path, body, success_codes, error_codes)
+        request.addCallback(lambda (headers, json_body): json_body)
+        return request
+
+    def _request_with_headers(self, method, path, body, success_codes,
+                              error_codes=None, headers=None):
+        """
+        Send a HTTP request to the Flocker API, return the response headers
+        and decoded JSON body.
+
+        :param headers: ``None`` or a ``dict`` of additional request
+            headers.
+
+        See ``_request`` for the other parameters.
+
+        :return: ``Deferred`` firing with a two-tuple of the response
+            ``Headers`` and the decoded JSON, or ``None`` for a
+            ``NOT_MODIFIED`` response.
+        """
         url = self._base_url + path
         action = _LOG_HTTP_REQUEST(url=url, method=method, request_body=body)
 
@@ -332,7 +494,12 @@ class FlockerClient(object):
         def got_result(result):
             if result.code in success_codes:
                 action.addSuccessFields(response_code=result.code)
-                return json_content(result)
+                if result.code == NOT_MODIFIED:
+                    d = succeed(None)
+                else:
+                    d = json_content(result)
+                d.addCallback(lambda json_body: (result.headers, json_body))
+                return d
             else:
                 d = content(result)
                 d.addCallback(error, result.code)
@@ -340,7 +507,8 @@ class FlockerClient(object):
 
         # Serialize the current task ID so we can trace logging across
         # processes:
-        headers = {b"X-Eliot-Task-Id": action.serialize_task_id()}
+        headers = dict(headers or {})
+        headers[b"X-Eliot-Task-Id"] = action.serialize_task_id()
         data = None
         if body is not None:
             headers["content-type"] = b"application/json"
@@ -348,16 +516,13 @@ class FlockerClient(object):
 
         with action.context():
             request = DeferredContext(self._treq.request(
-                method, url,
-                data=data, headers=headers,
-                # Keep tests from having dirty reactor problems:
-                persistent=False
-                ))
+                method, url, data=data, headers=headers,
+            ))
         request.addCallback(got_result)
 
-        def got_body(json_body):
-            action.addSuccessFields(response_body=json_body)
-            return json_body
+        def got_body(result):
+            action.addSuccessFields(response_body=result[1])
+            return result
         request.addCallback(got_body)
         request.addActionFinish()
         return request.result
@@ -402,6 +567,40 @@ class FlockerClient(object):
         request.addCallback(self._parse_configuration_dataset)
         return request
 
+    def update_datasets(self, create=(), move=pmap(), delete=()):
+        created = []
+        for dataset in create:
+            change = {u"primary": unicode(dataset.primary),
+                      u"dataset_id": unicode(dataset.dataset_id),
+                      u"metadata": dict(dataset.metadata)}
+            if dataset.maximum_size is not None:
+                change[u"maximum_size"] = dataset.maximum_size
+            created.append(change)
+        changes = {
+            u"create": created,
+            u"update": [
+                {u"dataset_id": unicode(dataset_id),
+                 u"primary": unicode(primary)}
+                for (dataset_id, primary) in move.items()
+            ],
+            u"delete": [unicode(dataset_id) for dataset_id in delete],
+        }
+        request = self._request(b"POST", b"/configuration/datasets/bulk",
+                                changes, {OK},
+                                {CONFLICT: DatasetAlreadyExists,
+                                 NOT_FOUND: DatasetNotFound})
+        request.addCallback(
+            lambda result: DatasetChanges(
+                created=map(self._parse_configuration_dataset,
+                            result[u"created"]),
+                moved=map(self._parse_configuration_dataset,
+                          result[u"updated"]),
+                deleted=map(self._parse_configuration_dataset,
+                            result[u"deleted"]),
+            )
+        )
+        return request
+
     def list_datasets_configuration(self):
         request = self._request(b"GET", b"/configuration/datasets", None, {OK})
         request.addCallback(
@@ -413,24 +612,51 @@ class FlockerClient(object):
         )
         return request
 
-    def list_datasets_state(self):
-        request = self._request(b"GET", b"/state/datasets", None, {OK})
+    def _parse_dataset_state(self, dataset_dict):
+        """
+        Convert a dictionary decoded from JSON with a dataset's state.
 
-        def parse_dataset_state(dataset_dict):
-            primary = dataset_dict.get(u"primary")
-            if primary is not None:
-                primary = UUID(primary)
-            path = dataset_dict.get(u"path")
-            if path is not None:
-                path = FilePath(path)
-            return DatasetState(primary=primary,
-                                maximum_size=dataset_dict.get(
-                                    u"maximum_size", None),
-                                dataset_id=UUID(dataset_dict[u"dataset_id"]),
-                                path=path)
+        :param dataset_dict: Dictionary describing a dataset.
+        :return: ``DatasetState`` instance.
+        """
+        primary = dataset_dict.get(u"primary")
+        if primary is not None:
+            primary = UUID(primary)
+        path = dataset_dict.get(u"path")
+        if path is not None:
+            path = FilePath(path)
+        return DatasetState(primary=primary,
+                            maximum_size=dataset_dict.get(
+                                u"maximum_size", None),
+                            dataset_id=UUID(dataset_dict[u"dataset_id"]),
+                            path=path)
 
+    def list_datasets_state(self):
+        request = self._request(b"GET", b"/state/datasets", None, {OK})
         request.addCallback(
-            lambda results: [parse_dataset_state(d) for d in results])
+            lambda results: [self._parse_dataset_state(d) for d in results])
+        return request
+
+    def watch_datasets_state(self, version=None):
+        # The version is the entity tag of the response.  Until it changes
+        # the server holds conditional requests for up to the given wait
+        # and then tells us nothing was modified, so we ask again.
+        headers = {}
+        if version is not None:
+            headers = {b"if-none-match": [version],
+                       b"prefer": [b"wait=%d" % (_WATCH_WAIT,)]}
+        request = self._request_with_headers(
+            b"GET", b"/state/datasets", None, {OK, NOT_MODIFIED},
+            headers=headers)
+
+        def got_result((response_headers, results)):
+            if results is None:
+                return self.watch_datasets_state(version)
+            return DatasetStateListing(
+                version=response_headers.getRawHeaders(b"etag", [None])[0],
+                datasets=[self._parse_dataset_state(d) for d in results],
+            )
+        request.addCallback(got_result)
         return request
 
     def _parse_lease(self, dictionary):
@@ -25,8 +25,9 @@ from twisted.internet.defer import gatherResults
 
 from .._client import (
     IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetAlreadyExists,
-    DatasetState, FlockerClient, ResponseError, _LOG_HTTP_REQUEST,
-    Lease, LeaseAlreadyHeld,
+    DatasetNotFound, DatasetChanges, DatasetState, FlockerClient,
+    ResponseError,
+    _LOG_HTTP_REQUEST, Lease, LeaseAlreadyHeld, connection_pool,
 )
 from ...ca import rest_api_context_factory
 from ...ca.testtools import get_credential_sets
@@ -242,6 +243,115 @@ def make_clientv1_tests():
             d.addCallback(got_listing)
             return d
 
+        def test_update_datasets(self):
+            """
+            ``update_datasets`` creates, moves and deletes datasets and
+            returns the changed datasets.
+            """
+            moving = Dataset(dataset_id=uuid4(), primary=self.node_1,
+                             maximum_size=DATASET_SIZE)
+            deleting = Dataset(dataset_id=uuid4(), primary=self.node_1,
+                               maximum_size=DATASET_SIZE)
+            creating = Dataset(dataset_id=uuid4(), primary=self.node_2,
+                               maximum_size=DATASET_SIZE,
+                               metadata={u"hello": u"there"})
+            d = self.assert_creates(self.client, primary=self.node_1,
+                                    maximum_size=DATASET_SIZE,
+                                    dataset_id=moving.dataset_id)
+            d.addCallback(lambda _: self.assert_creates(
+                self.client, primary=self.node_1, maximum_size=DATASET_SIZE,
+                dataset_id=deleting.dataset_id))
+            d.addCallback(lambda _: self.client.update_datasets(
+                create=[creating],
+                move={moving.dataset_id: self.node_2},
+                delete=[deleting.dataset_id],
+            ))
+
+            def got_result(changes):
+                listed = self.client.list_datasets_configuration()
+                listed.addCallback(lambda l: (changes, set(l)))
+                return listed
+            d.addCallback(got_result)
+
+            moved = moving.set(primary=self.node_2)
+            d.addCallback(self.assertEqual, (
+                DatasetChanges(
+                    created=[creating], moved=[moved], deleted=[deleting]),
+                {creating, moved},
+            ))
+            return d
+
+        def test_update_datasets_conflicting_dataset_id(self):
+            """
+            If ``update_datasets`` would create a dataset with the same
+            ``dataset_id`` as an existing one the result is
+            ``DatasetAlreadyExists`` and none of the changes are made.
+            """
+            d = self.assert_creates(self.client, primary=self.node_1,
+                                    maximum_size=DATASET_SIZE)
+
+            def got_result(existing):
+                updating = self.client.update_datasets(
+                    create=[
+                        Dataset(dataset_id=uuid4(), primary=self.node_1,
+                                maximum_size=DATASET_SIZE),
+                        existing.set(primary=self.node_2),
+                    ],
+                )
+                updating = self.assertFailure(updating, DatasetAlreadyExists)
+                updating.addCallback(
+                    lambda _: self.client.list_datasets_configuration())
+                updating.addCallback(
+                    lambda l: self.assertEqual([existing], list(l)))
+                return updating
+            d.addCallback(got_result)
+            return d
+
+        def assert_update_not_found(self, **kwargs):
+            """
+            Assert that ``update_datasets`` fails with ``DatasetNotFound``
+            when given the changes of an existing dataset and ``kwargs``,
+            and that none of the changes are made.
+
+            :param kwargs: ``move`` or ``delete`` changes to a dataset which
+                doesn't exist.
+
+            :return: ``Deferred`` firing once the check is done.
+            """
+            d = self.assert_creates(self.client, primary=self.node_1,
+                                    maximum_size=DATASET_SIZE)
+
+            def got_result(existing):
+                updating = self.client.update_datasets(
+                    create=[Dataset(dataset_id=uuid4(), primary=self.node_1,
+                                    maximum_size=DATASET_SIZE)],
+                    **kwargs
+                )
+                updating = self.assertFailure(updating, DatasetNotFound)
+                updating.addCallback(
+                    lambda _: self.client.list_datasets_configuration())
+                updating.addCallback(
+                    lambda l: self.assertEqual([existing], list(l)))
+                return updating
+            d.addCallback(got_result)
+            return d
+
+        def test_update_datasets_move_unknown(self):
+            """
+            If ``update_datasets`` would move a dataset which doesn't exist
+            the result is ``DatasetNotFound`` and none of the changes are
+            made.
+            """
+            return self.assert_update_not_found(move={uuid4(): self.node_2})
+
+        def test_update_datasets_delete_unknown(self):
+            """
+            If ``update_datasets`` would delete a dataset which doesn't exist
+            the result is ``DatasetNotFound`` and none of the changes are
+            made.
+            """
+            return self.assert_update_not_found(delete=[uuid4()])
+
         def test_list_state(self):
             """
             ``list_datasets_state`` returns information about state.
@@ -262,6 +372,42 @@ def make_clientv1_tests():
                               states))
             return d
 
+        def test_watch_state(self):
+            """
+            ``watch_datasets_state`` without a version returns the current
+            state.
+            """
+            dataset_id = uuid4()
+            d = self.assert_creates(self.client, primary=self.node_1,
+                                    dataset_id=dataset_id)
+            d.addCallback(lambda _: self.synchronize_state())
+            d.addCallback(lambda _: self.client.watch_datasets_state())
+            d.addCallback(lambda listing: self.assertIn(
+                dataset_id,
+                [dataset.dataset_id for dataset in listing.datasets]))
+            return d
+
+        def test_watch_state_change(self):
+            """
+            ``watch_datasets_state`` with the version of an earlier result
+            returns the state once it changes.
+            """
+            dataset_id = uuid4()
+            d = self.client.watch_datasets_state()
+
+            def got_initial(listing):
+                watching = self.client.watch_datasets_state(listing.version)
+                creating = self.assert_creates(
+                    self.client, primary=self.node_1, dataset_id=dataset_id)
+                creating.addCallback(lambda _: self.synchronize_state())
+                creating.addCallback(lambda _: watching)
+                return creating
+            d.addCallback(got_initial)
+            d.addCallback(lambda listing: self.assertEqual(
+                [dataset_id],
+                [dataset.dataset_id for dataset in listing.datasets]))
+            return d
+
         def test_acquire_lease_result(self):
             """
             ``acquire_lease`` returns a ``Deferred`` firing with ``Lease``
@@ -379,12 +525,97 @@ class FlockerClientTests(make_clientv1_tests()):
             clock)
         api_service.startService()
         self.addCleanup(api_service.stopService)
+        self.api_service = api_service
 
         credential_set.copy_to(credentials_path, user=True)
+        self.credentials_path = credentials_path
+        return self.create_pooled_client(None)
+
+    def create_pooled_client(self, pool):
+        """
+        Create a new ``FlockerClient`` instance pointing at the control
+        service REST API started by ``create_client``.
+
+        :param pool: The ``HTTPConnectionPool`` for the client to use.
+
+        :return: ``FlockerClient`` instance.
+        """
         return FlockerClient(reactor, b"127.0.0.1", self.port,
-                             credentials_path.child(b"cluster.crt"),
-                             credentials_path.child(b"user.crt"),
-                             credentials_path.child(b"user.key"))
+                             self.credentials_path.child(b"cluster.crt"),
+                             self.credentials_path.child(b"user.crt"),
+                             self.credentials_path.child(b"user.key"),
+                             pool)
+
+    def assert_connections(self, client, expected):
+        """
+        Assert the number of connections a client makes to the control
+        service for a few requests.
+
+        :param FlockerClient client: The client.
+        :param int expected: The expected number of connections.
+
+        :return: ``Deferred`` firing when the test is done.
+        """
+        connections = []
+        site = self.api_service.factory.wrappedFactory
+        build_protocol = site.buildProtocol
+
+        def connected(address):
+            connections.append(address)
+            return build_protocol(address)
+        self.patch(site, "buildProtocol", connected)
+
+        d = client.list_leases()
+        d.addCallback(lambda _: client.list_datasets_configuration())
+        d.addCallback(lambda _: client.list_datasets_state())
+        d.addCallback(lambda _: self.assertEqual(expected, len(connections)))
+        return d
+
+    def test_new_connections(self):
+        """
+        By default ``FlockerClient`` makes a new connection for each request.
+        """
+        return self.assert_connections(self.client, 3)
+
+    def test_persistent_connections(self):
+        """
+        ``FlockerClient`` reuses connections from a pool created by
+        ``connection_pool``.
+        """
+        pool = connection_pool(reactor)
+        self.addCleanup(pool.closeCachedConnections)
+        return self.assert_connections(self.create_pooled_client(pool), 1)
+
+    def test_connection_pool_limits(self):
+        """
+        ``connection_pool`` creates a pool of persistent connections with the
+        given limits.
+        """
+        pool = connection_pool(reactor, max_connections=7, timeout=11)
+        self.assertEqual(
+            (True, 7, 11),
+            (pool.persistent, pool.maxPersistentPerHost,
+             pool.cachedConnectionTimeout),
+        )
+
+    def test_watch_state_unversioned(self):
+        """
+        ``watch_datasets_state`` returns a listing without a version if the
+        server doesn't send an ``ETag``.
+        """
+        site = self.api_service.factory.wrappedFactory
+        request_factory = site.requestFactory
+
+        class UnversionedRequest(request_factory):
+            def write(self, data):
+                if not self.startedWriting:
+                    self.responseHeaders.removeHeader(b"etag")
+                return request_factory.write(self, data)
+        self.patch(site, "requestFactory", UnversionedRequest)
+
+        d = self.client.watch_datasets_state()
+        d.addCallback(lambda listing: self.assertIs(None, listing.version))
+        return d
 
     def synchronize_state(self):
         deployment = self.persistence_service.get()
@@ -0,0 +1,21 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Benchmarks for Flocker.
+
+The benchmarks run entirely in memory against synthetic clusters so they are
+reproducible and need no network access or real nodes.  Results are reported
+as JSON and can be compared with the results of an earlier run.  Run them with
+``admin/benchmark-control``.
+"""
+
+from ._framework import (
+    Benchmark, BenchmarkResult, Comparison, run_benchmarks, compare,
+    results_to_json, results_from_json,
+)
+from ._cluster import synthetic_cluster
+
+__all__ = [
+    "Benchmark", "BenchmarkResult", "Comparison", "run_benchmarks",
+    "compare", "results_to_json", "results_from_json", "synthetic_cluster",
+]
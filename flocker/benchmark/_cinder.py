@@ -0,0 +1,115 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.benchmark.test.test_cinder -*-
+
+"""
+Benchmarks for waiting for Cinder volumes to change state.
+"""
+
+from twisted.internet.task import Clock
+
+from ..node.agents.cinder import BatchedVolumeStateMonitor, VolumeStateMonitor
+from ..node.agents.testtools import FakeCinderVolumeManager
+
+from ._framework import Benchmark
+
+# The number of volumes in the tenant besides those being waited for; every
+# listing includes them.
+_OTHER_VOLUMES = 100
+
+# The time, in seconds, by which all the volumes being waited for become
+# available.
+_SETTLE_TIME = 30
+
+
+def _creating_volumes(waits):
+    """
+    Create a fake tenant in which volumes are being created, becoming
+    available one after another over ``_SETTLE_TIME`` seconds.
+
+    :param int waits: The number of volumes being created.
+
+    :return: A tuple of the ``Clock`` controlling the tenant, its
+        ``FakeCinderVolumeManager`` and a ``list`` of the volumes being
+        created.
+    """
+    clock = Clock()
+    manager = FakeCinderVolumeManager(clock)
+    for i in range(_OTHER_VOLUMES):
+        manager.change_status(manager.create(size=1).id, u"available")
+    volumes = []
+    for i in range(waits):
+        volume = manager.create(size=1)
+        manager.change_status(
+            volume.id, u"available", delay=_SETTLE_TIME * (i + 1.0) / waits,
+        )
+        volumes.append(volume)
+    return clock, manager, volumes
+
+
+def _wait_benchmarks(waits):
+    """
+    :param int waits: The number of operations waiting at once.
+
+    :return: ``list`` of ``Benchmark`` comparing each operation listing the
+        volumes every second with ``BatchedVolumeStateMonitor`` listing them
+        once per interval for all the operations.
+    """
+    name = u"cinder/wait/{}/%d" % (waits,)
+
+    def polling():
+        clock, manager, volumes = _creating_volumes(waits)
+        monitors = [
+            VolumeStateMonitor(
+                manager, volume, u"available", (u"creating",),
+            )
+            for volume in volumes
+        ]
+
+        def run():
+            waiting = monitors
+            while waiting:
+                waiting = [
+                    monitor for monitor in waiting
+                    if not monitor.reached_desired_state()
+                ]
+                clock.advance(1)
+        return run
+
+    def batched():
+        clock, manager, volumes = _creating_volumes(waits)
+        monitor = BatchedVolumeStateMonitor(
+            clock, manager, list_volumes=manager.list,
+        )
+
+        def run():
+            listed = []
+            for volume in volumes:
+                monitor.wait_for(
+                    volume, u"available", (u"creating",),
+                ).addCallback(listed.append)
+            while clock.getDelayedCalls():
+                clock.advance(1)
+            if len(listed) != len(volumes):
+                raise AssertionError("Not every wait finished.")
+        return run
+
+    return [
+        Benchmark(name=name.format(u"polling"), setup=polling),
+        Benchmark(name=name.format(u"batched"), setup=batched),
+    ]
+
+
+def cinder_benchmarks(waits=(100,)):
+    """
+    Create benchmarks for the Cinder storage driver, using a fake
+    ``ICinderVolumeManager``.
+
+    :param waits: Iterable of the numbers of operations waiting for volumes
+        at once to run the benchmarks with.
+
+    :return: ``list`` of ``Benchmark``.
+    """
+    benchmarks = []
+    for count in waits:
+        benchmarks.extend(_wait_benchmarks(count))
+    return benchmarks
@@ -0,0 +1,98 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.benchmark.test.test_cluster -*-
+
+"""
+Synthetic clusters for benchmarks.
+"""
+
+from random import Random
+from uuid import UUID
+
+from pyrsistent import PClass, field
+
+from twisted.python.filepath import FilePath
+
+from ..control import (
+    Application, AttachedVolume, Dataset, Deployment, DeploymentState,
+    DockerImage, Manifestation, Node, NodeState, Port,
+)
+
+
+class SyntheticCluster(PClass):
+    """
+    The configuration and state of a cluster in which the state matches the
+    configuration.
+
+    :ivar Deployment configuration: The configuration.
+    :ivar DeploymentState state: The state.
+    """
+    configuration = field(type=Deployment, mandatory=True)
+    state = field(type=DeploymentState, mandatory=True)
+
+
+def _uuid(random):
+    """
+    :param Random random: Source of randomness.
+    :return UUID: A random version 4 UUID.
+    """
+    return UUID(int=random.getrandbits(128), version=4)
+
+
+def synthetic_cluster(nodes, applications_per_node=3, seed=0):
+    """
+    Create a cluster with a dataset and some applications, one of them using
+    the dataset, on each node.
+
+    The same arguments always result in the same cluster so that benchmark
+    results are comparable between runs.
+
+    :param int nodes: The number of nodes.
+    :param int applications_per_node: The number of applications on each
+        node.
+    :param seed: Seed for the random generation of UUIDs.
+
+    :return SyntheticCluster: The cluster.
+    """
+    random = Random(seed)
+    image = DockerImage.from_string(u"clusterhq/postgresql:9.4")
+    configured_nodes = []
+    node_states = []
+    for i in range(nodes):
+        manifestation = Manifestation(
+            dataset=Dataset(
+                dataset_id=unicode(_uuid(random)), maximum_size=1024 ** 3,
+                metadata={u"name": u"dataset-{}".format(i)},
+            ),
+            primary=True,
+        )
+        dataset_id = manifestation.dataset_id
+        applications = [
+            Application(
+                name=u"app-{}-{}".format(i, j), image=image,
+                ports=[Port(internal_port=5432, external_port=5432 + j)],
+            )
+            for j in range(applications_per_node)
+        ]
+        if applications:
+            applications[0] = applications[0].set(
+                volume=AttachedVolume(
+                    manifestation=manifestation,
+                    mountpoint=FilePath(b"/var/lib/postgresql"),
+                ),
+            )
+        node_uuid = _uuid(random)
+        hostname = u"10.0.{}.{}".format(i // 256, i % 256)
+        configured_nodes.append(Node(
+            uuid=node_uuid, applications=applications,
+            manifestations={dataset_id: manifestation},
+        ))
+        node_states.append(NodeState(
+            uuid=node_uuid, hostname=hostname, applications=applications,
+            manifestations={dataset_id: manifestation},
+            paths={dataset_id: FilePath(b"/flocker").child(bytes(dataset_id))},
+            devices={_uuid(random): FilePath(b"/dev/xvd{}".format(i))},
+        ))
+    return SyntheticCluster(
+        configuration=Deployment(nodes=configured_nodes),
+        state=DeploymentState(nodes=node_states),
+    )
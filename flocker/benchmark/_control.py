@@ -0,0 +1,1016 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.benchmark.test.test_control -*-
+
+"""
+Benchmarks for the control service.
+"""
+
+from datetime import datetime
+from itertools import count
+from json import dumps
+from random import Random
+from uuid import UUID, uuid4
+
+from eliot import Logger
+
+from pytz import UTC
+
+from twisted.internet.address import IPv4Address
+from twisted.internet.defer import succeed
+from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.internet.ssl import ClientContextFactory
+from twisted.internet.task import Clock
+from twisted.protocols.amp import AmpBox, String, parseString
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.python.filepath import FilePath
+from twisted.test.iosim import FakeTransport, connect
+from twisted.test.proto_helpers import (
+    MemoryReactor, MemoryReactorClock, StringTransport,
+)
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.web.http import CREATED, NOT_MODIFIED, OK
+from twisted.web.http_headers import Headers
+
+from ..apiclient import FlockerClient, connection_pool
+from ..ca import rest_api_context_factory
+from ..ca.testtools import CredentialSet
+from ..control._model import ChangeSource, Dataset, NodeState
+from ..control._codec import BINARY_CODEC, CODECS
+from ..control._clusterstate import ClusterStateService
+from ..control._persistence import ConfigurationPersistenceService
+from ..control._protocol import (
+    Big, CachingEncoder, ClusterStatusCommand, ControlAMPService,
+    DEFAULT_BATCH_WINDOW,
+)
+from ..control.httpapi import (
+    ConfigurationAPIUserV1, SAMPLED_OUTPUT_VALIDATION_RATE,
+)
+from ..restapi.testtools import dummyRequest, render
+
+from ._cluster import _uuid, synthetic_cluster
+from ._framework import Benchmark
+
+
+def _cluster_state_service(cluster):
+    """
+    :param SyntheticCluster cluster: A cluster.
+    :return ClusterStateService: A service which knows the state of the
+        cluster.
+    """
+    service = ClusterStateService(Clock())
+    service.apply_changes_from_source(
+        ChangeSource(), list(cluster.state.nodes),
+    )
+    return service
+
+
+class _ControlEnvironment(object):
+    """
+    The services of a control service whose configuration and state are
+    those of a synthetic cluster.
+
+    :ivar SyntheticCluster cluster: The cluster.
+    :ivar Clock clock: The clock used by the services.
+    :ivar ClusterStateService cluster_state: Service knowing the cluster
+        state.
+    :ivar ConfigurationPersistenceService persistence: Service knowing the
+        cluster configuration.
+    :ivar ConfigurationAPIUserV1 api: The REST API.
+    :ivar resource: The ``IResource`` of the ``ConfigurationAPIUserV1``.
+    """
+    def __init__(self, cluster, cluster_state, path):
+        """
+        :param SyntheticCluster cluster: See above.
+        :param ClusterStateService cluster_state: See above.  Environments
+            can share this since the changes made by the benchmarks are
+            changes agents might report at any time.
+        :param FilePath path: Directory in which to store the configuration.
+        """
+        self.cluster = cluster
+        self.clock = Clock()
+        self.cluster_state = cluster_state
+        self.persistence = ConfigurationPersistenceService(self.clock, path)
+        self.persistence.startService()
+        self.persistence.save(cluster.configuration)
+        self.api = ConfigurationAPIUserV1(
+            self.persistence, self.cluster_state, self.clock,
+        )
+        self.resource = self.api.app.resource()
+        self._changes = count()
+
+    def changed_node(self):
+        """
+        :return NodeState: The state of one of the nodes of the cluster
+            with a new device, as an agent would report after a change.
+            Successive calls change successive nodes.
+        """
+        nodes = sorted(self.cluster.state.nodes, key=lambda node: node.uuid)
+        node = nodes[next(self._changes) % len(nodes)]
+        return node.set(devices={uuid4(): FilePath(b"/dev/xvdz")})
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Make a request of the REST API.
+
+        :param bytes method: The HTTP method.
+        :param bytes path: The path of the URL.
+        :param body: Object to encode as the JSON body of the request, or
+            ``None`` for no body.
+        :param dict headers: Additional request headers.
+
+        :return: The rendered ``IRequest``.
+        """
+        headers = Headers(headers or {})
+        if body is None:
+            content = b""
+        else:
+            content = dumps(body)
+            headers.setRawHeaders(b"content-type", [b"application/json"])
+        request = dummyRequest(method, path, headers, content)
+        render(self.resource, request)
+        return request
+
+
+def _once(factory):
+    """
+    :param factory: No-argument callable.
+    :return: No-argument callable which returns the result of calling
+        ``factory`` the first time it is called.
+    """
+    result = []
+
+    def get():
+        if not result:
+            result.append(factory())
+        return result[0]
+    return get
+
+
+class _FakeAgent(object):
+    """
+    A connection to an agent, as seen by ``ControlAMPService``, which
+    serializes commands like ``ControlAMP`` would and acknowledges them
+    immediately.
+
+    :ivar UUID node_uuid: The node of the agent.
+    """
+    wire_codec = BINARY_CODEC
+
+    def __init__(self, node_uuid):
+        self.node_uuid = node_uuid
+        self.transport = StringTransport()
+
+    def callRemote(self, command, **kwargs):
+        command.makeArguments(kwargs, self).serialize()
+        return succeed({
+            u"generation":
+            kwargs.get("end_generation", kwargs.get("generation")),
+        })
+
+
+def _codec_benchmarks(suffix, cluster):
+    """
+    Benchmarks for encoding and decoding the cluster state with each codec,
+    and for re-encoding it with ``CachingEncoder`` after a change.
+    """
+    benchmarks = []
+    for codec in CODECS:
+        encoded = codec.encode(cluster.state)
+        benchmarks.extend([
+            Benchmark(
+                name=u"{} encode{}".format(codec.name, suffix),
+                setup=lambda codec=codec: (
+                    lambda: codec.encode(cluster.state)
+                ),
+            ),
+            Benchmark(
+                name=u"{} decode{}".format(codec.name, suffix),
+                setup=lambda codec=codec, encoded=encoded: (
+                    lambda: codec.decode(encoded)
+                ),
+            ),
+        ])
+
+        def setup(codec=codec, encoder=_once(CachingEncoder)):
+            encoder = encoder()
+            state = cluster.state
+            encoder.encode(state, codec)
+            changed = state.update_node(
+                next(iter(state.nodes)).set(
+                    devices={uuid4(): FilePath(b"/dev/x")},
+                )
+            )
+            return lambda: encoder.encode(changed, codec)
+        benchmarks.append(Benchmark(
+            name=u"CachingEncoder {} one node changed{}".format(
+                codec.name, suffix,
+            ),
+            setup=setup,
+        ))
+    return benchmarks
+
+
+def _state_benchmarks(suffix, get_environment):
+    """
+    Benchmarks for recording changes to the cluster state.
+    """
+    def apply_changes():
+        environment = get_environment()
+        source = ChangeSource()
+        changes = [environment.changed_node()]
+        return lambda: environment.cluster_state.apply_changes_from_source(
+            source, changes,
+        )
+
+    def update_node():
+        environment = get_environment()
+        state = environment.cluster_state.as_deployment()
+        node = environment.changed_node()
+        return lambda: state.update_node(node)
+
+    return [
+        Benchmark(
+            name=u"ClusterStateService.apply_changes_from_source" + suffix,
+            setup=apply_changes,
+        ),
+        Benchmark(
+            name=u"DeploymentState.update_node" + suffix,
+            setup=update_node,
+        ),
+    ]
+
+
+_SOURCES_PER_NODE = 10
+
+
+def _expiration_benchmarks(suffix, size):
+    """
+    Benchmarks for expiring old state.
+
+    :param int size: The size of the cluster.  There are
+        ``_SOURCES_PER_NODE`` times as many sources of state, each reporting
+        the state of one node, so that the number of wipers of a large cluster
+        can be simulated.
+    """
+    def setup():
+        clock = Clock()
+        service = ClusterStateService(clock)
+        changes = []
+        for i in range(size * _SOURCES_PER_NODE):
+            source = ChangeSource()
+            source.set_last_activity(clock.seconds())
+            changes.append((source, [NodeState(
+                uuid=uuid4(), hostname=u"10.0.{}.{}".format(i // 256, i % 256),
+            )]))
+        service.apply_changes_from_sources(changes)
+        # Nothing is close to expiring, as is usually the case:
+        clock.advance(1)
+        return service._wipe_expired
+
+    return [
+        Benchmark(
+            name=u"ClusterStateService._wipe_expired {} sources per "
+            u"node{}".format(_SOURCES_PER_NODE, suffix),
+            setup=setup,
+        ),
+    ]
+
+
+def _persistence_benchmarks(suffix, cluster, directory):
+    """
+    Benchmarks for saving a small change to the configuration, as when a
+    lease is renewed.
+
+    :param directory: No-argument callable returning a new directory in
+        which to store configuration.
+    """
+    def setup(journal):
+        path = directory()
+        service = ConfigurationPersistenceService(Clock(), path)
+        service.startService()
+        service.save(cluster.configuration)
+        service.stopService()
+        service = ConfigurationPersistenceService(
+            Clock(), path, journal=journal,
+        )
+        service.startService()
+        node = sorted(
+            cluster.configuration.nodes, key=lambda node: node.uuid,
+        )[0]
+        dataset_id = UUID(next(iter(node.manifestations)))
+        renewals = count(1)
+
+        def run():
+            configuration = service.get()
+            service.save(configuration.set(
+                leases=configuration.leases.acquire(
+                    datetime.fromtimestamp(0, UTC), dataset_id, node.uuid,
+                    next(renewals),
+                ),
+            ))
+        return run
+
+    name = u"ConfigurationPersistenceService.save lease renewal {}" + suffix
+    return [
+        Benchmark(name=name.format(u"snapshot"), setup=lambda: setup(False)),
+        Benchmark(name=name.format(u"journal"), setup=lambda: setup(True)),
+    ]
+
+
+def _service_benchmarks(suffix, get_environment, agents):
+    """
+    Benchmarks for sending the configuration and state to agents.
+
+    Each agent is sent a view of the whole cluster so the cost of sending
+    to agents on all nodes grows with the square of the size of the
+    cluster.  Only some nodes have an agent connected to keep the time taken
+    reasonable for large clusters.
+
+    :param int agents: The number of connected agents.
+    """
+    def service():
+        environment = get_environment()
+        result = ControlAMPService(
+            environment.clock, environment.cluster_state,
+            environment.persistence,
+            TCP4ServerEndpoint(MemoryReactor(), 1234), ClientContextFactory(),
+        )
+        nodes = sorted(
+            environment.cluster.state.nodes, key=lambda node: node.uuid,
+        )
+        result.connections = set(
+            _FakeAgent(node.uuid) for node in nodes[:agents]
+        )
+        return result
+    full_service = _once(service)
+    diff_service = _once(service)
+
+    def full():
+        # Newly connected agents are sent the full configuration and state.
+        service = full_service()
+        service.connections = set(
+            _FakeAgent(connection.node_uuid)
+            for connection in service.connections
+        )
+        environment = get_environment()
+        environment.cluster_state.apply_changes_from_source(
+            ChangeSource(), [environment.changed_node()],
+        )
+        return lambda: service._send_state_to_connections(service.connections)
+
+    def diff():
+        # Agents which have acknowledged an earlier update are sent the
+        # changes since then.
+        service = diff_service()
+        service._send_state_to_connections(service.connections)
+        environment = get_environment()
+        environment.cluster_state.apply_changes_from_source(
+            ChangeSource(), [environment.changed_node()],
+        )
+        return lambda: service._send_state_to_connections(service.connections)
+
+    def reports(batch_window):
+        # Every connected agent reports a change at about the same time.
+        def setup():
+            environment = get_environment()
+            service = ControlAMPService(
+                environment.clock, environment.cluster_state,
+                environment.persistence,
+                TCP4ServerEndpoint(MemoryReactor(), 1234),
+                ClientContextFactory(), batch_window=batch_window,
+            )
+            service.connections = set(
+                _FakeAgent(connection.node_uuid)
+                for connection in diff_service().connections
+            )
+            service._send_state_to_connections(service.connections)
+            source = ChangeSource()
+            changes = [[environment.changed_node()] for _ in range(agents)]
+
+            def run():
+                for node_changes in changes:
+                    service.node_changed(source, node_changes)
+                environment.clock.advance(batch_window)
+            return run
+        return setup
+
+    name = u"ControlAMPService._send_state_to_connections {} x{}" + suffix
+    reports_name = u"ControlAMPService.node_changed {} x{}" + suffix
+    return [
+        Benchmark(name=name.format(u"full", agents), setup=full),
+        Benchmark(name=name.format(u"diff", agents), setup=diff),
+        Benchmark(
+            name=reports_name.format(u"unbatched", agents),
+            setup=reports(0),
+        ),
+        Benchmark(
+            name=reports_name.format(u"batched", agents),
+            setup=reports(DEFAULT_BATCH_WINDOW),
+        ),
+    ]
+
+
+# The number of datasets added to a cluster state to pad it to a given size:
+_PADDING_DATASETS = 100
+
+
+def _padded_state(state, megabytes):
+    """
+    :param DeploymentState state: The state of a cluster.
+    :param int megabytes: The number of megabytes of padding to add.
+
+    :return DeploymentState: ``state`` with non-manifest datasets added whose
+        metadata is ``megabytes`` MB of hexadecimal digits.  The digits are
+        random so that the binary codec can't store them just once.
+    """
+    random = Random(megabytes)
+    length = megabytes * 10 ** 6 // _PADDING_DATASETS
+    datasets = {}
+    for i in range(_PADDING_DATASETS):
+        dataset_id = unicode(_uuid(random))
+        datasets[dataset_id] = Dataset(
+            dataset_id=dataset_id,
+            metadata={
+                u"padding": u"%0*x" % (length, random.getrandbits(length * 4)),
+            },
+        )
+    return state.set(
+        nonmanifest_datasets=state.nonmanifest_datasets.update(datasets),
+    )
+
+
+class _Receiver(object):
+    """
+    The parts of an agent's AMP protocol which ``ClusterStatusCommand`` uses
+    to parse its arguments.
+    """
+    logger = Logger()
+
+
+def _receive_benchmarks(suffix, cluster, megabytes):
+    """
+    Benchmarks for an agent parsing a binary encoded ``ClusterStatusCommand``
+    whose state has been padded to several sizes.  How much the memory used
+    grows is measured too.
+
+    :param megabytes: Iterable of the numbers of megabytes to pad the state
+        with.
+    """
+    receiver = _Receiver()
+
+    def setup(size):
+        # The box is built without ``ClusterStatusCommand.makeArguments`` so
+        # that the padded state isn't kept by the shared ``CachingEncoder``,
+        # and it is rebuilt for every measurement so that it isn't kept at
+        # all between benchmarks.
+        strings = AmpBox(
+            generation=b"1",
+            eliot_context=b"{}@/1".format(uuid4()),
+        )
+        for name, value in [
+            (b"configuration", cluster.configuration),
+            (b"state", _padded_state(cluster.state, size)),
+        ]:
+            Big(String()).toBox(
+                name, strings, {name: BINARY_CODEC.encode(value)}, None,
+            )
+        data = strings.serialize()
+        del strings
+
+        def receive():
+            [box] = parseString(data)
+            ClusterStatusCommand.parseArguments(box, receiver)
+        return receive
+
+    return [
+        Benchmark(
+            name=u"ClusterStatusCommand receive {} MB state{}".format(
+                size, suffix,
+            ),
+            setup=lambda size=size: setup(size),
+            memory=True,
+        )
+        for size in megabytes
+    ]
+
+
+def _rest_benchmark(suffix, get_environment, method, path, expected,
+                    prepare):
+    """
+    :param unicode suffix: Suffix of the benchmark's name.
+    :param get_environment: No-argument callable returning the
+        ``_ControlEnvironment`` to use.
+    :param bytes method: The HTTP method of the request.
+    :param bytes path: The path of the URL, a template which is formatted
+        with the values returned by ``prepare``.
+    :param int expected: The response code of a successful request.
+    :param prepare: Callable which is given the ``_ControlEnvironment``,
+        makes any requests needed before measuring this one and returns
+        a ``dict`` of values to format ``path`` with and the body of the
+        request.
+
+    :return Benchmark: Benchmark for a request to the REST API.
+    """
+    def setup():
+        environment = get_environment()
+        values, body = prepare(environment)
+        request_path = path.format(**values)
+
+        def run():
+            request = environment.request(method, request_path, body)
+            if request.code != expected:
+                raise AssertionError(
+                    "{} {} failed with {}: {}".format(
+                        method, request_path, request.code,
+                        request._responseBody,
+                    )
+                )
+        return run
+    return Benchmark(
+        name=u"ConfigurationAPIUserV1 {} {}{}".format(
+            method.decode("ascii"), path.decode("ascii"), suffix,
+        ),
+        setup=setup,
+    )
+
+
+def _conditional_benchmarks(suffix, get_environment):
+    """
+    :param unicode suffix: Suffix of the benchmarks' names.
+    :param get_environment: No-argument callable returning the
+        ``_ControlEnvironment`` to use.
+
+    :return: ``list`` of ``Benchmark`` for polling the listings of datasets
+        when the configuration or state has changed since the previous poll,
+        when it hasn't and when the client already has the response.
+    """
+    def benchmark(path, get_service, kind):
+        def setup():
+            environment = get_environment()
+            service = get_service(environment)
+            etag = environment.request(b"GET", path).responseHeaders \
+                .getRawHeaders(b"etag")[0]
+            headers = {}
+            expected = OK
+            if kind == u"not modified":
+                headers = {b"if-none-match": [etag]}
+                expected = NOT_MODIFIED
+
+            def run():
+                if kind == u"changed":
+                    # Changing the configuration or state itself would
+                    # dominate the measurement.
+                    service.generation += 1
+                request = environment.request(b"GET", path, headers=headers)
+                if request.code != expected:
+                    raise AssertionError(
+                        "GET {} failed with {}".format(path, request.code)
+                    )
+            return run
+        return Benchmark(
+            name=u"ConfigurationAPIUserV1 GET {} poll {}{}".format(
+                path.decode("ascii"), kind, suffix,
+            ),
+            setup=setup,
+        )
+    return [
+        benchmark(path, get_service, kind)
+        for path, get_service in [
+            (b"/configuration/datasets",
+             lambda environment: environment.persistence),
+            (b"/state/datasets",
+             lambda environment: environment.cluster_state),
+        ]
+        for kind in [u"changed", u"unchanged", u"not modified"]
+    ]
+
+
+def _validation_benchmarks(suffix, get_environment):
+    """
+    :param unicode suffix: Suffix of the benchmarks' names.
+    :param get_environment: No-argument callable returning the
+        ``_ControlEnvironment`` to use.
+
+    :return: ``list`` of ``Benchmark`` for building the largest responses
+        with every response's output validated against the schema and with
+        the sampled validation used in production.
+    """
+    def benchmark(path, get_service, validation, rate):
+        def setup():
+            environment = get_environment()
+            environment.api.output_validation_rate = rate
+            service = get_service(environment)
+
+            def run():
+                # Make sure the response is built rather than cached.
+                service.generation += 1
+                request = environment.request(b"GET", path)
+                if request.code != OK:
+                    raise AssertionError(
+                        "GET {} failed with {}".format(path, request.code)
+                    )
+            return run
+        return Benchmark(
+            name=u"ConfigurationAPIUserV1 GET {} validate {}{}".format(
+                path.decode("ascii"), validation, suffix,
+            ),
+            setup=setup,
+        )
+    return [
+        benchmark(path, get_service, validation, rate)
+        for path, get_service in [
+            (b"/state/datasets",
+             lambda environment: environment.cluster_state),
+            (b"/configuration/containers",
+             lambda environment: environment.persistence),
+        ]
+        for validation, rate in [
+            (u"all", 1), (u"sampled", SAMPLED_OUTPUT_VALIDATION_RATE),
+        ]
+    ]
+
+
+def _provisioning_benchmarks(suffix, get_environment, datasets):
+    """
+    :param unicode suffix: Suffix of the benchmarks' names.
+    :param get_environment: No-argument callable returning the
+        ``_ControlEnvironment`` to use.
+    :param int datasets: The number of datasets to create.
+
+    :return: ``list`` of ``Benchmark`` for creating many datasets with one
+        request each and with a single bulk request.
+    """
+    def new_datasets(environment):
+        first, second = _nodes(environment)
+        return [
+            {u"primary": unicode(node.uuid),
+             u"dataset_id": unicode(uuid4()),
+             u"maximum_size": 1024 ** 3}
+            for node in [first, second] * (datasets // 2)
+        ]
+
+    def check(request, path):
+        if request.code not in (OK, CREATED):
+            raise AssertionError(
+                "POST {} failed with {}: {}".format(
+                    path, request.code, request._responseBody,
+                )
+            )
+
+    def singly():
+        environment = get_environment()
+
+        def run():
+            for body in new_datasets(environment):
+                check(environment.request(
+                    b"POST", b"/configuration/datasets", body,
+                ), b"/configuration/datasets")
+        return run
+
+    def bulk():
+        environment = get_environment()
+
+        def run():
+            check(environment.request(
+                b"POST", b"/configuration/datasets/bulk",
+                {u"create": new_datasets(environment)},
+            ), b"/configuration/datasets/bulk")
+        return run
+
+    return [
+        Benchmark(
+            name=u"ConfigurationAPIUserV1 create {} datasets {}{}".format(
+                datasets, kind, suffix,
+            ),
+            setup=setup,
+        )
+        for kind, setup in [(u"singly", singly), (u"bulk", bulk)]
+    ]
+
+
+class _MemoryControlService(object):
+    """
+    Serve the REST API of a ``_ControlEnvironment`` over TLS to a
+    ``FlockerClient``, delivering bytes between them in memory.
+
+    :ivar MemoryReactorClock reactor: The reactor the client connects with.
+    """
+    def __init__(self, environment, credentials):
+        """
+        :param _ControlEnvironment environment: The environment whose REST
+            API to serve.
+        :param CredentialSet credentials: The credentials of the cluster.
+        """
+        self.reactor = MemoryReactorClock()
+        root = Resource()
+        root.putChild(b"v1", environment.resource)
+        self._factory = TLSMemoryBIOFactory(
+            rest_api_context_factory(
+                credentials.root.credential.certificate, credentials.control,
+            ),
+            # The timeouts of a ``Site``'s connections use the global
+            # reactor, which this doesn't run:
+            False, Site(root, timeout=None),
+        )
+        self._pumps = []
+
+    def serve(self):
+        """
+        Accept the client's new connections and deliver all the bytes
+        written by either side until neither has more to say.
+        """
+        while len(self._pumps) < len(self.reactor.sslClients):
+            _, _, factory, context_factory = (
+                self.reactor.sslClients[len(self._pumps)][:4]
+            )
+            client_address = IPv4Address(b"TCP", b"127.0.0.1", 50000)
+            server_address = IPv4Address(b"TCP", b"127.0.0.1", 4523)
+            client = TLSMemoryBIOFactory(
+                context_factory, True, factory,
+            ).buildProtocol(server_address)
+            server = self._factory.buildProtocol(client_address)
+            self._pumps.append(connect(
+                server, FakeTransport(
+                    server, True, server_address, client_address),
+                client, FakeTransport(
+                    client, False, client_address, server_address),
+            ))
+        for pump in self._pumps:
+            pump.flush()
+
+
+def _client_benchmarks(suffix, get_environment, get_credentials, requests=10):
+    """
+    :param unicode suffix: Suffix of the benchmarks' names.
+    :param get_environment: No-argument callable returning the
+        ``_ControlEnvironment`` to use.
+    :param get_credentials: No-argument callable returning the
+        ``CredentialSet`` to use.
+    :param int requests: The number of requests to measure.
+
+    :return: ``list`` of ``Benchmark`` for a series of requests made by
+        ``FlockerClient`` with a new connection for each and with a pool of
+        persistent connections.  The requests are small, so the time taken
+        is mostly that of connecting, including the TLS handshake.
+    """
+    def benchmark(pooled):
+        def setup():
+            credentials = get_credentials()
+            service = _MemoryControlService(get_environment(), credentials)
+            pool = None
+            if pooled:
+                pool = connection_pool(service.reactor)
+            client = FlockerClient(
+                service.reactor, b"127.0.0.1", 4523,
+                credentials.path.child(b"cluster.crt"),
+                credentials.path.child(b"allison.crt"),
+                credentials.path.child(b"allison.key"),
+                pool,
+            )
+
+            def run():
+                for i in range(requests):
+                    results = []
+                    client.list_leases().addBoth(results.append)
+                    service.serve()
+                    if not results or not isinstance(results[0], list):
+                        raise AssertionError(
+                            "Request failed: {!r}".format(results)
+                        )
+            return run
+        return Benchmark(
+            name=u"FlockerClient {} requests {}{}".format(
+                requests, u"pooled" if pooled else u"unpooled", suffix,
+            ),
+            setup=setup,
+        )
+    return [benchmark(False), benchmark(True)]
+
+
+def _no_body(environment):
+    return {}, None
+
+
+def _nodes(environment):
+    """
+    :return: The configuration of two nodes of the cluster.
+    """
+    nodes = sorted(
+        environment.persistence.get().nodes, key=lambda node: node.uuid,
+    )
+    return nodes[0], nodes[1]
+
+
+def _new_dataset(environment):
+    first, second = _nodes(environment)
+    return {}, {
+        u"primary": unicode(first.uuid),
+        u"maximum_size": 1024 ** 3,
+        u"metadata": {u"name": u"benchmark"},
+    }
+
+
+def _bulk_datasets(environment):
+    """
+    Create a dataset, move another and delete a third, creating the
+    datasets to move and delete first.
+    """
+    first, second = _nodes(environment)
+    _, create = _new_dataset(environment)
+    moved, _ = _created_dataset(environment)
+    deleted, _ = _created_dataset(environment)
+    return {}, {
+        u"create": [create],
+        u"update": [{u"dataset_id": moved[u"dataset_id"],
+                     u"primary": unicode(second.uuid)}],
+        u"delete": [deleted[u"dataset_id"]],
+    }
+
+
+def _created_dataset(environment):
+    _, body = _new_dataset(environment)
+    body[u"dataset_id"] = unicode(uuid4())
+    environment.request(b"POST", b"/configuration/datasets", body)
+    return {u"dataset_id": body[u"dataset_id"]}, None
+
+
+def _move_dataset(environment):
+    """
+    Move a dataset which isn't used by an application between two nodes,
+    creating it first if necessary.
+    """
+    dataset_id = u"e10c9a4e-2d47-4a4c-9d64-8b4f1c2a7e55"
+    first, second = _nodes(environment)
+    if dataset_id not in first.manifestations:
+        if dataset_id not in second.manifestations:
+            environment.request(
+                b"POST", b"/configuration/datasets",
+                {u"primary": unicode(first.uuid), u"dataset_id": dataset_id},
+            )
+            return _move_dataset(environment)
+        first, second = second, first
+    return {u"dataset_id": dataset_id}, {u"primary": unicode(second.uuid)}
+
+
+def _new_container(environment):
+    first, second = _nodes(environment)
+    return {}, {
+        u"node_uuid": unicode(first.uuid),
+        u"name": u"benchmark-" + unicode(uuid4()),
+        u"image": u"clusterhq/postgresql:9.4",
+    }
+
+
+def _created_container(environment):
+    _, body = _new_container(environment)
+    environment.request(b"POST", b"/configuration/containers", body)
+    return {u"name": body[u"name"]}, None
+
+
+def _move_container(environment):
+    first, second = _nodes(environment)
+    applications = [
+        application for application in first.applications
+        if application.volume is None
+    ]
+    if not applications:
+        first, second = second, first
+        applications = [
+            application for application in first.applications
+            if application.volume is None
+        ]
+    return (
+        {u"name": applications[0].name},
+        {u"node_uuid": unicode(second.uuid)},
+    )
+
+
+def _compose(environment):
+    """
+    :return: The cluster's applications in the format of ``flocker-deploy``.
+    """
+    applications = {}
+    deployment = {}
+    for node in environment.cluster.state.nodes:
+        deployment[node.hostname] = []
+        for application in node.applications:
+            deployment[node.hostname].append(application.name)
+            applications[application.name] = {
+                u"image": application.image.full_name,
+                u"ports": [
+                    {u"internal": port.internal_port,
+                     u"external": port.external_port}
+                    for port in application.ports
+                ],
+            }
+    return {}, {
+        u"applications": {u"version": 1, u"applications": applications},
+        u"deployment": {u"version": 1, u"nodes": deployment},
+    }
+
+
+def _new_lease(environment):
+    first, second = _nodes(environment)
+    return {}, {
+        u"dataset_id": unicode(uuid4()),
+        u"node_uuid": unicode(first.uuid),
+        u"expires": None,
+    }
+
+
+def _acquired_lease(environment):
+    _, body = _new_lease(environment)
+    environment.request(b"POST", b"/configuration/leases", body)
+    return {u"dataset_id": body[u"dataset_id"]}, None
+
+
+# The requests made of each endpoint of ``ConfigurationAPIUserV1``: method,
+# path, response code and the function preparing for the request.
+_REST_REQUESTS = [
+    (b"GET", b"/version", OK, _no_body),
+    (b"GET", b"/configuration/datasets", OK, _no_body),
+    (b"POST", b"/configuration/datasets", CREATED, _new_dataset),
+    (b"POST", b"/configuration/datasets/{dataset_id}", OK, _move_dataset),
+    (b"DELETE", b"/configuration/datasets/{dataset_id}", OK,
+     _created_dataset),
+    (b"POST", b"/configuration/datasets/bulk", OK, _bulk_datasets),
+    (b"GET", b"/state/datasets", OK, _no_body),
+    (b"GET", b"/configuration/containers", OK, _no_body),
+    (b"POST", b"/configuration/containers", CREATED, _new_container),
+    (b"POST", b"/configuration/containers/{name}", OK, _move_container),
+    (b"DELETE", b"/configuration/containers/{name}", OK, _created_container),
+    (b"GET", b"/state/containers", OK, _no_body),
+    (b"GET", b"/state/nodes", OK, _no_body),
+    (b"POST", b"/configuration/_compose", OK, _compose),
+    (b"GET", b"/configuration/leases", OK, _no_body),
+    (b"POST", b"/configuration/leases", CREATED, _new_lease),
+    (b"DELETE", b"/configuration/leases/{dataset_id}", OK, _acquired_lease),
+]
+
+
+def control_benchmarks(sizes, path, agents=10, datasets=500,
+                       megabytes=(10, 50, 100)):
+    """
+    Create benchmarks for the control service.
+
+    :param sizes: Iterable of the numbers of nodes of the synthetic clusters
+        to run the benchmarks with.  At least two are needed.
+    :param FilePath path: Directory in which the benchmarks can store
+        configuration.
+    :param int agents: The number of agents the control service sends
+        updates to.  Clusters smaller than this have an agent on every node.
+    :param int datasets: The number of datasets a workload provisions at
+        once.
+    :param megabytes: The sizes, in megabytes, of the large cluster states
+        agents receive.
+
+    :return: ``list`` of ``Benchmark``.
+    """
+    directories = count()
+    credentials = _once(CredentialSet.create)
+
+    def environment(cluster, cluster_state):
+        return _once(lambda: _ControlEnvironment(
+            cluster, cluster_state(), path.child(bytes(next(directories))),
+        ))
+
+    benchmarks = []
+    for size in sizes:
+        suffix = u"/{}".format(size)
+        cluster = synthetic_cluster(size)
+        cluster_state = _once(
+            lambda cluster=cluster: _cluster_state_service(cluster)
+        )
+        benchmarks.extend(_codec_benchmarks(suffix, cluster))
+        benchmarks.extend(_receive_benchmarks(suffix, cluster, megabytes))
+        benchmarks.extend(_state_benchmarks(
+            suffix, environment(cluster, cluster_state),
+        ))
+        benchmarks.extend(_expiration_benchmarks(suffix, size))
+        benchmarks.extend(_persistence_benchmarks(
+            suffix, cluster, lambda: path.child(bytes(next(directories))),
+        ))
+        benchmarks.extend(_service_benchmarks(
+            suffix, environment(cluster, cluster_state), min(agents, size),
+        ))
+        benchmarks.extend(_conditional_benchmarks(
+            suffix, environment(cluster, cluster_state),
+        ))
+        benchmarks.extend(_validation_benchmarks(
+            suffix, environment(cluster, cluster_state),
+        ))
+        benchmarks.extend(_provisioning_benchmarks(
+            suffix, environment(cluster, cluster_state), datasets,
+        ))
+        benchmarks.extend(_client_benchmarks(
+            suffix, environment(cluster, cluster_state), credentials,
+        ))
+        for method, request_path, expected, prepare in _REST_REQUESTS:
+            # Each endpoint gets its own configuration so that changes made by
+            # one don't affect the others.
+            benchmarks.append(_rest_benchmark(
+                suffix, environment(cluster, cluster_state), method,
+                request_path, expected, prepare,
+            ))
+    return benchmarks
@@ -0,0 +1,276 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.benchmark.test.test_framework -*-
+
+"""
+Running benchmarks and reporting and comparing their results.
+"""
+
+import gc
+from json import dumps, loads
+from timeit import default_timer
+
+from pyrsistent import PClass, PVector, field, pvector
+
+from twisted.python.filepath import FilePath
+
+
+# The version of the JSON results format:
+_RESULTS_VERSION = 1
+
+
+class Benchmark(PClass):
+    """
+    A piece of code whose speed is measured.
+
+    :ivar unicode name: A name identifying the benchmark in results.  It
+        should include the parameters of the benchmark, for example the size
+        of the synthetic cluster it uses.
+    :ivar setup: A no-argument callable which prepares for one measurement
+        and returns the no-argument callable to measure.  The time taken by
+        ``setup`` is not measured, so expensive preparation (for example of
+        inputs which a measurement consumes) belongs here.
+    :ivar bool memory: Whether to also measure how much the memory used by
+        the process grows during each measurement.
+    """
+    name = field(type=unicode, mandatory=True)
+    setup = field(mandatory=True)
+    memory = field(type=bool, initial=False)
+
+
+class BenchmarkResult(PClass):
+    """
+    The measurements of one benchmark.
+
+    :ivar unicode name: The name of the ``Benchmark``.
+    :ivar PVector times: The time taken by each measurement, in seconds.
+    :ivar PVector peak_memory: The most the resident set size of the process
+        grew by during each measurement, in bytes.  Empty unless the
+        benchmark measures memory and ``ProcessMemory`` works here.
+    """
+    name = field(type=unicode, mandatory=True)
+    times = field(type=PVector, factory=pvector, mandatory=True)
+    peak_memory = field(type=PVector, factory=pvector, initial=pvector())
+
+    @property
+    def minimum(self):
+        """
+        The shortest time taken.  This is the most repeatable measurement
+        since other activity on the machine only ever makes code slower.
+        """
+        return min(self.times)
+
+    @property
+    def median(self):
+        """
+        The median time taken.
+        """
+        times = sorted(self.times)
+        middle = len(times) // 2
+        if len(times) % 2:
+            return times[middle]
+        return (times[middle - 1] + times[middle]) / 2.0
+
+    @property
+    def mean(self):
+        """
+        The mean time taken.
+        """
+        return sum(self.times) / len(self.times)
+
+
+class ProcessMemory(object):
+    """
+    The memory used by this process, read from Linux's ``/proc`` filesystem.
+
+    Resetting the peak needs Linux 4.0 or later.
+
+    :ivar FilePath _proc: The ``/proc`` directory of the process.
+    """
+    def __init__(self, proc=FilePath(b"/proc/self")):
+        self._proc = proc
+
+    def reset_peak(self):
+        """
+        Start tracking the peak resident set size afresh.
+
+        :return bool: Whether the peak could be reset.
+        """
+        # ``FilePath.setContent`` replaces the file rather than writing to
+        # it, which isn't possible in ``/proc``.
+        try:
+            with self._proc.child(b"clear_refs").open(b"w") as clear_refs:
+                clear_refs.write(b"5")
+        except (IOError, OSError):
+            return False
+        return True
+
+    def usage(self):
+        """
+        :return: A tuple of the current and peak resident set sizes of the
+            process, in bytes.
+        """
+        sizes = {}
+        for line in self._proc.child(b"status").getContent().splitlines():
+            name, _, value = line.partition(b":")
+            if name in (b"VmRSS", b"VmHWM"):
+                # The sizes are given in kB.
+                sizes[name] = int(value.split()[0]) * 1024
+        return sizes[b"VmRSS"], sizes[b"VmHWM"]
+
+
+def run_benchmark(benchmark, repeat, timer=default_timer,
+                  memory=ProcessMemory()):
+    """
+    Measure a benchmark.
+
+    Garbage collection is disabled during each measurement, like ``timeit``
+    does, so that collections triggered by earlier code don't distort it.
+
+    :param Benchmark benchmark: The benchmark to measure.
+    :param int repeat: The number of measurements to make.
+    :param timer: No-argument callable returning the current time in seconds.
+    :param ProcessMemory memory: Used to measure memory, for benchmarks
+        which ask for it.
+
+    :return BenchmarkResult: The measurements.
+    """
+    times = []
+    peak_memory = []
+    for i in range(repeat):
+        function = benchmark.setup()
+        measure_memory = benchmark.memory and memory.reset_peak()
+        if measure_memory:
+            before, _ = memory.usage()
+        gc.disable()
+        try:
+            start = timer()
+            function()
+            times.append(timer() - start)
+        finally:
+            gc.enable()
+        if measure_memory:
+            _, peak = memory.usage()
+            peak_memory.append(peak - before)
+    return BenchmarkResult(
+        name=benchmark.name, times=times, peak_memory=peak_memory,
+    )
+
+
+def run_benchmarks(benchmarks, repeat, timer=default_timer,
+                   memory=ProcessMemory()):
+    """
+    Measure several benchmarks.
+
+    :param benchmarks: Iterable of ``Benchmark``.
+    :param int repeat: The number of measurements to make of each.
+    :param timer: See ``run_benchmark``.
+    :param memory: See ``run_benchmark``.
+
+    :return: ``list`` of ``BenchmarkResult``, in the same order.
+    """
+    return [
+        run_benchmark(benchmark, repeat, timer, memory)
+        for benchmark in benchmarks
+    ]
+
+
+def results_to_json(results, metadata):
+    """
+    :param results: Iterable of ``BenchmarkResult``.
+    :param dict metadata: JSON-serializable information about the run, for
+        example the version of the code and of Python.
+
+    :return bytes: JSON encoding of the results.
+    """
+    return dumps({
+        u"version": _RESULTS_VERSION,
+        u"metadata": metadata,
+        u"results": {
+            result.name: {
+                u"min": result.minimum,
+                u"median": result.median,
+                u"mean": result.mean,
+                u"times": list(result.times),
+                u"peak_memory": list(result.peak_memory),
+            }
+            for result in results
+        },
+    }, indent=4, sort_keys=True)
+
+
+def results_from_json(data):
+    """
+    :param bytes data: Results encoded by ``results_to_json``.
+
+    :raise ValueError: If ``data`` isn't in a supported format.
+
+    :return: ``list`` of ``BenchmarkResult``, sorted by name.
+    """
+    decoded = loads(data)
+    if decoded.get(u"version") != _RESULTS_VERSION:
+        raise ValueError(
+            "Unsupported results version: {!r}".format(
+                decoded.get(u"version")
+            )
+        )
+    return [
+        BenchmarkResult(
+            name=name, times=result[u"times"],
+            peak_memory=result.get(u"peak_memory", []),
+        )
+        for (name, result) in sorted(decoded[u"results"].items())
+    ]
+
+
+class Comparison(PClass):
+    """
+    The comparison of the results of one benchmark with a baseline.
+
+    :ivar unicode name: The name of the benchmark.
+    :ivar float baseline: The shortest time taken in the baseline run.
+    :ivar float current: The shortest time taken in the current run.
+    :ivar bool regressed: ``True`` if the current run was slower than the
+        baseline by more than the tolerance.
+    """
+    name = field(type=unicode, mandatory=True)
+    baseline = field(type=float, mandatory=True)
+    current = field(type=float, mandatory=True)
+    regressed = field(type=bool, mandatory=True)
+
+    @property
+    def ratio(self):
+        """
+        The current time as a multiple of the baseline time.
+        """
+        if self.baseline == 0:
+            return float("inf") if self.current else 1.0
+        return self.current / self.baseline
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with those of an earlier run.
+
+    The shortest time of each benchmark is compared since it is the least
+    affected by other activity on the machine.
+
+    :param results: Iterable of ``BenchmarkResult`` from the current run.
+    :param baseline: Iterable of ``BenchmarkResult`` from an earlier run.
+    :param float tolerance: The fraction by which a benchmark may be slower
+        than the baseline without being considered a regression.
+
+    :return: ``list`` of ``Comparison`` for the benchmarks which are in both
+        runs, in the order of ``results``.
+    """
+    baseline = {result.name: result for result in baseline}
+    comparisons = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        before = float(baseline[result.name].minimum)
+        after = float(result.minimum)
+        comparisons.append(Comparison(
+            name=result.name, baseline=before, current=after,
+            regressed=after > before * (1 + tolerance),
+        ))
+    return comparisons
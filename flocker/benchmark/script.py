@@ -0,0 +1,146 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.benchmark.test.test_script -*-
+
+"""
+Command line tool running the benchmarks and comparing the results with a
+baseline.
+"""
+
+import platform
+import re
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from twisted.python.filepath import FilePath
+from twisted.python.usage import Options, UsageError
+
+from .. import __version__
+from ._cinder import cinder_benchmarks
+from ._control import control_benchmarks
+from ._framework import (
+    compare, results_from_json, results_to_json, run_benchmarks,
+)
+
+
+class BenchmarkOptions(Options):
+    """
+    Options for running the benchmarks.
+    """
+    optParameters = [
+        ["nodes", None, "10,100,1000",
+         "Comma separated numbers of nodes of the synthetic clusters to "
+         "benchmark with."],
+        ["agents", None, 10,
+         "The number of agents the control service sends updates to.", int],
+        ["repeat", None, 5,
+         "The number of times to repeat each measurement.", int],
+        ["filter", None, None,
+         "Regular expression; only benchmarks whose names match are run."],
+        ["output", None, None,
+         "File to write the results to as JSON.  By default they are written "
+         "to standard output."],
+        ["baseline", None, None,
+         "File containing the JSON results of an earlier run to compare "
+         "with."],
+        ["tolerance", None, 0.1,
+         "The fraction by which a benchmark may be slower than the baseline "
+         "before it is considered to have regressed.", float],
+    ]
+
+    def postOptions(self):
+        try:
+            self["nodes"] = [int(size) for size in self["nodes"].split(",")]
+        except ValueError:
+            raise UsageError("`--nodes` must be a list of integers.")
+        if min(self["nodes"]) < 2:
+            raise UsageError("Clusters must have at least two nodes.")
+        if self["agents"] < 1 or self["repeat"] < 1:
+            raise UsageError("`--agents` and `--repeat` must be positive.")
+        if self["filter"] is not None:
+            try:
+                self["filter"] = re.compile(self["filter"])
+            except re.error as e:
+                raise UsageError("Invalid `--filter`: {}".format(e))
+        if self["output"] is not None:
+            self["output"] = FilePath(self["output"])
+        if self["baseline"] is not None:
+            self["baseline"] = FilePath(self["baseline"])
+            try:
+                self["baseline"] = results_from_json(
+                    self["baseline"].getContent()
+                )
+            except (IOError, ValueError, KeyError) as e:
+                raise UsageError("Can't read `--baseline`: {}".format(e))
+
+
+def _metadata(options):
+    """
+    :return dict: Information about the benchmark run to store with the
+        results.
+    """
+    return {
+        u"flocker_version": __version__,
+        u"python_version": platform.python_version(),
+        u"python_implementation": platform.python_implementation(),
+        u"platform": platform.platform(),
+        u"repeat": options["repeat"],
+        u"agents": options["agents"],
+    }
+
+
+def main(args, base_path, top_level, stdout=sys.stdout, stderr=sys.stderr):
+    """
+    Run the benchmarks, write the results as JSON and compare them with a
+    baseline.  Exit with status 1 if any benchmark regressed.
+
+    :param list args: The command line arguments.
+    :param FilePath base_path: The executable being run.
+    :param FilePath top_level: The top-level of the flocker repository.
+    """
+    options = BenchmarkOptions()
+
+    try:
+        options.parseOptions(args)
+    except UsageError as e:
+        stderr.write("%s: %s\n" % (base_path.basename(), e))
+        raise SystemExit(1)
+
+    scratch = FilePath(mkdtemp())
+    try:
+        benchmarks = [
+            benchmark
+            for benchmark in control_benchmarks(
+                options["nodes"], scratch, options["agents"],
+            ) + cinder_benchmarks()
+            if options["filter"] is None or
+            options["filter"].search(benchmark.name)
+        ]
+        results = run_benchmarks(benchmarks, options["repeat"])
+    finally:
+        rmtree(scratch.path)
+
+    encoded = results_to_json(results, _metadata(options))
+    if options["output"] is None:
+        stdout.write(encoded + b"\n")
+    else:
+        options["output"].setContent(encoded)
+
+    for result in results:
+        line = "{:<70} {:>10.6f}".format(result.name, result.minimum)
+        if result.peak_memory:
+            line += " {:>10.1f} MB".format(max(result.peak_memory) / 1e6)
+        stderr.write(line + "\n")
+
+    if options["baseline"] is not None:
+        regressed = False
+        for comparison in compare(
+            results, options["baseline"], options["tolerance"],
+        ):
+            regressed = regressed or comparison.regressed
+            stderr.write("{:<70} {:>7.2f}x{}\n".format(
+                comparison.name, comparison.ratio,
+                " REGRESSED" if comparison.regressed else "",
+            ))
+        if regressed:
+            raise SystemExit(1)
@@ -0,0 +1,27 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.benchmark._cinder``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._cinder import cinder_benchmarks
+from .._framework import run_benchmarks
+
+
+class CinderBenchmarksTests(SynchronousTestCase):
+    """
+    Tests for ``cinder_benchmarks``.
+    """
+    def test_run(self):
+        """
+        All the benchmarks can be run repeatedly, with the number of waiting
+        operations in their names.
+        """
+        benchmarks = cinder_benchmarks([3])
+        results = run_benchmarks(benchmarks, 2)
+        self.assertEqual(
+            [u"cinder/wait/polling/3", u"cinder/wait/batched/3"],
+            [result.name for result in results],
+        )
@@ -0,0 +1,54 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.benchmark._cluster``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._cluster import synthetic_cluster
+
+
+class SyntheticClusterTests(SynchronousTestCase):
+    """
+    Tests for ``synthetic_cluster``.
+    """
+    def test_nodes(self):
+        """
+        The state has the requested number of nodes, each with a dataset and
+        the requested number of applications.
+        """
+        state = synthetic_cluster(3, applications_per_node=2).state
+        self.assertEqual(
+            (3, [2, 2, 2], 3),
+            (len(state.nodes),
+             [len(node.applications) for node in state.nodes],
+             len(list(state.all_datasets()))),
+        )
+
+    def test_configuration(self):
+        """
+        The configuration has the same nodes, applications and datasets as
+        the state.
+        """
+        cluster = synthetic_cluster(3)
+        self.assertEqual(
+            {(node.uuid, node.applications, node.manifestations)
+             for node in cluster.state.nodes},
+            {(node.uuid, node.applications, node.manifestations)
+             for node in cluster.configuration.nodes},
+        )
+
+    def test_reproducible(self):
+        """
+        The same arguments result in the same cluster.
+        """
+        self.assertEqual(synthetic_cluster(3), synthetic_cluster(3))
+
+    def test_seed(self):
+        """
+        Different seeds result in different clusters.
+        """
+        self.assertNotEqual(
+            synthetic_cluster(3, seed=1), synthetic_cluster(3, seed=2),
+        )
@@ -0,0 +1,65 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.benchmark._control``.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from ...control.httpapi import ConfigurationAPIUserV1
+from .._control import control_benchmarks
+from .._framework import run_benchmarks
+
+
+class ControlBenchmarksTests(SynchronousTestCase):
+    """
+    Tests for ``control_benchmarks``.
+    """
+    def test_run(self):
+        """
+        All the benchmarks can be run repeatedly on a small cluster.  The
+        benchmarks of the REST API fail if a request is unsuccessful.
+        """
+        benchmarks = control_benchmarks(
+            [2], FilePath(self.mktemp()), datasets=4, megabytes=[1],
+        )
+        results = run_benchmarks(benchmarks, 3)
+        self.assertEqual(
+            [benchmark.name for benchmark in benchmarks],
+            [result.name for result in results],
+        )
+
+    def test_sizes(self):
+        """
+        There are the same benchmarks for each cluster size, with the size in
+        their names.
+        """
+        names = [
+            benchmark.name for benchmark in
+            control_benchmarks([2, 3], FilePath(self.mktemp()), agents=2)
+        ]
+        two = [name for name in names if name.endswith(u"/2")]
+        three = [name for name in names if name.endswith(u"/3")]
+        self.assertEqual(
+            (len(names), [name[:-2] for name in two]),
+            (len(two) + len(three), [name[:-2] for name in three]),
+        )
+
+    def test_all_endpoints(self):
+        """
+        There is a benchmark for every endpoint of
+        ``ConfigurationAPIUserV1``.
+        """
+        names = {
+            benchmark.name for benchmark in
+            control_benchmarks([2], FilePath(self.mktemp()))
+        }
+        expected = set()
+        for rule in ConfigurationAPIUserV1.app.url_map.iter_rules():
+            path = rule.rule.replace(u"<", u"{").replace(u">", u"}")
+            for method in rule.methods - {u"HEAD"}:
+                expected.add(
+                    u"ConfigurationAPIUserV1 {} {}/2".format(method, path)
+                )
+        self.assertEqual(set(), expected - names)
@@ -0,0 +1,268 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.benchmark._framework``.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._framework import (
+    Benchmark, BenchmarkResult, ProcessMemory, compare, results_from_json,
+    results_to_json, run_benchmark, run_benchmarks,
+)
+
+
+class FakeTimer(object):
+    """
+    A timer which advances by one second each time it is read.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class FakeMemory(object):
+    """
+    A ``ProcessMemory`` whose usage grows by one kB each time it is read.
+
+    :ivar bool resettable: Whether the peak can be reset.
+    """
+    def __init__(self, resettable=True):
+        self.resettable = resettable
+        self.current = 0
+        self.peak = 0
+
+    def reset_peak(self):
+        self.peak = self.current
+        return self.resettable
+
+    def usage(self):
+        self.current += 1024
+        self.peak = max(self.peak, self.current) + 1024
+        return self.current, self.peak
+
+
+class RunBenchmarkTests(SynchronousTestCase):
+    """
+    Tests for ``run_benchmark`` and ``run_benchmarks``.
+    """
+    def test_repeat(self):
+        """
+        ``setup`` is called before each measurement and the function it
+        returns is called once per measurement.
+        """
+        calls = []
+
+        def setup():
+            calls.append("setup")
+            return lambda: calls.append("run")
+
+        run_benchmark(Benchmark(name=u"x", setup=setup), 2)
+        self.assertEqual(["setup", "run", "setup", "run"], calls)
+
+    def test_times(self):
+        """
+        The result has the time taken by each measurement, according to the
+        given timer.
+        """
+        timer = FakeTimer()
+
+        def setup():
+            return lambda: timer()
+
+        result = run_benchmark(Benchmark(name=u"x", setup=setup), 3, timer)
+        self.assertEqual(
+            BenchmarkResult(name=u"x", times=[2, 2, 2]), result,
+        )
+
+    def test_memory(self):
+        """
+        The result of a benchmark which measures memory has how much the
+        memory used grew by during each measurement.
+        """
+        result = run_benchmark(
+            Benchmark(name=u"x", setup=lambda: lambda: None, memory=True), 2,
+            memory=FakeMemory(),
+        )
+        self.assertEqual([2048, 2048], result.peak_memory)
+
+    def test_memory_not_measured(self):
+        """
+        Memory isn't measured for benchmarks which don't ask for it, or if
+        the peak memory use can't be reset.
+        """
+        results = [
+            run_benchmark(
+                Benchmark(name=u"x", setup=lambda: lambda: None,
+                          memory=memory),
+                2, memory=FakeMemory(resettable=resettable),
+            )
+            for (memory, resettable) in [(False, True), (True, False)]
+        ]
+        self.assertEqual(
+            [[], []], [list(result.peak_memory) for result in results],
+        )
+
+    def test_benchmarks(self):
+        """
+        ``run_benchmarks`` returns a result for each benchmark in order.
+        """
+        benchmarks = [
+            Benchmark(name=name, setup=lambda: lambda: None)
+            for name in [u"b", u"a"]
+        ]
+        self.assertEqual(
+            [u"b", u"a"],
+            [result.name for result in run_benchmarks(benchmarks, 1)],
+        )
+
+
+class BenchmarkResultTests(SynchronousTestCase):
+    """
+    Tests for ``BenchmarkResult``.
+    """
+    def test_statistics(self):
+        """
+        The minimum, median and mean times are calculated.
+        """
+        result = BenchmarkResult(name=u"x", times=[4.0, 1.0, 2.0, 9.0])
+        self.assertEqual(
+            (1.0, 3.0, 4.0), (result.minimum, result.median, result.mean),
+        )
+
+    def test_odd_median(self):
+        """
+        The median of an odd number of times is the middle one.
+        """
+        result = BenchmarkResult(name=u"x", times=[3.0, 1.0, 2.0])
+        self.assertEqual(2.0, result.median)
+
+
+class JSONTests(SynchronousTestCase):
+    """
+    Tests for ``results_to_json`` and ``results_from_json``.
+    """
+    def test_roundtrip(self):
+        """
+        Results encoded by ``results_to_json`` are decoded by
+        ``results_from_json``.
+        """
+        results = [
+            BenchmarkResult(name=u"a", times=[1.0, 2.0]),
+            BenchmarkResult(name=u"b", times=[0.5], peak_memory=[1024]),
+        ]
+        self.assertEqual(
+            results,
+            results_from_json(results_to_json(results, {u"python": u"2.7"})),
+        )
+
+    def test_unsupported_version(self):
+        """
+        ``results_from_json`` raises ``ValueError`` if the results are in an
+        unknown format.
+        """
+        self.assertRaises(
+            ValueError, results_from_json, b'{"version": 2, "results": {}}',
+        )
+
+
+class ProcessMemoryTests(SynchronousTestCase):
+    """
+    Tests for ``ProcessMemory``.
+    """
+    def setUp(self):
+        self.proc = FilePath(self.mktemp())
+        self.proc.makedirs()
+        self.proc.child(b"status").setContent(
+            b"Name:\tpython\n"
+            b"VmHWM:\t  2048 kB\n"
+            b"VmRSS:\t  1024 kB\n"
+        )
+
+    def test_usage(self):
+        """
+        ``ProcessMemory.usage`` returns the current and peak resident set
+        sizes in bytes.
+        """
+        self.assertEqual(
+            (1024 * 1024, 2048 * 1024), ProcessMemory(self.proc).usage(),
+        )
+
+    def test_reset_peak(self):
+        """
+        ``ProcessMemory.reset_peak`` writes ``5`` to ``clear_refs``.
+        """
+        self.assertEqual(
+            (True, b"5"),
+            (ProcessMemory(self.proc).reset_peak(),
+             self.proc.child(b"clear_refs").getContent()),
+        )
+
+    def test_reset_peak_unsupported(self):
+        """
+        ``ProcessMemory.reset_peak`` returns ``False`` if ``clear_refs``
+        can't be written.
+        """
+        self.assertFalse(
+            ProcessMemory(self.proc.child(b"missing")).reset_peak()
+        )
+
+    def test_self(self):
+        """
+        By default ``ProcessMemory`` reads the usage of this process.
+        """
+        current, peak = ProcessMemory().usage()
+        self.assertTrue(0 < current <= peak)
+    if not FilePath(b"/proc/self/status").exists():
+        test_self.skip = "/proc is not available."
+
+
+class CompareTests(SynchronousTestCase):
+    """
+    Tests for ``compare``.
+    """
+    def test_regressed(self):
+        """
+        A benchmark whose shortest time is slower than the baseline's by more
+        than the tolerance has regressed.
+        """
+        [comparison] = compare(
+            [BenchmarkResult(name=u"x", times=[1.2, 3.0])],
+            [BenchmarkResult(name=u"x", times=[1.0])],
+            0.1,
+        )
+        self.assertEqual(
+            (True, 1.0, 1.2),
+            (comparison.regressed, comparison.baseline, comparison.current),
+        )
+
+    def test_within_tolerance(self):
+        """
+        A benchmark which is slower than the baseline by less than the
+        tolerance hasn't regressed.
+        """
+        [comparison] = compare(
+            [BenchmarkResult(name=u"x", times=[1.05])],
+            [BenchmarkResult(name=u"x", times=[1.0])],
+            0.1,
+        )
+        self.assertEqual(
+            (False, 1.05), (comparison.regressed, comparison.ratio),
+        )
+
+    def test_missing(self):
+        """
+        Benchmarks which are only in one of the runs aren't compared.
+        """
+        self.assertEqual(
+            [],
+            compare(
+                [BenchmarkResult(name=u"x", times=[1.0])],
+                [BenchmarkResult(name=u"y", times=[1.0])],
+                0.1,
+            ),
+        )
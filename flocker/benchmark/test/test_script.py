@@ -0,0 +1,112 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.benchmark.script``.
+"""
+
+from io import BytesIO
+
+from twisted.python.filepath import FilePath
+from twisted.python.usage import UsageError
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._framework import BenchmarkResult, results_from_json, results_to_json
+from ..script import BenchmarkOptions, main
+
+
+class BenchmarkOptionsTests(SynchronousTestCase):
+    """
+    Tests for ``BenchmarkOptions``.
+    """
+    def test_nodes(self):
+        """
+        ``--nodes`` is a comma separated list of cluster sizes.
+        """
+        options = BenchmarkOptions()
+        options.parseOptions(["--nodes", "2,30"])
+        self.assertEqual([2, 30], options["nodes"])
+
+    def test_too_few_nodes(self):
+        """
+        Clusters must have at least two nodes.
+        """
+        self.assertRaises(
+            UsageError, BenchmarkOptions().parseOptions, ["--nodes", "1"],
+        )
+
+    def test_bad_baseline(self):
+        """
+        ``--baseline`` must be a file containing results.
+        """
+        path = FilePath(self.mktemp())
+        path.setContent(b"{}")
+        self.assertRaises(
+            UsageError, BenchmarkOptions().parseOptions,
+            ["--baseline", path.path],
+        )
+
+
+class MainTests(SynchronousTestCase):
+    """
+    Tests for ``main``.
+    """
+    def run_main(self, *args):
+        """
+        Run a quick benchmark of the ``/version`` endpoint.
+
+        :param args: Additional command line arguments.
+        :return: ``BytesIO`` the summary was written to.
+        """
+        stderr = BytesIO()
+        main(
+            ["--nodes", "2", "--repeat", "1", "--filter", "GET /version"] +
+            list(args),
+            FilePath(b"benchmark-control"), FilePath(b"."),
+            stdout=BytesIO(), stderr=stderr,
+        )
+        return stderr
+
+    def test_output(self):
+        """
+        The results are written as JSON to the ``--output`` file.
+        """
+        output = FilePath(self.mktemp())
+        self.run_main("--output", output.path)
+        self.assertEqual(
+            [u"ConfigurationAPIUserV1 GET /version/2"],
+            [result.name for result in results_from_json(
+                output.getContent()
+            )],
+        )
+
+    def test_regression(self):
+        """
+        ``main`` exits with status 1 if a benchmark is slower than in the
+        baseline.
+        """
+        baseline = FilePath(self.mktemp())
+        baseline.setContent(results_to_json(
+            [BenchmarkResult(
+                name=u"ConfigurationAPIUserV1 GET /version/2", times=[0.0],
+            )],
+            {},
+        ))
+        exception = self.assertRaises(
+            SystemExit, self.run_main, "--baseline", baseline.path,
+        )
+        self.assertEqual(1, exception.code)
+
+    def test_no_regression(self):
+        """
+        ``main`` returns normally if no benchmark is slower than in the
+        baseline.
+        """
+        baseline = FilePath(self.mktemp())
+        baseline.setContent(results_to_json(
+            [BenchmarkResult(
+                name=u"ConfigurationAPIUserV1 GET /version/2", times=[1000.0],
+            )],
+            {},
+        ))
+        stderr = self.run_main("--baseline", baseline.path)
+        self.assertNotIn(b"REGRESSED", stderr.getvalue())
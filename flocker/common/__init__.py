@@ -6,12 +6,16 @@ Shared flocker components.
 
 __all__ = [
     'INode', 'FakeNode', 'ProcessNode', 'gather_deferreds',
-    'auto_threaded', 'interface_decorator',
+    'auto_threaded', 'interface_decorator', 'InstrumentedThreadPool',
+    'ThreadPoolMetrics', 'dedicated_threadpool',
     'get_all_ips', 'ipaddress_from_string',
 ]
 
 from ._ipc import INode, FakeNode, ProcessNode
 from ._defer import gather_deferreds
-from ._thread import auto_threaded
+from ._thread import (
+    auto_threaded, InstrumentedThreadPool, ThreadPoolMetrics,
+    dedicated_threadpool,
+)
 from ._interface import interface_decorator
 from ._net import get_all_ips, ipaddress_from_string
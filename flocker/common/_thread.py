@@ -1,14 +1,39 @@
 # Copyright ClusterHQ Inc.  See LICENSE file for details.
 
+# -*- test-case-name: flocker.common.test.test_thread -*-
+
 """
 Some thread-related tools.
 """
 
+import threading
+from time import time
+
+from eliot import Field, MessageType
+
+from pyrsistent import PClass, field
+
 from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 
 from ._interface import interface_decorator
 
 
+# A call which waits this many seconds for a thread is logged:
+SLOW_THREADPOOL_WAIT = 1.0
+
+THREADPOOL_DELAYED = MessageType(
+    u"flocker:common:threadpool:delayed",
+    [Field.for_types(u"threadpool", [unicode, None],
+                     u"The name of the threadpool."),
+     Field.for_types(u"wait", [float],
+                     u"Seconds the call waited for a thread."),
+     Field.for_types(u"queued", [int],
+                     u"Calls still waiting for a thread.")],
+    u"A call waited a long time for a thread of a threadpool.",
+)
+
+
 def _threaded_method(method_name, sync_name, reactor_name, threadpool_name):
     """
     Create a method that calls another method in a threadpool.
@@ -65,3 +90,106 @@ def auto_threaded(interface, reactor, sync, threadpool):
         interface, _threaded_method,
         sync, reactor, threadpool,
     )
+
+
+class ThreadPoolMetrics(PClass):
+    """
+    Statistics about the calls made using a threadpool.
+
+    :ivar int calls: The number of calls which have started running.
+    :ivar int queued: The number of calls currently waiting for a thread.
+    :ivar int max_queued: The most calls which have waited at once.
+    :ivar float total_wait: The total time, in seconds, calls have waited.
+    :ivar float max_wait: The longest time, in seconds, a call has waited.
+    """
+    calls = field(type=int, initial=0)
+    queued = field(type=int, initial=0)
+    max_queued = field(type=int, initial=0)
+    total_wait = field(type=float, initial=0.0)
+    max_wait = field(type=float, initial=0.0)
+
+    def submitted(self):
+        """
+        :return: A copy of these metrics updated for a new call waiting for a
+            thread.
+        """
+        queued = self.queued + 1
+        return self.set(queued=queued, max_queued=max(queued, self.max_queued))
+
+    def started(self, wait):
+        """
+        :param float wait: How long the call waited for a thread.
+
+        :return: A copy of these metrics updated for a call which has started
+            running.
+        """
+        return self.set(
+            calls=self.calls + 1, queued=self.queued - 1,
+            total_wait=self.total_wait + wait,
+            max_wait=max(wait, self.max_wait),
+        )
+
+
+class InstrumentedThreadPool(ThreadPool):
+    """
+    A ``ThreadPool`` which measures how many calls wait for a thread and for
+    how long.
+
+    :ivar ThreadPoolMetrics metrics: Statistics about the calls.
+    :ivar float slow_wait: Calls which wait at least this many seconds are
+        logged.
+    :ivar _time: No-argument callable returning the current time in seconds.
+    :ivar _lock: A ``threading.Lock`` protecting ``metrics``.
+    """
+    def __init__(self, minthreads=5, maxthreads=20, name=None,
+                 slow_wait=SLOW_THREADPOOL_WAIT, time=time):
+        ThreadPool.__init__(self, minthreads, maxthreads, name)
+        self.metrics = ThreadPoolMetrics()
+        self.slow_wait = slow_wait
+        self._time = time
+        self._lock = threading.Lock()
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        submitted = self._time()
+
+        def started(*args, **kw):
+            wait = float(self._time() - submitted)
+            with self._lock:
+                self.metrics = self.metrics.started(wait)
+                queued = self.metrics.queued
+            if wait >= self.slow_wait:
+                name = self.name
+                if name is not None:
+                    name = unicode(name)
+                THREADPOOL_DELAYED(
+                    threadpool=name, wait=wait, queued=queued,
+                ).write()
+            return func(*args, **kw)
+
+        with self._lock:
+            self.metrics = self.metrics.submitted()
+        ThreadPool.callInThreadWithCallback(
+            self, onResult, started, *args, **kw
+        )
+
+
+def dedicated_threadpool(reactor, name, size):
+    """
+    Create and start an ``InstrumentedThreadPool`` which stops when the
+    reactor does, like the reactor's own threadpool, so that blocking calls
+    made with it don't wait behind those made by the rest of the process.
+
+    Threads are only started as calls need them.
+
+    :param reactor: The reactor whose lifetime the threadpool shares.
+    :param bytes name: The name of the threadpool.
+    :param int size: The most threads the threadpool runs at once.
+
+    :return: The ``InstrumentedThreadPool``.
+    """
+    threadpool = InstrumentedThreadPool(
+        minthreads=0, maxthreads=size, name=name,
+    )
+    threadpool.start()
+    reactor.addSystemEventTrigger("during", "shutdown", threadpool.stop)
+    return threadpool
@@ -4,15 +4,24 @@
 Tests for ``flocker.common._thread``.
 """
 
+from eliot.testing import capture_logging, assertHasMessage
+
 from zope.interface import Attribute, Interface, implementer
 
+from twisted.internet.defer import gatherResults
+from twisted.internet.threads import deferToThreadPool
 from twisted.trial.unittest import SynchronousTestCase, TestCase
 from twisted.python.failure import Failure
 from twisted.python.threadpool import ThreadPool
 
 from pyrsistent import PRecord, field
 
-from .. import auto_threaded
+from .. import (
+    auto_threaded, InstrumentedThreadPool, ThreadPoolMetrics,
+    dedicated_threadpool,
+)
+from .._thread import THREADPOOL_DELAYED
+from ...testtools import MemoryCoreReactor
 
 
 class IStub(Interface):
@@ -204,3 +213,85 @@ class AutoThreadedIntegrationTests(TestCase):
         result = async_spy.method(a, b, c)
         result.addCallback(self.assertEqual, spy.method(a, b, c))
         return result
+
+
+class InstrumentedThreadPoolTests(TestCase):
+    """
+    Tests for ``InstrumentedThreadPool``.
+    """
+    def threadpool(self, times, slow_wait):
+        """
+        :param list times: The times, in seconds, the threadpool finds it to
+            be each time it looks.
+        :param float slow_wait: See ``InstrumentedThreadPool``.
+
+        :return: An ``InstrumentedThreadPool`` with a single thread which
+            hasn't been started.
+        """
+        times = iter(times)
+        threadpool = InstrumentedThreadPool(
+            minthreads=0, maxthreads=1, name=b"test",
+            slow_wait=slow_wait, time=lambda: next(times),
+        )
+        self.addCleanup(threadpool.stop)
+        return threadpool
+
+    def test_metrics(self):
+        """
+        ``InstrumentedThreadPool.metrics`` counts the calls waiting for a
+        thread and the calls which have started, and how long they waited.
+        """
+        from twisted.internet import reactor
+        threadpool = self.threadpool([0.0, 1.0, 3.0, 7.0], slow_wait=60.0)
+        d = gatherResults([
+            deferToThreadPool(reactor, threadpool, lambda: 1),
+            deferToThreadPool(reactor, threadpool, lambda: 2),
+        ])
+        queued = threadpool.metrics
+        threadpool.start()
+
+        def ran(results):
+            self.assertEqual(
+                ([1, 2], ThreadPoolMetrics(queued=2, max_queued=2),
+                 ThreadPoolMetrics(calls=2, queued=0, max_queued=2,
+                                   total_wait=9.0, max_wait=6.0)),
+                (results, queued, threadpool.metrics),
+            )
+        return d.addCallback(ran)
+
+    @capture_logging(None)
+    def test_slow(self, logger):
+        """
+        A call which waits at least ``slow_wait`` seconds for a thread is
+        logged.
+        """
+        from twisted.internet import reactor
+        threadpool = self.threadpool([0.0, 2.0], slow_wait=1.0)
+        d = deferToThreadPool(reactor, threadpool, lambda: None)
+        threadpool.start()
+
+        def ran(ignored):
+            assertHasMessage(self, logger, THREADPOOL_DELAYED, dict(
+                threadpool=u"test", wait=2.0, queued=0,
+            ))
+        return d.addCallback(ran)
+
+
+class DedicatedThreadPoolTests(SynchronousTestCase):
+    """
+    Tests for ``dedicated_threadpool``.
+    """
+    def test_lifetime(self):
+        """
+        The threadpool is sized as requested, is started without any threads
+        and stops when the reactor shuts down.
+        """
+        reactor = MemoryCoreReactor()
+        threadpool = dedicated_threadpool(reactor, b"test", 7)
+        self.addCleanup(threadpool.stop)
+        started = (threadpool.started, len(threadpool.threads))
+        reactor.fireSystemEvent("shutdown")
+        self.assertEqual(
+            (b"test", 7, (True, 0), False),
+            (threadpool.name, threadpool.max, started, threadpool.started),
+        )
@@ -5,6 +5,8 @@ Combine and retrieve current cluster state.
 """
 
 from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from itertools import count
 
 from twisted.python.versions import Version
 from twisted.python.deprecate import deprecated
@@ -13,6 +15,8 @@ from twisted.application.internet import TimerService
 
 from pyrsistent import PRecord, field, pmap
 
+from eliot import Logger, write_traceback
+
 from ._model import DeploymentState, ChangeSource
 
 
@@ -55,8 +59,21 @@ class ClusterStateService(MultiService):
     :ivar DeploymentState _deployment_state: The current known cluster state.
     :ivar PMap _information_wipers: Map (wiper class, wiper key) to
         ``_WiperAndSource``.
+    :ivar dict _source_wipers: Map from each source of the wipers in
+        ``_information_wipers`` to the ``set`` of keys of its wipers.
+    :ivar list _expirations: Heap of three-tuples of the time at which the
+        wipers of a source are due to expire, a sequence number to break
+        ties and the source.  There is one entry for each source in
+        ``_source_wipers``.
     :ivar _clock: ``IReactorTime`` provider.
+    :ivar int generation: A counter which is incremented whenever the known
+        cluster state changes.  Equal generations of the same service mean
+        equal results from ``as_deployment``.
+    :ivar list _change_callbacks: Callables to call whenever the known
+        cluster state changes.
     """
+    logger = Logger()
+
     def __init__(self, reactor):
         MultiService.__init__(self)
         self._deployment_state = DeploymentState()
@@ -64,22 +81,83 @@ class ClusterStateService(MultiService):
         timer.clock = reactor
         timer.setServiceParent(self)
         self._information_wipers = pmap()
+        self._source_wipers = {}
+        self._expirations = []
+        self._sequence = count()
         self._clock = reactor
+        self.generation = 0
+        self._change_callbacks = []
+
+    def register(self, change_callback):
+        """
+        Register a function to be called whenever the known cluster state
+        changes.
+
+        :param change_callback: Callable that takes no arguments, will be
+            called when the cluster state changes.
+        """
+        self._change_callbacks.append(change_callback)
+
+    def _changed(self):
+        """
+        Record a change to the known cluster state and tell the registered
+        callbacks about it.
+        """
+        self.generation += 1
+        for callback in self._change_callbacks:
+            try:
+                callback()
+            except:
+                write_traceback(self.logger, u"")
+
+    def _schedule_expiration(self, source):
+        """
+        Schedule a check of whether the wipers of a source have expired, for
+        ``EXPIRATION_TIME`` after its last activity.
+
+        :param IClusterStateSource source: The source.
+        """
+        heappush(self._expirations, (
+            source.last_activity() + EXPIRATION_TIME, next(self._sequence),
+            source,
+        ))
 
     def _wipe_expired(self):
         """
         Clear any expired state from memory.
+
+        Only the sources which were due to expire are looked at.  Sources are
+        only told about activity by their connections, so a source which has
+        been active since it was scheduled is rescheduled instead.
         """
         current_time = datetime.utcfromtimestamp(self._clock.seconds())
-        evolver = self._information_wipers.evolver()
-        for key, wipe in self._information_wipers.items():
-            last_activity = wipe.last_activity()
-            if current_time - last_activity >= EXPIRATION_TIME:
-                self._deployment_state = wipe.update_cluster_state(
-                    self._deployment_state
-                )
-                evolver.remove(key)
-        self._information_wipers = evolver.persistent()
+        expirations = self._expirations
+        deployment_state = self._deployment_state
+        evolver = None
+        while expirations and expirations[0][0] <= current_time:
+            source = heappop(expirations)[2]
+            keys = self._source_wipers[source]
+            if not keys:
+                # All of its wipers were replaced by wipers from other
+                # sources.
+                del self._source_wipers[source]
+            elif current_time - source.last_activity() < EXPIRATION_TIME:
+                self._schedule_expiration(source)
+            else:
+                del self._source_wipers[source]
+                if evolver is None:
+                    evolver = self._information_wipers.evolver()
+                for key in keys:
+                    self._deployment_state = evolver[key].update_cluster_state(
+                        self._deployment_state
+                    )
+                    evolver.remove(key)
+        if evolver is not None:
+            self._information_wipers = evolver.persistent()
+            # Wipers may remove information which is already gone, or which
+            # they never remove; that isn't a change.
+            if self._deployment_state != deployment_state:
+                self._changed()
 
     def manifestation_path(self, node_uuid, dataset_id):
         """
@@ -111,19 +189,45 @@ class ClusterStateService(MultiService):
         :param list changes: Some ``IClusterStateChange`` providers to use to
             update the internal cluster state.
         """
+        self.apply_changes_from_sources([(source, changes)])
+
+    def apply_changes_from_sources(self, changes_from_sources):
+        """
+        Apply changes from several sources to the cluster state, in order.
+
+        This is equivalent to calling ``apply_changes_from_source`` for each
+        source but records the information wipers for all of the changes in
+        one go.
+
+        :param changes_from_sources: Iterable of two-tuples of an
+            ``IClusterChangeSource`` and a ``list`` of ``IClusterStateChange``
+            providers from that source.  See ``apply_changes_from_source``.
+        """
         # XXX: Multiple nodes may report being primary for a dataset. Enforce
         # consistency here. See
         # https://clusterhq.atlassian.net/browse/FLOC-1303
-        for change in changes:
-            self._deployment_state = change.update_cluster_state(
-                self._deployment_state
-            )
-        for change in changes:
-            wiper = change.get_information_wipe()
-            key = (wiper.__class__, wiper.key())
-            self._information_wipers = self._information_wipers.set(
-                key, _WiperAndSource(wiper=wiper, source=source)
-            )
+        deployment_state = self._deployment_state
+        wipers = self._information_wipers.evolver()
+        for source, changes in changes_from_sources:
+            for change in changes:
+                deployment_state = change.update_cluster_state(
+                    deployment_state
+                )
+            for change in changes:
+                wiper = change.get_information_wipe()
+                key = (wiper.__class__, wiper.key())
+                if key in wipers:
+                    self._source_wipers[wipers[key].source].discard(key)
+                wipers[key] = _WiperAndSource(wiper=wiper, source=source)
+                keys = self._source_wipers.get(source)
+                if keys is None:
+                    keys = self._source_wipers[source] = set()
+                    self._schedule_expiration(source)
+                keys.add(key)
+        self._information_wipers = wipers.persistent()
+        if deployment_state is not self._deployment_state:
+            self._deployment_state = deployment_state
+            self._changed()
 
     @deprecated(v1_0, "ClusterStateService.apply_changes_from_source")
     def apply_changes(self, changes):
@@ -0,0 +1,399 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_codec -*-
+
+"""
+Encodings of the configuration model used on the wire.
+
+Two codecs are available:
+
+* ``JSON_CODEC`` uses ``wire_encode`` and ``wire_decode``.  It is understood
+  by every version of Flocker.
+* ``BINARY_CODEC`` uses msgpack.  Class names, field names, UUIDs, paths and
+  long strings are stored once per message in a string table and referred to
+  by index elsewhere, so the result is much smaller than the JSON encoding and
+  quicker to produce and parse.
+
+Messages produced by ``BINARY_CODEC`` start with a marker that can never start
+a JSON document, so ``decode`` can decode the output of either codec.  The
+codec used to send messages is negotiated using ``VersionCommand``.
+"""
+
+from calendar import timegm
+from datetime import datetime
+from itertools import chain
+from uuid import UUID
+
+from msgpack import Unpacker, packb
+
+from pyrsistent import PClass, PMap, PRecord, PSet, PVector, field, pmap
+
+from pytz import UTC
+
+from twisted.python.filepath import FilePath
+
+from ._persistence import _CONFIG_CLASS_MAP, wire_encode, wire_decode
+
+
+# Prefix of every message produced by the binary codec.  0xc1 is never used
+# by msgpack and can't begin a JSON document.  The second byte is the version
+# of the format.
+_BINARY_MARKER = b"\xc1\x01"
+
+# Unicode strings at least this long are stored in the string table.  Shorter
+# strings take less space inline than a reference to the table would.
+_INTERN_LENGTH = 8
+
+# Tags identifying the kind of object encoded as a single entry msgpack map.
+# Everything encoded as a msgpack array is a sequence.
+_RECORD = 0
+_MAP = 1
+_DICT = 2
+_UUID = 3
+_PATH = 4
+_DATETIME = 5
+_STRING = 6
+_INTEGER = 7
+
+# The range of integers msgpack can represent natively.  Others are encoded
+# as strings.
+_MIN_INTEGER = -2 ** 63
+_MAX_INTEGER = 2 ** 64 - 1
+
+
+# Types msgpack serializes natively:
+_NATIVE = frozenset([bytes, bool, int, float, type(None)])
+
+
+class _BinaryEncoder(object):
+    """
+    Convert model objects into structures msgpack can serialize, collecting
+    a string table as it goes.
+
+    :ivar list table: The strings (``unicode`` or ``bytes``) referred to by
+        index from the converted structure.
+    :ivar dict _indexes: Map from ``(type, string)`` to index in ``table``.
+        The type is part of the key because equal ``bytes`` and ``unicode``
+        must be kept apart.
+    """
+    def __init__(self):
+        self.table = []
+        self._indexes = {}
+
+    def intern(self, string):
+        """
+        :param string: ``unicode`` or ``bytes`` to store in the table.
+        :return int: The index of ``string`` in the table.
+        """
+        key = (type(string), string)
+        try:
+            return self._indexes[key]
+        except KeyError:
+            index = self._indexes[key] = len(self.table)
+            self.table.append(string)
+            return index
+
+    def convert(self, obj):
+        """
+        :param obj: An object from the configuration model.
+        :return: A structure of ``list``, ``dict`` and primitive values which
+            msgpack can serialize.
+        """
+        kind = type(obj)
+        if kind in _NATIVE:
+            return obj
+        try:
+            converter = _CONVERTERS[kind]
+        except KeyError:
+            converter = _CONVERTERS[kind] = _find_converter(kind)
+        return converter(self, obj)
+
+    def _sequence(self, items):
+        """
+        :param items: Iterable of objects.
+        :return list: The converted objects.
+        """
+        convert = self.convert
+        return [
+            item if type(item) in _NATIVE else convert(item)
+            for item in items
+        ]
+
+    def _items(self, pairs):
+        """
+        :param pairs: Iterable of key/value pairs.
+        :return list: The converted keys and values, flattened.
+        """
+        result = []
+        append = result.append
+        convert = self.convert
+        for key, value in pairs:
+            append(key if type(key) in _NATIVE else convert(key))
+            append(value if type(value) in _NATIVE else convert(value))
+        return result
+
+    def _fields(self, obj, fields):
+        """
+        :param obj: A ``PRecord`` or ``PClass``.
+        :param fields: Iterable of name/value pairs of the fields of ``obj``
+            which have a value.
+        :return dict: The converted record.
+        """
+        intern = self.intern
+        convert = self.convert
+        payload = [intern(obj.__class__.__name__)]
+        append = payload.append
+        for name, value in fields:
+            append(intern(name))
+            append(value if type(value) in _NATIVE else convert(value))
+        return {_RECORD: payload}
+
+    def _precord(self, obj):
+        return self._fields(obj, obj.iteritems())
+
+    def _pclass(self, obj):
+        return self._fields(obj, obj.evolver().data.iteritems())
+
+    def _pmap(self, obj):
+        return {_MAP: self._items(obj.iteritems())}
+
+    def _dict(self, obj):
+        return {_DICT: self._items(obj.iteritems())}
+
+    def _unicode(self, obj):
+        if len(obj) >= _INTERN_LENGTH:
+            return {_STRING: self.intern(obj)}
+        return obj
+
+    def _long(self, obj):
+        if _MIN_INTEGER <= obj <= _MAX_INTEGER:
+            return obj
+        return {_INTEGER: bytes(obj)}
+
+    def _uuid(self, obj):
+        return {_UUID: self.intern(obj.bytes)}
+
+    def _filepath(self, obj):
+        return {_PATH: self.intern(obj.path)}
+
+    def _datetime(self, obj):
+        if obj.tzinfo is None:
+            raise ValueError(
+                "Datetime without a timezone: {}".format(obj))
+        return {_DATETIME: timegm(obj.utctimetuple())}
+
+
+def _find_converter(kind):
+    """
+    :param type kind: The type of an object to convert.
+    :raise TypeError: If objects of that type can't be converted.
+    :return: The unbound ``_BinaryEncoder`` method which converts objects of
+        type ``kind``.
+    """
+    # Order matters: ``PRecord`` is a subclass of ``PMap``.
+    for base, converter in [
+        (unicode, _BinaryEncoder._unicode),
+        (long, _BinaryEncoder._long),
+        (PRecord, _BinaryEncoder._precord),
+        (PClass, _BinaryEncoder._pclass),
+        (PMap, _BinaryEncoder._pmap),
+        ((PSet, PVector, set, frozenset, list, tuple),
+         _BinaryEncoder._sequence),
+        (dict, _BinaryEncoder._dict),
+        (UUID, _BinaryEncoder._uuid),
+        (FilePath, _BinaryEncoder._filepath),
+        (datetime, _BinaryEncoder._datetime),
+    ]:
+        if issubclass(kind, base):
+            return converter
+    raise TypeError("{!r} is not serializable".format(kind))
+
+
+# Map from type to the ``_BinaryEncoder`` method which converts instances of
+# it, filled in as types are encountered:
+_CONVERTERS = {}
+
+
+def _pairs(flattened):
+    """
+    :param list flattened: Keys and values, alternating.
+    :return: Iterator of key/value pairs.
+    """
+    iterator = iter(flattened)
+    return zip(iterator, iterator)
+
+
+def binary_wire_encode(obj):
+    """
+    Encode the given model object into bytes using msgpack.
+
+    :param obj: An object from the configuration model, e.g. ``Deployment``.
+    :return bytes: Encoded object.
+    """
+    encoder = _BinaryEncoder()
+    body = packb(encoder.convert(obj), use_bin_type=True)
+    return b"".join([
+        _BINARY_MARKER, packb(encoder.table, use_bin_type=True), body,
+    ])
+
+
+def binary_wire_decode(data):
+    """
+    Decode the given model object from bytes produced by
+    ``binary_wire_encode``.
+
+    :param bytes data: Encoded object.
+    """
+    if not data.startswith(_BINARY_MARKER):
+        raise ValueError("Not a binary encoded object.")
+    return _binary_decode_chunks([data])
+
+
+def _binary_decode_chunks(chunks):
+    """
+    Decode the given model object from pieces of the bytes produced by
+    ``binary_wire_encode``.
+
+    Each piece is parsed as soon as it is read, and the parser only keeps the
+    bytes of objects it hasn't finished parsing, so the complete encoding is
+    never held in memory at once.
+
+    :param chunks: Iterable of ``bytes`` which together are the encoded
+        object.  The first must start with the binary marker.
+    """
+    table = []
+    # Decoded UUIDs and paths, by table index, so repeated ones are only
+    # decoded once:
+    decoded = {}
+
+    def decode_record(payload):
+        fields = {
+            table[name]: value for (name, value) in _pairs(payload[1:])
+        }
+        return _CONFIG_CLASS_MAP[table[payload[0]]].create(fields)
+
+    def decode_uuid(index):
+        try:
+            return decoded[index]
+        except KeyError:
+            result = decoded[index] = UUID(bytes=table[index])
+            return result
+
+    def decode_path(index):
+        try:
+            return decoded[index]
+        except KeyError:
+            result = decoded[index] = FilePath(table[index])
+            return result
+
+    decoders = {
+        _RECORD: decode_record,
+        _MAP: lambda payload: pmap(_pairs(payload)),
+        _DICT: lambda payload: dict(_pairs(payload)),
+        _UUID: decode_uuid,
+        _PATH: decode_path,
+        _DATETIME: lambda seconds: datetime.fromtimestamp(seconds, UTC),
+        _STRING: table.__getitem__,
+        _INTEGER: long,
+    }
+
+    def decode(tagged):
+        [(tag, payload)] = tagged.items()
+        return decoders[tag](payload)
+
+    unpacker = Unpacker(object_hook=decode, encoding="utf-8")
+    # The string table followed by the object:
+    parsed = []
+    skip = len(_BINARY_MARKER)
+    for chunk in chunks:
+        if skip:
+            chunk = chunk[skip:]
+            skip = 0
+        unpacker.feed(chunk)
+        # Iterating stops when the data fed so far is used up, and parsing
+        # resumes where it left off when more is fed.
+        for item in unpacker:
+            if not parsed:
+                # The table contains only strings so ``decode`` isn't called
+                # for it.  It is complete before any of the object is parsed.
+                table.extend(item)
+            parsed.append(item)
+    if len(parsed) != 2:
+        raise ValueError("Incomplete binary encoded object.")
+    return parsed[1]
+
+
+class WireCodec(PClass):
+    """
+    A way of encoding model objects to send over the network.
+
+    :ivar unicode name: The name used to identify this codec when negotiating
+        with a peer.
+    :ivar encode: One-argument callable converting a model object to bytes.
+    :ivar decode: One-argument callable converting bytes to a model object.
+    """
+    name = field(type=unicode, mandatory=True)
+    encode = field(mandatory=True)
+    decode = field(mandatory=True)
+
+
+JSON_CODEC = WireCodec(
+    name=u"json", encode=wire_encode, decode=wire_decode,
+)
+BINARY_CODEC = WireCodec(
+    name=u"msgpack", encode=binary_wire_encode, decode=binary_wire_decode,
+)
+
+# All supported codecs, most preferred first:
+CODECS = [BINARY_CODEC, JSON_CODEC]
+
+
+def decode(data):
+    """
+    Decode the given model object from bytes produced by any supported
+    codec.
+
+    :param bytes data: Encoded object.
+    """
+    if data.startswith(_BINARY_MARKER):
+        return binary_wire_decode(data)
+    return wire_decode(data)
+
+
+def decode_chunks(chunks):
+    """
+    Decode the given model object from pieces of the bytes produced by any
+    supported codec.
+
+    Objects encoded by ``BINARY_CODEC`` are parsed piece by piece, without
+    joining the pieces together first.
+
+    :param chunks: Iterable of ``bytes`` which together are the encoded
+        object.
+    """
+    chunks = iter(chunks)
+    # Enough of the start to tell which codec was used:
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= len(_BINARY_MARKER):
+            break
+    if first.startswith(_BINARY_MARKER):
+        return _binary_decode_chunks(chain([first], chunks))
+    return wire_decode(b"".join(chain([first], chunks)))
+
+
+def negotiate_codec(names):
+    """
+    Choose the codec to use when sending to a peer.
+
+    :param names: The names of the codecs the peer can decode, or ``None`` if
+        the peer didn't say (in which case it only understands JSON).
+
+    :return WireCodec: The most preferred codec the peer can decode.
+    """
+    if names is None:
+        return JSON_CODEC
+    for codec in CODECS:
+        if codec.name in names:
+            return codec
+    return JSON_CODEC
@@ -0,0 +1,226 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_diffing -*-
+
+"""
+Code to calculate the difference between two pyrsistent objects and to apply
+that difference to a pyrsistent object.
+
+This is used to send the control service's view of the cluster to agents as a
+series of small changes rather than as a complete snapshot each time.
+"""
+
+from pyrsistent import PClass, PMap, PSet, PVector, field, pvector
+
+
+def _get(obj, key):
+    """
+    Retrieve a child of a pyrsistent object.
+
+    :param obj: A ``PClass``, ``PRecord``, ``PMap`` or ``PVector``.
+    :param key: The attribute name, key or index of the child.
+
+    :return: The child object.
+    """
+    if isinstance(obj, PClass):
+        return getattr(obj, key)
+    return obj[key]
+
+
+def _transform(obj, path, operation):
+    """
+    Replace the object at ``path`` within ``obj`` with the result of calling
+    ``operation`` with it.
+
+    :param obj: The root pyrsistent object.
+    :param path: A sequence of attribute names, keys or indexes leading from
+        ``obj`` to the object to operate on.
+    :param operation: A one-argument callable returning the replacement.
+
+    :return: A new root object with the replacement made.
+    """
+    if len(path) == 0:
+        return operation(obj)
+    key = path[0]
+    return obj.set(key, _transform(_get(obj, key), path[1:], operation))
+
+
+def _path_field():
+    """
+    :return: A ``field`` holding a ``PVector`` path.
+    """
+    return field(type=PVector, factory=pvector, mandatory=True,
+                 initial=pvector())
+
+
+class _Set(PClass):
+    """
+    Set the value at a path.
+
+    :ivar PVector path: The path of the value to set.  The last element is the
+        attribute name or key within the parent object.  An empty path
+        replaces the whole object.
+    :ivar value: The new value.
+    """
+    path = _path_field()
+    value = field()
+
+    def apply(self, obj):
+        if len(self.path) == 0:
+            return self.value
+        return _transform(
+            obj, self.path[:-1], lambda o: o.set(self.path[-1], self.value)
+        )
+
+
+class _Add(PClass):
+    """
+    Add an item to the set at a path.
+
+    :ivar PVector path: The path of the set.
+    :ivar item: The item to add.
+    """
+    path = _path_field()
+    item = field()
+
+    def apply(self, obj):
+        return _transform(obj, self.path, lambda o: o.add(self.item))
+
+
+class _Remove(PClass):
+    """
+    Remove an item from the set, or a key from the mapping, at a path.
+
+    :ivar PVector path: The path of the set or mapping.
+    :ivar item: The item or key to remove.
+    """
+    path = _path_field()
+    item = field()
+
+    def apply(self, obj):
+        return _transform(obj, self.path, lambda o: o.remove(self.item))
+
+
+class Diff(PClass):
+    """
+    A sequence of operations which transform one pyrsistent object into
+    another.
+
+    :ivar PVector changes: The ``_Set``, ``_Add`` and ``_Remove`` operations
+        to apply, in order.
+    """
+    changes = field(type=PVector, factory=pvector, mandatory=True,
+                    initial=pvector())
+
+    def apply(self, obj):
+        """
+        Apply this diff to an object.
+
+        :param obj: The object this diff was calculated from (or an equal
+            one).
+
+        :return: An object equal to the one this diff was calculated to.
+        """
+        for change in self.changes:
+            obj = change.apply(obj)
+        return obj
+
+
+def _is_atomic(obj):
+    """
+    Determine whether changes to an object must be expressed by replacing it
+    entirely.
+
+    Records with whole-object invariants can pass through invalid states if
+    their fields are changed one at a time so they are never recursed into.
+
+    :return: ``True`` if the object must be replaced as a whole.
+    """
+    return bool(
+        getattr(obj, "_precord_invariants", ()) or
+        getattr(obj, "_pclass_invariants", ())
+    )
+
+
+def _pclass_items(obj):
+    """
+    :param PClass obj: An object.
+    :return: A ``dict`` mapping the names of the set fields of ``obj`` to
+        their values.
+    """
+    return {
+        name: getattr(obj, name) for name in obj._pclass_fields
+        if hasattr(obj, name)
+    }
+
+
+def _create_diffs_for_sets(path, set_a, set_b):
+    """
+    :return: A ``list`` of ``_Remove`` and ``_Add`` operations that transform
+        ``set_a`` into ``set_b``.
+    """
+    return (
+        [_Remove(path=path, item=item) for item in set_a.difference(set_b)] +
+        [_Add(path=path, item=item) for item in set_b.difference(set_a)]
+    )
+
+
+def _create_diffs_for_mappings(path, mapping_a, mapping_b):
+    """
+    :return: A ``list`` of operations that transform ``mapping_a`` into
+        ``mapping_b``.
+    """
+    changes = []
+    for key, value_b in mapping_b.items():
+        if key in mapping_a:
+            changes.extend(
+                _create_diffs_for(path.append(key), mapping_a[key], value_b)
+            )
+        else:
+            changes.append(_Set(path=path.append(key), value=value_b))
+    for key in mapping_a:
+        if key not in mapping_b:
+            changes.append(_Remove(path=path, item=key))
+    return changes
+
+
+def _create_diffs_for(path, a, b):
+    """
+    :return: A ``list`` of operations that transform ``a``, found at ``path``,
+        into ``b``.
+    """
+    if a is b or a == b:
+        return []
+    if type(a) is type(b) and not _is_atomic(a):
+        if isinstance(a, PClass):
+            return _create_diffs_for_mappings(
+                path, _pclass_items(a), _pclass_items(b)
+            )
+        elif isinstance(a, PMap):
+            return _create_diffs_for_mappings(path, a, b)
+        elif isinstance(a, PSet):
+            return _create_diffs_for_sets(path, a, b)
+    # There's no smaller way to describe the change; replace the whole value.
+    return [_Set(path=path, value=b)]
+
+
+def create_diff(object_a, object_b):
+    """
+    Calculate the changes necessary to transform one pyrsistent object into
+    another.
+
+    Unchanged parts of the two objects are not included in the result, so the
+    size of the result is proportional to the size of the change rather than
+    the size of the objects.
+
+    :param object_a: The starting object.
+    :param object_b: The target object.
+
+    :return Diff: A diff which, when applied to ``object_a``, results in an
+        object equal to ``object_b``.
+    """
+    return Diff(changes=_create_diffs_for(pvector(), object_a, object_b))
+
+
+# Classes used by diffs that must be serializable so diffs can be sent over
+# the network:
+DIFF_SERIALIZABLE_CLASSES = [_Set, _Add, _Remove, Diff]
@@ -0,0 +1,120 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_metrics -*-
+
+"""
+A local HTTP endpoint exposing statistics about how the control service
+ingests state from, and sends updates to, convergence agents.
+"""
+
+from json import dumps
+
+from twisted.application.internet import StreamServerEndpointService
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from ._protocol import ACK_LATENCY_BUCKETS
+
+METRICS_PORT = 4525
+
+
+def _fan_out(metrics):
+    """
+    :param _FanOutMetrics metrics: Statistics about updates sent to agents.
+
+    :return: A ``dict`` of the statistics which can be encoded as JSON.
+    """
+    return {
+        u"updates": metrics.updates,
+        u"acknowledged": metrics.acknowledged,
+        u"failed": metrics.failed,
+        u"delayed": metrics.delayed,
+        u"elided": metrics.elided,
+        u"stale": metrics.stale,
+        u"bytes_sent": metrics.bytes_sent,
+        u"largest_update": metrics.largest_update,
+        u"ack_latency": {
+            u"buckets": list(ACK_LATENCY_BUCKETS) + [None],
+            u"counts": list(metrics.ack_latency),
+            u"total": metrics.total_ack_latency,
+            u"max": metrics.max_ack_latency,
+        },
+    }
+
+
+def control_metrics(control_amp_service):
+    """
+    Describe the statistics a ``ControlAMPService`` has collected.
+
+    The ``ack_latency`` histograms have an upper bound, in seconds, for each
+    bucket; the last bound is ``None`` as that bucket counts everything
+    slower.
+
+    :param ControlAMPService control_amp_service: The service whose
+        statistics to describe.
+
+    :return: A ``dict`` which can be encoded as JSON.
+    """
+    ingestion = control_amp_service.ingestion_metrics
+    agents = []
+    for connection, metrics in control_amp_service.agent_metrics.items():
+        agent = _fan_out(metrics)
+        address = connection.transport.getPeer()
+        agent[u"address"] = u"{}:{}".format(
+            getattr(address, "host", address), getattr(address, "port", u""),
+        )
+        node_uuid = getattr(connection, "node_uuid", None)
+        agent[u"node_uuid"] = (
+            None if node_uuid is None else unicode(node_uuid)
+        )
+        agents.append(agent)
+    return {
+        u"ingestion": {
+            u"batches": ingestion.batches,
+            u"reports": ingestion.reports,
+            u"changes": ingestion.changes,
+            u"largest_batch": ingestion.largest_batch,
+            u"total_latency": ingestion.total_latency,
+            u"max_latency": ingestion.max_latency,
+        },
+        u"updates": _fan_out(control_amp_service.fan_out_metrics),
+        u"agents": sorted(
+            agents, key=lambda agent: (agent[u"node_uuid"], agent[u"address"])
+        ),
+    }
+
+
+class MetricsResource(Resource):
+    """
+    A resource which renders ``control_metrics`` as JSON.
+
+    :ivar ControlAMPService control_amp_service: The service whose
+        statistics are rendered.
+    """
+    isLeaf = True
+
+    def __init__(self, control_amp_service):
+        Resource.__init__(self)
+        self.control_amp_service = control_amp_service
+
+    def render_GET(self, request):
+        request.setHeader(b"content-type", b"application/json")
+        return dumps(control_metrics(self.control_amp_service))
+
+
+def create_metrics_service(control_amp_service, endpoint):
+    """
+    Create a service that serves statistics about a ``ControlAMPService`` at
+    ``/metrics``.
+
+    The statistics are served without TLS or authentication, so the endpoint
+    should only be reachable locally.
+
+    :param ControlAMPService control_amp_service: The service whose
+        statistics are served.
+    :param endpoint: Twisted endpoint to listen on.
+
+    :return: Service that will listen on the endpoint.
+    """
+    root = Resource()
+    root.putChild(b"metrics", MetricsResource(control_amp_service))
+    return StreamServerEndpointService(endpoint, Site(root))
@@ -12,6 +12,7 @@ upgrading from older versions of Flocker.
 
 from uuid import UUID
 from warnings import warn
+from weakref import ref
 from hashlib import md5
 from datetime import datetime, timedelta
 
@@ -26,6 +27,26 @@ from pyrsistent import (
 from zope.interface import Interface, implementer
 
 
+def _checked(checked_class, argument):
+    """
+    Convert a value to a checked collection type.
+
+    :param checked_class: ``CheckedPSet``, ``CheckedPVector`` or
+        ``CheckedPMap`` subclass.
+    :param argument: Value to convert.
+
+    :return: ``argument`` itself if it is already a ``checked_class``,
+        since its contents have already been checked.  Otherwise a new
+        ``checked_class`` with the contents of ``argument``.  Rebuilding a
+        large collection (for example the nodes of a ``DeploymentState``)
+        every time a record containing it is updated would hash every item
+        again.
+    """
+    if type(argument) is checked_class:
+        return argument
+    return checked_class(argument)
+
+
 def _sequence_field(checked_class, suffix, item_type, optional, initial):
     """
     Create checked field for either ``PSet`` or ``PVector``.
@@ -48,9 +69,10 @@ def _sequence_field(checked_class, suffix, item_type, optional, initial):
             if argument is None:
                 return None
             else:
-                return TheType(argument)
+                return _checked(TheType, argument)
     else:
-        factory = TheType
+        def factory(argument):
+            return _checked(TheType, argument)
     return field(type=optional_type(TheType) if optional else TheType,
                  factory=factory, mandatory=True,
                  initial=factory(initial))
@@ -123,9 +145,10 @@ def pmap_field(
             if argument is None:
                 return None
             else:
-                return TheMap(argument)
+                return _checked(TheMap, argument)
     else:
-        factory = TheMap
+        def factory(argument):
+            return _checked(TheMap, argument)
 
     if initial is _UNDEFINED:
         initial = TheMap()
@@ -471,6 +494,194 @@ def same_node(node1, node2):
     return node1.uuid == node2.uuid
 
 
+class _Memo(object):
+    """
+    Values computed from immutable objects, remembered for as long as the
+    objects exist.
+
+    Records can't have attributes other than their fields, and fields are
+    serialized, compared and diffed, so derived values such as indexes are
+    kept here instead, keyed by the identity of the object they were
+    computed from.
+
+    Not thread-safe, so should only be used by a single thread (the Twisted
+    reactor thread, presumably).
+
+    :ivar _compute: One-argument callable computing the value for an object.
+    :ivar dict _values: Map from ``id`` of an object to a two-tuple of a weak
+        reference to that object and the value computed from it.
+    """
+    def __init__(self, compute):
+        self._compute = compute
+        self._values = {}
+
+    def get(self, obj):
+        """
+        :param obj: An immutable object which can be weakly referenced.
+        :return: The value for ``obj``, computed if it isn't known yet.
+        """
+        try:
+            reference, value = self._values[id(obj)]
+        except KeyError:
+            pass
+        else:
+            if reference() is obj:
+                return value
+        value = self._compute(obj)
+        self.remember(obj, value)
+        return value
+
+    def peek(self, obj):
+        """
+        :param obj: An immutable object which can be weakly referenced.
+        :return: The value for ``obj`` if it is known, otherwise ``None``.
+        """
+        entry = self._values.get(id(obj))
+        if entry is not None and entry[0]() is obj:
+            return entry[1]
+        return None
+
+    def remember(self, obj, value):
+        """
+        Record the value for an object, for example one derived cheaply from
+        the value of a similar object.  It is forgotten when the object is
+        garbage collected.
+
+        :param obj: An immutable object which can be weakly referenced.
+        :param value: The value ``_compute`` would return for ``obj``.
+        """
+        key = id(obj)
+
+        def forget(reference):
+            # The id may have been reused by an object remembered since.
+            entry = self._values.get(key)
+            if entry is not None and entry[0] is reference:
+                del self._values[key]
+        self._values[key] = (ref(obj, forget), value)
+
+
+def _index_nodes(nodes):
+    """
+    :param PSet nodes: ``Node`` or ``NodeState`` instances.
+    :return PMap: Map from UUID to the node in ``nodes`` with that UUID.
+    """
+    return pmap({node.uuid: node for node in nodes})
+
+
+def _index_datasets(nodes):
+    """
+    :param PSet nodes: ``Node`` or ``NodeState`` instances.
+    :return PMap: Map from dataset ID to a ``tuple`` of two-tuples of each
+        ``Manifestation`` of that dataset and the node it is on.
+    """
+    index = {}
+    for node in nodes:
+        if node.manifestations is None:
+            continue
+        for dataset_id, manifestation in node.manifestations.items():
+            index.setdefault(dataset_id, []).append((manifestation, node))
+    return pmap({
+        dataset_id: tuple(located) for (dataset_id, located) in index.items()
+    })
+
+
+# ``Deployment`` and ``DeploymentState`` keep their nodes in a ``PSet``.
+# Finding a node or dataset in it means searching the whole set, so indexes
+# of each set are memoized.  The indexes of a set created by replacing one
+# node of another set are derived from the indexes of the original in time
+# proportional to the size of that node (see ``_replace_node``), so updating
+# a node of a large cluster doesn't involve looking at all the others.  The
+# index by dataset is otherwise built when first needed for each set.
+_NODE_INDEXES = _Memo(_index_nodes)
+_DATASET_INDEXES = _Memo(_index_datasets)
+
+
+def _replace_node_datasets(datasets, original, replacement):
+    """
+    Update an index by dataset of a set of nodes for the replacement of a
+    node.
+
+    :param PMap datasets: The index, see ``_index_datasets``.
+    :param original: The node being removed, or ``None``.
+    :param replacement: The node being added, or ``None``.
+
+    :return PMap: The updated index.
+    """
+    evolver = datasets.evolver()
+    if original is not None and original.manifestations is not None:
+        for dataset_id in original.manifestations:
+            located = tuple(
+                entry for entry in evolver[dataset_id]
+                if entry[1] is not original
+            )
+            if located:
+                evolver[dataset_id] = located
+            else:
+                evolver.remove(dataset_id)
+    if replacement is not None and replacement.manifestations is not None:
+        for dataset_id, manifestation in replacement.manifestations.items():
+            located = ((manifestation, replacement),)
+            if dataset_id in evolver:
+                located = evolver[dataset_id] + located
+            evolver[dataset_id] = located
+    return evolver.persistent()
+
+
+def _replace_node(nodes, original, replacement):
+    """
+    Replace a node in a set of nodes.
+
+    :param PSet nodes: ``Node`` or ``NodeState`` instances.
+    :param original: The node in ``nodes`` to remove, or ``None``.
+    :param replacement: The node to add, or ``None``.
+
+    :return PSet: The updated nodes, whose index by UUID is known.  Their
+        index by dataset is known too if that of ``nodes`` was.
+    """
+    index = _NODE_INDEXES.get(nodes)
+    datasets = _DATASET_INDEXES.peek(nodes)
+    if original is not None:
+        nodes = nodes.discard(original)
+        index = index.discard(original.uuid)
+    if replacement is not None:
+        nodes = nodes.add(replacement)
+        index = index.set(replacement.uuid, replacement)
+    _NODE_INDEXES.remember(nodes, index)
+    if datasets is not None:
+        _DATASET_INDEXES.remember(
+            nodes, _replace_node_datasets(datasets, original, replacement),
+        )
+    return nodes
+
+
+def _get_manifestations(deployment, dataset_id):
+    """
+    Find the manifestations of a dataset.
+
+    :param deployment: A ``Deployment`` or ``DeploymentState``.
+    :param unicode dataset_id: The ID of the dataset.
+
+    :return: A ``tuple`` of two-tuples of each ``Manifestation`` of the
+        dataset and the ``Node`` or ``NodeState`` it is on.
+    """
+    return _DATASET_INDEXES.get(deployment.nodes).get(dataset_id, ())
+
+
+def _primary_manifestations(deployment):
+    """
+    Find the primary manifestations of all datasets.
+
+    :param deployment: A ``Deployment`` or ``DeploymentState``.
+
+    :return: An iterator of two-tuples of each primary ``Manifestation`` and
+        the ``Node`` or ``NodeState`` it is on.
+    """
+    for located in _DATASET_INDEXES.get(deployment.nodes).values():
+        for manifestation, node in located:
+            if manifestation.primary:
+                yield manifestation, node
+
+
 def _get_node(default_factory):
     """
     Create a helper function for getting a node from a deployment.
@@ -487,12 +698,10 @@ def _get_node(default_factory):
              is found.
     """
     def get_node(deployment, uuid, **defaults):
-        nodes = list(
-            node for node in deployment.nodes if node.uuid == uuid
-        )
-        if len(nodes) == 0:
+        node = _NODE_INDEXES.get(deployment.nodes).get(uuid)
+        if node is None:
             return default_factory(uuid=uuid, **defaults)
-        return nodes[0]
+        return node
     return get_node
 
 
@@ -620,6 +829,8 @@ class Deployment(PRecord):
     leases = field(type=Leases, mandatory=True, initial=Leases())
 
     get_node = _get_node(Node)
+    get_manifestations = _get_manifestations
+    primary_manifestations = _primary_manifestations
 
     def applications(self):
         """
@@ -642,9 +853,8 @@ class Deployment(PRecord):
 
         :return Deployment: Updated with new ``Node``.
         """
-        return Deployment(leases=self.leases, nodes=frozenset(
-            list(n for n in self.nodes if not same_node(n, node)) +
-            [node]))
+        original = _NODE_INDEXES.get(self.nodes).get(node.uuid)
+        return self.set(nodes=_replace_node(self.nodes, original, node))
 
     def move_application(self, application, target_node):
         """
@@ -946,19 +1156,20 @@ class _WipeNodeState(PRecord):
     attributes = pset_field(str)
 
     def update_cluster_state(self, cluster_state):
-        nodes = {n for n in cluster_state.nodes
-                 if n.uuid == self.node_uuid}
-        if not nodes:
+        original_node = _NODE_INDEXES.get(cluster_state.nodes).get(
+            self.node_uuid
+        )
+        if original_node is None:
             return cluster_state
-        [original_node] = nodes
         updated_node = original_node.evolver()
         for attribute in self.attributes:
             updated_node = updated_node.set(attribute, None)
         updated_node = updated_node.persistent()
-        final_nodes = cluster_state.nodes.discard(original_node)
-        if updated_node._provides_information():
-            final_nodes = final_nodes.add(updated_node)
-        return cluster_state.set("nodes", final_nodes)
+        if not updated_node._provides_information():
+            updated_node = None
+        return cluster_state.set("nodes", _replace_node(
+            cluster_state.nodes, original_node, updated_node,
+        ))
 
     def key(self):
         return (self.node_uuid, self.attributes)
@@ -987,6 +1198,8 @@ class DeploymentState(PRecord):
     nodes = pset_field(NodeState)
 
     get_node = _get_node(NodeState)
+    get_manifestations = _get_manifestations
+    primary_manifestations = _primary_manifestations
 
     nonmanifest_datasets = pmap_field(
         unicode, Dataset, invariant=_keys_match_dataset_id
@@ -1008,17 +1221,18 @@ class DeploymentState(PRecord):
 
         :return DeploymentState: Updated with new ``NodeState``.
         """
-        nodes = {n for n in self.nodes if same_node(n, node_state)}
-        if not nodes:
-            return self.transform(["nodes"], lambda s: s.add(node_state))
-        [original_node] = nodes
-        updated_node = original_node.evolver()
-        for key, value in node_state.items():
-            if value is not None:
-                updated_node = updated_node.set(key, value)
+        original_node = _NODE_INDEXES.get(self.nodes).get(node_state.uuid)
+        if original_node is None:
+            updated_node = node_state
+        else:
+            updated_node = original_node.evolver()
+            for key, value in node_state.items():
+                if value is not None:
+                    updated_node = updated_node.set(key, value)
+            updated_node = updated_node.persistent()
         return self.set(
-            "nodes", self.nodes.discard(original_node).add(
-                updated_node.persistent()))
+            "nodes", _replace_node(self.nodes, original_node, updated_node)
+        )
 
     def all_datasets(self):
         """
@@ -1026,12 +1240,8 @@ class DeploymentState(PRecord):
             ``None``) for all the primary manifest datasets and non-manifest
             datasets in the ``DeploymentState``.
         """
-        for node in self.nodes:
-            if node.manifestations is None:
-                continue
-            for manifestation in node.manifestations.values():
-                if manifestation.primary:
-                    yield manifestation.dataset, node
+        for manifestation, node in self.primary_manifestations():
+            yield manifestation.dataset, node
         for dataset in self.nonmanifest_datasets.values():
             yield dataset, None
 
@@ -4,6 +4,8 @@
 Persistence of cluster configuration.
 """
 
+import os
+from hashlib import sha256
 from json import dumps, loads, JSONEncoder
 from uuid import UUID
 from calendar import timegm
@@ -11,16 +13,18 @@ from datetime import datetime
 
 from eliot import Logger, write_traceback, MessageType, Field, ActionType
 
-from pyrsistent import PRecord, PVector, PMap, PSet, pmap, PClass
+from pyrsistent import PRecord, PVector, PMap, PSet, pmap, PClass, field
 
 from pytz import UTC
 
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service, MultiService
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.threads import deferToThreadPool
 from twisted.internet.task import LoopingCall
 
 from ._model import SERIALIZABLE_CLASSES, Deployment, Configuration
+from ._diffing import DIFF_SERIALIZABLE_CLASSES, create_diff
 
 # The class at the root of the configuration tree.
 ROOT_CLASS = Deployment
@@ -33,8 +37,16 @@ _CLASS_MARKER = u"$__class__$"
 # always integers.
 _CONFIG_VERSION = 3
 
+# The shortest and longest times, in seconds, to wait before writing the
+# configuration again after writes in write-behind mode have failed:
+_MIN_WRITE_RETRY_DELAY = 1
+_MAX_WRITE_RETRY_DELAY = 60
+
 # Map of serializable class names to classes
-_CONFIG_CLASS_MAP = {cls.__name__: cls for cls in SERIALIZABLE_CLASSES}
+_CONFIG_CLASS_MAP = {
+    cls.__name__: cls
+    for cls in SERIALIZABLE_CLASSES + DIFF_SERIALIZABLE_CLASSES
+}
 
 
 class ConfigurationMigrationError(Exception):
@@ -237,6 +249,75 @@ _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED = MessageType(
     u"as the already-saved deployment.  It has optimized this away."
 )
 
+_LOG_WRITTEN_BEHIND = MessageType(
+    u"flocker-control:persistence:written-behind",
+    [Field.for_types(u"saves", [int],
+                     u"The number of saves written together."),
+     Field.for_types(u"write_latency", [float],
+                     u"Seconds taken to encode and write the configuration."),
+     Field.for_types(u"save_latency", [float],
+                     u"Seconds the earliest of the saves waited to be "
+                     u"written.")],
+    u"The configuration was written to disk after some saves.",
+)
+
+# The default number of seconds the persistence service waits after a save to
+# collect more before writing the configuration in write-behind mode.
+DEFAULT_SAVE_DELAY = 0.05
+
+
+class _SaveMetrics(PClass):
+    """
+    Statistics about the writes of a ``ConfigurationPersistenceService`` in
+    write-behind mode.
+
+    :ivar int writes: The number of times the configuration was written.
+    :ivar int saves: The number of saves covered by those writes.
+    :ivar float total_write_latency: The total number of seconds taken to
+        encode and write the configuration.
+    :ivar float max_write_latency: The longest any write took.
+    :ivar float max_save_latency: The longest any save took to become
+        durable.
+    """
+    writes = field(type=int, initial=0)
+    saves = field(type=int, initial=0)
+    total_write_latency = field(type=float, initial=0.0)
+    max_write_latency = field(type=float, initial=0.0)
+    max_save_latency = field(type=float, initial=0.0)
+
+    def record(self, saves, write_latency, save_latency):
+        """
+        :param int saves: The number of saves covered by a write.
+        :param float write_latency: The number of seconds the write took.
+        :param float save_latency: The number of seconds the earliest of the
+            saves waited to be written.
+
+        :return _SaveMetrics: These statistics updated with the write.
+        """
+        return self.set(
+            writes=self.writes + 1,
+            saves=self.saves + saves,
+            total_write_latency=self.total_write_latency + write_latency,
+            max_write_latency=max(self.max_write_latency, write_latency),
+            max_save_latency=max(self.max_save_latency, save_latency),
+        )
+
+
+def _atomic_write(path, content):
+    """
+    Replace the content of a file such that it is either entirely the old
+    content or entirely the new content, even after a crash.
+
+    :param FilePath path: The file to write.
+    :param bytes content: The new content.
+    """
+    temporary = path.temporarySibling(b".new")
+    with temporary.open("wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    temporary.moveTo(path)
+
 
 class LeaseService(Service):
     """
@@ -292,24 +373,292 @@ def update_leases(transform, persistence_service):
     return d
 
 
+class _Journal(object):
+    """
+    An append-only log of changes to the configuration stored in a snapshot
+    file.
+
+    The first line of the journal identifies the snapshot it applies to by a
+    digest of the snapshot's content, so that a journal left behind by a
+    crash after a new snapshot was written is ignored.  Every other line is
+    the JSON encoding of a ``dict`` with the configuration ``version`` and a
+    ``Diff`` of the ``Deployment``.
+
+    :ivar FilePath path: The journal file.
+    :ivar int size: The number of bytes of changes in the journal.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+
+    def read(self, snapshot, version):
+        """
+        Read the changes to a snapshot.
+
+        :param bytes snapshot: The content of the snapshot file.
+        :param int version: The configuration version of the snapshot.
+
+        :raise ConfigurationMigrationError: If the changes are for a different
+            configuration version than the snapshot.
+
+        :return: ``list`` of the ``bytes`` encoding of each entry, in order.
+            Entries are not decoded since a snapshot of an older version
+            must be migrated, along with its changes, first.
+        """
+        if not self.path.exists():
+            return []
+        lines = self.path.getContent().splitlines()
+        if not lines or lines[0] != _digest(snapshot):
+            return []
+        entries = []
+        for number, line in enumerate(lines[1:], 2):
+            try:
+                entry = loads(line)
+            except ValueError:
+                if number == len(lines):
+                    # A change which was being appended during a crash.
+                    break
+                raise
+            if entry[u"version"] != version:
+                raise ConfigurationMigrationError(
+                    "Configuration journal entries of version {} don't "
+                    "apply to a version {} configuration.".format(
+                        entry[u"version"], version,
+                    )
+                )
+            entries.append(line)
+        return entries
+
+    def reset(self, snapshot):
+        """
+        Start a new, empty journal for a snapshot.
+
+        :param bytes snapshot: The content of the snapshot file.
+        """
+        _atomic_write(self.path, _digest(snapshot) + b"\n")
+        self.size = 0
+
+    def append(self, diff):
+        """
+        Durably append a change to the journal.
+
+        :param Diff diff: The change to the ``Deployment``.
+        """
+        line = dumps(
+            {u"version": _CONFIG_VERSION, u"diff": diff},
+            cls=_ConfigurationEncoder,
+        ) + b"\n"
+        with self.path.open("ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(line)
+
+    def remove(self):
+        """
+        Remove the journal, if there is one.
+        """
+        if self.path.exists():
+            self.path.remove()
+        self.size = 0
+
+
+def _json_key(value):
+    """
+    :param value: A JSON-decoded value.
+
+    :return: A hashable value which is equal for JSON-decoded values that
+        encode equal model objects.  Lists may encode sets, so their order is
+        disregarded.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _json_key(item)) for key, item in value.items()
+        ))
+    if isinstance(value, list):
+        return tuple(sorted(_json_key(item) for item in value))
+    return value
+
+
+def _json_child(node, key):
+    """
+    :param node: The JSON-decoded encoding of a ``PRecord``, ``PClass``,
+        ``PMap`` or ``PVector``.
+    :param key: The JSON-decoded encoding of an attribute name, key or index.
+
+    :return: The JSON-decoded encoding of the child.
+    """
+    if isinstance(node, dict) and node.get(_CLASS_MARKER) == u"PMap":
+        for item_key, item in node[u"values"]:
+            if _json_key(item_key) == _json_key(key):
+                return item
+        raise KeyError(key)
+    return node[key]
+
+
+def _json_set(node, key, value):
+    """
+    Set a child of a JSON-decoded model object.  See ``_json_child``.
+    """
+    if isinstance(node, dict) and node.get(_CLASS_MARKER) == u"PMap":
+        values = [
+            [item_key, item] for item_key, item in node[u"values"]
+            if _json_key(item_key) != _json_key(key)
+        ]
+        values.append([key, value])
+        node[u"values"] = values
+    else:
+        node[key] = value
+
+
+def _json_remove(node, item):
+    """
+    Remove an item from a JSON-decoded ``PSet``, or a key from a
+    JSON-decoded ``PMap``.
+    """
+    if isinstance(node, dict):
+        node[u"values"] = [
+            [key, value] for key, value in node[u"values"]
+            if _json_key(key) != _json_key(item)
+        ]
+    else:
+        node[:] = [
+            existing for existing in node
+            if _json_key(existing) != _json_key(item)
+        ]
+
+
+def _apply_json_diff(deployment, diff):
+    """
+    Apply an encoded ``Diff`` to an encoded ``Deployment`` without decoding
+    either, so that changes journaled by an older version of the
+    configuration can be applied before the configuration is migrated.
+
+    :param deployment: The JSON-decoded encoding of a ``Deployment``.  It is
+        modified in place.
+    :param diff: The JSON-decoded encoding of a ``Diff`` calculated from
+        that ``Deployment``.
+
+    :return: The JSON-decoded encoding of the changed ``Deployment``.
+    """
+    for change in diff[u"changes"]:
+        kind = change[_CLASS_MARKER]
+        path = change[u"path"]
+        if kind == u"_Set":
+            if not path:
+                deployment = change[u"value"]
+                continue
+            parent_path = path[:-1]
+        else:
+            parent_path = path
+        node = deployment
+        for key in parent_path:
+            node = _json_child(node, key)
+        if kind == u"_Set":
+            _json_set(node, path[-1], change[u"value"])
+        elif kind == u"_Add":
+            _json_remove(node, change[u"item"])
+            node.append(change[u"item"])
+        else:
+            _json_remove(node, change[u"item"])
+    return deployment
+
+
+def _replay_journal(config, entries):
+    """
+    Apply journaled changes to a configuration of the same, possibly older,
+    version.
+
+    :param bytes config: The encoded configuration.
+    :param entries: The encoded journal entries, as returned by
+        ``_Journal.read``.
+
+    :return bytes: The encoded configuration with the changes applied.
+    """
+    decoded = loads(config)
+    deployment = decoded[u"deployment"]
+    for entry in entries:
+        deployment = _apply_json_diff(deployment, loads(entry)[u"diff"])
+    decoded[u"deployment"] = deployment
+    return dumps(decoded)
+
+
+def _digest(snapshot):
+    """
+    :param bytes snapshot: The content of a snapshot file.
+    :return bytes: A digest identifying the snapshot.
+    """
+    return sha256(snapshot).hexdigest()
+
+
 class ConfigurationPersistenceService(MultiService):
     """
     Persist configuration to disk, and load it back.
 
+    In write-behind mode saves take effect immediately but the configuration
+    is written in a thread, once for all the saves made within a short
+    period.
+
+    In journaling mode only the changes made by each save are written,
+    appended to a journal.  The journal is compacted into a new snapshot of
+    the whole configuration once it is larger than the snapshot, and
+    whenever the service starts.
+
     :ivar Deployment _deployment: The current desired deployment configuration.
+    :ivar list _unwritten: Two-tuples of a ``Deferred`` to fire once the
+        configuration is written and the time of the save, for each save
+        which hasn't been written yet in write-behind mode.  The
+        ``Deferred`` is ``None`` for a save whose write failed, which is
+        written again but has no-one waiting for it any more.
+    :ivar list _writing: The ``Deferred``\ s to fire once the write in
+        progress is finished, or ``None`` if there is no write in progress.
+    :ivar _write_call: The ``IDelayedCall`` which will start the next write,
+        or ``None``.
+    :ivar int _write_failures: The number of writes in a row which have
+        failed in write-behind mode.
+    :ivar _SaveMetrics save_metrics: Statistics about the writes in
+        write-behind mode.
+    :ivar _Journal _journal: The journal of changes to the snapshot.
+    :ivar Deployment _written: The configuration most recently written.
+    :ivar int _snapshot_size: The size of the snapshot file.
+    :ivar int generation: A counter which is incremented whenever the
+        configuration changes.  Equal generations of the same service mean
+        equal results from ``get``.
     """
     logger = Logger()
 
-    def __init__(self, reactor, path):
+    def __init__(self, reactor, path, save_delay=None, threadpool=None,
+                 journal=False):
         """
         :param reactor: Reactor to use for thread pool.
         :param FilePath path: Directory where desired deployment will be
             persisted.
+        :param save_delay: ``None`` to write the configuration synchronously
+            when it is saved.  Otherwise the number of seconds to wait after
+            a save before writing the configuration, in write-behind mode.
+        :param threadpool: The ``ThreadPool`` to write the configuration in,
+            in write-behind mode.  By default the reactor's.
+        :param bool journal: Whether to use journaling mode.
         """
         MultiService.__init__(self)
+        self._reactor = reactor
         self._path = path
         self._config_path = self._path.child(b"current_configuration.json")
         self._change_callbacks = []
+        self._save_delay = save_delay
+        self._threadpool = threadpool
+        self._unwritten = []
+        self._writing = None
+        self._write_call = None
+        self._write_failures = 0
+        self.save_metrics = _SaveMetrics()
+        self._journaling = journal
+        self.generation = 0
+        self._journal = _Journal(
+            self._path.child(b"current_configuration.journal")
+        )
+        self._written = None
+        self._snapshot_size = 0
         LeaseService(reactor, self).setServiceParent(self)
 
     def startService(self):
@@ -319,6 +668,33 @@ class ConfigurationPersistenceService(MultiService):
         MultiService.startService(self)
         _LOG_STARTUP(configuration=self.get()).write(self.logger)
 
+    def stopService(self):
+        """
+        Stop the service once all saved configuration has been written.
+        """
+        stopping = maybeDeferred(MultiService.stopService, self)
+        stopping.addCallback(lambda _: self._flush())
+        return stopping
+
+    def _flush(self):
+        """
+        Write any saved configuration without waiting for the save delay.
+
+        :return Deferred: Fires once all the configuration saved so far has
+            been written.
+        """
+        if self._writing is None and not self._unwritten:
+            return succeed(None)
+        flushed = Deferred()
+        if self._unwritten:
+            self._unwritten.append((flushed, self._reactor.seconds()))
+            if self._writing is None:
+                self._write_call.cancel()
+                self._write_behind()
+        else:
+            self._writing.append(flushed)
+        return flushed
+
     def _process_v1_config(self, file_name, archive_name):
         """
         Check if a v1 configuration file exists and upgrade it if necessary.
@@ -370,7 +746,13 @@ class ConfigurationPersistenceService(MultiService):
             config_json = self._config_path.getContent()
             config_dict = loads(config_json)
             config_version = config_dict['version']
+            entries = self._journal.read(config_json, config_version)
             if config_version < _CONFIG_VERSION:
+                # The journaled changes can only be decoded once they have
+                # been migrated, so apply them to the snapshot and migrate
+                # the result.
+                config_json = _replay_journal(config_json, entries)
+                entries = []
                 with _LOG_UPGRADE(self.logger,
                                   configuration=config_json,
                                   source_version=config_version,
@@ -378,12 +760,13 @@ class ConfigurationPersistenceService(MultiService):
                     config_json = migrate_configuration(
                         config_version, _CONFIG_VERSION,
                         config_json, ConfigurationMigration)
-            config = wire_decode(config_json)
-            self._deployment = config.deployment
-            self._sync_save(config.deployment)
+            deployment = wire_decode(config_json).deployment
+            for entry in entries:
+                deployment = wire_decode(entry)[u"diff"].apply(deployment)
+            self._deployment = deployment
         else:
             self._deployment = Deployment()
-            self._sync_save(self._deployment)
+        self._write_snapshot(self._deployment)
 
     def register(self, change_callback):
         """
@@ -397,9 +780,107 @@ class ConfigurationPersistenceService(MultiService):
     def _sync_save(self, deployment):
         """
         Save and flush new configuration to disk synchronously.
+
+        In journaling mode only the changes since the configuration was last
+        written are written, unless the journal is due to be compacted.
+        """
+        if self._journaling and self._journal.size < self._snapshot_size:
+            self._journal.append(create_diff(self._written, deployment))
+            self._written = deployment
+        else:
+            self._write_snapshot(deployment)
+
+    def _write_snapshot(self, deployment):
+        """
+        Save and flush the whole configuration to disk synchronously,
+        compacting the journal.
         """
         config = Configuration(version=_CONFIG_VERSION, deployment=deployment)
-        self._config_path.setContent(wire_encode(config))
+        snapshot = wire_encode(config)
+        _atomic_write(self._config_path, snapshot)
+        # Once the snapshot is written the old journal no longer applies to
+        # it, whether or not it is replaced.
+        if self._journaling:
+            self._journal.reset(snapshot)
+        else:
+            self._journal.remove()
+        self._snapshot_size = len(snapshot)
+        self._written = deployment
+
+    def _save_later(self):
+        """
+        Arrange for the current configuration to be written in write-behind
+        mode.
+
+        :return Deferred: Fires once it has been written.
+        """
+        saved = Deferred()
+        self._unwritten.append((saved, self._reactor.seconds()))
+        if self._writing is None and self._write_call is None:
+            self._write_call = self._reactor.callLater(
+                self._save_delay, self._write_behind,
+            )
+        return saved
+
+    def _write_behind(self):
+        """
+        Write the current configuration in a thread and notify the saves
+        waiting for it once it is written.
+        """
+        self._write_call = None
+        waiting = self._writing = [
+            saved for (saved, when) in self._unwritten if saved is not None
+        ]
+        first_save = self._unwritten[0][1]
+        self._unwritten = []
+        started = self._reactor.seconds()
+        threadpool = self._threadpool
+        if threadpool is None:
+            threadpool = self._reactor.getThreadPool()
+        writing = deferToThreadPool(
+            self._reactor, threadpool, self._sync_save, self._deployment,
+        )
+
+        def finished(result):
+            self._writing = None
+            if self._unwritten:
+                self._write_call = self._reactor.callLater(
+                    self._save_delay, self._write_behind,
+                )
+            return result
+
+        def written(result):
+            self._write_failures = 0
+            finished = self._reactor.seconds()
+            write_latency = float(finished - started)
+            save_latency = float(finished - first_save)
+            self.save_metrics = self.save_metrics.record(
+                len(waiting), write_latency, save_latency,
+            )
+            _LOG_WRITTEN_BEHIND(
+                saves=len(waiting), write_latency=write_latency,
+                save_latency=save_latency,
+            ).write(self.logger)
+            for saved in waiting:
+                saved.callback(None)
+
+        def failed(reason):
+            # The configuration is only in memory, and a save of the same
+            # configuration won't write it, so write it again later, waiting
+            # longer the more writes have failed.
+            self._write_failures += 1
+            self._unwritten.insert(0, (None, first_save))
+            if self._write_call is None:
+                self._write_call = self._reactor.callLater(
+                    min(max(self._save_delay, _MIN_WRITE_RETRY_DELAY) *
+                        2 ** self._write_failures,
+                        _MAX_WRITE_RETRY_DELAY),
+                    self._write_behind,
+                )
+            for saved in waiting:
+                saved.errback(reason)
+        writing.addBoth(finished)
+        writing.addCallbacks(written, failed)
 
     def save(self, deployment):
         """
@@ -412,8 +893,13 @@ class ConfigurationPersistenceService(MultiService):
             return succeed(None)
 
         with _LOG_SAVE(self.logger, configuration=deployment):
-            self._sync_save(deployment)
+            if self._save_delay is None:
+                self._sync_save(deployment)
+                saving = succeed(None)
+            else:
+                saving = self._save_later()
             self._deployment = deployment
+            self.generation += 1
             # At some future point this will likely involve talking to a
             # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
             # guarantee immediate saving of the data.
@@ -424,7 +910,7 @@ class ConfigurationPersistenceService(MultiService):
                     # Second argument will be ignored in next Eliot release, so
                     # not bothering with particular value.
                     write_traceback(self.logger, u"")
-            return succeed(None)
+            return saving
 
     def get(self):
         """
@@ -0,0 +1,205 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_projection -*-
+
+"""
+Per-node views of the cluster configuration and state.
+
+A convergence agent only needs complete information about its own node.  About
+its peers it needs to know much less:
+
+* ``ApplicationNodeDeployer`` looks at the ports of applications configured on
+  other nodes (to set up proxies) and at their hostnames.
+* ``P2PManifestationDeployer`` looks at the configured and current
+  manifestations of other nodes (to find handoffs, creations and deletions)
+  and at their hostnames.
+* ``BlockDeviceDeployer`` looks at the current primary manifestations of other
+  nodes (so it doesn't create datasets which already exist elsewhere).
+
+The leases and non-manifest datasets are needed by all of them.  Everything
+else about peers - applications without ports, current applications, paths
+and devices - is left out of the view sent to an agent.
+"""
+
+from pyrsistent import pvector
+
+from ._model import NodeState
+from ._diffing import Diff, _Set, _Add, _Remove
+
+
+# The path of the set of nodes in a ``Deployment`` or ``DeploymentState``:
+_NODES_PATH = pvector([u"nodes"])
+
+
+def _peer_node(node):
+    """
+    :param Node node: The configuration of a node.
+
+    :return Node: The configuration of the node as seen by agents on other
+        nodes.  Only applications which expose ports are included.
+    """
+    return node.set(
+        applications=[app for app in node.applications if app.ports],
+    )
+
+
+def _peer_node_state(node_state):
+    """
+    :param NodeState node_state: The state of a node.
+
+    :return NodeState: The state of the node as seen by agents on other
+        nodes.  Applications are unknown and, if manifestations are known,
+        paths and devices are empty.
+    """
+    if node_state.manifestations is None:
+        known = None
+    else:
+        known = {}
+    return node_state.set(applications=None, paths=known, devices=known)
+
+
+class ClusterProjector(object):
+    """
+    Build per-node views of cluster configuration and state, and of the
+    changes to them.
+
+    Not thread-safe, so should only be used by a single thread (the Twisted
+    reactor thread, presumably).
+
+    :ivar dict _peers: Map from ``id`` of a ``Node`` or ``NodeState`` to a
+        two-tuple of that object and its view as a peer.  The object is kept
+        so that its ``id`` can't be reused while the entry exists.
+    :ivar dict _projections: Map from node UUID to a three-tuple of the
+        configuration and state most recently projected for that node and the
+        result.
+    """
+    def __init__(self):
+        self._peers = {}
+        self._projections = {}
+
+    def _peer(self, node):
+        """
+        :param node: A ``Node`` or ``NodeState``.
+        :return: The view of ``node`` as a peer, cached by identity.
+        """
+        try:
+            original, peer = self._peers[id(node)]
+        except KeyError:
+            pass
+        else:
+            if original is node:
+                return peer
+        if isinstance(node, NodeState):
+            peer = _peer_node_state(node)
+        else:
+            peer = _peer_node(node)
+        self._peers[id(node)] = (node, peer)
+        return peer
+
+    def _project_node(self, node_uuid, node):
+        """
+        :return: ``node`` unchanged if it is the node with UUID ``node_uuid``,
+            otherwise its view as a peer.
+        """
+        if node.uuid == node_uuid:
+            return node
+        return self._peer(node)
+
+    def _project_deployment(self, node_uuid, deployment):
+        """
+        :param deployment: A ``Deployment`` or ``DeploymentState``.
+        :return: ``deployment`` as seen by the agent on node ``node_uuid``.
+        """
+        return deployment.set(nodes=[
+            self._project_node(node_uuid, node) for node in deployment.nodes
+        ])
+
+    def project(self, node_uuid, configuration, state):
+        """
+        Build the view of the cluster for the agent on a particular node.
+
+        The result for the most recent inputs for each node is cached, keyed
+        by the identity of the inputs.
+
+        :param UUID node_uuid: The node the view is for.
+        :param Deployment configuration: The cluster configuration.
+        :param DeploymentState state: The cluster state.
+
+        :return: A two-tuple of the projected ``Deployment`` and
+            ``DeploymentState``.
+        """
+        cached = self._projections.get(node_uuid)
+        if (
+            cached is not None and
+            cached[0] is configuration and cached[1] is state
+        ):
+            return cached[2]
+        result = (
+            self._project_deployment(node_uuid, configuration),
+            self._project_deployment(node_uuid, state),
+        )
+        self._projections[node_uuid] = (configuration, state, result)
+        return result
+
+    def project_diff(self, node_uuid, diff):
+        """
+        Convert a diff between two cluster configurations or states into the
+        diff between the views of them for the agent on a particular node.
+
+        :param UUID node_uuid: The node the view is for.
+        :param Diff diff: A diff between two ``Deployment``\ s or two
+            ``DeploymentState``\ s.
+
+        :return Diff: A diff which transforms the view of the first for
+            ``node_uuid`` into the view of the second.
+        """
+        changes = []
+        for change in diff.changes:
+            if isinstance(change, (_Add, _Remove)):
+                if change.path == _NODES_PATH:
+                    change = change.set(
+                        item=self._project_node(node_uuid, change.item)
+                    )
+            elif len(change.path) == 0:
+                change = change.set(
+                    value=self._project_deployment(node_uuid, change.value)
+                )
+            changes.append(change)
+
+        # Peers whose changes aren't visible in the view would otherwise be
+        # removed and added back again unchanged.
+        removed = set(
+            change.item for change in changes
+            if isinstance(change, _Remove) and change.path == _NODES_PATH
+        )
+        unchanged = set(
+            change.item for change in changes
+            if isinstance(change, _Add) and change.path == _NODES_PATH
+        ) & removed
+        return Diff(changes=[
+            projected for projected in changes
+            if isinstance(projected, _Set) or
+            projected.path != _NODES_PATH or
+            projected.item not in unchanged
+        ])
+
+    def retain(self, nodes):
+        """
+        Discard cached views of nodes other than the given ones.
+
+        :param nodes: An iterable of the ``Node`` and ``NodeState`` instances
+            in current use.
+        """
+        peers = {}
+        uuids = set()
+        for node in nodes:
+            uuids.add(node.uuid)
+            try:
+                peers[id(node)] = self._peers[id(node)]
+            except KeyError:
+                pass
+        self._peers = peers
+        self._projections = {
+            node_uuid: projection
+            for (node_uuid, projection) in self._projections.items()
+            if node_uuid in uuids
+        }
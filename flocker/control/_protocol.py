@@ -23,6 +23,27 @@ Interactions:
   cluster-wide state representation (the state of all of the nodes) and sends a
   ``ClusterStatusCommand`` to all convergence agents.
 
+* Each cluster status sent by the control service is identified by a
+  generation number which the convergence agent echoes back in its
+  acknowledgement.  Once an agent has acknowledged a generation the control
+  service sends it a ``ClusterStatusDiffCommand`` describing only the changes
+  since that generation instead of a complete ``ClusterStatusCommand``.  A
+  full ``ClusterStatusCommand`` is sent again whenever the agent's generation
+  is unknown, for example after reconnecting or if a diff could not be
+  applied.
+
+* Each agent is sent a view of the cluster specific to its node, once the
+  control service has learned which node that is from the agent's
+  ``NodeStateCommand``.  The agent's own node is included in full but only the
+  parts of other nodes which an agent can act upon are included (see
+  ``flocker.control._projection``).
+
+* When an agent connects it sends a ``VersionCommand`` listing the codecs it
+  can decode.  The control service chooses one to use for the commands it
+  sends to that agent and tells the agent, which then uses it too.  Agents and
+  control services which don't know about codecs use JSON (see
+  ``flocker.control._codec``).
+
 Eliot contexts are transferred along with AMP commands, allowing tracing
 of logged actions across processes (see
 http://eliot.readthedocs.org/en/0.6.0/threads.html).
@@ -31,15 +52,17 @@ http://eliot.readthedocs.org/en/0.6.0/threads.html).
     ``SerializableArgument``, allowing for cached serialization.
 """
 
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import timedelta
-from io import BytesIO
-from itertools import count
-from contextlib import contextmanager
+from itertools import chain, count
+from json import JSONEncoder
+from json.encoder import encode_basestring_ascii
 
-from eliot import Logger, ActionType, Action, Field, MessageType
+from eliot import Logger, ActionType, Action, Field, MessageType, writeFailure
 from eliot.twisted import DeferredContext
 
-from pyrsistent import PClass, field
+from pyrsistent import PClass, PRecord, PMap, PSet, PVector, field, pvector
 
 from characteristic import with_cmp
 
@@ -47,7 +70,7 @@ from zope.interface import Interface, Attribute
 
 from twisted.application.service import Service
 from twisted.protocols.amp import (
-    Argument, Command, Integer, CommandLocator, AMP, Unicode,
+    Argument, Command, Integer, CommandLocator, AMP, Unicode, ListOf,
     MAX_VALUE_LENGTH,
 )
 from twisted.internet.task import LoopingCall
@@ -55,9 +78,14 @@ from twisted.internet.protocol import ServerFactory
 from twisted.application.internet import StreamServerEndpointService
 from twisted.protocols.tls import TLSMemoryBIOFactory
 
-from ._persistence import wire_encode, wire_decode
+from ._persistence import wire_encode, _CLASS_MARKER
+from ._codec import (
+    JSON_CODEC, CODECS, decode, decode_chunks, negotiate_codec,
+)
+from ._diffing import Diff, create_diff
+from ._projection import ClusterProjector
 from ._model import (
-    Deployment, DeploymentState, ChangeSource,
+    Deployment, DeploymentState, ChangeSource, NodeState,
 )
 
 PING_INTERVAL = timedelta(seconds=30)
@@ -88,75 +116,223 @@ class Big(Argument):
         See ``IArgumentType`` for argument and return type documentation.
         """
         self.another_argument.toBox(name, strings, objects, proto)
-        value = BytesIO(strings.pop(name))
-        counter = 0
-        while True:
-            nextChunk = value.read(MAX_VALUE_LENGTH)
-            if not nextChunk:
-                break
-            strings["%s.%d" % (name, counter)] = nextChunk
-            counter += 1
+        value = strings.pop(name)
+        for counter, start in enumerate(
+            xrange(0, len(value), MAX_VALUE_LENGTH)
+        ):
+            strings["%s.%d" % (name, counter)] = value[
+                start:start + MAX_VALUE_LENGTH
+            ]
 
     def fromBox(self, name, strings, objects, proto):
         """
-        During deserialization, the indexed chunks are re-assembled from the
-        ``strings`` dictionary and the combined value is then placed back into
-        the strings dictionary using the expected key name. The ``fromBox``
-        method of the wrapped ``Argument`` is then called supplied with the
-        updated ``strings`` dictionary, deserializes the large value and
-        populates the ``objects`` dictionary with the result.
+        During deserialization, the indexed chunks are removed from the
+        ``strings`` dictionary in order.
+
+        If the wrapped ``Argument`` can decode a value from its chunks (see
+        ``SerializableArgument.fromChunks``) they are passed to it one at a
+        time, so the large value is never re-assembled.  Otherwise the
+        chunks are joined, the combined value is placed back into the
+        ``strings`` dictionary using the expected key name and the
+        ``fromBox`` method of the wrapped ``Argument`` is called to
+        deserialize it and populate the ``objects`` dictionary.
 
         See ``IArgumentType`` for argument and return type documentation.
         """
+        chunks = self._chunks(name, strings)
+        from_chunks = getattr(self.another_argument, "fromChunks", None)
+        if from_chunks is None:
+            strings[name] = b"".join(chunks)
+            self.another_argument.fromBox(name, strings, objects, proto)
+        else:
+            # Mirror ``Argument.fromBox``'s conversion of the wire name.
+            objects[name.replace(b"-", b"_")] = from_chunks(chunks)
+
+    def _chunks(self, name, strings):
+        """
+        Remove the chunks of a value from an ``AmpBox``.
+
+        :param bytes name: The name of the argument.
+        :param strings: See ``IArgumentType.fromBox``.
 
-        value = BytesIO()
+        :return: Iterator of the chunks, in order.  Each chunk is removed
+            from ``strings`` as it is reached.
+        """
         for counter in count(0):
-            chunk = strings.get("%s.%d" % (name, counter))
+            chunk = strings.pop("%s.%d" % (name, counter), None)
             if chunk is None:
-                break
-            value.write(chunk)
-            strings[name] = value.getvalue()
-        self.another_argument.fromBox(name, strings, objects, proto)
+                return
+            yield chunk
+
+
+# Encoders for the values JSON represents natively, by exact type:
+_JSON_PRIMITIVES = {
+    unicode: encode_basestring_ascii,
+    bytes: encode_basestring_ascii,
+    int: int.__str__,
+    long: long.__str__,
+    bool: lambda value: b"true" if value else b"false",
+    type(None): lambda value: b"null",
+    float: JSONEncoder().encode,
+}
+
+# The JSON encoding of the class marker key:
+_JSON_CLASS_MARKER = encode_basestring_ascii(_CLASS_MARKER)
+
+# The default limit on the total size, in bytes, of the encodings kept by a
+# ``CachingEncoder``:
+CACHED_ENCODINGS_MAX_BYTES = 64 * 1024 * 1024
 
 
 class CachingEncoder(object):
     """
-    Cache results of ``wire_encode`` and re-use them, relying on the fact
-    we're encoding immutable objects.
+    Cache results of encoding with a ``WireCodec`` and re-use them, relying on
+    the fact we're encoding immutable objects.
+
+    The JSON encoding of each nested pyrsistent object is cached separately
+    and cached encodings are spliced into the encoding of the objects which
+    contain them.  Since most of the model is unchanged from one update to the
+    next, encoding a new version of the cluster state or configuration mostly
+    consists of re-using the encodings of the unchanged parts.  Other codecs
+    only cache the encoding of the whole object.
+
+    Cache entries are keyed by object identity.  An entry keeps a reference to
+    its object so the identity of a cached object can't be reused.
+
+    The cache is bounded both by the number of entries and by the total size
+    of the cached encodings, since the encodings of whole cluster states can
+    be large and each update produces new ones.
 
     Not thread-safe, so should only be used by a single thread (the
     Twisted reactor thread, presumably).
 
-    :attr _cache: Either ``None`` indicating no caching or a dicitonary
-        with objects mapped to cached wire encoded values.
+    :ivar int size: The maximum number of encodings to cache.
+    :ivar int max_bytes: The maximum total size of the cached encodings.
+    :ivar int hits: The number of times a cached encoding was re-used.
+    :ivar int misses: The number of times an encoding wasn't in the cache.
+    :ivar int evictions: The number of encodings evicted from the cache to
+        make space.
+    :ivar OrderedDict _cache: Map from a codec name and an object's ``id`` to
+        that object and its encoding, least recently used first.
+    :ivar int _bytes: The total size of the cached encodings.
     """
-    def __init__(self):
-        self._cache = None
+    def __init__(self, size=50000, max_bytes=CACHED_ENCODINGS_MAX_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def cached_bytes(self):
+        """
+        The total size of the cached encodings.
+        """
+        return self._bytes
 
-    def encode(self, obj):
+    def _cached(self, codec_name, obj, encode):
         """
-        Encode an object to bytes using ``wire_encode``, or return cached
-        result if available and running in context of ``cache()`` context
-        manager.
+        Get the encoding of an object from the cache, adding it if necessary.
+
+        :param unicode codec_name: The name of the codec.
+        :param obj: The object to encode.
+        :param encode: One-argument callable to encode ``obj`` with if it
+            isn't in the cache.
+
+        :return bytes: The encoding of ``obj``.
+        """
+        key = (codec_name, id(obj))
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            if entry[0] is obj:
+                self.hits += 1
+                # Re-inserting makes it the most recently used entry.
+                self._cache[key] = entry
+                return entry[1]
+            # A stale entry for an object which no longer exists.
+            self._bytes -= len(entry[1])
+        self.misses += 1
+        encoding = encode(obj)
+        if len(encoding) > self.max_bytes:
+            return encoding
+        self._cache[key] = (obj, encoding)
+        self._bytes += len(encoding)
+        while len(self._cache) > self.size or self._bytes > self.max_bytes:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+        return encoding
+
+    def encode(self, obj, codec=JSON_CODEC):
+        """
+        Encode an object to bytes using ``codec``, re-using cached encodings
+        where possible.
 
         :param obj: Object to encode.
+        :param WireCodec codec: The codec to encode with.
         :return: Resulting ``bytes``.
         """
-        if self._cache is None:
-            return wire_encode(obj)
+        if codec is JSON_CODEC:
+            return self._encode_json(obj)
+        return self._cached(codec.name, obj, codec.encode)
 
-        if obj not in self._cache:
-            self._cache[obj] = wire_encode(obj)
-        return self._cache[obj]
-
-    @contextmanager
-    def cache(self):
+    def _encode_json(self, obj):
+        """
+        :param obj: Object to encode.
+        :return bytes: The same encoding ``wire_encode`` would produce (up to
+            the order of dictionary keys).
         """
-        While in context of this context manager results will be cached.
+        try:
+            primitive = _JSON_PRIMITIVES[type(obj)]
+        except KeyError:
+            pass
+        else:
+            return primitive(obj)
+        if isinstance(obj, (PMap, PClass, PSet, PVector)):
+            return self._cached(JSON_CODEC.name, obj, self._encode_json_data)
+        return self._encode_json_data(obj)
+
+    def _encode_json_data(self, obj):
         """
-        self._cache = {}
-        yield
-        self._cache = None
+        Encode an object which JSON doesn't represent natively, using
+        ``_encode_json`` for the objects it contains.
+
+        :param obj: Object to encode.
+        :return bytes: The encoding.
+        """
+        encode = self._encode_json
+        if isinstance(obj, PRecord):
+            fields = obj.iteritems()
+        elif isinstance(obj, PClass):
+            fields = obj.evolver().data.iteritems()
+        elif isinstance(obj, PMap):
+            return b"".join([
+                b"{", _JSON_CLASS_MARKER, b': "PMap", "values": [',
+                b", ".join(
+                    b"".join([b"[", encode(key), b", ", encode(value), b"]"])
+                    for key, value in obj.iteritems()
+                ),
+                b"]}",
+            ])
+        elif isinstance(obj, (PSet, PVector, set, frozenset, list, tuple)):
+            return b"".join([
+                b"[", b", ".join(encode(item) for item in obj), b"]",
+            ])
+        else:
+            # Plain dictionaries and leaf values like ``UUID`` are rare enough
+            # not to bother caching.
+            return wire_encode(obj)
+        members = [
+            b"".join([encode_basestring_ascii(name), b": ", encode(value)])
+            for name, value in fields
+        ]
+        members.append(b"".join([
+            _JSON_CLASS_MARKER, b": ",
+            encode_basestring_ascii(obj.__class__.__name__),
+        ]))
+        return b"".join([b"{", b", ".join(members), b"}"])
 
 _caching_encoder = CachingEncoder()
 
@@ -176,7 +352,26 @@ class SerializableArgument(Argument):
         self._expected_classes = classes
 
     def fromString(self, in_bytes):
-        obj = wire_decode(in_bytes)
+        return self._check(decode(in_bytes))
+
+    def fromChunks(self, chunks):
+        """
+        Decode an object from the pieces of its encoding, as received by
+        ``Big``.
+
+        :param chunks: Iterable of ``bytes`` which together are the encoded
+            object.
+        """
+        return self._check(decode_chunks(chunks))
+
+    def _check(self, obj):
+        """
+        :param obj: A decoded object.
+
+        :raise TypeError: If ``obj`` isn't of one of the expected classes.
+
+        :return: ``obj``.
+        """
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
@@ -184,11 +379,20 @@ class SerializableArgument(Argument):
         return obj
 
     def toString(self, obj):
+        return self.toStringProto(obj, None)
+
+    def toStringProto(self, obj, proto):
+        """
+        Encode ``obj`` with the codec negotiated for ``proto``'s connection,
+        JSON if there is none.
+        """
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
             )
-        return _caching_encoder.encode(obj)
+        return _caching_encoder.encode(
+            obj, getattr(proto, "wire_codec", JSON_CODEC),
+        )
 
 
 class _EliotActionArgument(Unicode):
@@ -209,9 +413,14 @@ class VersionCommand(Command):
     Return configuration protocol version of the control service.
 
     Semantic versioning: Major version changes implies incompatibility.
+
+    The caller may also list the names of the codecs it can decode, most
+    preferred first.  The control service responds with the name of the codec
+    it chose to send commands to the caller with, and the caller should then
+    use the same codec for commands it sends.
     """
-    arguments = []
-    response = [('major', Integer())]
+    arguments = [('codecs', ListOf(Unicode(), optional=True))]
+    response = [('major', Integer()), ('codec', Unicode(optional=True))]
 
 
 class NoOp(Command):
@@ -225,6 +434,13 @@ class NoOp(Command):
     requiresAnswer = False
 
 
+class GenerationMismatch(Exception):
+    """
+    A ``ClusterStatusDiffCommand`` was received by an agent which does not
+    have the generation the diff is based on.
+    """
+
+
 class ClusterStatusCommand(Command):
     """
     Used by the control service to inform a convergence agent of the
@@ -232,11 +448,35 @@ class ClusterStatusCommand(Command):
 
     Having both as a single command simplifies the decision making process
     in the convergence agent during startup.
+
+    The ``generation`` identifies this particular configuration and state.
+    Agents which support ``ClusterStatusDiffCommand`` include it in their
+    response to tell the control service which generation they now have.
     """
     arguments = [('configuration', Big(SerializableArgument(Deployment))),
                  ('state', Big(SerializableArgument(DeploymentState))),
+                 ('generation', Integer(optional=True)),
                  ('eliot_context', _EliotActionArgument())]
-    response = []
+    response = [('generation', Integer(optional=True))]
+
+
+class ClusterStatusDiffCommand(Command):
+    """
+    Used by the control service to inform a convergence agent of the changes
+    to the cluster state and desired configuration since a generation the
+    agent has acknowledged.
+
+    The agent responds with ``GenerationMismatch`` if it doesn't have
+    ``start_generation``, in which case the control service falls back to
+    sending a full ``ClusterStatusCommand``.
+    """
+    arguments = [('configuration_diff', Big(SerializableArgument(Diff))),
+                 ('state_diff', Big(SerializableArgument(Diff))),
+                 ('start_generation', Integer()),
+                 ('end_generation', Integer()),
+                 ('eliot_context', _EliotActionArgument())]
+    response = [('generation', Integer())]
+    errors = {GenerationMismatch: b"GENERATION_MISMATCH"}
 
 
 class NodeStateCommand(Command):
@@ -275,6 +515,9 @@ class ControlServiceLocator(CommandLocator):
     :ivar IClusterStateSource _source: The change source uniquely representing
         the AMP connection for which this locator is being used.
     :ivar _reactor: See ``reactor`` parameter of ``__init__``
+    :ivar node_uuid: The UUID of the node the agent reported state for, or
+        ``None`` if it hasn't reported any node state yet.
+    :ivar WireCodec wire_codec: The codec negotiated with the agent.
     """
     def __init__(self, reactor, control_amp_service):
         """
@@ -294,6 +537,8 @@ class ControlServiceLocator(CommandLocator):
 
         self._reactor = reactor
         self.control_amp_service = control_amp_service
+        self.node_uuid = None
+        self.wire_codec = JSON_CODEC
 
     def locateResponder(self, name):
         """
@@ -314,12 +559,16 @@ class ControlServiceLocator(CommandLocator):
         return {}
 
     @VersionCommand.responder
-    def version(self):
-        return {"major": 1}
+    def version(self, codecs=None):
+        self.wire_codec = negotiate_codec(codecs)
+        return {"major": 1, "codec": self.wire_codec.name}
 
     @NodeStateCommand.responder
     def node_changed(self, eliot_context, state_changes):
         with eliot_context:
+            for change in state_changes:
+                if isinstance(change, NodeState):
+                    self.node_uuid = change.uuid
             self.control_amp_service.node_changed(
                 self._source, state_changes,
             )
@@ -332,7 +581,10 @@ class ControlAMP(AMP):
 
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar int bytes_sent: The number of bytes of AMP boxes sent so far.
     """
+    bytes_sent = 0
+
     def __init__(self, reactor, control_amp_service):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
@@ -344,6 +596,30 @@ class ControlAMP(AMP):
         self.control_amp_service = control_amp_service
         self._pinger = Pinger(reactor)
 
+    @property
+    def node_uuid(self):
+        """
+        The UUID of the node the connected agent is running on, or ``None`` if
+        not yet known.
+        """
+        return self.locator.node_uuid
+
+    @property
+    def wire_codec(self):
+        """
+        The ``WireCodec`` negotiated with the connected agent.
+        """
+        return self.locator.wire_codec
+
+    def sendBox(self, box):
+        AMP.sendBox(self, box)
+        # Each key and value is preceded by its two byte length and the box
+        # ends with two zero bytes.  Counting them is much cheaper than
+        # serializing the box again.
+        self.bytes_sent += 2 + sum(
+            4 + len(key) + len(value) for (key, value) in box.iteritems()
+        )
+
     def connectionMade(self):
         AMP.connectionMade(self)
         self.control_amp_service.connected(self)
@@ -413,6 +689,64 @@ AGENT_UPDATE_DELAYED = MessageType(
     u"progress.",
 )
 
+AGENT_UPDATE_STALE = MessageType(
+    "flocker:controlservice:agent_update_stale",
+    [AGENT],
+    u"An agent took too long to acknowledge an update so it was sent the "
+    u"next one without waiting for the acknowledgement.",
+)
+
+STATE_BATCH_APPLIED = MessageType(
+    "flocker:controlservice:state_batch_applied",
+    [Field.for_types(u"reports", [int],
+                     u"The number of state reports from agents."),
+     Field.for_types(u"changes", [int], u"The number of state changes."),
+     Field.for_types(u"latency", [float],
+                     u"Seconds the oldest report waited to be applied.")],
+    u"State reported by agents was applied to the cluster state.",
+)
+
+# The default number of seconds ``ControlAMPService`` collects state reports
+# from agents for before applying them, and the number of changes which causes
+# them to be applied sooner.
+DEFAULT_BATCH_WINDOW = 0.05
+DEFAULT_BATCH_SIZE = 100
+
+# The default number of seconds after which ``ControlAMPService`` stops
+# waiting for an agent to acknowledge an update before sending it another.
+DEFAULT_MAX_STALENESS = 60.0
+
+# The upper bounds, in seconds, of the buckets of the histograms of how long
+# agents take to acknowledge updates.  There is a final bucket for anything
+# longer.
+ACK_LATENCY_BUCKETS = (0.01, 0.1, 1.0, 10.0, 60.0)
+
+
+class _ClusterSnapshot(PClass):
+    """
+    A configuration and state sent to agents, identified by a generation.
+
+    :ivar int generation: Number identifying this snapshot.  Later snapshots
+        have larger generations.
+    :ivar Deployment configuration: The desired configuration.
+    :ivar DeploymentState state: The cluster state.
+    """
+    generation = field(type=int, mandatory=True)
+    configuration = field(type=Deployment, mandatory=True)
+    state = field(type=DeploymentState, mandatory=True)
+
+
+class _AcknowledgedSnapshot(PClass):
+    """
+    A snapshot an agent has acknowledged receiving.
+
+    :ivar _ClusterSnapshot snapshot: The snapshot the view was built from.
+    :ivar node_uuid: The UUID of the node the view was projected for, or
+        ``None`` if the agent was sent the complete snapshot.
+    """
+    snapshot = field(type=_ClusterSnapshot, mandatory=True)
+    node_uuid = field(mandatory=True)
+
 
 class _UpdateState(PClass):
     """
@@ -422,9 +756,129 @@ class _UpdateState(PClass):
     :ivar response: The pending result of an update that is in progress.
     :ivar scheduled: ``True`` if another update should be performed as soon as
         the current one is done, ``False`` otherwise.
+    :ivar sent: The time the update was sent, in seconds since the epoch.
     """
     response = field()
     next_scheduled = field()
+    sent = field()
+
+
+class _IngestionMetrics(PClass):
+    """
+    Statistics about the batches of state changes reported by agents which
+    ``ControlAMPService`` has applied.
+
+    :ivar int batches: The number of batches applied.
+    :ivar int reports: The number of ``NodeStateCommand``\ s applied.
+    :ivar int changes: The number of state changes applied.
+    :ivar int largest_batch: The most changes applied in one batch.
+    :ivar float total_latency: The sum over all batches of the number of
+        seconds the oldest report in the batch waited to be applied.
+    :ivar float max_latency: The longest any report waited to be applied.
+    """
+    batches = field(type=int, initial=0)
+    reports = field(type=int, initial=0)
+    changes = field(type=int, initial=0)
+    largest_batch = field(type=int, initial=0)
+    total_latency = field(type=float, initial=0.0)
+    max_latency = field(type=float, initial=0.0)
+
+    def record(self, reports, changes, latency):
+        """
+        :param int reports: The number of reports in a batch.
+        :param int changes: The number of changes in the batch.
+        :param float latency: See ``total_latency``.
+
+        :return _IngestionMetrics: These statistics updated with the batch.
+        """
+        return self.set(
+            batches=self.batches + 1,
+            reports=self.reports + reports,
+            changes=self.changes + changes,
+            largest_batch=max(self.largest_batch, changes),
+            total_latency=self.total_latency + latency,
+            max_latency=max(self.max_latency, latency),
+        )
+
+
+class _FanOutMetrics(PClass):
+    """
+    Statistics about the updates ``ControlAMPService`` has sent to agents.
+
+    :ivar int updates: The number of updates sent.
+    :ivar int acknowledged: The number of updates agents acknowledged.
+    :ivar int failed: The number of updates which failed.
+    :ivar int delayed: The number of times an update was postponed until
+        the agent acknowledged the previous one.
+    :ivar int elided: The number of times an update was skipped because a
+        postponed update would include its changes.
+    :ivar int stale: The number of times an agent hadn't acknowledged an
+        update within the maximum staleness, and so was sent the next one
+        without waiting.
+    :ivar int bytes_sent: The number of bytes of updates sent.
+    :ivar int largest_update: The most bytes sent in one update.
+    :ivar PVector ack_latency: A histogram of the number of seconds agents
+        took to acknowledge updates: the number of acknowledgements within
+        each of ``ACK_LATENCY_BUCKETS``, followed by the number of slower
+        ones.
+    :ivar float total_ack_latency: The sum of the number of seconds agents
+        took to acknowledge updates.
+    :ivar float max_ack_latency: The longest an agent took to acknowledge
+        an update.
+    """
+    updates = field(type=int, initial=0)
+    acknowledged = field(type=int, initial=0)
+    failed = field(type=int, initial=0)
+    delayed = field(type=int, initial=0)
+    elided = field(type=int, initial=0)
+    stale = field(type=int, initial=0)
+    bytes_sent = field(type=int, initial=0)
+    largest_update = field(type=int, initial=0)
+    ack_latency = field(
+        type=PVector, initial=pvector([0] * (len(ACK_LATENCY_BUCKETS) + 1)),
+    )
+    total_ack_latency = field(type=float, initial=0.0)
+    max_ack_latency = field(type=float, initial=0.0)
+
+    def sent(self, size):
+        """
+        :param int size: The number of bytes of an update.
+
+        :return _FanOutMetrics: These statistics updated with the update.
+        """
+        return self.set(
+            updates=self.updates + 1,
+            bytes_sent=self.bytes_sent + size,
+            largest_update=max(self.largest_update, size),
+        )
+
+    def acknowledged_after(self, latency):
+        """
+        :param float latency: The number of seconds an agent took to
+            acknowledge an update.
+
+        :return _FanOutMetrics: These statistics updated with the
+            acknowledgement.
+        """
+        bucket = bisect_left(ACK_LATENCY_BUCKETS, latency)
+        return self.set(
+            acknowledged=self.acknowledged + 1,
+            ack_latency=self.ack_latency.set(
+                bucket, self.ack_latency[bucket] + 1,
+            ),
+            total_ack_latency=self.total_ack_latency + latency,
+            max_ack_latency=max(self.max_ack_latency, latency),
+        )
+
+    def incremented(self, name):
+        """
+        :param str name: The name of one of the counts of this object, for
+            example ``"elided"``.
+
+        :return _FanOutMetrics: These statistics with that count increased
+            by one.
+        """
+        return self.set(name, getattr(self, name) + 1)
 
 
 class ControlAMPService(Service):
@@ -436,11 +890,34 @@ class ControlAMPService(Service):
     :ivar dict _current_command: A dictionary containing information about
         connections to which state updates are currently in progress.  The keys
         are protocol instances.  The values are ``_UpdateState`` instances.
+    :ivar dict _acknowledged: A dictionary mapping protocol instances to the
+        most recent ``_AcknowledgedSnapshot`` that agent has acknowledged.
+        Changes since that snapshot are sent instead of a full snapshot.
+    :ivar ClusterProjector _projector: Builds the view of the cluster sent to
+        each agent.
+    :ivar _ClusterSnapshot _latest: The most recently sent snapshot, or
+        ``None`` if nothing has been sent yet.
+    :ivar list _pending_reports: Three-tuples of the source, the changes and
+        the time of each state report from an agent which hasn't been applied
+        to the cluster state yet.
+    :ivar int _pending_changes: The number of changes in
+        ``_pending_reports``.
+    :ivar _batch_call: The ``IDelayedCall`` which will apply the pending
+        reports, or ``None``.
+    :ivar _IngestionMetrics ingestion_metrics: Statistics about the state
+        reports applied so far.
+    :ivar _FanOutMetrics fan_out_metrics: Statistics about the updates sent
+        to all agents so far.
+    :ivar dict agent_metrics: A dictionary mapping protocol instances of
+        connected agents to ``_FanOutMetrics`` about the updates sent to
+        that agent.
     """
     logger = Logger()
 
     def __init__(self, reactor, cluster_state, configuration_service, endpoint,
-                 context_factory):
+                 context_factory, batch_window=DEFAULT_BATCH_WINDOW,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 max_staleness=DEFAULT_MAX_STALENESS):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
         :param ClusterStateService cluster_state: Object that records known
@@ -449,9 +926,34 @@ class ControlAMPService(Service):
             Persistence service for desired cluster configuration.
         :param endpoint: Endpoint to listen on.
         :param context_factory: TLS context factory.
+        :param float batch_window: The number of seconds to collect state
+            reports from agents for before applying them to the cluster state
+            together and sending a single update to agents.  If zero each
+            report is applied as soon as it is received.
+        :param int batch_size: Apply the collected state reports as soon as
+            they contain this many changes, without waiting for the rest of
+            ``batch_window``.
+        :param max_staleness: The number of seconds to wait for an agent to
+            acknowledge an update before sending it later updates anyway, or
+            ``None`` to wait indefinitely.  This stops an agent which is slow
+            or stuck from missing all changes until it acknowledges.
         """
+        self._reactor = reactor
+        self._batch_window = batch_window
+        self._batch_size = batch_size
+        self._max_staleness = max_staleness
+        self._pending_reports = []
+        self._pending_changes = 0
+        self._batch_call = None
+        self.ingestion_metrics = _IngestionMetrics()
+        self.fan_out_metrics = _FanOutMetrics()
+        self.agent_metrics = {}
         self.connections = set()
         self._current_command = {}
+        self._acknowledged = {}
+        self._generations = count(1)
+        self._latest = None
+        self._projector = ClusterProjector()
         self.cluster_state = cluster_state
         self.configuration_service = configuration_service
         self.endpoint_service = StreamServerEndpointService(
@@ -470,6 +972,9 @@ class ControlAMPService(Service):
         self.endpoint_service.startService()
 
     def stopService(self):
+        if self._batch_call is not None:
+            self._batch_call.cancel()
+            self._batch_call = None
         self.endpoint_service.stopService()
         for connection in self.connections:
             connection.transport.loseConnection()
@@ -480,8 +985,9 @@ class ControlAMPService(Service):
 
         :param connections: A collection of ``AMP`` instances.
         """
-        configuration = self.configuration_service.get()
-        state = self.cluster_state.as_deployment()
+        snapshot = self._current_snapshot()
+        configuration = snapshot.configuration
+        state = snapshot.state
 
         # Connections are separated into three groups to support a scheme which
         # lets us avoid sending certain updates which we know are not
@@ -506,6 +1012,7 @@ class ControlAMPService(Service):
         # sending one intermediate update to them.
         elided_update = []
 
+        now = self._reactor.seconds()
         for connection in connections:
             try:
                 update = self._current_command[connection]
@@ -517,7 +1024,16 @@ class ControlAMPService(Service):
             else:
                 # These connections do currently have an unacknowledged update
                 # outstanding.
-                if update.next_scheduled:
+                if (
+                    self._max_staleness is not None and
+                    now - update.sent >= self._max_staleness
+                ):
+                    # But the agent has taken too long to acknowledge it.
+                    # Rather than leave it further behind, stop waiting and
+                    # send it another update right away.
+                    self._abandon_update(connection)
+                    can_update.append(connection)
+                elif update.next_scheduled:
                     # And these connections are also already scheduled to
                     # receive another update after the one they're currently
                     # processing.  That update will include the most up-to-date
@@ -529,69 +1045,237 @@ class ControlAMPService(Service):
                     # schedule one.
                     delayed_update.append(connection)
 
-        # Do all of the update work inside this caching context.  This makes
-        # multiple encodings of the same piece of state much less expensive by
-        # saving the first result and re-using it.  The cache is only
-        # maintained for the duration of the block.
-        with _caching_encoder.cache():
-            # Make sure to run the logging action inside the caching block.
-            # This lets encoding for logging share the cache with encoding for
-            # network traffic.
-            with LOG_SEND_CLUSTER_STATE() as action:
-                if can_update:
-                    # If there are any protocols that can be updated right now,
-                    # we also want to see what updates they receive.  Since
-                    # logging shares the caching context, it shouldn't be any
-                    # more expensive to serialize this information into the log
-                    # now.  We specifically avoid logging this information if
-                    # no protocols are being updated because the serializing is
-                    # more expensive in that case and at the same time that
-                    # information isn't actually useful.
-                    action.add_success_fields(
-                        configuration=configuration, state=state
-                    )
-                else:
-                    # Eliot wants those fields though.
-                    action.add_success_fields(configuration=None, state=None)
+        # Encoding for logging and for network traffic share
+        # ``_caching_encoder``.  It keeps the encodings of the parts of the
+        # configuration and state which haven't changed since previous updates
+        # and multiple encodings of the same piece of state re-use the first
+        # result.
+        with LOG_SEND_CLUSTER_STATE() as action:
+            if can_update:
+                # If there are any protocols that can be updated right now, we
+                # also want to see what updates they receive.  Since logging
+                # shares the cache, it shouldn't be much more expensive to
+                # serialize this information into the log now.  We
+                # specifically avoid logging this information if no protocols
+                # are being updated because the serializing is more expensive
+                # in that case and at the same time that information isn't
+                # actually useful.
+                action.add_success_fields(
+                    configuration=configuration, state=state
+                )
+            else:
+                # Eliot wants those fields though.
+                action.add_success_fields(configuration=None, state=None)
+
+            # Agents which acknowledged the same generation can share the same
+            # diffs (and so the cached encoding of them).
+            diffs = {}
+            for connection in can_update:
+                self._update_connection(connection, snapshot, diffs)
+
+            for connection in elided_update:
+                AGENT_UPDATE_ELIDED(agent=connection).write()
+                self._record(connection, lambda metrics: metrics.incremented(
+                    "elided"))
+
+            for connection in delayed_update:
+                self._delayed_update_connection(connection)
+
+    def _record(self, connection, update):
+        """
+        Update the statistics about updates sent to agents.
+
+        :param ControlAMP connection: The agent the statistics are about.
+        :param update: One-argument callable which is given
+            ``_FanOutMetrics`` and returns them updated.
+        """
+        self.fan_out_metrics = update(self.fan_out_metrics)
+        if connection in self.agent_metrics:
+            self.agent_metrics[connection] = update(
+                self.agent_metrics[connection]
+            )
+
+    def _abandon_update(self, connection):
+        """
+        Stop waiting for an agent to acknowledge its update in progress.
 
-                for connection in can_update:
-                    self._update_connection(connection, configuration, state)
+        The agent's response to that update is ignored when it arrives.
+        Since it isn't known which generation the agent has, its next update
+        is a full snapshot.
 
-                for connection in elided_update:
-                    AGENT_UPDATE_ELIDED(agent=connection).write()
+        :param ControlAMP connection: The agent's connection.
+        """
+        AGENT_UPDATE_STALE(agent=connection).write()
+        self._record(connection, lambda metrics: metrics.incremented("stale"))
+        del self._current_command[connection]
+        self._acknowledged.pop(connection, None)
 
-                for conection in delayed_update:
-                    self._delayed_update_connection(connection)
+    def _current_snapshot(self):
+        """
+        Get the current configuration and state, assigning them a new
+        generation if either has changed since the last snapshot.
 
-    def _update_connection(self, connection, configuration, state):
+        :return _ClusterSnapshot: The current snapshot.
         """
-        Send a ``ClusterStatusCommand`` to an agent.
+        configuration = self.configuration_service.get()
+        state = self.cluster_state.as_deployment()
+        latest = self._latest
+        if (
+            latest is None or
+            latest.configuration is not configuration or
+            latest.state is not state
+        ):
+            self._latest = _ClusterSnapshot(
+                generation=next(self._generations),
+                configuration=configuration,
+                state=state,
+            )
+            self._projector.retain(chain(configuration.nodes, state.nodes))
+        return self._latest
+
+    def _diffs_since(self, acknowledged, snapshot, diffs):
+        """
+        Calculate the configuration and state changes between two snapshots.
+
+        :param _ClusterSnapshot acknowledged: The older snapshot.
+        :param _ClusterSnapshot snapshot: The newer snapshot.
+        :param dict diffs: Previously calculated results for ``snapshot``,
+            keyed by the generation of the older snapshot.  Updated with the
+            result.
+
+        :return: A two-tuple of configuration ``Diff`` and state ``Diff``.
+        """
+        try:
+            return diffs[acknowledged.generation]
+        except KeyError:
+            result = diffs[acknowledged.generation] = (
+                create_diff(
+                    acknowledged.configuration, snapshot.configuration
+                ),
+                create_diff(acknowledged.state, snapshot.state),
+            )
+            return result
+
+    def _update_connection(self, connection, snapshot, diffs):
+        """
+        Send a ``ClusterStatusCommand`` or, if the agent has acknowledged an
+        earlier generation, a ``ClusterStatusDiffCommand`` to an agent.
 
         :param ControlAMP connection: The connection to use to send the
             command.
 
-        :param Deployment configuration: The cluster configuration to send.
-        :param DeploymentState state: The current cluster state to send.
+        :param _ClusterSnapshot snapshot: The configuration and state to send.
+            If the agent's node is known it is sent the view of these for that
+            node.
+        :param dict diffs: See ``_diffs_since``.
         """
+        # Test doubles for connections don't necessarily know about nodes; an
+        # agent whose node isn't known is sent everything.
+        node_uuid = getattr(connection, "node_uuid", None)
+        acknowledged = self._acknowledged.get(connection)
+        if acknowledged is not None and acknowledged.node_uuid != node_uuid:
+            # The agent has a view for some other node (or the complete
+            # cluster), which the diffs wouldn't apply to.
+            acknowledged = None
+        sent = self._reactor.seconds()
+        bytes_sent = getattr(connection, "bytes_sent", 0)
         action = LOG_SEND_TO_AGENT(agent=connection)
         with action.context():
-            d = DeferredContext(connection.callRemote(
-                ClusterStatusCommand,
-                configuration=configuration,
-                state=state,
-                eliot_context=action
-            ))
+            if acknowledged is None:
+                configuration = snapshot.configuration
+                state = snapshot.state
+                if node_uuid is not None:
+                    configuration, state = self._projector.project(
+                        node_uuid, configuration, state,
+                    )
+                response = connection.callRemote(
+                    ClusterStatusCommand,
+                    configuration=configuration,
+                    state=state,
+                    generation=snapshot.generation,
+                    eliot_context=action
+                )
+            else:
+                configuration_diff, state_diff = self._diffs_since(
+                    acknowledged.snapshot, snapshot, diffs,
+                )
+                if node_uuid is not None:
+                    configuration_diff = self._projector.project_diff(
+                        node_uuid, configuration_diff,
+                    )
+                    state_diff = self._projector.project_diff(
+                        node_uuid, state_diff,
+                    )
+                response = connection.callRemote(
+                    ClusterStatusDiffCommand,
+                    configuration_diff=configuration_diff,
+                    state_diff=state_diff,
+                    start_generation=acknowledged.snapshot.generation,
+                    end_generation=snapshot.generation,
+                    eliot_context=action
+                )
+            d = DeferredContext(response)
             d.addActionFinish()
-            d.result.addErrback(lambda _: None)
-
-        update = self._current_command[connection] = _UpdateState(
-            response=d.result,
+        response = d.result
+        size = getattr(connection, "bytes_sent", 0) - bytes_sent
+        self._record(connection, lambda metrics: metrics.sent(size))
+
+        def current():
+            # Whether this is still the update in progress for the agent,
+            # rather than one abandoned for being stale.
+            update = self._current_command.get(connection)
+            return update is not None and update.response is response
+
+        def acknowledged_update(result):
+            latency = float(self._reactor.seconds() - sent)
+            self._record(
+                connection,
+                lambda metrics: metrics.acknowledged_after(latency),
+            )
+            if not current():
+                return False
+            if result.get("generation") == snapshot.generation:
+                self._acknowledged[connection] = _AcknowledgedSnapshot(
+                    snapshot=snapshot, node_uuid=node_uuid,
+                )
+            else:
+                # The agent doesn't track generations so it can only be sent
+                # full snapshots.
+                self._acknowledged.pop(connection, None)
+            return False
+
+        def failed_update(reason):
+            self._record(
+                connection, lambda metrics: metrics.incremented("failed"),
+            )
+            if not current():
+                return False
+            # We don't know what the agent has now so the next update must be
+            # a full snapshot.  If the agent told us it couldn't apply the diff
+            # then send that full snapshot right away.
+            self._acknowledged.pop(connection, None)
+            return reason.check(GenerationMismatch) is not None
+
+        self._current_command[connection] = _UpdateState(
+            response=response,
             next_scheduled=False,
+            sent=sent,
         )
-
-        def finished_update(ignored):
-            del self._current_command[connection]
-        update.response.addCallback(finished_update)
+        response.addCallbacks(acknowledged_update, failed_update)
+
+        def finished_update(resend):
+            # Returns whether the update was still in progress, in which case
+            # any delayed update is due now.
+            if not current():
+                return False
+            update = self._current_command.pop(connection)
+            if (
+                resend and not update.next_scheduled and
+                connection in self.connections
+            ):
+                self._send_state_to_connections([connection])
+            return True
+        response.addCallback(finished_update)
 
     def _delayed_update_connection(self, connection):
         """
@@ -604,9 +1288,13 @@ class ControlAMPService(Service):
             related to this will be used and then updated.
         """
         AGENT_UPDATE_DELAYED(agent=connection).write()
+        self._record(connection, lambda metrics: metrics.incremented(
+            "delayed"))
         update = self._current_command[connection]
         update.response.addCallback(
-            lambda ignored: self._send_state_to_connections([connection]),
+            lambda finished: (
+                finished and self._send_state_to_connections([connection])
+            ),
         )
         self._current_command[connection] = update.set(next_scheduled=True)
 
@@ -618,6 +1306,7 @@ class ControlAMPService(Service):
         """
         with AGENT_CONNECTED(agent=connection):
             self.connections.add(connection)
+            self.agent_metrics[connection] = _FanOutMetrics()
             self._send_state_to_connections([connection])
 
     def disconnected(self, connection):
@@ -627,6 +1316,8 @@ class ControlAMPService(Service):
         :param ControlAMP connection: The lost connection.
         """
         self.connections.remove(connection)
+        self._acknowledged.pop(connection, None)
+        self.agent_metrics.pop(connection, None)
 
     def node_changed(self, source, state_changes):
         """
@@ -637,7 +1328,48 @@ class ControlAMPService(Service):
         :param list state_changes: One or more ``IClusterStateChange``
             providers representing the state change which has taken place.
         """
-        self.cluster_state.apply_changes_from_source(source, state_changes)
+        # When many agents report at once, applying each report and sending
+        # the result to every agent would build and send many intermediate
+        # versions of the cluster state.  Instead reports are collected for a
+        # short while and applied together, followed by a single update.
+        self._pending_reports.append(
+            (source, state_changes, self._reactor.seconds())
+        )
+        self._pending_changes += len(state_changes)
+        if (
+            self._batch_window <= 0 or
+            self._pending_changes >= self._batch_size
+        ):
+            self._apply_pending_reports()
+        elif self._batch_call is None:
+            self._batch_call = self._reactor.callLater(
+                self._batch_window, self._apply_pending_reports,
+            )
+
+    def _apply_pending_reports(self):
+        """
+        Apply all the state reports received since the last batch to the
+        cluster state and send the result to all connected agents.
+        """
+        if self._batch_call is not None:
+            if self._batch_call.active():
+                self._batch_call.cancel()
+            self._batch_call = None
+        reports = self._pending_reports
+        changes = self._pending_changes
+        self._pending_reports = []
+        self._pending_changes = 0
+        latency = float(self._reactor.seconds() - reports[0][2])
+        self.cluster_state.apply_changes_from_sources(
+            (source, state_changes)
+            for (source, state_changes, received) in reports
+        )
+        self.ingestion_metrics = self.ingestion_metrics.record(
+            len(reports), changes, latency,
+        )
+        STATE_BATCH_APPLIED(
+            reports=len(reports), changes=changes, latency=latency,
+        ).write()
         self._send_state_to_connections(self.connections)
 
 
@@ -663,6 +1395,11 @@ class IConvergenceAgent(Interface):
         """
         The cluster's desired configuration or actual state have changed.
 
+        Once the control service knows which node the agent is running on,
+        other nodes are described only in as much detail as agents need to
+        converge their own node: applications without ports, current
+        applications, paths and devices of other nodes are left out.
+
         :param Deployment configuration: The desired configuration for the
             cluster.
 
@@ -677,6 +1414,12 @@ class IConvergenceAgent(Interface):
 class _AgentLocator(CommandLocator):
     """
     Command locator for convergence agent.
+
+    :ivar _generation: The generation of the most recently received cluster
+        status, or ``None`` if it is unknown.
+    :ivar Deployment _configuration: The most recently received configuration.
+    :ivar DeploymentState _state: The most recently received cluster state.
+    :ivar WireCodec wire_codec: The codec negotiated with the control service.
     """
     def __init__(self, agent):
         """
@@ -684,6 +1427,10 @@ class _AgentLocator(CommandLocator):
         """
         CommandLocator.__init__(self)
         self.agent = agent
+        self._generation = None
+        self._configuration = None
+        self._state = None
+        self.wire_codec = JSON_CODEC
 
     @NoOp.responder
     def noop(self):
@@ -700,10 +1447,35 @@ class _AgentLocator(CommandLocator):
         return self.agent.logger
 
     @ClusterStatusCommand.responder
-    def cluster_updated(self, eliot_context, configuration, state):
+    def cluster_updated(self, eliot_context, configuration, state,
+                        generation):
         with eliot_context:
+            self._generation = generation
+            self._configuration = configuration
+            self._state = state
             self.agent.cluster_updated(configuration, state)
-            return {}
+            return {"generation": generation}
+
+    @ClusterStatusDiffCommand.responder
+    def cluster_updated_diff(self, eliot_context, configuration_diff,
+                             state_diff, start_generation, end_generation):
+        with eliot_context:
+            if (
+                self._generation is None or
+                self._generation != start_generation
+            ):
+                raise GenerationMismatch(
+                    "Have generation {}, diff is from generation {}".format(
+                        self._generation, start_generation
+                    )
+                )
+            self._configuration = configuration_diff.apply(
+                self._configuration
+            )
+            self._state = state_diff.apply(self._state)
+            self._generation = end_generation
+            self.agent.cluster_updated(self._configuration, self._state)
+            return {"generation": end_generation}
 
 
 class AgentAMP(AMP):
@@ -726,11 +1498,35 @@ class AgentAMP(AMP):
         self.agent = agent
         self._pinger = Pinger(reactor)
 
+    @property
+    def wire_codec(self):
+        """
+        The ``WireCodec`` negotiated with the control service.
+        """
+        return self.locator.wire_codec
+
     def connectionMade(self):
         AMP.connectionMade(self)
+        self._negotiate_codec()
         self.agent.connected(self)
         self._pinger.start(self, PING_INTERVAL)
 
+    def _negotiate_codec(self):
+        """
+        Ask the control service to choose a codec.  JSON is used until it
+        responds, and if it doesn't know about codecs.
+        """
+        d = self.callRemote(
+            VersionCommand, codecs=[codec.name for codec in CODECS],
+        )
+
+        def negotiated(result):
+            self.locator.wire_codec = negotiate_codec(
+                [result["codec"]] if result.get("codec") else None
+            )
+        d.addCallback(negotiated)
+        d.addErrback(writeFailure, self.locator.logger)
+
     def connectionLost(self, reason):
         AMP.connectionLost(self, reason)
         self.agent.disconnected()
@@ -23,6 +23,7 @@ from twisted.web.server import Site
 from twisted.web.resource import Resource
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 
 from klein import Klein
 
@@ -30,7 +31,7 @@ from pyrsistent import discard
 
 from ..restapi import (
     EndpointResponse, structured, user_documentation, make_bad_request,
-    private_api
+    private_api, conditional,
 )
 from . import (
     Dataset, Manifestation, Application, DockerImage, Port,
@@ -50,6 +51,10 @@ from .. import __version__
 # Default port for REST API:
 REST_API_PORT = 4523
 
+# The fraction of responses whose output is validated against the schema in
+# production.  Validating large responses costs more than building them.
+SAMPLED_OUTPUT_VALIDATION_RATE = 0.01
+
 
 SCHEMA_BASE = FilePath(__file__).parent().child(b'schema')
 SCHEMAS = {
@@ -95,6 +100,99 @@ LEASE_HELD = make_bad_request(
 _UNDEFINED_MAXIMUM_SIZE = object()
 
 
+def _configuration_etag(api):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+
+    :return bytes: An entity tag for responses derived only from the
+        configuration.
+    """
+    return b'"%s-c%d"' % (api.etag_prefix, api.persistence_service.generation)
+
+
+def _state_etag(api):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+
+    :return bytes: An entity tag for responses derived only from the cluster
+        state.
+    """
+    return b'"%s-s%d"' % (
+        api.etag_prefix, api.cluster_state_service.generation)
+
+
+def _wait_for_configuration(api, seconds):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+    :param seconds: The most seconds to wait.
+
+    :return Deferred: Fires once the configuration changes or the time
+        passes.
+    """
+    return api.configuration_changes.wait(seconds)
+
+
+def _wait_for_state(api, seconds):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+    :param seconds: The most seconds to wait.
+
+    :return Deferred: Fires once the cluster state changes or the time
+        passes.
+    """
+    return api.state_changes.wait(seconds)
+
+
+class _ChangeWaiters(object):
+    """
+    The long polls waiting for a change.
+
+    :ivar _clock: ``IReactorTime`` provider used for timeouts.
+    :ivar dict _waiting: Map from the ``Deferred`` of each waiting long poll
+        to the ``IDelayedCall`` which ends its wait.
+    """
+    def __init__(self, clock):
+        """
+        :param clock: See above.
+        """
+        self._clock = clock
+        self._waiting = {}
+
+    def wait(self, seconds):
+        """
+        Wait for the next change.
+
+        :param seconds: The most seconds to wait.
+
+        :return Deferred: Fires with ``None`` after the next call to
+            ``changed`` or once the time passes, whichever is first.
+        """
+        def cancel(waiting):
+            self._waiting.pop(waiting).cancel()
+        waiting = Deferred(canceller=cancel)
+        self._waiting[waiting] = self._clock.callLater(
+            seconds, self._timed_out, waiting)
+        return waiting
+
+    def _timed_out(self, waiting):
+        """
+        End one wait.
+
+        :param Deferred waiting: The ``Deferred`` of the wait.
+        """
+        del self._waiting[waiting]
+        waiting.callback(None)
+
+    def changed(self):
+        """
+        End all the waits.
+        """
+        waiting, self._waiting = self._waiting, {}
+        for d, timeout in waiting.items():
+            timeout.cancel()
+            d.callback(None)
+
+
 class ConfigurationAPIUserV1(object):
     """
     A user accessing the API.
@@ -102,11 +200,27 @@ class ConfigurationAPIUserV1(object):
     The APIs exposed here typically operate on cluster configuration.  They
     frequently return success results when a configuration change has been made
     durable but has not yet been deployed onto the cluster.
+
+    Responses which only depend on the configuration or only on the cluster
+    state carry an entity tag derived from the generation of the
+    corresponding service, so that polling clients can make conditional
+    requests.  Conditional requests can also be long polls which wait for
+    the entity tag to change.
+
+    :ivar bytes etag_prefix: A prefix for entity tags, unique to this object
+        so that tags from before a restart never match.
+    :ivar _ChangeWaiters configuration_changes: The long polls waiting for
+        the configuration to change.
+    :ivar _ChangeWaiters state_changes: The long polls waiting for the
+        cluster state to change.
+    :ivar output_validation_rate: The fraction of responses whose output is
+        validated against the schema.  Below ``1``, responses which fail
+        validation are logged rather than failed.
     """
     app = Klein()
 
     def __init__(self, persistence_service, cluster_state_service,
-                 clock=reactor):
+                 clock=reactor, output_validation_rate=1):
         """
         :param ConfigurationPersistenceService persistence_service: Service
             for retrieving and setting desired configuration.
@@ -116,10 +230,19 @@ class ConfigurationAPIUserV1(object):
 
         :param IReactorTime clock: The clock to use for time. By default
             global reactor.
+
+        :param output_validation_rate: See above.  By default every response
+            is validated.
         """
         self.persistence_service = persistence_service
         self.cluster_state_service = cluster_state_service
         self.clock = clock
+        self.output_validation_rate = output_validation_rate
+        self.etag_prefix = uuid4().hex.encode("ascii")
+        self.configuration_changes = _ChangeWaiters(clock)
+        persistence_service.register(self.configuration_changes.changed)
+        self.state_changes = _ChangeWaiters(clock)
+        cluster_state_service.register(self.state_changes.changed)
 
     @app.route("/version", methods=['GET'])
     @user_documentation(
@@ -149,6 +272,7 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get configured datasets"],
         section=u"dataset",
     )
+    @conditional(_configuration_etag, _wait_for_configuration)
     @structured(
         inputSchema={},
         outputSchema={
@@ -220,45 +344,12 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        if dataset_id is None:
-            dataset_id = unicode(uuid4())
-        dataset_id = dataset_id.lower()
-
-        if metadata is None:
-            metadata = {}
-
-        primary = UUID(hex=primary)
-
-        # Use persistence_service to get a Deployment for the cluster
-        # configuration.
-        deployment = self.persistence_service.get()
-        for node in deployment.nodes:
-            for manifestation in node.manifestations.values():
-                if manifestation.dataset.dataset_id == dataset_id:
-                    raise DATASET_ID_COLLISION
-
-        # XXX Check cluster state to determine if the given primary node
-        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
-        # See FLOC-1278
-
-        dataset = Dataset(
-            dataset_id=dataset_id,
-            maximum_size=maximum_size,
-            metadata=pmap(metadata)
+        deployment, result = _create_dataset(
+            self.persistence_service.get(), primary, dataset_id,
+            maximum_size, metadata,
         )
-        manifestation = Manifestation(dataset=dataset, primary=True)
-
-        primary_node = deployment.get_node(primary)
-
-        new_node_config = primary_node.transform(
-            ("manifestations", manifestation.dataset_id), manifestation)
-        new_deployment = deployment.update_node(new_node_config)
-        saving = self.persistence_service.save(new_deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(dataset, primary)
-            return EndpointResponse(CREATED, result)
-        saving.addCallback(saved)
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(lambda _: EndpointResponse(CREATED, result))
         return saving
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['DELETE'])
@@ -292,26 +383,11 @@ class ConfigurationAPIUserV1(object):
             as deleted in the cluster configuration or giving error
             information if this is not possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # XXX this doesn't handle replicas
-        # https://clusterhq.atlassian.net/browse/FLOC-1240
-        old_manifestation, origin_node = _find_manifestation_and_node(
-            deployment, dataset_id)
-
-        new_node = origin_node.transform(
-            ("manifestations", dataset_id, "dataset", "deleted"), True)
-        deployment = deployment.update_node(new_node)
-
+        deployment, result = _delete_dataset(
+            self.persistence_service.get(), dataset_id,
+        )
         saving = self.persistence_service.save(deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                new_node.manifestations[dataset_id].dataset, new_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
+        saving.addCallback(lambda _: EndpointResponse(OK, result))
         return saving
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['POST'])
@@ -354,37 +430,70 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
+        deployment, result = _update_dataset(
+            self.persistence_service.get(), dataset_id, primary,
         )
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(lambda _: EndpointResponse(OK, result))
+        return saving
 
-        if primary_manifestation.dataset.deleted:
-            raise DATASET_DELETED
+    @app.route("/configuration/datasets/bulk", methods=['POST'])
+    @user_documentation(
+        u"""
+        Create, move and delete many datasets at once.
 
-        if primary is not None:
-            deployment = _update_dataset_primary(
-                deployment, dataset_id, UUID(hex=primary)
-            )
+        The changes are applied in that order and saved to the cluster
+        configuration together: either all of them are made or, if any of
+        them is not possible, none are.  This is much faster than making
+        the changes one at a time when there are many of them.
+        """,
+        header=u"Change many datasets",
+        examples=[
+            u"bulk update datasets",
+        ],
+        section=u"dataset",
+    )
+    @structured(
+        inputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/'
+            'configuration_datasets_bulk_result'},
+        schema_store=SCHEMAS
+    )
+    def bulk_update_datasets(self, create=(), update=(), delete=()):
+        """
+        Change many datasets in the cluster configuration at once.
+
+        :param list create: A ``dict`` describing each dataset to create,
+            with the keys accepted by ``create_dataset_configuration``.
+        :param list update: A ``dict`` describing each change to an
+            existing dataset, with a ``dataset_id`` key and the other keys
+            accepted by ``update_dataset``.
+        :param list delete: The unique identifiers of datasets to delete.
+
+        :return: A ``dict`` with ``created``, ``updated`` and ``deleted``
+            keys, each a ``list`` describing the datasets changed that way
+            in the same order as the request, or giving error information
+            if any of the changes is not possible.
+        """
+        deployment, created = _create_datasets(
+            self.persistence_service.get(), create)
+        updated = []
+        for change in update:
+            deployment, result = _update_dataset(deployment, **change)
+            updated.append(result)
+        deleted = []
+        for dataset_id in delete:
+            deployment, result = _delete_dataset(deployment, dataset_id)
+            deleted.append(result)
 
         saving = self.persistence_service.save(deployment)
-
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
-
-        # Return an API response dictionary containing the dataset with updated
-        # primary address.
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                primary_manifestation.dataset,
-                current_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
+        saving.addCallback(lambda _: EndpointResponse(OK, {
+            u"created": created, u"updated": updated, u"deleted": deleted,
+        }))
         return saving
 
     @app.route("/state/datasets", methods=['GET'])
@@ -393,11 +502,19 @@ class ConfigurationAPIUserV1(object):
         The result reflects the control service's knowledge, which may be
         out of date or incomplete. E.g. a dataset agent has not connected
         or updated the control service yet.
+
+        The response includes an ``ETag`` header.  A request with an
+        ``If-None-Match`` header giving that tag gets an empty ``304 Not
+        Modified`` response while the state is unchanged.  If the request
+        also has a ``Prefer: wait=<seconds>`` header it instead waits up to
+        that many seconds (at most 60) for the state to change, so clients
+        can watch for changes rather than poll.
         """,
         header=u"Get current cluster datasets",
         examples=[u"get state datasets"],
         section=u"dataset",
     )
+    @conditional(_state_etag, _wait_for_state)
     @structured(
         inputSchema={},
         outputSchema={
@@ -450,6 +567,7 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get configured containers"],
         section=u"container",
     )
+    @conditional(_configuration_etag, _wait_for_configuration)
     @structured(
         inputSchema={},
         outputSchema={
@@ -478,6 +596,7 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get actual containers"],
         section=u"container",
     )
+    @conditional(_state_etag, _wait_for_state)
     @structured(
         inputSchema={},
         outputSchema={
@@ -825,6 +944,7 @@ class ConfigurationAPIUserV1(object):
         ],
         section=u"common",
     )
+    @conditional(_state_etag, _wait_for_state)
     @structured(
         inputSchema={},
         outputSchema={"$ref":
@@ -1067,6 +1187,141 @@ def _update_dataset_primary(deployment, dataset_id, primary):
     return deployment
 
 
+def _create_datasets(deployment, datasets):
+    """
+    Add new datasets to a configuration.
+
+    The manifestations of all the datasets with the same primary node are
+    added to it at once, since replacing a node in a large configuration
+    is expensive.
+
+    :param Deployment deployment: The configuration.
+    :param datasets: Iterable of ``dict`` with the keys accepted by
+        ``ConfigurationAPIUserV1.create_dataset_configuration``.
+
+    :raise: ``DATASET_ID_COLLISION`` if a dataset ID is in use.
+
+    :return: Two-tuple of the updated ``Deployment`` and a ``list`` of
+        ``dict`` describing the new datasets for an API response.
+    """
+    manifestations = {}
+    results = []
+    for dataset in datasets:
+        dataset_id = dataset.get(u"dataset_id")
+        if dataset_id is None:
+            dataset_id = unicode(uuid4())
+        dataset_id = dataset_id.lower()
+
+        primary = UUID(hex=dataset[u"primary"])
+
+        if (deployment.get_manifestations(dataset_id) or
+                any(dataset_id in new for new in manifestations.values())):
+            raise DATASET_ID_COLLISION
+
+        # XXX Check cluster state to determine if the given primary node
+        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
+        # See FLOC-1278
+
+        dataset = Dataset(
+            dataset_id=dataset_id,
+            maximum_size=dataset.get(u"maximum_size"),
+            metadata=pmap(dataset.get(u"metadata") or {})
+        )
+        manifestation = Manifestation(dataset=dataset, primary=True)
+        manifestations.setdefault(primary, {})[dataset_id] = manifestation
+        results.append(api_dataset_from_dataset_and_node(dataset, primary))
+
+    for primary, new in manifestations.items():
+        primary_node = deployment.get_node(primary)
+        new_node_config = primary_node.set(
+            manifestations=primary_node.manifestations.update(new))
+        deployment = deployment.update_node(new_node_config)
+    return deployment, results
+
+
+def _create_dataset(deployment, primary, dataset_id=None, maximum_size=None,
+                    metadata=None):
+    """
+    Add a new dataset to a configuration.
+
+    See ``ConfigurationAPIUserV1.create_dataset_configuration`` for the
+    parameters other than ``deployment``.
+
+    :param Deployment deployment: The configuration.
+
+    :raise: ``DATASET_ID_COLLISION`` if the dataset ID is in use.
+
+    :return: Two-tuple of the updated ``Deployment`` and a ``dict``
+        describing the new dataset for an API response.
+    """
+    deployment, [result] = _create_datasets(deployment, [{
+        u"primary": primary, u"dataset_id": dataset_id,
+        u"maximum_size": maximum_size, u"metadata": metadata,
+    }])
+    return deployment, result
+
+
+def _delete_dataset(deployment, dataset_id):
+    """
+    Mark a dataset in a configuration as deleted.
+
+    :param Deployment deployment: The configuration.
+    :param unicode dataset_id: The unique identifier of the dataset.
+
+    :raise: ``DATASET_NOT_FOUND`` if there is no such dataset.
+
+    :return: Two-tuple of the updated ``Deployment`` and a ``dict``
+        describing the deleted dataset for an API response.
+    """
+    # XXX this doesn't handle replicas
+    # https://clusterhq.atlassian.net/browse/FLOC-1240
+    old_manifestation, origin_node = _find_manifestation_and_node(
+        deployment, dataset_id)
+
+    new_node = origin_node.transform(
+        ("manifestations", dataset_id, "dataset", "deleted"), True)
+    deployment = deployment.update_node(new_node)
+    return deployment, api_dataset_from_dataset_and_node(
+        new_node.manifestations[dataset_id].dataset, new_node.uuid,
+    )
+
+
+def _update_dataset(deployment, dataset_id, primary=None):
+    """
+    Update an existing dataset in a configuration.
+
+    :param Deployment deployment: The configuration.
+    :param unicode dataset_id: The unique identifier of the dataset.
+    :param primary: The UUID of the node to which the dataset will be
+        moved, as ``unicode``, or ``None`` indicating no change.
+
+    :raise: ``DATASET_NOT_FOUND`` if there is no such dataset or
+        ``DATASET_DELETED`` if it is deleted.
+
+    :return: Two-tuple of the updated ``Deployment`` and a ``dict``
+        describing the updated dataset for an API response.
+    """
+    # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id
+    )
+
+    if primary_manifestation.dataset.deleted:
+        raise DATASET_DELETED
+
+    if primary is not None:
+        deployment = _update_dataset_primary(
+            deployment, dataset_id, UUID(hex=primary)
+        )
+
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id
+    )
+    return deployment, api_dataset_from_dataset_and_node(
+        primary_manifestation.dataset, current_node.uuid,
+    )
+
+
 def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     """
     Update the ``deployment`` so that the ``Dataset`` with the supplied
@@ -1080,12 +1335,11 @@ def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     :returns: An updated ``Deployment``.
     """
     manifestation, node = _find_manifestation_and_node(deployment, dataset_id)
-    deployment = deployment.set(nodes=deployment.nodes.discard(node))
     node = node.transform(
         ['manifestations', dataset_id, 'dataset', 'maximum_size'],
         maximum_size
     )
-    return deployment.set(nodes=deployment.nodes.add(node))
+    return deployment.update_node(node)
 
 
 def manifestations_from_deployment(deployment, dataset_id):
@@ -1100,9 +1354,7 @@ def manifestations_from_deployment(deployment, dataset_id):
     :return: Iterable returning all manifestations of the supplied
         ``dataset_id``.
     """
-    for node in deployment.nodes:
-        if dataset_id in node.manifestations:
-            yield node.manifestations[dataset_id], node
+    return deployment.get_manifestations(dataset_id)
 
 
 def datasets_from_deployment(deployment):
@@ -1118,18 +1370,13 @@ def datasets_from_deployment(deployment):
 
     :return: Iterable returning all datasets.
     """
-    for node in deployment.nodes:
-        if node.manifestations is None:
-            continue
-        for manifestation in node.manifestations.values():
-            if manifestation.primary:
-                # There may be multiple datasets marked as primary until we
-                # implement consistency checking when state is reported by each
-                # node.
-                # See https://clusterhq.atlassian.net/browse/FLOC-1303
-                yield api_dataset_from_dataset_and_node(
-                    manifestation.dataset, node.uuid
-                )
+    # There may be multiple datasets marked as primary until we implement
+    # consistency checking when state is reported by each node.
+    # See https://clusterhq.atlassian.net/browse/FLOC-1303
+    for manifestation, node in deployment.primary_manifestations():
+        yield api_dataset_from_dataset_and_node(
+            manifestation.dataset, node.uuid
+        )
 
 
 def containers_from_deployment(deployment):
@@ -1198,7 +1445,8 @@ def api_dataset_from_dataset_and_node(dataset, node_uuid):
 
 
 def create_api_service(persistence_service, cluster_state_service, endpoint,
-                       context_factory, clock=reactor):
+                       context_factory, clock=reactor,
+                       output_validation_rate=1):
     """
     Create a Twisted Service that serves the API on the given endpoint.
 
@@ -1215,11 +1463,15 @@ def create_api_service(persistence_service, cluster_state_service, endpoint,
     :param IReactorTime clock: The clock to use for time. By default
         global reactor.
 
+    :param output_validation_rate: The fraction of responses whose output is
+        validated against the schema.  By default every response is
+        validated.
+
     :return: Service that will listen on the endpoint using HTTP API server.
     """
     api_root = Resource()
     user = ConfigurationAPIUserV1(persistence_service, cluster_state_service,
-                                  clock)
+                                  clock, output_validation_rate)
     api_root.putChild('v1', user.app.resource())
     api_root._v1_user = user  # For unit testing purposes, alas
 
@@ -15,12 +15,17 @@ from twisted.python.filepath import FilePath
 from twisted.application.service import MultiService
 from twisted.internet.ssl import Certificate
 
-from .httpapi import create_api_service, REST_API_PORT
-from ._persistence import ConfigurationPersistenceService
+from .httpapi import (
+    create_api_service, REST_API_PORT, SAMPLED_OUTPUT_VALIDATION_RATE,
+)
+from ._persistence import (
+    ConfigurationPersistenceService, DEFAULT_SAVE_DELAY,
+)
 from ._clusterstate import ClusterStateService
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, main_for_service)
-from ._protocol import ControlAMPService
+from ._protocol import ControlAMPService, DEFAULT_MAX_STALENESS
+from ._metrics import create_metrics_service, METRICS_PORT
 from ..ca import (
     rest_api_context_factory, ControlCredential, amp_server_context_factory,
 )
@@ -40,6 +45,14 @@ class ControlOptions(Options):
          "The external API port to listen on."],
         ["agent-port", "a", 'tcp:4524',
          "The port convergence agents will connect to."],
+        ["metrics-port", None,
+         'tcp:%d:interface=127.0.0.1' % (METRICS_PORT,),
+         "The local port statistics about convergence agents are served "
+         "on."],
+        ["agent-max-staleness", None, DEFAULT_MAX_STALENESS,
+         "The number of seconds to wait for a convergence agent to "
+         "acknowledge an update before sending it the next one anyway.",
+         float],
         ["certificates-directory", "c", DEFAULT_CERTIFICATE_PATH,
          ("Absolute path to directory containing the cluster "
           "root certificate (cluster.crt) and control service certificate "
@@ -63,20 +76,26 @@ class ControlScript(object):
 
         top_service = MultiService()
         persistence = ConfigurationPersistenceService(
-            reactor, options["data-path"])
+            reactor, options["data-path"], save_delay=DEFAULT_SAVE_DELAY,
+            journal=True)
         persistence.setServiceParent(top_service)
         cluster_state = ClusterStateService(reactor)
         cluster_state.setServiceParent(top_service)
         api_service = create_api_service(
             persistence, cluster_state, serverFromString(
                 reactor, options["port"]),
-            rest_api_context_factory(ca, control_credential))
+            rest_api_context_factory(ca, control_credential),
+            output_validation_rate=SAMPLED_OUTPUT_VALIDATION_RATE)
         api_service.setServiceParent(top_service)
         amp_service = ControlAMPService(
             reactor, cluster_state, persistence, serverFromString(
                 reactor, options["agent-port"]),
-            amp_server_context_factory(ca, control_credential))
+            amp_server_context_factory(ca, control_credential),
+            max_staleness=options["agent-max-staleness"])
         amp_service.setServiceParent(top_service)
+        metrics_service = create_metrics_service(
+            amp_service, serverFromString(reactor, options["metrics-port"]))
+        metrics_service.setServiceParent(top_service)
         return main_for_service(reactor, top_service)
 
 
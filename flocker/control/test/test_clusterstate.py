@@ -14,7 +14,7 @@ from .._model import ChangeSource
 from .._clusterstate import ClusterStateService
 from .. import (
     Application, DockerImage, NodeState, DeploymentState, Manifestation,
-    Dataset,
+    Dataset, NonManifestDatasets,
 )
 from .clusterstatetools import advance_some, advance_rest
 
@@ -252,3 +252,120 @@ class ClusterStateServiceTests(SynchronousTestCase):
             service.as_deployment(),
             DeploymentState(nodes=[self.WITH_APPS]),
         )
+
+    def test_changes_from_sources(self):
+        """
+        ``ClusterStateService.apply_changes_from_sources`` applies the changes
+        from each source in order.
+        """
+        service = self.service()
+        first = ChangeSource()
+        second = ChangeSource()
+        updated = self.WITH_APPS.set(applications=[APP1])
+        service.apply_changes_from_sources([
+            (first, [self.WITH_APPS]), (second, [updated]),
+        ])
+        self.assertEqual(
+            DeploymentState(nodes=[updated]), service.as_deployment(),
+        )
+
+    def test_sources_expire(self):
+        """
+        The changes applied by
+        ``ClusterStateService.apply_changes_from_sources`` are wiped according
+        to the last activity of the source they came from.
+        """
+        service = self.service()
+        active = ChangeSource()
+        active.set_last_activity(self.clock.seconds())
+        inactive = ChangeSource()
+        inactive.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_sources([
+            (active, [self.WITH_APPS]), (inactive, [self.WITH_MANIFESTATION]),
+        ])
+        advance_some(self.clock)
+        active.set_last_activity(self.clock.seconds())
+        advance_rest(self.clock)
+        self.assertEqual(
+            DeploymentState(nodes=[self.WITH_APPS]), service.as_deployment(),
+        )
+
+    def test_only_due_examined(self):
+        """
+        Sources whose state isn't due to expire aren't asked for their last
+        activity when checking for expired state.
+        """
+        service = self.service()
+        source = CountingSource()
+        source.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(source, [self.WITH_APPS])
+        advance_some(self.clock)
+        self.assertEqual(1, source.calls)
+
+    def test_generation_changes(self):
+        """
+        ``ClusterStateService.generation`` is incremented when changes are
+        applied.
+        """
+        service = self.service()
+        before = service.generation
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual(before + 1, service.generation)
+
+    def test_generation_wipes(self):
+        """
+        ``ClusterStateService.generation`` is incremented when state is
+        wiped, but not when nothing expires.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        before = service.generation
+        advance_rest(self.clock)
+        unexpired = service.generation
+        advance_some(self.clock)
+        self.assertEqual(
+            [before, before + 1], [unexpired, service.generation],
+        )
+
+    def test_generation_unchanged_wipes(self):
+        """
+        ``ClusterStateService.generation`` is not incremented and registered
+        callbacks are not called when expired wipers leave the state
+        unchanged.
+        """
+        service = self.service()
+        service.apply_changes([NonManifestDatasets(datasets={
+            MANIFESTATION.dataset_id: MANIFESTATION.dataset,
+        })])
+        generations = []
+        service.register(lambda: generations.append(service.generation))
+        before = service.generation
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertEqual((before, []), (service.generation, generations))
+
+    def test_register(self):
+        """
+        Callbacks registered with ``ClusterStateService.register`` are called
+        whenever the cluster state changes.
+        """
+        service = self.service()
+        generations = []
+        service.register(lambda: generations.append(service.generation))
+        service.apply_changes([self.WITH_APPS])
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertEqual([1, 2], generations)
+
+
+class CountingSource(ChangeSource):
+    """
+    A ``ChangeSource`` which counts how often its last activity is read.
+
+    :ivar int calls: The number of calls to ``last_activity``.
+    """
+    calls = 0
+
+    def last_activity(self):
+        self.calls += 1
+        return ChangeSource.last_activity(self)
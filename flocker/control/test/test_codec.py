@@ -0,0 +1,224 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._codec``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from hypothesis import given
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+from .._codec import (
+    BINARY_CODEC, JSON_CODEC, binary_wire_encode, binary_wire_decode, decode,
+    decode_chunks, negotiate_codec,
+)
+from .._diffing import create_diff
+from .._model import Deployment, DeploymentState, NodeState, Leases
+from .._persistence import wire_encode
+from .test_persistence import DEPLOYMENTS, TEST_DEPLOYMENT
+from .test_protocol import huge_state
+
+
+class BinaryCodecTests(SynchronousTestCase):
+    """
+    Tests for ``binary_wire_encode`` and ``binary_wire_decode``.
+    """
+    def assert_roundtrips(self, obj):
+        """
+        ``obj`` is unchanged by encoding and decoding it with the binary
+        codec.
+        """
+        as_bytes = binary_wire_encode(obj)
+        self.assertEqual(
+            (bytes, obj), (type(as_bytes), binary_wire_decode(as_bytes)),
+        )
+
+    @given(DEPLOYMENTS)
+    def test_deployments(self, deployment):
+        """
+        ``Deployment``\ s can be roundtripped.
+        """
+        self.assert_roundtrips(deployment)
+
+    def test_test_deployment(self):
+        """
+        The deployment used to test persistence can be roundtripped.
+        """
+        self.assert_roundtrips(TEST_DEPLOYMENT)
+
+    def test_state(self):
+        """
+        ``DeploymentState``\ s, including paths and devices, can be
+        roundtripped.
+        """
+        self.assert_roundtrips(huge_state().update_node(NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.1", applications=[],
+            manifestations={}, paths={}, devices={},
+        )))
+
+    def test_leases(self):
+        """
+        Leases, which include ``datetime``\ s, are decoded like they are by
+        ``wire_decode``.
+        """
+        deployment = Deployment(leases=Leases().acquire(
+            datetime.now(tz=UTC), uuid4(), uuid4(), 60,
+        ))
+        self.assertEqual(
+            JSON_CODEC.decode(wire_encode(deployment)),
+            binary_wire_decode(binary_wire_encode(deployment)),
+        )
+
+    def test_diff(self):
+        """
+        ``Diff``\ s can be roundtripped.
+        """
+        self.assert_roundtrips(create_diff(DeploymentState(), huge_state()))
+
+    def test_primitives(self):
+        """
+        Sequences, dictionaries, ``bytes``, ``unicode``, numbers and paths
+        which aren't part of records can be roundtripped.
+        """
+        self.assert_roundtrips(
+            [{u"key": FilePath(b"/x")}, b"bytes", u"unicode" * 3, 1.5, None,
+             True],
+        )
+
+    def test_shared_strings(self):
+        """
+        Repeated UUIDs are only included in the encoding once.
+        """
+        node_uuid = uuid4()
+        encoded = binary_wire_encode(
+            [node_uuid, node_uuid, NodeState(hostname=u"x", uuid=node_uuid)]
+        )
+        self.assertEqual(1, encoded.count(node_uuid.bytes))
+
+    def test_smaller(self):
+        """
+        The binary encoding is smaller than the JSON encoding.
+        """
+        state = huge_state()
+        self.assertTrue(
+            len(binary_wire_encode(state)) < len(wire_encode(state)) / 2
+        )
+
+    def test_not_binary(self):
+        """
+        ``binary_wire_decode`` raises ``ValueError`` if given something other
+        than the binary encoding.
+        """
+        self.assertRaises(ValueError, binary_wire_decode, wire_encode(None))
+
+    def test_unserializable(self):
+        """
+        ``binary_wire_encode`` raises ``TypeError`` if given an object it
+        can't encode.
+        """
+        self.assertRaises(TypeError, binary_wire_encode, object())
+
+
+class DecodeTests(SynchronousTestCase):
+    """
+    Tests for ``decode``.
+    """
+    def test_json(self):
+        """
+        ``decode`` decodes the JSON encoding.
+        """
+        state = huge_state()
+        self.assertEqual(state, decode(JSON_CODEC.encode(state)))
+
+    def test_binary(self):
+        """
+        ``decode`` decodes the binary encoding.
+        """
+        state = huge_state()
+        self.assertEqual(state, decode(BINARY_CODEC.encode(state)))
+
+
+def _split(data, size):
+    """
+    :param bytes data: Some bytes.
+    :param int size: The length of the pieces to split ``data`` into.
+
+    :return: ``list`` of ``bytes`` which together are ``data``.
+    """
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class DecodeChunksTests(SynchronousTestCase):
+    """
+    Tests for ``decode_chunks``.
+    """
+    def test_json(self):
+        """
+        ``decode_chunks`` decodes the JSON encoding split into pieces.
+        """
+        state = huge_state()
+        self.assertEqual(
+            state, decode_chunks(_split(JSON_CODEC.encode(state), 1000)),
+        )
+
+    def test_binary(self):
+        """
+        ``decode_chunks`` decodes the binary encoding split into pieces.
+        """
+        state = huge_state()
+        self.assertEqual(
+            state, decode_chunks(_split(BINARY_CODEC.encode(state), 1000)),
+        )
+
+    def test_binary_bytes(self):
+        """
+        ``decode_chunks`` decodes the binary encoding split anywhere, even
+        within the marker or the string table.
+        """
+        self.assertEqual(
+            TEST_DEPLOYMENT,
+            decode_chunks(_split(BINARY_CODEC.encode(TEST_DEPLOYMENT), 1)),
+        )
+
+    def test_incomplete(self):
+        """
+        ``decode_chunks`` raises ``ValueError`` if the binary encoding is
+        truncated.
+        """
+        encoded = BINARY_CODEC.encode(TEST_DEPLOYMENT)
+        self.assertRaises(
+            ValueError, decode_chunks, _split(encoded[:-1], 100),
+        )
+
+
+class NegotiateCodecTests(SynchronousTestCase):
+    """
+    Tests for ``negotiate_codec``.
+    """
+    def test_unspecified(self):
+        """
+        Peers which don't list the codecs they support get JSON.
+        """
+        self.assertEqual(JSON_CODEC, negotiate_codec(None))
+
+    def test_preferred(self):
+        """
+        The most preferred supported codec is chosen regardless of the order
+        the peer lists them in.
+        """
+        self.assertEqual(
+            BINARY_CODEC,
+            negotiate_codec([JSON_CODEC.name, BINARY_CODEC.name]),
+        )
+
+    def test_unknown(self):
+        """
+        Peers which list only unknown codecs get JSON.
+        """
+        self.assertEqual(JSON_CODEC, negotiate_codec([u"xml"]))
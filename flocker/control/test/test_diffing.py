@@ -0,0 +1,157 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._diffing``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+from .._diffing import create_diff, _Set, _Add, _Remove
+from .._persistence import wire_encode, wire_decode
+from .._model import (
+    DeploymentState, NodeState, Dataset, Manifestation, Leases,
+    Deployment, Node,
+)
+from .test_persistence import DEPLOYMENTS
+
+
+MANIFESTATION = Manifestation(
+    dataset=Dataset(dataset_id=unicode(uuid4())), primary=True,
+)
+NODE_STATE = NodeState(
+    hostname=u"192.0.2.1", uuid=uuid4(), applications=[],
+    manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+    paths={MANIFESTATION.dataset_id: FilePath(b"/mnt/x")},
+    devices={},
+)
+OTHER_NODE_STATE = NodeState(hostname=u"192.0.2.2", uuid=uuid4())
+
+
+class CreateDiffTests(SynchronousTestCase):
+    """
+    Tests for ``create_diff`` and ``Diff.apply``.
+    """
+    @given(st.tuples(DEPLOYMENTS, DEPLOYMENTS))
+    def test_deployments(self, deployments):
+        """
+        Applying the diff between two ``Deployment``\ s to the first results in
+        the second.
+        """
+        a, b = deployments
+        self.assertEqual(b, create_diff(a, b).apply(a))
+
+    def test_equal(self):
+        """
+        The diff between two equal objects has no changes.
+        """
+        state = DeploymentState(nodes={NODE_STATE})
+        self.assertEqual(
+            [],
+            list(create_diff(state, DeploymentState(nodes={NODE_STATE}))
+                 .changes),
+        )
+
+    def test_proportional_to_change(self):
+        """
+        The diff between two ``DeploymentState``\ s which differ only in one
+        node describes only that node.
+        """
+        before = DeploymentState(nodes={NODE_STATE, OTHER_NODE_STATE})
+        changed = OTHER_NODE_STATE.set(applications=[])
+        after = before.update_node(changed)
+        self.assertEqual(
+            [_Remove(path=[u"nodes"], item=OTHER_NODE_STATE),
+             _Add(path=[u"nodes"], item=changed)],
+            list(create_diff(before, after).changes),
+        )
+
+    def test_mapping_keys(self):
+        """
+        Keys added to and removed from a mapping are described individually.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        before = DeploymentState(
+            nonmanifest_datasets={MANIFESTATION.dataset_id:
+                                  MANIFESTATION.dataset},
+        )
+        after = DeploymentState(
+            nonmanifest_datasets={dataset.dataset_id: dataset},
+        )
+        diff = create_diff(before, after)
+        self.assertEqual(
+            (
+                [_Set(path=[u"nonmanifest_datasets", dataset.dataset_id],
+                      value=dataset),
+                 _Remove(path=[u"nonmanifest_datasets"],
+                         item=MANIFESTATION.dataset_id)],
+                after,
+            ),
+            (list(diff.changes), diff.apply(before)),
+        )
+
+    def test_invariants(self):
+        """
+        Records with invariants covering several fields are replaced as a whole
+        so that no intermediate result violates the invariant.
+        """
+        node = Node(uuid=uuid4())
+        before = Deployment(nodes={node})
+        after = Deployment(
+            nodes={node.set(manifestations={MANIFESTATION.dataset_id:
+                                            MANIFESTATION})},
+        )
+        self.assertEqual(after, create_diff(before, after).apply(before))
+
+    def test_replace_root(self):
+        """
+        Objects of different types are replaced entirely.
+        """
+        self.assertEqual(
+            [_Set(path=[], value=Deployment())],
+            list(create_diff(DeploymentState(), Deployment()).changes),
+        )
+
+    def test_nested_pclass(self):
+        """
+        A change to a field of a ``Lease`` is described by setting only that
+        field.
+        """
+        leases = Leases().acquire(
+            datetime.now(tz=UTC), uuid4(), uuid4(), 60,
+        )
+        before = Deployment(leases=leases)
+        [lease] = leases.values()
+        after = Deployment(
+            leases=leases.set(
+                lease.dataset_id, lease.set(expiration=None),
+            )
+        )
+        diff = create_diff(before, after)
+        self.assertEqual(
+            ([_Set(path=[u"leases", lease.dataset_id, u"expiration"],
+                   value=None)],
+             after),
+            (list(diff.changes), diff.apply(before)),
+        )
+
+    def test_wire_roundtrip(self):
+        """
+        A ``Diff`` can be roundtripped through ``wire_encode`` and
+        ``wire_decode`` and still be applied.
+        """
+        before = DeploymentState(nodes={OTHER_NODE_STATE})
+        after = before.update_node(NODE_STATE).set(
+            nonmanifest_datasets={MANIFESTATION.dataset_id:
+                                  MANIFESTATION.dataset},
+        )
+        diff = wire_decode(wire_encode(create_diff(before, after)))
+        self.assertEqual(after, diff.apply(before))
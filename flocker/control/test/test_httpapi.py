@@ -15,14 +15,16 @@ from zope.interface.verify import verifyObject
 
 from twisted.internet import reactor
 from twisted.internet.defer import gatherResults
+from twisted.internet.task import deferLater
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.http import (
     CREATED, OK, CONFLICT, BAD_REQUEST, NOT_FOUND, INTERNAL_SERVER_ERROR,
-    NOT_ALLOWED as METHOD_NOT_ALLOWED
+    NOT_ALLOWED as METHOD_NOT_ALLOWED, NOT_MODIFIED
 )
 from twisted.web.client import readBody
+from twisted.web.http_headers import Headers
 from twisted.application.service import IService
 from twisted.python.filepath import FilePath
 from twisted.internet.ssl import ClientContextFactory
@@ -39,7 +41,8 @@ from .. import (
 )
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
-    api_dataset_from_dataset_and_node, container_configuration_response
+    api_dataset_from_dataset_and_node, container_configuration_response,
+    _ChangeWaiters,
 )
 from .._persistence import ConfigurationPersistenceService
 from .._clusterstate import ClusterStateService
@@ -2342,6 +2345,190 @@ RealTestsDeleteDataset, MemoryTestsDeleteDataset = (
 )
 
 
+class BulkUpdateDatasetsTestsMixin(APITestsMixin):
+    """
+    Tests for the bulk dataset endpoint at ``/configuration/datasets/bulk``.
+    """
+    def _setup_manifestations(self):
+        """
+        Create and save a configuration with a node that has two
+        manifestations and a node with none.
+
+        :return: ``Deferred`` firing with a ``list`` of the two
+            ``Manifestation``\ s.
+        """
+        manifestations = [_manifestation(), _manifestation()]
+        node_a = Node(
+            uuid=self.NODE_A_UUID,
+            manifestations={m.dataset_id: m for m in manifestations},
+        )
+        node_b = Node(uuid=self.NODE_B_UUID)
+        d = self.persistence_service.save(
+            Deployment(nodes=frozenset([node_a, node_b])))
+        d.addCallback(lambda _: manifestations)
+        return d
+
+    def test_bulk(self):
+        """
+        The ``POST`` action creates, moves and deletes the given datasets,
+        saving the configuration once, and returns the changed datasets.
+        """
+        created = self._setup_manifestations()
+        new_dataset_id = unicode(uuid4())
+
+        def got_manifestations((moved, deleted)):
+            generation = self.persistence_service.generation
+            d = self.assertResult(
+                b"POST", b"/configuration/datasets/bulk",
+                {u"create": [{u"dataset_id": new_dataset_id,
+                              u"primary": self.NODE_A,
+                              u"maximum_size": 1024 * 1024 * 100}],
+                 u"update": [{u"dataset_id": moved.dataset_id,
+                              u"primary": self.NODE_B}],
+                 u"delete": [deleted.dataset_id]},
+                OK,
+                {u"created": [{u"dataset_id": new_dataset_id,
+                               u"primary": self.NODE_A,
+                               u"maximum_size": 1024 * 1024 * 100,
+                               u"metadata": {},
+                               u"deleted": False}],
+                 u"updated": [{u"dataset_id": moved.dataset_id,
+                               u"primary": self.NODE_B,
+                               u"metadata": {},
+                               u"deleted": False}],
+                 u"deleted": [{u"dataset_id": deleted.dataset_id,
+                               u"primary": self.NODE_A,
+                               u"metadata": {},
+                               u"deleted": True}]},
+            )
+
+            def saved(_):
+                deployment = self.persistence_service.get()
+                self.assertEqual(
+                    (generation + 1,
+                     [(self.NODE_A_UUID, False)],
+                     [(self.NODE_B_UUID, False)],
+                     [(self.NODE_A_UUID, True)]),
+                    (self.persistence_service.generation,
+                     [(node.uuid, m.dataset.deleted) for (m, node)
+                      in deployment.get_manifestations(new_dataset_id)],
+                     [(node.uuid, m.dataset.deleted) for (m, node)
+                      in deployment.get_manifestations(moved.dataset_id)],
+                     [(node.uuid, m.dataset.deleted) for (m, node)
+                      in deployment.get_manifestations(deleted.dataset_id)])
+                )
+            d.addCallback(saved)
+            return d
+        created.addCallback(got_manifestations)
+        return created
+
+    def test_earlier_changes(self):
+        """
+        Each change is applied to the configuration resulting from the
+        changes before it, so a dataset created by a request can be moved
+        by the same request.
+        """
+        dataset_id = unicode(uuid4())
+        return self.assertResult(
+            b"POST", b"/configuration/datasets/bulk",
+            {u"create": [{u"dataset_id": dataset_id,
+                          u"primary": self.NODE_A}],
+             u"update": [{u"dataset_id": dataset_id,
+                          u"primary": self.NODE_B}]},
+            OK,
+            {u"created": [{u"dataset_id": dataset_id,
+                           u"primary": self.NODE_A,
+                           u"metadata": {},
+                           u"deleted": False}],
+             u"updated": [{u"dataset_id": dataset_id,
+                           u"primary": self.NODE_B,
+                           u"metadata": {},
+                           u"deleted": False}],
+             u"deleted": []},
+        )
+
+    def _test_no_changes(self, body, code, result):
+        """
+        Assert that a request fails without changing the configuration.
+
+        :param body: A function of the two ``Manifestation``\ s created by
+            ``_setup_manifestations`` returning the request body.
+        :param int code: The expected response code.
+        :param result: The expected response body.
+
+        :return: ``Deferred`` firing when the test is done.
+        """
+        created = self._setup_manifestations()
+
+        def got_manifestations(manifestations):
+            deployment = self.persistence_service.get()
+            d = self.assertResult(
+                b"POST", b"/configuration/datasets/bulk",
+                body(*manifestations), code, result,
+            )
+            d.addCallback(lambda _: self.assertEqual(
+                deployment, self.persistence_service.get()))
+            return d
+        created.addCallback(got_manifestations)
+        return created
+
+    def test_collision(self):
+        """
+        If a dataset to be created already exists no changes are made and
+        CONFLICT is returned.
+        """
+        return self._test_no_changes(
+            lambda existing, deleted: {
+                u"create": [{u"primary": self.NODE_B},
+                            {u"dataset_id": existing.dataset_id,
+                             u"primary": self.NODE_B}],
+                u"delete": [deleted.dataset_id],
+            },
+            CONFLICT,
+            {u"description":
+             u"The provided dataset_id is already in use."},
+        )
+
+    def test_collision_in_request(self):
+        """
+        If two datasets to be created have the same dataset ID no changes
+        are made and CONFLICT is returned.
+        """
+        dataset_id = unicode(uuid4())
+        return self._test_no_changes(
+            lambda existing, deleted: {
+                u"create": [{u"dataset_id": dataset_id,
+                             u"primary": self.NODE_A},
+                            {u"dataset_id": dataset_id,
+                             u"primary": self.NODE_B}],
+            },
+            CONFLICT,
+            {u"description":
+             u"The provided dataset_id is already in use."},
+        )
+
+    def test_unknown_dataset(self):
+        """
+        If a dataset to be deleted doesn't exist no changes are made and
+        NOT_FOUND is returned.
+        """
+        return self._test_no_changes(
+            lambda moved, deleted: {
+                u"update": [{u"dataset_id": moved.dataset_id,
+                             u"primary": self.NODE_B}],
+                u"delete": [deleted.dataset_id, unicode(uuid4())],
+            },
+            NOT_FOUND,
+            {u"description": u"Dataset not found."},
+        )
+
+
+RealTestsBulkUpdateDatasets, MemoryTestsBulkUpdateDatasets = (
+    buildIntegrationTests(
+        BulkUpdateDatasetsTestsMixin, "BulkUpdateDatasets", _build_app)
+)
+
+
 def get_dataset_ids(deployment):
     """
     Get an iterator of all of the ``dataset_id`` values on all nodes in the
@@ -2533,6 +2720,177 @@ RealTestsGetDatasetConfiguration, MemoryTestsGetDatasetConfiguration = (
 )
 
 
+class ConditionalRequestTestsMixin(APITestsMixin):
+    """
+    Tests for conditional requests of the configuration and state listing
+    endpoints.
+    """
+    def get_etag(self, path):
+        """
+        Get the entity tag of a resource.
+
+        :param bytes path: The path of the resource.
+
+        :return: ``Deferred`` firing with the entity tag.
+        """
+        d = self.assertResponseCode(b"GET", path, None, OK)
+        d.addCallback(lambda response: response.headers.getRawHeaders(
+            b"etag")[0])
+        return d
+
+    def conditional_get(self, path, etag):
+        """
+        Issue a request for a resource unless it has changed.
+
+        :param bytes path: The path of the resource.
+        :param bytes etag: The entity tag the client has.
+
+        :return: ``Deferred`` firing with the response code.
+        """
+        d = self.agent.request(
+            b"GET", path, Headers({b"if-none-match": [etag]}), None)
+        d.addCallback(lambda response: response.code)
+        return d
+
+    def assert_conditional(self, path, change):
+        """
+        A resource is not modified until ``change`` is called.
+
+        :param bytes path: The path of the resource.
+        :param change: A no-argument callable which changes the resource.
+
+        :return: ``Deferred`` that fires when the test is done.
+        """
+        codes = []
+        d = self.get_etag(path)
+
+        def got_etag(etag):
+            unchanged = self.conditional_get(path, etag)
+            unchanged.addCallback(codes.append)
+            unchanged.addCallback(lambda _: change())
+            unchanged.addCallback(lambda _: self.conditional_get(path, etag))
+            unchanged.addCallback(codes.append)
+            return unchanged
+        d.addCallback(got_etag)
+        d.addCallback(lambda _: self.assertEqual([NOT_MODIFIED, OK], codes))
+        return d
+
+    def test_configuration(self):
+        """
+        ``/configuration/datasets`` isn't modified until the configuration
+        changes.
+        """
+        manifestation = _manifestation()
+        return self.assert_conditional(
+            b"/configuration/datasets",
+            lambda: self.persistence_service.save(Deployment(nodes={
+                Node(uuid=self.NODE_A_UUID, manifestations={
+                    manifestation.dataset_id: manifestation}),
+            })),
+        )
+
+    def test_state(self):
+        """
+        ``/state/datasets`` isn't modified until the cluster state changes.
+        """
+        manifestation = _manifestation()
+        return self.assert_conditional(
+            b"/state/datasets",
+            lambda: self.cluster_state_service.apply_changes([NodeState(
+                uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP,
+                manifestations={manifestation.dataset_id: manifestation},
+                paths={manifestation.dataset_id: FilePath(b"/a")},
+                devices={},
+            )]),
+        )
+
+    def test_long_poll(self):
+        """
+        A conditional request of ``/state/datasets`` which prefers to wait
+        gets the new state once the cluster state changes.
+        """
+        manifestation = _manifestation()
+        d = self.get_etag(b"/state/datasets")
+
+        def got_etag(etag):
+            waiting = self.agent.request(
+                b"GET", b"/state/datasets", Headers({
+                    b"if-none-match": [etag], b"prefer": [b"wait=60"],
+                }), None)
+            deferLater(
+                reactor, 0.01, self.cluster_state_service.apply_changes,
+                [NonManifestDatasets(datasets={
+                    manifestation.dataset_id: manifestation.dataset,
+                })],
+            )
+            return waiting
+        d.addCallback(got_etag)
+        d.addCallback(lambda response: self.assertEqual(OK, response.code))
+        return d
+
+    def test_configuration_tag_differs_from_state_tag(self):
+        """
+        The entity tags of configuration and state resources differ, even if
+        the services are at the same generation.
+        """
+        d = gatherResults([
+            self.get_etag(b"/configuration/datasets"),
+            self.get_etag(b"/state/datasets"),
+        ])
+        d.addCallback(lambda tags: self.assertNotEqual(tags[0], tags[1]))
+        return d
+
+
+RealTestsConditionalRequest, MemoryTestsConditionalRequest = (
+    buildIntegrationTests(
+        ConditionalRequestTestsMixin, "ConditionalRequest", _build_app
+    )
+)
+
+
+class ChangeWaitersTests(SynchronousTestCase):
+    """
+    Tests for ``_ChangeWaiters``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.waiters = _ChangeWaiters(self.clock)
+
+    def test_changed(self):
+        """
+        The ``Deferred`` returned by ``_ChangeWaiters.wait`` fires after the
+        next change and its timeout is cancelled.
+        """
+        waiting = self.waiters.wait(10)
+        self.waiters.changed()
+        self.assertEqual(
+            (None, []),
+            (self.successResultOf(waiting), self.clock.getDelayedCalls()),
+        )
+
+    def test_timeout(self):
+        """
+        The ``Deferred`` returned by ``_ChangeWaiters.wait`` fires once the
+        given number of seconds pass without a change.
+        """
+        waiting = self.waiters.wait(10)
+        self.clock.advance(9)
+        self.assertNoResult(waiting)
+        self.clock.advance(1)
+        self.assertEqual(None, self.successResultOf(waiting))
+
+    def test_cancel(self):
+        """
+        Cancelling the ``Deferred`` returned by ``_ChangeWaiters.wait``
+        cancels its timeout and it isn't fired by later changes.
+        """
+        waiting = self.waiters.wait(10)
+        waiting.cancel()
+        self.failureResultOf(waiting)
+        self.waiters.changed()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
 class CreateAPIServiceTests(SynchronousTestCase):
     """
     Tests for ``create_api_service``.
@@ -2547,6 +2905,22 @@ class CreateAPIServiceTests(SynchronousTestCase):
             ConfigurationPersistenceService(reactor, FilePath(self.mktemp())),
             ClusterStateService(reactor), endpoint, ClientContextFactory()))
 
+    def test_output_validation_rate(self):
+        """
+        ``create_api_service`` passes the output validation rate to the
+        ``ConfigurationAPIUserV1``.
+        """
+        reactor = MemoryReactor()
+        service = create_api_service(
+            ConfigurationPersistenceService(reactor, FilePath(self.mktemp())),
+            ClusterStateService(reactor), TCP4ServerEndpoint(reactor, 6789),
+            ClientContextFactory(), output_validation_rate=0.5)
+        self.assertEqual(
+            0.5,
+            service.factory.wrappedFactory.resource._v1_user
+            .output_validation_rate,
+        )
+
 
 class DatasetsStateTestsMixin(APITestsMixin):
     """
@@ -0,0 +1,114 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._metrics``.
+"""
+
+from json import loads
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import MemoryReactor
+from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.server import Site
+from twisted.web.test.requesthelper import DummyRequest
+
+from ...testtools.amp import DelayedAMPClient
+from .._protocol import AgentAMP, ACK_LATENCY_BUCKETS
+from .._metrics import (
+    control_metrics, MetricsResource, create_metrics_service,
+)
+from .test_protocol import (
+    FakeAgent, LoopbackAMPClient, build_control_amp_service,
+)
+
+
+class ControlMetricsTests(SynchronousTestCase):
+    """
+    Tests for ``control_metrics``.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.service = build_control_amp_service(self, self.reactor)
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.server = DelayedAMPClient(
+            LoopbackAMPClient(AgentAMP(Clock(), FakeAgent()).locator)
+        )
+
+    def test_no_agents(self):
+        """
+        Without any agents every count is zero.
+        """
+        metrics = control_metrics(self.service)
+        self.assertEqual(
+            ([], 0, 0, [0] * (len(ACK_LATENCY_BUCKETS) + 1)),
+            (metrics[u"agents"], metrics[u"ingestion"][u"batches"],
+             metrics[u"updates"][u"updates"],
+             metrics[u"updates"][u"ack_latency"][u"counts"]),
+        )
+
+    def test_agents(self):
+        """
+        The statistics of each connected agent are included, along with its
+        address.
+        """
+        self.service.connected(self.server)
+        self.reactor.advance(0.5)
+        self.server.respond()
+        [agent] = control_metrics(self.service)[u"agents"]
+        self.assertEqual(
+            (1, 1, [0, 0, 1, 0, 0, 0], 0.5, u"192.168.1.1:54321", None),
+            (agent[u"updates"], agent[u"acknowledged"],
+             agent[u"ack_latency"][u"counts"],
+             agent[u"ack_latency"][u"total"], agent[u"address"],
+             agent[u"node_uuid"]),
+        )
+
+    def test_buckets(self):
+        """
+        The upper bounds of the latency histogram buckets are included, with
+        ``None`` for the last, unbounded, bucket.
+        """
+        metrics = control_metrics(self.service)
+        self.assertEqual(
+            list(ACK_LATENCY_BUCKETS) + [None],
+            metrics[u"updates"][u"ack_latency"][u"buckets"],
+        )
+
+
+class MetricsResourceTests(SynchronousTestCase):
+    """
+    Tests for ``MetricsResource`` and ``create_metrics_service``.
+    """
+    def test_render(self):
+        """
+        ``MetricsResource`` renders ``control_metrics`` as JSON.
+        """
+        service = build_control_amp_service(self)
+        request = DummyRequest([])
+        body = MetricsResource(service).render_GET(request)
+        self.assertEqual(
+            (control_metrics(service), b"application/json"),
+            (loads(body), request.outgoingHeaders[b"content-type"]),
+        )
+
+    def test_service(self):
+        """
+        ``create_metrics_service`` serves a ``MetricsResource`` at
+        ``/metrics`` on the given endpoint.
+        """
+        service = build_control_amp_service(self)
+        reactor = MemoryReactor()
+        metrics_service = create_metrics_service(
+            service, TCP4ServerEndpoint(reactor, 4525, interface=b"127.0.0.1"),
+        )
+        metrics_service.startService()
+        self.addCleanup(metrics_service.stopService)
+        [(port, factory, _, interface)] = reactor.tcpServers
+        resource = factory.resource.getStaticEntity(b"metrics")
+        self.assertEqual(
+            (4525, b"127.0.0.1", Site, MetricsResource, service),
+            (port, interface, factory.__class__, resource.__class__,
+             resource.control_amp_service),
+        )
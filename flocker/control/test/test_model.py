@@ -10,7 +10,7 @@ from uuid import uuid4, UUID
 
 from pyrsistent import (
     InvariantException, pset, PRecord, PSet, pmap, PMap, thaw, PVector,
-    pvector
+    pvector, discard,
 )
 
 from twisted.trial.unittest import SynchronousTestCase
@@ -19,7 +19,10 @@ from twisted.python.filepath import FilePath
 from zope.interface.verify import verifyObject
 
 from ...testtools import make_with_init_tests
-from .._model import pset_field, pmap_field, pvector_field, ip_to_uuid
+from .._model import (
+    pset_field, pmap_field, pvector_field, ip_to_uuid, _NODE_INDEXES,
+    _DATASET_INDEXES, _index_datasets,
+)
 
 from .. import (
     IClusterStateChange, IClusterStateWipe,
@@ -501,6 +504,145 @@ class GetNodeTests(SynchronousTestCase):
         )
 
 
+class GetManifestationsTests(SynchronousTestCase):
+    """
+    Tests for ``Deployment.get_manifestations`` and
+    ``DeploymentState.get_manifestations``.
+    """
+    def test_deployment(self):
+        """
+        ``Deployment.get_manifestations`` returns each manifestation of the
+        dataset with the ``Node`` it is on.
+        """
+        node = Node(uuid=uuid4(), manifestations={MANIFESTATION.dataset_id:
+                                                  MANIFESTATION})
+        trap = Node(uuid=uuid4())
+        config = Deployment(nodes={node, trap})
+        self.assertEqual(
+            ((MANIFESTATION, node),),
+            config.get_manifestations(MANIFESTATION.dataset_id),
+        )
+
+    def test_deploymentstate(self):
+        """
+        ``DeploymentState.get_manifestations`` returns each manifestation of
+        the dataset with the ``NodeState`` it is on, ignoring nodes whose
+        manifestations are unknown.
+        """
+        replica = MANIFESTATION.set(primary=False)
+        nodes = [
+            NodeState(
+                uuid=uuid4(), hostname=u"192.0.2.{}".format(i),
+                manifestations={MANIFESTATION.dataset_id: manifestation},
+                devices={}, paths={},
+            )
+            for i, manifestation in enumerate([MANIFESTATION, replica])
+        ]
+        ignorant = NodeState(uuid=uuid4(), hostname=u"192.0.2.3")
+        state = DeploymentState(nodes=nodes + [ignorant])
+        self.assertEqual(
+            {(MANIFESTATION, nodes[0]), (replica, nodes[1])},
+            set(state.get_manifestations(MANIFESTATION.dataset_id)),
+        )
+
+    def test_missing(self):
+        """
+        ``get_manifestations`` returns an empty tuple if the dataset has no
+        manifestations.
+        """
+        config = Deployment(nodes={Node(uuid=uuid4())})
+        self.assertEqual((), config.get_manifestations(unicode(uuid4())))
+
+    def test_memoized(self):
+        """
+        The index used by ``get_manifestations`` is only built once for a
+        given set of nodes.
+        """
+        config = Deployment(nodes={Node(uuid=uuid4())})
+        config.get_manifestations(unicode(uuid4()))
+        _DATASET_INDEXES.remember(
+            config.nodes, pmap({u"marker": ((MANIFESTATION, None),)}),
+        )
+        self.assertEqual(
+            ((MANIFESTATION, None),), config.get_manifestations(u"marker"),
+        )
+
+    def test_derived(self):
+        """
+        The index used by ``get_manifestations`` for the nodes of a
+        ``Deployment`` updated by ``update_node`` is derived from the index
+        of the original and matches one built from scratch.
+        """
+        other = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        source = Node(uuid=uuid4(), manifestations={
+            MANIFESTATION.dataset_id: MANIFESTATION,
+            other.dataset_id: other,
+        })
+        target = Node(uuid=uuid4())
+        config = Deployment(nodes={source, target})
+        config.get_manifestations(MANIFESTATION.dataset_id)
+        config = config.update_node(source.transform(
+            ["manifestations", MANIFESTATION.dataset_id], discard,
+        ))
+        config = config.update_node(target.transform(
+            ["manifestations", MANIFESTATION.dataset_id], MANIFESTATION,
+        ))
+        self.assertEqual(
+            _index_datasets(config.nodes),
+            _DATASET_INDEXES.peek(config.nodes),
+        )
+
+
+class PrimaryManifestationsTests(SynchronousTestCase):
+    """
+    Tests for ``Deployment.primary_manifestations`` and
+    ``DeploymentState.primary_manifestations``.
+    """
+    def test_primary(self):
+        """
+        ``primary_manifestations`` returns each primary manifestation with
+        the node it is on, ignoring replicas and nodes whose manifestations
+        are unknown.
+        """
+        other = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        replica = MANIFESTATION.set(primary=False)
+        nodes = [
+            NodeState(
+                uuid=uuid4(), hostname=u"192.0.2.{}".format(i),
+                manifestations={
+                    manifestation.dataset_id: manifestation
+                    for manifestation in manifestations
+                },
+                devices={}, paths={},
+            )
+            for i, manifestations in enumerate([[MANIFESTATION],
+                                                [replica, other]])
+        ]
+        ignorant = NodeState(uuid=uuid4(), hostname=u"192.0.2.3")
+        state = DeploymentState(nodes=nodes + [ignorant])
+        self.assertItemsEqual(
+            [(MANIFESTATION, nodes[0]), (other, nodes[1])],
+            list(state.primary_manifestations()),
+        )
+
+    def test_memoized(self):
+        """
+        ``primary_manifestations`` uses the index used by
+        ``get_manifestations``.
+        """
+        node = Node(uuid=uuid4())
+        config = Deployment(nodes={node})
+        _DATASET_INDEXES.remember(
+            config.nodes,
+            pmap({MANIFESTATION.dataset_id: ((MANIFESTATION, node),)}),
+        )
+        self.assertEqual(
+            [(MANIFESTATION, node)], list(config.primary_manifestations()),
+        )
+
+
 class DeploymentTests(SynchronousTestCase):
     """
     Tests for ``Deployment``.
@@ -829,6 +971,16 @@ class PSetFieldTests(SynchronousTestCase):
         record = Record(value=[1, 2])
         assert isinstance(record.value, PSet)
 
+    def test_factory_reuses_checked(self):
+        """
+        ``pset_field``'s factory returns a set which is already of the right
+        type unchanged, rather than rebuilding it.
+        """
+        class Record(PRecord):
+            value = pset_field(int)
+        record = Record(value=[1, 2])
+        self.assertIs(record.value, Record(value=record.value).value)
+
     def test_checked_set(self):
         """
         ``pset_field`` results in a set that enforces its type.
@@ -1008,6 +1160,16 @@ class PMapFieldTests(SynchronousTestCase):
     This will hopefully be contributed upstream to pyrsistent, thus the
     slightly different testing style.
     """
+    def test_factory_reuses_checked(self):
+        """
+        ``pmap_field``'s factory returns a map which is already of the right
+        type unchanged, rather than rebuilding it.
+        """
+        class Record(PRecord):
+            value = pmap_field(int, int)
+        record = Record(value={1: 2})
+        self.assertIs(record.value, Record(value=record.value).value)
+
     def test_initial_value(self):
         """
         ``pmap_field`` results in initial value that is empty.
@@ -1202,6 +1364,26 @@ class DeploymentStateTests(SynchronousTestCase):
             update_manifestations)
         self.assertEqual(updated, DeploymentState(nodes=[end_node]))
 
+    def test_update_node_many(self):
+        """
+        ``update_node()`` finds the node to update among many.
+        """
+        nodes = [
+            NodeState(uuid=uuid4(), hostname=u"192.0.2.{}".format(i))
+            for i in range(20)
+        ]
+        state = DeploymentState()
+        for node in nodes:
+            state = state.update_node(node)
+        for node in nodes:
+            state = state.update_node(node.set(applications=[]))
+        self.assertEqual(
+            DeploymentState(
+                nodes=[node.set(applications=[]) for node in nodes],
+            ),
+            state,
+        )
+
     def test_nonmanifest_datasets_keys_are_their_ids(self):
         """
         The keys of the ``nonmanifest_datasets`` attribute must match the
@@ -1638,3 +1820,86 @@ class LeaseTests(SynchronousTestCase):
             InvariantException,
             self.leases.set, uuid4(), lease
         )
+
+
+class NodeIndexesTests(SynchronousTestCase):
+    """
+    Tests for the indexes of nodes by UUID.
+    """
+    def assert_index(self, deployment):
+        """
+        The index of the nodes of ``deployment`` maps the UUID of each node
+        to the node.
+        """
+        self.assertEqual(
+            pmap({node.uuid: node for node in deployment.nodes}),
+            _NODE_INDEXES.get(deployment.nodes),
+        )
+
+    def test_update_node(self):
+        """
+        The index of the nodes of a ``DeploymentState`` updated by
+        ``update_node`` is correct.
+        """
+        node = NodeState(uuid=uuid4(), hostname=u"192.0.2.1")
+        state = DeploymentState(nodes=[
+            node, NodeState(uuid=uuid4(), hostname=u"192.0.2.2"),
+        ]).update_node(node.set(applications=[]))
+        self.assert_index(state)
+
+    def test_update_node_configuration(self):
+        """
+        The index of the nodes of a ``Deployment`` updated by
+        ``update_node`` is correct.
+        """
+        node = Node(uuid=uuid4())
+        deployment = Deployment(nodes=[node, Node(uuid=uuid4())]).update_node(
+            node.set(applications=[APP1]),
+        )
+        self.assert_index(deployment)
+
+    def test_wipe(self):
+        """
+        The index of the nodes of a ``DeploymentState`` from which a node has
+        been wiped doesn't include that node.
+        """
+        node = NodeState(uuid=uuid4(), hostname=u"192.0.2.1", applications=[])
+        state = node.get_information_wipe().update_cluster_state(
+            DeploymentState(nodes=[node])
+        )
+        self.assertEqual(
+            (DeploymentState(), pmap()),
+            (state, _NODE_INDEXES.get(state.nodes)),
+        )
+
+    def test_derived(self):
+        """
+        The index of the nodes of a ``DeploymentState`` updated by
+        ``update_node`` is derived from the index of the original without
+        being rebuilt.
+        """
+        node = NodeState(uuid=uuid4(), hostname=u"192.0.2.1")
+        original = DeploymentState(nodes=[node])
+        _NODE_INDEXES.remember(original.nodes, pmap({node.uuid: node}))
+        # Only an index which was derived from the one above will include
+        # this:
+        _NODE_INDEXES.remember(
+            original.nodes, pmap({node.uuid: node, u"marker": None}),
+        )
+        updated = original.update_node(
+            NodeState(uuid=uuid4(), hostname=u"192.0.2.2"),
+        )
+        self.assertIn(u"marker", _NODE_INDEXES.get(updated.nodes))
+
+    def test_forgotten(self):
+        """
+        The index of a set of nodes is forgotten when the set is garbage
+        collected.
+        """
+        state = DeploymentState(nodes=[
+            NodeState(uuid=uuid4(), hostname=u"192.0.2.1"),
+        ])
+        key = id(state.nodes)
+        _NODE_INDEXES.get(state.nodes)
+        del state
+        self.assertNotIn(key, _NODE_INDEXES._values)
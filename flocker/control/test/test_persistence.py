@@ -20,10 +20,12 @@ from hypothesis import strategies as st
 from twisted.internet import reactor
 from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase, SynchronousTestCase
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 
 from pyrsistent import PRecord, pset
 
+from .. import _persistence
 from .._persistence import (
     ConfigurationPersistenceService, wire_decode, wire_encode,
     _LOG_SAVE, _LOG_STARTUP, migrate_configuration,
@@ -31,6 +33,7 @@ from .._persistence import (
     _LOG_UPGRADE, MissingMigrationError, update_leases, _LOG_EXPIRE,
     _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED,
     )
+from ...common.test.test_thread import NonThreadPool
 from .._model import (
     Deployment, Application, DockerImage, Node, Dataset, Manifestation,
     AttachedVolume, SERIALIZABLE_CLASSES, NodeState, Configuration,
@@ -414,6 +417,447 @@ class ConfigurationPersistenceServiceTests(TestCase):
         old_saving.addCallback(saved_old)
         return old_saving
 
+    def test_generation(self):
+        """
+        ``generation`` is incremented by each save which changes the
+        configuration, and only by those.
+        """
+        service = self.service(FilePath(self.mktemp()), None)
+        generations = [service.generation]
+        service.save(TEST_DEPLOYMENT)
+        generations.append(service.generation)
+        service.save(TEST_DEPLOYMENT)
+        generations.append(service.generation)
+        self.assertEqual([0, 1, 1], generations)
+
+    def test_write_behind_persists(self):
+        """
+        A configuration saved in write-behind mode is written to disk by a
+        thread once the ``Deferred`` returned by ``save`` fires.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(reactor, path, save_delay=0)
+        service.startService()
+        self.addCleanup(service.stopService)
+        d = service.save(TEST_DEPLOYMENT)
+        d.addCallback(lambda _: wire_decode(
+            path.child(b"current_configuration.json").getContent()
+        ).deployment)
+        d.addCallback(self.assertEqual, TEST_DEPLOYMENT)
+        return d
+
+
+class _ThreadlessClock(Clock):
+    """
+    A ``Clock`` which fits into the execution model defined by
+    ``NonThreadPool``.
+    """
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class _HeldThreadPool(object):
+    """
+    A stand-in for ``twisted.python.threadpool.ThreadPool`` which runs
+    functions when the test says so.
+
+    :ivar list calls: Two-tuples of the callback and the function of each
+        call which hasn't been run yet.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        self.calls.append((onResult, lambda: func(*args, **kw)))
+
+    def run(self):
+        """
+        Run the earliest call.
+        """
+        onResult, func = self.calls.pop(0)
+        onResult(True, func())
+
+    def fail(self, reason):
+        """
+        Fail the earliest call without running it.
+
+        :param Failure reason: The failure.
+        """
+        onResult, func = self.calls.pop(0)
+        onResult(False, reason)
+
+
+class WriteBehindTests(SynchronousTestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` in write-behind mode.
+    """
+    def setUp(self):
+        self.reactor = _ThreadlessClock()
+        self.path = FilePath(self.mktemp())
+        self.threadpool = NonThreadPool()
+        self.service = ConfigurationPersistenceService(
+            self.reactor, self.path, save_delay=1, threadpool=self.threadpool,
+        )
+        self.service.startService()
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        """
+        Stop the service unless the test already has.
+        """
+        if self.service.running:
+            self.service.stopService()
+
+    def written(self):
+        """
+        :return Deployment: The configuration on disk.
+        """
+        return wire_decode(
+            self.path.child(b"current_configuration.json").getContent()
+        ).deployment
+
+    def test_immediate(self):
+        """
+        A saved configuration is used and registered callbacks are called
+        before it is written.
+        """
+        callbacks = []
+        self.service.register(lambda: callbacks.append(self.service.get()))
+        saving = self.service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, [TEST_DEPLOYMENT], Deployment(), False),
+            (self.service.get(), callbacks, self.written(), saving.called),
+        )
+
+    def test_written(self):
+        """
+        A saved configuration is written after the save delay and the
+        ``Deferred`` returned by ``save`` then fires.
+        """
+        saving = self.service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(1)
+        self.assertEqual(
+            (None, TEST_DEPLOYMENT),
+            (self.successResultOf(saving), self.written()),
+        )
+
+    def test_coalesced(self):
+        """
+        Configurations saved within the save delay are written once.
+        """
+        changed = TEST_DEPLOYMENT.transform(
+            ("nodes",), lambda nodes: nodes.add(Node(uuid=uuid4())),
+        )
+        first = self.service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(0.5)
+        second = self.service.save(changed)
+        self.reactor.advance(0.5)
+        self.assertEqual(
+            (None, None, changed, 1),
+            (self.successResultOf(first), self.successResultOf(second),
+             self.written(), self.threadpool.calls),
+        )
+
+    def test_metrics(self):
+        """
+        ``ConfigurationPersistenceService.save_metrics`` records the number of
+        writes, the saves they covered and how long saves waited.
+        """
+        self.service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(0.5)
+        self.service.save(Deployment())
+        self.reactor.advance(0.5)
+        metrics = self.service.save_metrics
+        self.assertEqual(
+            (1, 2, 1.0),
+            (metrics.writes, metrics.saves, metrics.max_save_latency),
+        )
+
+    def test_save_while_writing(self):
+        """
+        A configuration saved while an earlier one is being written is written
+        once that write has finished.
+        """
+        threadpool = _HeldThreadPool()
+        self.patch(self.service, "_threadpool", threadpool)
+        first = self.service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(1)
+        second = self.service.save(Deployment())
+        self.reactor.advance(1)
+        calls_while_writing = len(threadpool.calls)
+        threadpool.run()
+        self.reactor.advance(1)
+        threadpool.run()
+        self.assertEqual(
+            (1, None, None, Deployment()),
+            (calls_while_writing, self.successResultOf(first),
+             self.successResultOf(second), self.written()),
+        )
+
+    def test_failure(self):
+        """
+        If writing the configuration fails the ``Deferred`` returned by
+        ``save`` fires with the failure.
+        """
+        threadpool = _HeldThreadPool()
+        self.patch(self.service, "_threadpool", threadpool)
+        saving = self.service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(1)
+        threadpool.fail(Failure(ZeroDivisionError()))
+        self.failureResultOf(saving, ZeroDivisionError)
+
+    def test_failure_retried(self):
+        """
+        If writing the configuration fails it is written again after a delay
+        which doubles with each failure, without the configuration being
+        saved again.
+        """
+        threadpool = _HeldThreadPool()
+        self.patch(self.service, "_threadpool", threadpool)
+        saving = self.service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(1)
+        threadpool.fail(Failure(ZeroDivisionError()))
+        self.failureResultOf(saving, ZeroDivisionError)
+        self.reactor.advance(2)
+        threadpool.fail(Failure(ZeroDivisionError()))
+        self.reactor.advance(3.9)
+        calls_before_delay = len(threadpool.calls)
+        self.reactor.advance(0.1)
+        threadpool.run()
+        self.assertEqual(
+            (0, TEST_DEPLOYMENT, []),
+            (calls_before_delay, self.written(), threadpool.calls),
+        )
+
+    def test_stop_writes(self):
+        """
+        Stopping the service writes saved configuration without waiting for
+        the save delay.
+        """
+        saving = self.service.save(TEST_DEPLOYMENT)
+        stopping = self.service.stopService()
+        self.assertEqual(
+            (None, None, TEST_DEPLOYMENT),
+            (self.successResultOf(saving), self.successResultOf(stopping),
+             self.written()),
+        )
+
+
+class JournalTests(SynchronousTestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` in journaling mode.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.snapshot = self.path.child(b"current_configuration.json")
+        self.journal = self.path.child(b"current_configuration.journal")
+
+    def service(self, journal=True):
+        """
+        Start a service, schedule its stop.
+
+        :param bool journal: Whether to use journaling mode.
+
+        :return: Started ``ConfigurationPersistenceService``.
+        """
+        service = ConfigurationPersistenceService(
+            Clock(), self.path, journal=journal,
+        )
+        service.startService()
+        self.addCleanup(
+            lambda: service.running and service.stopService()
+        )
+        return service
+
+    def snapshot_deployment(self):
+        """
+        :return Deployment: The configuration in the snapshot file.
+        """
+        return wire_decode(self.snapshot.getContent()).deployment
+
+    def test_appended(self):
+        """
+        Saving a configuration appends the changes to the journal instead of
+        writing a new snapshot.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (Deployment(), 2),
+            (self.snapshot_deployment(),
+             len(self.journal.getContent().splitlines())),
+        )
+
+    def test_replayed(self):
+        """
+        The changes in the journal are applied to the snapshot when the
+        service starts, and the journal is compacted.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        service.save(TEST_DEPLOYMENT.transform(
+            ["nodes"], lambda nodes: nodes.add(Node(uuid=uuid4())),
+        ))
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        self.assertEqual(
+            (TEST_DEPLOYMENT, TEST_DEPLOYMENT, 1),
+            (self.service().get(), self.snapshot_deployment(),
+             len(self.journal.getContent().splitlines())),
+        )
+
+    def test_change_size(self):
+        """
+        The size of the changes written to the journal depends on the size of
+        the change rather than the size of the configuration.
+        """
+        service = self.service()
+        large = Deployment(nodes=[
+            Node(uuid=uuid4(), manifestations={
+                manifestation.dataset_id: manifestation,
+            })
+            for manifestation in (
+                Manifestation(
+                    dataset=Dataset(dataset_id=unicode(uuid4())),
+                    primary=True,
+                )
+                for i in range(100)
+            )
+        ])
+        service.save(large)
+        service.stopService()
+        service = self.service()
+        before = self.journal.getContent()
+        service.save(large.transform(
+            ["leases"],
+            lambda leases: leases.acquire(
+                datetime.now(tz=UTC), UUID(DATASET.dataset_id), NODE_UUID,
+            ),
+        ))
+        written = len(self.journal.getContent()) - len(before)
+        self.assertTrue(
+            written * 50 < len(self.snapshot.getContent()),
+            (written, len(self.snapshot.getContent())),
+        )
+
+    def test_compacted(self):
+        """
+        Once the journal is larger than the snapshot, the next save writes a
+        new snapshot and starts a new journal.
+        """
+        service = self.service()
+        # The changes made by the first save are larger than the empty
+        # snapshot:
+        service.save(TEST_DEPLOYMENT)
+        compacted = Deployment(nodes=[Node(uuid=uuid4())])
+        service.save(compacted)
+        self.assertEqual(
+            (compacted, 1),
+            (self.snapshot_deployment(),
+             len(self.journal.getContent().splitlines())),
+        )
+
+    def test_stale_journal(self):
+        """
+        A journal for a different snapshot, left behind by a crash after
+        a new snapshot was written, is ignored.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        journal = self.journal.getContent()
+        service.stopService()
+        self.journal.setContent(journal)
+        compacted = Deployment(nodes=[Node(uuid=uuid4())])
+        self.snapshot.setContent(wire_encode(
+            Configuration(version=_CONFIG_VERSION, deployment=compacted)
+        ))
+        self.assertEqual(compacted, self.service().get())
+
+    def test_incomplete_change(self):
+        """
+        A change which was only partially appended to the journal is
+        ignored.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        service = self.service()
+        service.save(Deployment())
+        service.stopService()
+        journal = self.journal.getContent()
+        self.journal.setContent(journal[:-10])
+        self.assertEqual(TEST_DEPLOYMENT, self.service().get())
+
+    def test_version_mismatch(self):
+        """
+        ``ConfigurationMigrationError`` is raised if the journal has changes
+        for a different configuration version than the snapshot.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        self.journal.setContent(self.journal.getContent().replace(
+            b'"version": 3', b'"version": 2',
+        ))
+        service = ConfigurationPersistenceService(
+            Clock(), self.path, journal=True,
+        )
+        self.assertRaises(ConfigurationMigrationError, service.startService)
+
+    def test_old_version(self):
+        """
+        Changes journaled by an older configuration version are applied to
+        the snapshot before it is migrated to the current version.
+        """
+        node = Node(uuid=uuid4())
+        changed = TEST_DEPLOYMENT.transform(
+            ["nodes"], lambda nodes: nodes.add(node),
+        ).transform(
+            ["leases"],
+            lambda leases: leases.acquire(
+                datetime.now(tz=UTC), UUID(DATASET.dataset_id), NODE_UUID,
+            ),
+        )
+        changed = changed.update_node(
+            changed.get_node(NODE_UUID).set(applications=[])
+        )
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        service.save(changed)
+        service.stopService()
+
+        migrated = []
+
+        def upgrade(config):
+            migrated.append(wire_decode(config).deployment)
+            decoded = json.loads(config)
+            decoded[u"version"] = _CONFIG_VERSION + 1
+            return json.dumps(decoded)
+        migration = type(
+            "NextConfigurationMigration", (ConfigurationMigration,),
+            {"upgrade_from_v%d" % (_CONFIG_VERSION,): staticmethod(upgrade)},
+        )
+        self.patch(_persistence, "ConfigurationMigration", migration)
+        self.patch(_persistence, "_CONFIG_VERSION", _CONFIG_VERSION + 1)
+
+        self.assertEqual(
+            ([changed], changed, changed, _CONFIG_VERSION + 1, 1),
+            (migrated, self.service().get(), self.snapshot_deployment(),
+             wire_decode(self.snapshot.getContent()).version,
+             len(self.journal.getContent().splitlines())),
+        )
+
+    def test_journaling_disabled(self):
+        """
+        A journal is replayed by a service which isn't journaling, which then
+        removes it.
+        """
+        self.service().save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, False),
+            (self.service(journal=False).get(), self.journal.exists()),
+        )
+
 
 class StubMigration(object):
     """
@@ -0,0 +1,194 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._projection``.
+"""
+
+from uuid import uuid4
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+from .._projection import ClusterProjector
+from .._diffing import create_diff
+from .._model import (
+    Deployment, DeploymentState, Node, NodeState, Application, DockerImage,
+    Port, Manifestation, Dataset,
+)
+from .test_persistence import DEPLOYMENTS
+
+
+MANIFESTATION = Manifestation(
+    dataset=Dataset(dataset_id=unicode(uuid4())), primary=True,
+)
+PORTLESS = Application(
+    name=u"portless", image=DockerImage.from_string(u"busybox"),
+)
+PORTED = Application(
+    name=u"ported", image=DockerImage.from_string(u"nginx"),
+    ports=[Port(internal_port=80, external_port=8080)],
+)
+
+LOCAL_UUID = uuid4()
+PEER_UUID = uuid4()
+
+LOCAL_NODE = Node(uuid=LOCAL_UUID, applications=[PORTLESS, PORTED])
+PEER_NODE = Node(
+    uuid=PEER_UUID, applications=[PORTLESS, PORTED],
+    manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+)
+CONFIGURATION = Deployment(nodes={LOCAL_NODE, PEER_NODE})
+
+LOCAL_STATE = NodeState(
+    uuid=LOCAL_UUID, hostname=u"192.0.2.1", applications=[PORTLESS],
+    manifestations={}, paths={}, devices={},
+)
+PEER_STATE = NodeState(
+    uuid=PEER_UUID, hostname=u"192.0.2.2", applications=[PORTLESS],
+    manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+    paths={MANIFESTATION.dataset_id: FilePath(b"/flocker/x")},
+    devices={},
+)
+STATE = DeploymentState(nodes={LOCAL_STATE, PEER_STATE})
+
+
+class ProjectTests(SynchronousTestCase):
+    """
+    Tests for ``ClusterProjector.project``.
+    """
+    def test_local_node_unchanged(self):
+        """
+        The configuration and state of the node the view is for are included
+        unchanged.
+        """
+        configuration, state = ClusterProjector().project(
+            LOCAL_UUID, CONFIGURATION, STATE,
+        )
+        self.assertEqual(
+            (LOCAL_NODE, LOCAL_STATE),
+            (configuration.get_node(LOCAL_UUID),
+             state.get_node(LOCAL_UUID)),
+        )
+
+    def test_peer_configuration(self):
+        """
+        Only applications with ports are included in the configuration of
+        other nodes.  Their manifestations are included.
+        """
+        configuration, state = ClusterProjector().project(
+            LOCAL_UUID, CONFIGURATION, STATE,
+        )
+        self.assertEqual(
+            PEER_NODE.set(applications=[PORTED]),
+            configuration.get_node(PEER_UUID),
+        )
+
+    def test_peer_state(self):
+        """
+        Applications, paths and devices are left out of the state of other
+        nodes.  Their hostnames and manifestations are included.
+        """
+        configuration, state = ClusterProjector().project(
+            LOCAL_UUID, CONFIGURATION, STATE,
+        )
+        self.assertEqual(
+            PEER_STATE.set(applications=None, paths={}, devices={}),
+            state.get_node(PEER_UUID),
+        )
+
+    def test_peer_unknown_manifestations(self):
+        """
+        The state of other nodes whose manifestations aren't known remains
+        valid.
+        """
+        peer = NodeState(uuid=PEER_UUID, hostname=u"192.0.2.2")
+        configuration, state = ClusterProjector().project(
+            LOCAL_UUID, CONFIGURATION, DeploymentState(nodes={peer}),
+        )
+        self.assertEqual(peer, state.get_node(PEER_UUID))
+
+    def test_cached(self):
+        """
+        Projecting the same configuration and state for the same node again
+        returns the identical result.
+        """
+        projector = ClusterProjector()
+        first = projector.project(LOCAL_UUID, CONFIGURATION, STATE)
+        second = projector.project(LOCAL_UUID, CONFIGURATION, STATE)
+        self.assertIs(first, second)
+
+    def test_retain(self):
+        """
+        ``ClusterProjector.retain`` discards cached views for nodes which are
+        no longer part of the cluster.
+        """
+        projector = ClusterProjector()
+        projector.project(LOCAL_UUID, CONFIGURATION, STATE)
+        projector.project(PEER_UUID, CONFIGURATION, STATE)
+        projector.retain([LOCAL_NODE, LOCAL_STATE])
+        self.assertEqual(
+            ([LOCAL_UUID], sorted([id(LOCAL_NODE), id(LOCAL_STATE)])),
+            (projector._projections.keys(), sorted(projector._peers.keys())),
+        )
+
+
+class ProjectDiffTests(SynchronousTestCase):
+    """
+    Tests for ``ClusterProjector.project_diff``.
+    """
+    def assert_projects(self, node_uuid, before, after):
+        """
+        The projected diff between ``before`` and ``after`` transforms the
+        projection of ``before`` into the projection of ``after``.
+        """
+        projector = ClusterProjector()
+        diff = projector.project_diff(node_uuid, create_diff(before, after))
+        self.assertEqual(
+            projector._project_deployment(node_uuid, after),
+            diff.apply(projector._project_deployment(node_uuid, before)),
+        )
+
+    @given(st.tuples(DEPLOYMENTS, DEPLOYMENTS))
+    def test_deployments(self, deployments):
+        """
+        The projected diff between two ``Deployment``\ s transforms the
+        projection of the first into the projection of the second.
+        """
+        before, after = deployments
+        node_uuid = next(iter(before.nodes), LOCAL_NODE).uuid
+        self.assert_projects(node_uuid, before, after)
+
+    def test_state(self):
+        """
+        The projected diff between two ``DeploymentState``\ s transforms the
+        projection of the first into the projection of the second.
+        """
+        self.assert_projects(
+            LOCAL_UUID,
+            DeploymentState(nodes={LOCAL_STATE}),
+            STATE.update_node(LOCAL_STATE.set(applications=[PORTED])),
+        )
+
+    def test_replace_root(self):
+        """
+        A change replacing the whole object is projected.
+        """
+        self.assert_projects(LOCAL_UUID, Deployment(), CONFIGURATION)
+
+    def test_invisible_peer_change(self):
+        """
+        Changes to other nodes which aren't part of the view of them result in
+        no changes.
+        """
+        after = STATE.update_node(
+            PEER_STATE.set(applications=[PORTLESS, PORTED]),
+        )
+        self.assertEqual(
+            [],
+            list(ClusterProjector().project_diff(
+                LOCAL_UUID, create_diff(STATE, after),
+            ).changes),
+        )
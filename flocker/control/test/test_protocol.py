@@ -14,7 +14,7 @@ from characteristic import attributes, Attribute
 
 from eliot import ActionType, start_action, MemoryLogger, Logger
 from eliot.testing import (
-    capture_logging, validate_logging, assertHasAction,
+    capture_logging, validate_logging, assertHasAction, assertHasMessage,
 )
 
 from twisted.internet.error import ConnectionDone
@@ -41,17 +41,33 @@ from .._protocol import (
     VersionCommand, ClusterStatusCommand, NodeStateCommand, IConvergenceAgent,
     NoOp, AgentAMP, ControlAMPService, ControlAMP, _AgentLocator,
     ControlServiceLocator, LOG_SEND_CLUSTER_STATE, LOG_SEND_TO_AGENT,
-    AGENT_CONNECTED, CachingEncoder, _caching_encoder
+    AGENT_CONNECTED, CachingEncoder,
+    ClusterStatusDiffCommand, GenerationMismatch, STATE_BATCH_APPLIED,
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_STALENESS, AGENT_UPDATE_STALE,
 )
+from .._diffing import create_diff
+from .._codec import JSON_CODEC, BINARY_CODEC
 from .._clusterstate import ClusterStateService
+from .._model import ChangeSource
 from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
     Dataset, DeploymentState, NonManifestDatasets,
 )
-from .._persistence import ConfigurationPersistenceService, wire_encode
+from .._persistence import (
+    ConfigurationPersistenceService, wire_encode, wire_decode,
+)
 from .clusterstatetools import advance_some, advance_rest
 
 
+class OldVersionCommand(Command):
+    """
+    ``VersionCommand`` as it was before codecs were negotiated.
+    """
+    commandName = VersionCommand.commandName
+    arguments = []
+    response = [('major', Integer())]
+
+
 def arbitrary_transformation(deployment):
     """
     Make some change to a deployment configuration.  Any change.
@@ -237,6 +253,16 @@ NONMANIFEST = NonManifestDatasets(
 del dataset
 
 
+class _CodecProtocol(object):
+    """
+    Stand-in for an AMP protocol which has negotiated a codec.
+
+    :ivar WireCodec wire_codec: The codec to encode with.
+    """
+    def __init__(self, wire_codec):
+        self.wire_codec = wire_codec
+
+
 class BigArgumentTests(SynchronousTestCase):
     """
     Tests for ``Big``.
@@ -263,6 +289,11 @@ class BigArgumentTests(SynchronousTestCase):
             ("big", Big(ListOf(Integer()))),
         ]
 
+    class CommandWithBigStateArgument(Command):
+        arguments = [
+            ("state", Big(SerializableArgument(DeploymentState))),
+        ]
+
     def test_interface(self):
         """
         ``Big`` instances provide ``IArgumentType``.
@@ -339,6 +370,60 @@ class BigArgumentTests(SynchronousTestCase):
             regular=b"goodbye world",
         )
 
+    def test_roundtrip_empty(self):
+        """
+        ``Big`` can serialize and unserialize an empty value.
+        """
+        self.assert_roundtrips(self.CommandWithBigArgument, big=b"")
+
+    def test_roundtrip_serializable(self):
+        """
+        ``Big`` can serialize and unserialize a ``SerializableArgument``
+        value which is larger than MAX_VALUE_LENGTH with each codec.
+        """
+        state = huge_state()
+        # The binary encoding is compact, so a few huge nodes are needed for
+        # it to be split into several chunks.
+        for hostname in [u"192.0.2.32", u"192.0.2.33"]:
+            state = state.update_node(
+                huge_node(NodeState(hostname=hostname, applications=[])),
+            )
+        for codec in [JSON_CODEC, BINARY_CODEC]:
+            amp_protocol = _CodecProtocol(codec)
+            box = self.CommandWithBigStateArgument.makeArguments(
+                {"state": state}, amp_protocol,
+            )
+            [roundtripped] = parseString(box.serialize())
+            self.assertEqual(
+                {"state": state},
+                self.CommandWithBigStateArgument.parseArguments(
+                    roundtripped, amp_protocol,
+                ),
+            )
+
+    def test_from_chunks(self):
+        """
+        ``Big`` passes the chunks of a value to the wrapped argument's
+        ``fromChunks`` method, if it has one, rather than joining them.
+        """
+        received = []
+
+        class Chunked(String):
+            def fromChunks(self, chunks):
+                received.extend(chunks)
+                return b"".join(received)
+
+        value = b"x" * (MAX_VALUE_LENGTH * 2 + 1)
+        argument = Big(Chunked())
+        strings = {}
+        argument.toBox(b"big", strings, {b"big": value}, None)
+        objects = {}
+        argument.fromBox(b"big", strings, objects, None)
+        self.assertEqual(
+            ({b"big": value}, {}, [MAX_VALUE_LENGTH, MAX_VALUE_LENGTH, 1]),
+            (objects, strings, [len(chunk) for chunk in received]),
+        )
+
 
 class SerializationTests(SynchronousTestCase):
     """
@@ -414,20 +499,38 @@ class SerializationTests(SynchronousTestCase):
 
     def test_caches(self):
         """
-        Encoding results are cached when in the context of the caching
-        encoder's ``cache()`` call.
+        Encoding results are cached by the caching encoder.
         """
         argument = SerializableArgument(Deployment)
-        with _caching_encoder.cache():
-            self.assertIs(argument.toString(TEST_DEPLOYMENT),
-                          argument.toString(TEST_DEPLOYMENT))
+        self.assertIs(argument.toString(TEST_DEPLOYMENT),
+                      argument.toString(TEST_DEPLOYMENT))
 
+    def test_negotiated_codec(self):
+        """
+        ``SerializableArgument`` encodes using the ``wire_codec`` of the
+        protocol and can decode the result.
+        """
+        argument = SerializableArgument(Deployment)
+        protocol = AgentAMP(Clock(), FakeAgent())
+        protocol.locator.wire_codec = BINARY_CODEC
+        as_bytes = argument.toStringProto(TEST_DEPLOYMENT, protocol)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, TEST_DEPLOYMENT),
+            (BINARY_CODEC.decode(as_bytes), argument.fromString(as_bytes)),
+        )
 
-def build_control_amp_service(test, reactor=None):
+
+def build_control_amp_service(test, reactor=None, batch_window=0,
+                              batch_size=DEFAULT_BATCH_SIZE,
+                              max_staleness=DEFAULT_MAX_STALENESS):
     """
     Create a new ``ControlAMPService``.
 
     :param TestCase test: The test this service is for.
+    :param float batch_window: See ``ControlAMPService.__init__``.  By default
+        state reports are applied immediately.
+    :param int batch_size: See ``ControlAMPService.__init__``.
+    :param max_staleness: See ``ControlAMPService.__init__``.
 
     :return ControlAMPService: Not started.
     """
@@ -443,7 +546,10 @@ def build_control_amp_service(test, reactor=None):
     return ControlAMPService(reactor, cluster_state, persistence_service,
                              TCP4ServerEndpoint(MemoryReactor(), 1234),
                              # Easiest TLS context factory to create:
-                             ClientContextFactory())
+                             ClientContextFactory(),
+                             batch_window=batch_window,
+                             batch_size=batch_size,
+                             max_staleness=max_staleness)
 
 
 class ControlTestCase(SynchronousTestCase):
@@ -468,7 +574,7 @@ class ControlTestCase(SynchronousTestCase):
             # predict.
             kwargs.pop('eliot_context')
             capture.append((args, kwargs))
-            return succeed(None)
+            return succeed({})
 
         # Patching is bad.
         # https://clusterhq.atlassian.net/browse/FLOC-1603
@@ -516,11 +622,13 @@ class ControlAMPTests(ControlTestCase):
 
         self.protocol.makeConnection(StringTransport())
         cluster_state = self.control_amp_service.cluster_state.as_deployment()
+        generation = self.control_amp_service._current_snapshot().generation
         self.assertEqual(
             sent[0],
             (((ClusterStatusCommand,),
               dict(configuration=TEST_DEPLOYMENT,
-                   state=cluster_state))))
+                   state=cluster_state,
+                   generation=generation))))
 
     def test_connection_lost(self):
         """
@@ -532,7 +640,7 @@ class ControlAMPTests(ControlTestCase):
         # Patching is bad.
         # https://clusterhq.atlassian.net/browse/FLOC-1603
         self.patch(self.protocol, "callRemote",
-                   lambda *args, **kwargs: succeed(None))
+                   lambda *args, **kwargs: succeed({}))
         self.protocol.makeConnection(StringTransport())
         self.protocol.connectionLost(Failure(ConnectionLost()))
         self.assertEqual(self.control_amp_service.connections, {marker})
@@ -544,7 +652,21 @@ class ControlAMPTests(ControlTestCase):
         """
         self.assertEqual(
             self.successResultOf(self.client.callRemote(VersionCommand)),
-            {"major": 1})
+            {"major": 1, "codec": JSON_CODEC.name})
+
+    def test_version_negotiates_codec(self):
+        """
+        ``VersionCommand`` with a list of codecs makes the control service
+        choose the most preferred codec the agent supports and use it to
+        encode commands sent to the agent.
+        """
+        result = self.successResultOf(self.client.callRemote(
+            VersionCommand, codecs=[JSON_CODEC.name, BINARY_CODEC.name],
+        ))
+        self.assertEqual(
+            ({"major": 1, "codec": BINARY_CODEC.name}, BINARY_CODEC),
+            (result, self.protocol.wire_codec),
+        )
 
     def test_nodestate_updates_node_state(self):
         """
@@ -563,6 +685,19 @@ class ControlAMPTests(ControlTestCase):
             self.control_amp_service.cluster_state.as_deployment(),
         )
 
+    def test_nodestate_records_node(self):
+        """
+        ``NodeStateCommand`` records the UUID of the node the agent reported
+        state for as ``ControlAMP.node_uuid``.
+        """
+        before = self.protocol.node_uuid
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand,
+                                   state_changes=(NONMANIFEST, NODE_STATE),
+                                   eliot_context=TEST_ACTION))
+        self.assertEqual((None, NODE_STATE.uuid),
+                         (before, self.protocol.node_uuid))
+
     def test_activity_refreshes_node_state(self):
         """
         Any time commands are dispatched by ``ControlAMP`` its activity
@@ -816,6 +951,476 @@ class ControlAMPServiceTests(ControlTestCase):
         )
 
 
+class StateBatchingTests(SynchronousTestCase):
+    """
+    Tests for the batching of state reported by agents to
+    ``ControlAMPService``.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(
+            self, self.reactor, batch_window=1, batch_size=3,
+        )
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.server = _RecordingAMPClient(
+            LoopbackAMPClient(self.client.locator)
+        )
+        self.service.connected(self.server)
+        self.source = ChangeSource()
+
+    def test_window(self):
+        """
+        State reported by agents is applied together, followed by a single
+        update to the agents, once the batch window has passed.
+        """
+        other = SIMPLE_NODE_STATE.set(uuid=uuid4(), hostname=u"192.0.2.18")
+        self.service.node_changed(self.source, [SIMPLE_NODE_STATE])
+        self.reactor.advance(0.5)
+        self.service.node_changed(self.source, [other])
+        before = (
+            self.service.cluster_state.as_deployment(),
+            len(self.server.commands),
+        )
+        self.reactor.advance(0.5)
+        self.assertEqual(
+            [(DeploymentState(), 1),
+             (DeploymentState(nodes=[SIMPLE_NODE_STATE, other]), 2)],
+            [before,
+             (self.agent.actual, len(self.server.commands))],
+        )
+
+    def test_batch_size(self):
+        """
+        State reported by agents is applied without waiting for the batch
+        window once there are ``batch_size`` changes.
+        """
+        other = SIMPLE_NODE_STATE.set(uuid=uuid4(), hostname=u"192.0.2.18")
+        delayed_calls = self.reactor.getDelayedCalls()
+        self.service.node_changed(self.source, [SIMPLE_NODE_STATE])
+        self.service.node_changed(self.source, [other, NONMANIFEST])
+        self.assertEqual(
+            (DeploymentState(
+                nodes=[SIMPLE_NODE_STATE, other],
+                nonmanifest_datasets=NONMANIFEST.datasets,
+            ), delayed_calls, 2),
+            (self.agent.actual, self.reactor.getDelayedCalls(),
+             len(self.server.commands)),
+        )
+
+    def test_metrics(self):
+        """
+        ``ControlAMPService.ingestion_metrics`` records the sizes of the
+        batches applied and how long the reports in them waited.
+        """
+        self.service.node_changed(self.source, [SIMPLE_NODE_STATE])
+        self.reactor.advance(1)
+        self.service.node_changed(self.source, [NODE_STATE, NONMANIFEST])
+        self.service.node_changed(self.source, [SIMPLE_NODE_STATE])
+        metrics = self.service.ingestion_metrics
+        self.assertEqual(
+            (2, 3, 4, 3, 1.0, 1.0),
+            (metrics.batches, metrics.reports, metrics.changes,
+             metrics.largest_batch, metrics.total_latency,
+             metrics.max_latency),
+        )
+
+    @capture_logging(
+        assertHasMessage, STATE_BATCH_APPLIED,
+        dict(reports=1, changes=1, latency=1.0),
+    )
+    def test_logged(self, logger):
+        """
+        Each batch of state applied is logged.
+        """
+        self.service.node_changed(self.source, [SIMPLE_NODE_STATE])
+        self.reactor.advance(1)
+
+    def test_stop(self):
+        """
+        Stopping the service cancels the application of pending state.
+        """
+        delayed_calls = self.reactor.getDelayedCalls()
+        self.service.node_changed(self.source, [SIMPLE_NODE_STATE])
+        self.service.stopService()
+        self.assertEqual(delayed_calls, self.reactor.getDelayedCalls())
+
+
+class FanOutMetricsTests(SynchronousTestCase):
+    """
+    Tests for the statistics ``ControlAMPService`` collects about the updates
+    it sends to agents, and for its handling of agents which are slow to
+    acknowledge them.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(
+            self, self.reactor, max_staleness=10,
+        )
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.server = DelayedAMPClient(LoopbackAMPClient(self.client.locator))
+        self.configuration = self.service.configuration_service.get()
+
+    def save(self):
+        """
+        Save a new configuration.
+
+        :return: The new configuration.
+        """
+        self.configuration = arbitrary_transformation(self.configuration)
+        self.service.configuration_service.save(self.configuration)
+        return self.configuration
+
+    def test_ack_latency(self):
+        """
+        How long each agent took to acknowledge each update is recorded in a
+        histogram, both for that agent and for all agents.
+        """
+        self.service.connected(self.server)
+        self.reactor.advance(0.5)
+        self.server.respond()
+        self.save()
+        self.reactor.advance(2)
+        self.server.respond()
+        metrics = self.service.agent_metrics[self.server]
+        self.assertEqual(
+            ((2, 2, [0, 0, 1, 1, 0, 0], 2.5, 2.0), metrics),
+            ((metrics.updates, metrics.acknowledged, list(metrics.ack_latency),
+              metrics.total_ack_latency, metrics.max_ack_latency),
+             self.service.fan_out_metrics),
+        )
+
+    def test_delayed_and_elided(self):
+        """
+        Updates which wait for an agent to acknowledge the previous one are
+        counted, as are updates skipped because a waiting update supersedes
+        them.
+        """
+        self.service.connected(self.server)
+        self.save()
+        self.save()
+        metrics = self.service.agent_metrics[self.server]
+        self.assertEqual((1, 1, 1), (
+            metrics.updates, metrics.delayed, metrics.elided,
+        ))
+
+    def test_disconnected(self):
+        """
+        The statistics about an agent are discarded when it disconnects, but
+        still count towards the totals for all agents.
+        """
+        self.service.connected(self.server)
+        self.server.respond()
+        self.service.disconnected(self.server)
+        self.assertEqual(
+            ({}, 1),
+            (self.service.agent_metrics,
+             self.service.fan_out_metrics.acknowledged),
+        )
+
+    def test_bytes_sent(self):
+        """
+        ``ControlAMP.bytes_sent`` counts the bytes written to the transport
+        and the number sent in each update is recorded.
+        """
+        protocol = ControlAMP(self.reactor, self.service)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        self.addCleanup(protocol.connectionLost, Failure(ConnectionDone()))
+        metrics = self.service.fan_out_metrics
+        self.assertEqual(
+            (len(transport.value()),) * 3,
+            (protocol.bytes_sent, metrics.bytes_sent, metrics.largest_update),
+        )
+
+    @capture_logging(assertHasMessage, AGENT_UPDATE_STALE)
+    def test_stale(self, logger):
+        """
+        If an agent hasn't acknowledged an update within the maximum
+        staleness, the next update is sent without waiting for the
+        acknowledgement, as a full ``ClusterStatusCommand`` since which
+        generation the agent has is unknown.
+        """
+        self.service.connected(self.server)
+        self.reactor.advance(10)
+        configuration = self.save()
+        self.server.respond()
+        self.assertEqual(
+            (configuration, 1, {}),
+            (self.agent.desired,
+             self.service.agent_metrics[self.server].stale,
+             self.service._acknowledged),
+        )
+
+    def test_stale_response_ignored(self):
+        """
+        The acknowledgement of an update abandoned for being stale doesn't
+        cause further updates, and the acknowledgement of the update which
+        replaced it is still awaited.
+        """
+        self.service.connected(self.server)
+        self.reactor.advance(10)
+        self.save()
+        # The acknowledgement of the stale update.
+        self.server.respond()
+        self.save()
+        self.assertEqual(
+            (2, 1),
+            (self.service.agent_metrics[self.server].updates,
+             len(self.server._calls)),
+        )
+
+    def test_not_stale(self):
+        """
+        Updates are delayed as usual while an agent's update in progress is
+        younger than the maximum staleness.
+        """
+        self.service.connected(self.server)
+        self.reactor.advance(9)
+        self.save()
+        self.assertEqual(
+            (0, 1),
+            (self.service.agent_metrics[self.server].stale,
+             len(self.server._calls)),
+        )
+
+    def test_no_max_staleness(self):
+        """
+        If the maximum staleness is ``None`` updates are always delayed until
+        the agent acknowledges the previous one.
+        """
+        self.service._max_staleness = None
+        self.service.connected(self.server)
+        self.reactor.advance(DEFAULT_MAX_STALENESS * 10)
+        self.save()
+        self.assertEqual(1, len(self.server._calls))
+
+
+class _RecordingAMPClient(object):
+    """
+    Wrap an AMP client, recording the commands sent through it.
+
+    :ivar list commands: The commands sent, in order.
+    """
+    def __init__(self, client):
+        self._client = client
+        self.transport = client.transport
+        self.commands = []
+
+    def callRemote(self, command, **kwargs):
+        self.commands.append(command)
+        return self._client.callRemote(command, **kwargs)
+
+
+class _GenerationIgnorantLocator(CommandLocator):
+    """
+    An agent-side locator which doesn't know about generations, like those of
+    older agents.
+    """
+    logger = Logger()
+
+    @ClusterStatusCommand.responder
+    def cluster_updated(self, eliot_context, configuration, state,
+                        generation):
+        return {}
+
+
+class ClusterStatusDiffTests(SynchronousTestCase):
+    """
+    Tests for sending changes to agents with ``ClusterStatusDiffCommand``.
+    """
+    def setUp(self):
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(self)
+        self.service.startService()
+        self.server = _RecordingAMPClient(
+            LoopbackAMPClient(self.client.locator)
+        )
+
+    def test_later_updates_are_diffs(self):
+        """
+        After the agent acknowledges the initial ``ClusterStatusCommand``,
+        further changes are sent using ``ClusterStatusDiffCommand`` and the
+        agent is told about the complete new configuration.
+        """
+        self.service.connected(self.server)
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.service.cluster_state.apply_changes([NODE_STATE])
+        self.service.node_changed(self.service.cluster_state, [])
+        self.assertEqual(
+            ([ClusterStatusCommand, ClusterStatusDiffCommand,
+              ClusterStatusDiffCommand],
+             TEST_DEPLOYMENT,
+             self.service.cluster_state.as_deployment()),
+            (self.server.commands, self.agent.desired, self.agent.actual),
+        )
+
+    def test_generation_mismatch(self):
+        """
+        If the agent does not have the generation a diff is based on, a full
+        ``ClusterStatusCommand`` is sent instead.
+        """
+        self.service.connected(self.server)
+        self.client.locator._generation = -1
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            ([ClusterStatusCommand, ClusterStatusDiffCommand,
+              ClusterStatusCommand],
+             TEST_DEPLOYMENT),
+            (self.server.commands, self.agent.desired),
+        )
+
+    def test_reconnect(self):
+        """
+        A full ``ClusterStatusCommand`` is sent to an agent when it
+        reconnects.
+        """
+        self.service.connected(self.server)
+        self.service.disconnected(self.server)
+        self.service.connected(self.server)
+        self.assertEqual(
+            [ClusterStatusCommand, ClusterStatusCommand],
+            self.server.commands,
+        )
+
+    def test_generation_ignorant_agent(self):
+        """
+        Agents which don't acknowledge generations are always sent full
+        ``ClusterStatusCommand``\ s.
+        """
+        server = _RecordingAMPClient(
+            LoopbackAMPClient(_GenerationIgnorantLocator())
+        )
+        self.service.connected(server)
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            [ClusterStatusCommand, ClusterStatusCommand], server.commands,
+        )
+
+    def test_diff_mismatch_rejected(self):
+        """
+        An agent responds to a ``ClusterStatusDiffCommand`` based on a
+        generation other than the one it has with ``GenerationMismatch``.
+        """
+        self.successResultOf(LoopbackAMPClient(self.client.locator).callRemote(
+            ClusterStatusCommand,
+            configuration=Deployment(),
+            state=DeploymentState(),
+            generation=1,
+            eliot_context=TEST_ACTION,
+        ))
+        d = LoopbackAMPClient(self.client.locator).callRemote(
+            ClusterStatusDiffCommand,
+            configuration_diff=create_diff(Deployment(), TEST_DEPLOYMENT),
+            state_diff=create_diff(DeploymentState(), DeploymentState()),
+            start_generation=2,
+            end_generation=3,
+            eliot_context=TEST_ACTION,
+        )
+        self.failureResultOf(d, GenerationMismatch)
+        self.assertEqual(Deployment(), self.agent.desired)
+
+
+class NodeViewTests(SynchronousTestCase):
+    """
+    Tests for sending agents the view of the cluster for their own node.
+    """
+    def setUp(self):
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(self)
+        self.service.startService()
+        self.server = _RecordingAMPClient(
+            LoopbackAMPClient(self.client.locator)
+        )
+        self.local = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.1", applications=[APP1],
+        )
+        self.peer = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.2", applications=[APP2],
+        )
+        self.configuration = Deployment(nodes={
+            Node(uuid=self.local.uuid, applications=[APP1]),
+            Node(uuid=self.peer.uuid, applications=[APP2]),
+        })
+        self.service.configuration_service.save(self.configuration)
+        self.service.cluster_state.apply_changes([self.local, self.peer])
+
+    def assert_agent_has_view(self):
+        """
+        The agent has the view of the current configuration and state for its
+        node.
+        """
+        snapshot = self.service._current_snapshot()
+        expected = self.service._projector.project(
+            self.local.uuid, snapshot.configuration, snapshot.state,
+        )
+        self.assertEqual(expected, (self.agent.desired, self.agent.actual))
+
+    def test_unknown_node(self):
+        """
+        An agent whose node isn't known yet is sent the complete configuration
+        and state.
+        """
+        self.service.connected(self.server)
+        self.assertEqual(
+            (self.configuration,
+             self.service.cluster_state.as_deployment()),
+            (self.agent.desired, self.agent.actual),
+        )
+
+    def test_known_node(self):
+        """
+        An agent whose node is known is sent only the parts of other nodes it
+        needs.
+        """
+        self.server.node_uuid = self.local.uuid
+        self.service.connected(self.server)
+        self.assertEqual(
+            (Node(uuid=self.peer.uuid), None),
+            (self.agent.desired.get_node(self.peer.uuid),
+             self.agent.actual.get_node(self.peer.uuid).applications),
+        )
+
+    def test_node_becomes_known(self):
+        """
+        Once the agent's node becomes known it is sent a full
+        ``ClusterStatusCommand`` with the view for that node.
+        """
+        self.service.connected(self.server)
+        self.server.node_uuid = self.local.uuid
+        self.service.node_changed(self.service.cluster_state, [])
+        self.assertEqual(
+            [ClusterStatusCommand, ClusterStatusCommand],
+            self.server.commands,
+        )
+        self.assert_agent_has_view()
+
+    def test_diffs_projected(self):
+        """
+        Changes are sent as ``ClusterStatusDiffCommand``\ s which keep the
+        agent's view up to date.
+        """
+        self.server.node_uuid = self.local.uuid
+        self.service.connected(self.server)
+        self.service.cluster_state.apply_changes([
+            self.local.set(applications=[APP2]),
+            self.peer.set(applications=[APP1]),
+        ])
+        self.service.node_changed(self.service.cluster_state, [])
+        self.assertEqual(
+            [ClusterStatusCommand, ClusterStatusDiffCommand],
+            self.server.commands,
+        )
+        self.assert_agent_has_view()
+
+
 @implementer(IConvergenceAgent)
 @attributes([Attribute("is_connected", default_value=False),
              Attribute("is_disconnected", default_value=False),
@@ -1023,7 +1628,7 @@ class ClusterStatusCommandTests(SynchronousTestCase):
         ClusterStatusCommand requires the following arguments.
         """
         self.assertItemsEqual(
-            ['configuration', 'state', 'eliot_context'],
+            ['configuration', 'state', 'generation', 'eliot_context'],
             (v[0] for v in ClusterStatusCommand.arguments))
 
 
@@ -1114,6 +1719,54 @@ class _NoOpCounter(CommandLocator):
         return {}
 
 
+class CodecNegotiationTests(SynchronousTestCase):
+    """
+    Tests for the negotiation of a ``WireCodec`` between ``AgentAMP`` and
+    ``ControlAMP``.
+    """
+    def test_negotiated(self):
+        """
+        When an ``AgentAMP`` connects to a ``ControlAMP`` both sides switch to
+        the binary codec and the agent still receives the cluster
+        configuration.
+        """
+        reactor = Clock()
+        service = build_control_amp_service(self, reactor)
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        agent = FakeAgent()
+        server = ControlAMP(reactor, service)
+        client = AgentAMP(reactor, agent)
+        pump = connectedServerAndClient(lambda: server, lambda: client)[2]
+        pump.flush()
+        service.configuration_service.save(Deployment())
+        pump.flush()
+        self.assertEqual(
+            (BINARY_CODEC, BINARY_CODEC, Deployment()),
+            (server.wire_codec, client.wire_codec, agent.desired),
+        )
+
+    def test_old_control_service(self):
+        """
+        If the control service doesn't respond with a codec the agent keeps
+        using JSON.
+        """
+        client = AgentAMP(Clock(), FakeAgent())
+        peer = AMP(locator=_OldVersionLocator())
+        pump = connectedServerAndClient(lambda: peer, lambda: client)[2]
+        pump.flush()
+        self.assertEqual(JSON_CODEC, client.wire_codec)
+
+
+class _OldVersionLocator(CommandLocator):
+    """
+    A control service side locator which doesn't know about codecs, like
+    those of older control services.
+    """
+    @OldVersionCommand.responder
+    def version(self):
+        return {"major": 1}
+
+
 class PingTestsMixin(object):
     """
     Mixin for ``TestCase`` defining tests for an ``AMP`` protocol that
@@ -1185,46 +1838,116 @@ class CachingEncoderTests(SynchronousTestCase):
             [loads(wire_encode(TEST_DEPLOYMENT)),
              loads(wire_encode(NODE_STATE))])
 
-    def test_no_caching(self):
+    def test_caches(self):
         """
-        ``CachingEncoder.encode`` does not cache results by default.
+        ``CachingEncoder.encode`` caches the result of encoding a particular
+        object and counts how often the cache was used.
         """
         cache = CachingEncoder()
-        result1 = cache.encode(TEST_DEPLOYMENT)
-        result2 = cache.encode(NODE_STATE)
-
+        result = cache.encode(NODE_STATE)
+        misses = cache.misses
+        hits = cache.hits
         self.assertEqual(
-            [cache.encode(TEST_DEPLOYMENT) is not result1,
-             cache.encode(NODE_STATE) is not result2],
-            [True, True])
+            (True, misses, hits + 1),
+            (cache.encode(NODE_STATE) is result, cache.misses, cache.hits),
+        )
 
-    def test_caches(self):
+    def test_fragments(self):
         """
-        ``CachingEncoder.encode`` caches the result of ``wire_encode`` for a
-        particular object if used in context of ``cache()``.
+        When a state which differs from a previously encoded one only in one
+        node is encoded, the encodings of the other nodes are re-used.
         """
         cache = CachingEncoder()
-        with cache.cache():
-            # Warm up cache:
-            result1 = cache.encode(TEST_DEPLOYMENT)
-            result2 = cache.encode(NODE_STATE)
+        before = DeploymentState(nodes={NODE_STATE, SIMPLE_NODE_STATE})
+        cache.encode(before)
+        after = before.update_node(SIMPLE_NODE_STATE.set(hostname=u"x"))
+        misses = cache.misses
+        hits = cache.hits
+        result = cache.encode(after)
+        self.assertEqual(
+            (after, True, True),
+            (wire_decode(result),
+             # The new state, its set of nodes and the changed node and its
+             # children:
+             cache.misses - misses < 10,
+             # The unchanged node:
+             cache.hits - hits >= 1),
+        )
 
-            self.assertEqual(
-                [loads(result1) == loads(wire_encode(TEST_DEPLOYMENT)),
-                 loads(result2) == loads(wire_encode(NODE_STATE)),
-                 cache.encode(TEST_DEPLOYMENT) is result1,
-                 cache.encode(NODE_STATE) is result2],
-                [True, True, True, True])
+    def test_eviction(self):
+        """
+        ``CachingEncoder`` evicts encodings once it holds the given number of
+        them.
+        """
+        cache = CachingEncoder(size=5)
+        result = cache.encode(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (loads(wire_encode(TEST_DEPLOYMENT)), True),
+            (loads(result), cache.evictions > 0),
+        )
 
-    def test_after_caching(self):
+    def test_bytes_bounded(self):
         """
-        Once ``cache`` context is exited the caching no longer applies.
+        However many updated states are encoded, the total size of the
+        encodings ``CachingEncoder`` keeps stays within its ``max_bytes``,
+        while the encodings of the latest state are still re-used.
+        """
+        max_bytes = 4 * len(wire_encode(TEST_DEPLOYMENT))
+        cache = CachingEncoder(max_bytes=max_bytes)
+        state = DeploymentState(nodes={NODE_STATE, SIMPLE_NODE_STATE})
+        sizes = []
+        for i in range(200):
+            state = state.update_node(
+                SIMPLE_NODE_STATE.set(hostname=u"192.0.2.%d" % (i,))
+            )
+            result = cache.encode(state)
+            cache.encode(state, BINARY_CODEC)
+            sizes.append(cache.cached_bytes)
+        hits = cache.hits
+        cache.encode(state)
+        self.assertEqual(
+            (state, True, True, True),
+            (wire_decode(result), max(sizes) <= max_bytes,
+             cache.evictions > 0, cache.hits == hits + 1),
+        )
+
+    def test_too_large(self):
+        """
+        An encoding larger than ``max_bytes`` is not cached, though smaller
+        encodings of the objects it contains may be.
+        """
+        cache = CachingEncoder(max_bytes=10)
+        result = cache.encode(NODE_STATE)
+        self.assertEqual(
+            (loads(wire_encode(NODE_STATE)), True),
+            (loads(result), cache.cached_bytes <= 10),
+        )
+
+    def test_other_codec(self):
+        """
+        ``CachingEncoder.encode`` caches encodings with codecs other than
+        JSON separately.
         """
         cache = CachingEncoder()
-        with cache.cache():
-            result1 = cache.encode(TEST_DEPLOYMENT)
-            result2 = cache.encode(NODE_STATE)
+        json = cache.encode(NODE_STATE)
+        binary = cache.encode(NODE_STATE, BINARY_CODEC)
         self.assertEqual(
-            [cache.encode(TEST_DEPLOYMENT) is not result1,
-             cache.encode(NODE_STATE) is not result2],
-            [True, True])
+            (NODE_STATE, True, True),
+            (BINARY_CODEC.decode(binary), binary != json,
+             cache.encode(NODE_STATE, BINARY_CODEC) is binary),
+        )
+
+    def test_primitives(self):
+        """
+        ``CachingEncoder.encode`` encodes values which JSON represents
+        natively like ``wire_encode`` does.
+        """
+        cache = CachingEncoder()
+        values = [
+            u"\N{SNOWMAN}", b"bytes", 1, 2 ** 70, 1.5, True, False, None,
+            [{u"key": u"value"}],
+        ]
+        self.assertEqual(
+            [loads(wire_encode(value)) for value in values],
+            [loads(cache.encode(value)) for value in values],
+        )
@@ -7,6 +7,8 @@ from ..script import ControlOptions, ControlScript
 from ...testtools import MemoryCoreReactor, StandardOptionsTestsMixin
 from .._clusterstate import ClusterStateService
 from ..httpapi import REST_API_PORT
+from .._metrics import METRICS_PORT, MetricsResource
+from .._protocol import DEFAULT_MAX_STALENESS
 
 from ...ca.testtools import get_credential_sets
 
@@ -70,6 +72,47 @@ class ControlOptionsTests(StandardOptionsTestsMixin,
         options.parseOptions([b"--agent-port", b"tcp:1234"])
         self.assertEqual(options["agent-port"], b"tcp:1234")
 
+    def test_default_metrics_port(self):
+        """
+        By default ``ControlOptions`` configures the metrics endpoint to
+        listen on ``METRICS_PORT`` on the loopback interface only.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(
+            options["metrics-port"],
+            b'tcp:%d:interface=127.0.0.1' % (METRICS_PORT,),
+        )
+
+    def test_custom_metrics_port(self):
+        """
+        The ``--metrics-port`` command-line option allows configuring the
+        metrics endpoint.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--metrics-port", b"tcp:1234"])
+        self.assertEqual(options["metrics-port"], b"tcp:1234")
+
+    def test_default_agent_max_staleness(self):
+        """
+        The default maximum staleness of agent updates configured by
+        ``ControlOptions`` is ``DEFAULT_MAX_STALENESS``.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(
+            options["agent-max-staleness"], DEFAULT_MAX_STALENESS,
+        )
+
+    def test_custom_agent_max_staleness(self):
+        """
+        The ``--agent-max-staleness`` command-line option is converted to a
+        ``float``.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--agent-max-staleness", b"2.5"])
+        self.assertEqual(options["agent-max-staleness"], 2.5)
+
 
 class ControlScriptTests(SynchronousTestCase):
     """
@@ -118,3 +161,24 @@ class ControlScriptTests(SynchronousTestCase):
         service = control_resource._v1_user.cluster_state_service
         self.assertEqual((service.__class__, service.running),
                          (ClusterStateService, True))
+
+    def test_starts_metrics_service(self):
+        """
+        ``ControlScript.main`` serves the metrics of the AMP service on the
+        metrics port.
+        """
+        reactor = MemoryCoreReactor()
+        self.options.parseOptions([
+            b"--metrics-port", b"tcp:8003:interface=127.0.0.1",
+            b"--data-path", self.data_path.path,
+            b"--certificates-directory", self.certificate_path.path
+        ])
+        self.script.main(reactor, self.options)
+        [(port, factory, _, interface)] = [
+            server for server in reactor.tcpServers if server[0] == 8003
+        ]
+        resource = factory.resource.getStaticEntity(b"metrics")
+        self.assertEqual(
+            (interface, resource.__class__),
+            (b"127.0.0.1", MetricsResource),
+        )
@@ -73,6 +73,7 @@ class VolumePlugin(object):
     can't be sure they won't change things in minor ways. We do validate
     outputs to ensure we output the documented requirements.
     """
+    # How often to poll the cluster state when it can't be watched:
     _POLL_INTERVAL = 0.05
 
     app = Klein()
@@ -169,6 +170,26 @@ class VolumePlugin(object):
         creating.addCallback(lambda _: {u"Err": None})
         return creating
 
+    def _local_path(self, name, datasets):
+        """
+        Find the path of a volume if it is available locally.
+
+        :param unicode name: The name of the volume.
+        :param datasets: The ``DatasetState`` of each dataset in the cluster.
+
+        :return: The mountpoint ``FilePath``, or ``None`` if it is currently
+            unknown.
+        """
+        # If we ever get rid of dataset_id hashing hack we'll need to
+        # lookup the dataset by its metadata, not its id.
+        dataset_id = UUID(dataset_id_from_name(name))
+        for dataset in datasets:
+            if dataset.dataset_id == dataset_id:
+                if dataset.primary == self._node_id:
+                    return dataset.path
+                return None
+        return None
+
     def _get_path(self, name):
         """
         Return a volume's path if available.
@@ -178,19 +199,8 @@ class VolumePlugin(object):
         :return: ``Deferred`` that fires with the mountpoint ``FilePath``,
             or ``None`` if it is currently unknown.
         """
-        # If we ever get rid of dataset_id hashing hack we'll need to
-        # lookup the dataset by its metadata, not its id.
-        dataset_id = UUID(dataset_id_from_name(name))
         d = self._flocker_client.list_datasets_state()
-
-        def got_state(datasets):
-            datasets = [dataset for dataset in datasets
-                        if dataset.dataset_id == dataset_id]
-            if datasets and datasets[0].primary == self._node_id:
-                return datasets[0].path
-            else:
-                return None
-        d.addCallback(got_state)
+        d.addCallback(lambda datasets: self._local_path(name, datasets))
         return d
 
     @app.route("/VolumeDriver.Mount", methods=["POST"])
@@ -200,7 +210,9 @@ class VolumePlugin(object):
         Move a volume with the given name to the current node and mount it.
 
         Since we need to return the filesystem path we wait until the
-        dataset is mounted locally.
+        dataset is mounted locally, watching the cluster state for changes
+        rather than polling it, unless the control service doesn't support
+        watching.
 
         :param unicode Name: The name of the volume.
 
@@ -209,19 +221,22 @@ class VolumePlugin(object):
         dataset_id = UUID(dataset_id_from_name(Name))
         d = self._flocker_client.move_dataset(self._node_id, dataset_id)
 
-        def get_state(_=None):
-            getting_path = self._get_path(Name)
+        def watch_state(version=None):
+            watching = self._flocker_client.watch_datasets_state(version)
 
-            def got_path(path):
+            def got_state(listing):
+                path = self._local_path(Name, listing.datasets)
                 if path is None:
-                    return deferLater(
-                        self._reactor, self._POLL_INTERVAL, get_state)
+                    if listing.version is None:
+                        return deferLater(
+                            self._reactor, self._POLL_INTERVAL, watch_state)
+                    return watch_state(listing.version)
                 else:
                     return {u"Err": None,
                             u"Mountpoint": path.path}
-            getting_path.addCallback(got_path)
-            return getting_path
-        d.addCallback(get_state)
+            watching.addCallback(got_state)
+            return watching
+        d.addCallback(lambda _: watch_state())
         return d
 
     @app.route("/VolumeDriver.Path", methods=["POST"])
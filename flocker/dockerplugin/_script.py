@@ -18,7 +18,7 @@ from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, main_for_service)
 from ._api import VolumePlugin
 from ..node.script import get_configuration
-from ..apiclient import FlockerClient
+from ..apiclient import FlockerClient, connection_pool
 from ..control.httpapi import REST_API_PORT
 
 PLUGIN_PATH = FilePath("/run/docker/plugins/flocker/flocker.sock")
@@ -73,10 +73,13 @@ class DockerPluginScript(object):
 
         certificates_path = options["agent-config"].parent()
         control_port = options["rest-api-port"]
+        # Docker asks the plugin for volumes often and each request needs
+        # a few requests of the control service, so reuse connections:
         flocker_client = FlockerClient(reactor, control_host, control_port,
                                        certificates_path.child(b"cluster.crt"),
                                        certificates_path.child(b"plugin.crt"),
-                                       certificates_path.child(b"plugin.key"))
+                                       certificates_path.child(b"plugin.key"),
+                                       connection_pool(reactor))
 
         self._create_listening_directory(PLUGIN_PATH.parent())
         endpoint = serverFromString(
@@ -10,7 +10,7 @@ from twisted.web.http import OK
 from twisted.internet import reactor
 
 from .._api import VolumePlugin, DEFAULT_SIZE
-from ...apiclient import FakeFlockerClient, Dataset
+from ...apiclient import FakeFlockerClient, Dataset, DatasetStateListing
 from ...control._config import dataset_id_from_name
 
 from ...restapi.testtools import buildIntegrationTests, APIAssertionsMixin
@@ -135,9 +135,8 @@ class APITestsMixin(APIAssertionsMixin):
             self.NODE_B, DEFAULT_SIZE, metadata={u"name": name},
             dataset_id=dataset_id)
 
-        # After two polling intervals the dataset arrives as state:
-        reactor.callLater(VolumePlugin._POLL_INTERVAL,
-                          self.flocker_client.synchronize_state)
+        # A little later the dataset arrives as state:
+        reactor.callLater(0.05, self.flocker_client.synchronize_state)
 
         d.addCallback(lambda _:
                       self.assertResult(
@@ -151,6 +150,44 @@ class APITestsMixin(APIAssertionsMixin):
                             if d.dataset_id == dataset_id]))
         return d
 
+    def test_mount_unversioned(self):
+        """
+        ``/VolumeDriver.Mount`` polls the cluster state, rather than watching
+        it, if the listings of the state have no version.
+        """
+        name = u"myvol"
+        dataset_id = UUID(dataset_id_from_name(name))
+        watches = []
+
+        def watch_datasets_state(version=None):
+            watches.append(version)
+            listing = self.flocker_client.list_datasets_state()
+            listing.addCallback(
+                lambda datasets: DatasetStateListing(
+                    version=None, datasets=datasets))
+            return listing
+        self.patch(
+            self.flocker_client, "watch_datasets_state", watch_datasets_state)
+
+        d = self.flocker_client.create_dataset(
+            self.NODE_B, DEFAULT_SIZE, metadata={u"name": name},
+            dataset_id=dataset_id)
+
+        # After a few polling intervals the dataset arrives as state:
+        reactor.callLater(VolumePlugin._POLL_INTERVAL * 3,
+                          self.flocker_client.synchronize_state)
+
+        d.addCallback(lambda _:
+                      self.assertResult(
+                          b"POST", b"/VolumeDriver.Mount",
+                          {u"Name": name}, OK,
+                          {u"Err": None,
+                           u"Mountpoint": u"/flocker/{}".format(dataset_id)}))
+        # Each poll waited for the interval:
+        d.addCallback(lambda _: self.assertTrue(
+            1 < len(watches) <= 5, watches))
+        return d
+
     def test_path(self):
         """
         ``/VolumeDriver.Path`` returns the mount path of the given volume if
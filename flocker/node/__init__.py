@@ -5,7 +5,8 @@ Local node manager for Flocker.
 """
 
 from ._change import (
-    IStateChange, in_parallel, sequentially, run_state_change
+    IStateChange, IResourceStateChange, ChangeScheduler, in_parallel,
+    sequentially, run_state_change
 )
 
 from ._deploy import (
@@ -18,7 +19,7 @@ from .script import BackendDescription, DeployerType
 
 
 __all__ = [
-    'IDeployer', 'IStateChange',
+    'IDeployer', 'IStateChange', 'IResourceStateChange', 'ChangeScheduler',
     'P2PManifestationDeployer',
     'ApplicationNodeDeployer',
     'run_state_change', 'in_parallel', 'sequentially',
@@ -1,4 +1,5 @@
 # Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_change -*-
 
 """
 A library for implementing state changes on external systems in an isolated
@@ -11,14 +12,16 @@ More complex changes can be composed from individual ``IStateChange``
 providers.
 
 ``run_state_change`` can be used to execute such a complex collection of
-changes.
+changes.  It uses a ``ChangeScheduler`` to keep changes which use the same
+resources, as declared by ``IResourceStateChange`` providers, from running at
+the same time.
 """
 
 from zope.interface import Interface, Attribute, implementer
 
 from pyrsistent import PVector, PRecord, pvector, field
 
-from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
 
 from eliot.twisted import DeferredContext
 
@@ -57,7 +60,132 @@ class IStateChange(Interface):
         """
 
 
-def run_state_change(change, deployer):
+class IResourceStateChange(IStateChange):
+    """
+    An operation that changes local state and must not run at the same time
+    as other operations on the same resources.
+    """
+    resources = Attribute(
+        "A ``frozenset`` of hashable keys naming the resources (for example, "
+        "a particular dataset's volume) this change uses exclusively."
+    )
+
+
+class ChangeScheduler(object):
+    """
+    Run operations as concurrently as their resources allow.
+
+    Operations which share a resource are run one after the other, in the
+    order they were submitted; others are run at the same time, up to a
+    limit.
+
+    :ivar limit: The most operations to run at once, or ``None`` for no limit.
+    :ivar int _running: The number of operations running.
+    :ivar set _in_use: The resources of the operations running.
+    :ivar list _waiting: Tuples of the resources, function, arguments and
+        ``Deferred`` of each operation waiting to run, in submission order.
+    :ivar bool _starting: Whether ``_start_waiting`` is running.
+    :ivar bool _changed: Whether an operation has been submitted or has
+        finished since ``_start_waiting`` last looked at ``_waiting``.
+    """
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._running = 0
+        self._in_use = set()
+        self._waiting = []
+        self._starting = False
+        self._changed = False
+
+    def run(self, resources, f, *args, **kwargs):
+        """
+        Call a function once nothing else is using its resources.
+
+        :param resources: An iterable of hashable keys naming the resources
+            the function uses.
+        :param f: The function to call.  It may return a ``Deferred``, in
+            which case its resources are in use until that fires.
+        :param args: Positional arguments to pass to it.
+        :param kwargs: Keyword arguments to pass to it.
+
+        :return: A ``Deferred`` that fires with the result of ``f``.
+        """
+        result = Deferred()
+        self._waiting.append((frozenset(resources), f, args, kwargs, result))
+        self._start_waiting()
+        return result
+
+    def _start_waiting(self):
+        """
+        Start each waiting operation which can run.
+        """
+        self._changed = True
+        # Operations may finish, or submit more operations, as soon as they
+        # are started.  Rather than re-entering, look again afterwards.
+        if self._starting:
+            return
+        self._starting = True
+        try:
+            while self._changed:
+                self._changed = False
+                self._start_some()
+        finally:
+            self._starting = False
+
+    def _start_some(self):
+        """
+        Start the waiting operations which conflict neither with running
+        operations nor with earlier waiting ones.
+        """
+        waiting, self._waiting = self._waiting, []
+        blocked = set()
+        still_waiting = []
+        for operation in waiting:
+            resources = operation[0]
+            if ((self.limit is not None and self._running >= self.limit) or
+                    not resources.isdisjoint(self._in_use) or
+                    not resources.isdisjoint(blocked)):
+                # Later operations on the same resources must wait their
+                # turn behind this one.
+                blocked |= resources
+                still_waiting.append(operation)
+            else:
+                self._start(*operation)
+        self._waiting = still_waiting + self._waiting
+
+    def _start(self, resources, f, args, kwargs, result):
+        """
+        Run an operation, releasing its resources once it is done.
+        """
+        self._running += 1
+        self._in_use |= resources
+
+        def finished(passthrough):
+            self._running -= 1
+            self._in_use -= resources
+            self._start_waiting()
+            return passthrough
+        running = maybeDeferred(f, *args, **kwargs)
+        running.addBoth(finished)
+        running.chainDeferred(result)
+
+
+def _run_leaf_change(change, action, deployer):
+    """
+    Run an ``IStateChange`` within its Eliot action.
+
+    :param IStateChange change: The change to run.
+    :param action: The change's Eliot action.
+    :param IDeployer deployer: The ``IDeployer`` to use.
+
+    :return: ``Deferred`` firing when the change is done.
+    """
+    with action.context():
+        context = DeferredContext(maybeDeferred(change.run, deployer))
+        context.addActionFinish()
+        return context.result
+
+
+def run_state_change(change, deployer, scheduler=None):
     """
     Apply the change to local state.
 
@@ -66,12 +194,17 @@ def run_state_change(change, deployer):
     :param IDeployer deployer: The ``IDeployer`` to use.  Specific
         ``IStateChange`` providers may require specific ``IDeployer`` providers
         that provide relevant functionality for applying the change.
+    :param ChangeScheduler scheduler: The scheduler with which to run each
+        individual ``IStateChange``, or ``None`` to use a new one without a
+        limit.
 
     :return: ``Deferred`` firing when the change is done.
     """
+    if scheduler is None:
+        scheduler = ChangeScheduler()
     if isinstance(change, _InParallel):
         return gather_deferreds(list(
-            run_state_change(subchange, deployer)
+            run_state_change(subchange, deployer, scheduler)
             for subchange in change.changes
         ))
     if isinstance(change, _Sequentially):
@@ -79,15 +212,19 @@ def run_state_change(change, deployer):
         for subchange in change.changes:
             d.addCallback(
                 lambda _, subchange=subchange: run_state_change(
-                    subchange, deployer
+                    subchange, deployer, scheduler
                 )
             )
         return d
 
-    with change.eliot_action.context():
-        context = DeferredContext(maybeDeferred(change.run, deployer))
-        context.addActionFinish()
-        return context.result
+    resources = frozenset()
+    if IResourceStateChange.providedBy(change):
+        resources = change.resources
+    # Start the action now so that it is logged in the context of the caller
+    # even if the change has to wait for its resources.
+    return scheduler.run(
+        resources, _run_leaf_change, change, change.eliot_action, deployer,
+    )
 
 
 # run_state_change doesn't use the IStateChange implementation provided by
@@ -19,20 +19,22 @@ from zope.interface import implementer
 from eliot import ActionType, Field, writeFailure, MessageType
 from eliot.twisted import DeferredContext
 
-from characteristic import attributes
+from characteristic import attributes, Attribute
 
 from machinist import (
     trivialInput, TransitionTable, constructFiniteStateMachine,
     MethodSuffixOutputer,
 )
 
-from twisted.application.service import MultiService
+from twisted.application.service import MultiService, Service
 from twisted.python.constants import Names, NamedConstant
+from twisted.python.runtime import platform
 from twisted.internet.defer import succeed, maybeDeferred
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.protocols.tls import TLSMemoryBIOFactory
 
 from . import run_state_change
+from ._change import ChangeScheduler, _InParallel, _Sequentially
 
 from ..common import gather_deferreds
 from ..control import (
@@ -40,6 +42,21 @@ from ..control import (
 )
 
 
+# The delay, in seconds, before the next iteration of the convergence loop
+# after an iteration that did some work, and the initial delay once the loop
+# starts to back off:
+MIN_SLEEP = 1.0
+
+# The default ceiling, in seconds, on the delay between iterations of the
+# convergence loop while nothing is changing:
+DEFAULT_MAX_SLEEP = 30.0
+
+# The most state changes run at once by an iteration of the convergence loop,
+# so that bringing up many datasets at once doesn't exceed storage API rate
+# limits:
+MAX_CONCURRENT_CHANGES = 20
+
+
 class ClusterStatusInputs(Names):
     """
     Inputs to the cluster status state machine.
@@ -201,6 +218,9 @@ class ConvergenceLoopInputs(Names):
     # Finished applying necessary changes to local state, a single
     # iteration of the convergence loop:
     ITERATION_DONE = NamedConstant()
+    # Local state has probably changed, so the next iteration should start
+    # as soon as possible:
+    WAKEUP = NamedConstant()
 
 
 @attributes(["client", "configuration", "state"])
@@ -238,6 +258,9 @@ class ConvergenceLoopOutputs(Names):
     STORE_INFO = NamedConstant()
     # Start an iteration of the covergence loop:
     CONVERGE = NamedConstant()
+    # Start the next iteration of the convergence loop without waiting for
+    # the delay since the previous one to pass:
+    WAKE = NamedConstant()
 
 
 _FIELD_CONNECTION = Field(
@@ -275,6 +298,28 @@ LOG_CALCULATED_ACTIONS = MessageType(
     u"flocker:agent:converge:actions", [_FIELD_ACTIONS],
     "The actions we're going to attempt.")
 
+_FIELD_SLEEP = Field.forTypes(
+    u"sleep", [float],
+    "The delay, in seconds, before the next iteration.")
+
+LOG_SCHEDULE_ITERATION = MessageType(
+    u"flocker:agent:converge:schedule", [_FIELD_SLEEP],
+    "The next iteration of the convergence loop has been scheduled.")
+
+
+def _is_no_op(change):
+    """
+    Determine whether an ``IStateChange`` is known to do nothing at all.
+
+    :param IStateChange change: The change to inspect.
+
+    :return: ``True`` if ``change`` only combines other changes and all of
+        those do nothing, ``False`` otherwise.
+    """
+    if isinstance(change, (_InParallel, _Sequentially)):
+        return all(_is_no_op(sub_change) for sub_change in change.changes)
+    return False
+
 
 class ConvergenceLoop(object):
     """
@@ -296,19 +341,39 @@ class ConvergenceLoop(object):
         acknowledged by the control service over the most recent connection
         to the control service.
     :type _last_acknowledged_state: tuple of IClusterStateChange
+
+    :ivar float max_sleep: The longest delay, in seconds, between iterations
+        while nothing is changing.
+
+    :ivar float _idle_sleep: The delay before the next iteration if the
+        current one turns out to do nothing.  It doubles after each such
+        iteration, up to ``max_sleep``.
+
+    :ivar _sleeping: The ``IDelayedCall`` that will start the next iteration,
+        or ``None`` if an iteration is in progress.
+
+    :ivar bool _woken: Whether something may have changed since the current
+        iteration started, so the next one should start without delay.
     """
-    def __init__(self, reactor, deployer):
+    def __init__(self, reactor, deployer, max_sleep=DEFAULT_MAX_SLEEP):
         """
         :param IReactorTime reactor: Used to schedule delays in the loop.
 
         :param IDeployer deployer: Used to discover local state and calculate
             necessary changes to match desired configuration.
+
+        :param float max_sleep: The longest delay, in seconds, between
+            iterations while nothing is changing.
         """
         self.reactor = reactor
         self.deployer = deployer
+        self.max_sleep = max_sleep
         self.cluster_state = None
         self.client = None
         self._last_acknowledged_state = None
+        self._idle_sleep = MIN_SLEEP
+        self._sleeping = None
+        self._woken = False
 
     def output_STORE_INFO(self, context):
         old_client = self.client
@@ -319,6 +384,15 @@ class ConvergenceLoop(object):
             # one update using the new client.
             self._last_acknowledged_state = None
 
+    def output_WAKE(self, context):
+        self._idle_sleep = MIN_SLEEP
+        if self._sleeping is None:
+            # An iteration is in progress; start the next one as soon as it
+            # is done.
+            self._woken = True
+        else:
+            self._sleeping.reset(0)
+
     def _send_state_to_control_service(self, state_changes):
         context = LOG_SEND_TO_CONTROL_SERVICE(
             self.fsm.logger, connection=self.client,
@@ -360,7 +434,37 @@ class ConvergenceLoop(object):
         else:
             return succeed(None)
 
+    def _iteration_done(self):
+        self._sleeping = None
+        self.fsm.receive(ConvergenceLoopInputs.ITERATION_DONE)
+
+    def _schedule_iteration_done(self, busy):
+        """
+        Schedule the next iteration of the convergence loop.
+
+        Iterations follow each other quickly while they have work to do or
+        something has woken the loop.  Otherwise the delay doubles after each
+        iteration, up to ``max_sleep``.
+
+        :param bool busy: Whether the iteration that just finished did any
+            work.
+        """
+        if self._woken:
+            sleep = 0.0
+        elif busy:
+            sleep = MIN_SLEEP
+            self._idle_sleep = MIN_SLEEP
+        else:
+            sleep = self._idle_sleep
+            self._idle_sleep = min(self._idle_sleep * 2, self.max_sleep)
+        self._woken = False
+        LOG_SCHEDULE_ITERATION(sleep=sleep).write(self.fsm.logger)
+        # Scheduling the input, rather than delivering it right away, also
+        # keeps the state machine from being re-entered from its own output.
+        self._sleeping = self.reactor.callLater(sleep, self._iteration_done)
+
     def output_CONVERGE(self, context):
+        self._woken = False
         known_local_state = self.cluster_state.get_node(
             self.deployer.node_uuid, hostname=self.deployer.hostname)
 
@@ -383,6 +487,7 @@ class ConvergenceLoop(object):
 
             # XXX And for this update to be the side-effect of an output
             # resulting.
+            changed = self._last_acknowledged_state != state_changes
             sent_state = self._maybe_send_state_to_control_service(
                 state_changes)
 
@@ -391,36 +496,40 @@ class ConvergenceLoop(object):
             )
             LOG_CALCULATED_ACTIONS(calculated_actions=action).write(
                 self.fsm.logger)
-            ran_state_change = run_state_change(action, self.deployer)
+            ran_state_change = run_state_change(
+                action, self.deployer,
+                ChangeScheduler(limit=MAX_CONCURRENT_CHANGES),
+            )
             DeferredContext(ran_state_change).addErrback(
                 writeFailure, self.fsm.logger)
 
             # Wait for the control node to acknowledge the new
             # state, and for the convergence actions to run.
-            return gather_deferreds([sent_state, ran_state_change])
+            gathered = gather_deferreds([sent_state, ran_state_change])
+            gathered.addCallback(
+                lambda _: changed or not _is_no_op(action)
+            )
+            return gathered
         d.addCallback(got_local_state)
 
         # If an error occurred we just want to log it and then try
-        # converging again; hopefully next time we'll have more success.
-        d.addErrback(writeFailure, self.fsm.logger)
+        # converging again soon; hopefully next time we'll have more
+        # success.
+        def failed(reason):
+            writeFailure(reason, self.fsm.logger)
+            return True
+        d.addErrback(failed)
 
         # It would be better to have a "quiet time" state in the FSM and
         # transition to that next, then have a timeout input kick the machine
-        # back around to the beginning of the loop in the FSM.  However, we're
-        # not going to keep this sleep-for-a-bit solution in the long term.
-        # Instead, we'll be more event driven.  So just going with the simple
-        # solution and inserting a side-effect-y delay directly here.
-
-        d.addCallback(
-            lambda _:
-                self.reactor.callLater(
-                    1.0, self.fsm.receive, ConvergenceLoopInputs.ITERATION_DONE
-                )
-        )
+        # back around to the beginning of the loop in the FSM.  Instead the
+        # delay is a side-effect which the WAKE output can cut short.
+        d.addCallback(self._schedule_iteration_done)
         d.addActionFinish()
 
 
-def build_convergence_loop_fsm(reactor, deployer):
+def build_convergence_loop_fsm(reactor, deployer,
+                               max_sleep=DEFAULT_MAX_SLEEP):
     """
     Create a convergence loop FSM.
 
@@ -428,27 +537,40 @@ def build_convergence_loop_fsm(reactor, deployer):
 
     :param IDeployer deployer: Used to discover local state and calcualte
         necessary changes to match desired configuration.
+
+    :param float max_sleep: The longest delay, in seconds, between iterations
+        while nothing is changing.
     """
     I = ConvergenceLoopInputs
     O = ConvergenceLoopOutputs
     S = ConvergenceLoopStates
 
     table = TransitionTable()
-    table = table.addTransition(
-        S.STOPPED, I.STATUS_UPDATE, [O.STORE_INFO, O.CONVERGE], S.CONVERGING)
+    table = table.addTransitions(
+        S.STOPPED, {
+            I.STATUS_UPDATE: ([O.STORE_INFO, O.CONVERGE], S.CONVERGING),
+            # There is nothing to wake up:
+            I.WAKEUP: ([], S.STOPPED),
+        })
     table = table.addTransitions(
         S.CONVERGING, {
-            I.STATUS_UPDATE: ([O.STORE_INFO], S.CONVERGING),
-            I.STOP: ([], S.CONVERGING_STOPPING),
+            # New configuration or cluster state may need acting on, so
+            # don't wait for the delay between iterations:
+            I.STATUS_UPDATE: ([O.STORE_INFO, O.WAKE], S.CONVERGING),
+            I.WAKEUP: ([O.WAKE], S.CONVERGING),
+            # Stop once the current iteration is done, rather than after
+            # the delay:
+            I.STOP: ([O.WAKE], S.CONVERGING_STOPPING),
             I.ITERATION_DONE: ([O.CONVERGE], S.CONVERGING),
         })
     table = table.addTransitions(
         S.CONVERGING_STOPPING, {
-            I.STATUS_UPDATE: ([O.STORE_INFO], S.CONVERGING),
+            I.STATUS_UPDATE: ([O.STORE_INFO, O.WAKE], S.CONVERGING),
+            I.WAKEUP: ([], S.CONVERGING_STOPPING),
             I.ITERATION_DONE: ([], S.STOPPED),
         })
 
-    loop = ConvergenceLoop(reactor, deployer)
+    loop = ConvergenceLoop(reactor, deployer, max_sleep)
     fsm = constructFiniteStateMachine(
         inputs=I, outputs=O, states=S, initial=S.STOPPED, table=table,
         richInputs=[_ClientStatusUpdate], inputContext={},
@@ -457,8 +579,53 @@ def build_convergence_loop_fsm(reactor, deployer):
     return fsm
 
 
+class LocalChangeService(Service, object):
+    """
+    Service that watches directories for entries being added or removed and
+    reports each change.  For example, udev adds and removes nodes in
+    ``/dev`` as block devices are attached to and detached from the host.
+
+    ``twisted.internet.inotify`` can't be imported where the C library
+    lacks ``inotify``, so it is only imported once the service starts.
+
+    :ivar reactor: The reactor, which must support ``inotify``.
+    :ivar paths: ``FilePath``\ s of the directories to watch.
+    :ivar changed: A no-argument callable called on each change.
+    """
+    def __init__(self, reactor, paths, changed):
+        self.reactor = reactor
+        self.paths = paths
+        self.changed = changed
+        self._notifier = None
+
+    def _notify(self, ignored, path, mask):
+        self.changed()
+
+    def startService(self):
+        from twisted.internet.inotify import (
+            INotify, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO,
+        )
+        Service.startService(self)
+        self._notifier = INotify(self.reactor)
+        self._notifier.startReading()
+        # Changes to the entries of watched directories that suggest local
+        # state has changed:
+        mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        for path in self.paths:
+            self._notifier.watch(path, mask=mask, callbacks=[self._notify])
+
+    def stopService(self):
+        Service.stopService(self)
+        self._notifier.loseConnection()
+        self._notifier = None
+
+
 @implementer(IConvergenceAgent)
-@attributes(["reactor", "deployer", "host", "port"])
+@attributes([
+    "reactor", "deployer", "host", "port",
+    Attribute("max_sleep", default_value=DEFAULT_MAX_SLEEP),
+    Attribute("watch_paths", default_value=()),
+])
 class AgentLoopService(MultiService, object):
     """
     Service in charge of running the convergence loop.
@@ -468,6 +635,12 @@ class AgentLoopService(MultiService, object):
             then changing it.
     :ivar host: Host to connect to.
     :ivar port: Port to connect to.
+    :ivar float max_sleep: The longest delay, in seconds, between iterations
+        of the convergence loop while nothing is changing.
+    :ivar watch_paths: ``FilePath``\ s of directories whose entries being
+        added or removed wakes up the convergence loop.  They are only
+        watched where ``inotify`` is supported; elsewhere the loop relies on
+        ``max_sleep`` alone.
     :ivar cluster_status: A cluster status FSM.
     :ivar factory: The factory used to connect to the control service.
     :ivar reconnecting_factory: The underlying factory used to connect to
@@ -479,11 +652,15 @@ class AgentLoopService(MultiService, object):
         :param context_factory: TLS context factory for the AMP client.
         """
         MultiService.__init__(self)
-        convergence_loop = build_convergence_loop_fsm(
-            self.reactor, self.deployer
+        self.convergence_loop = convergence_loop = build_convergence_loop_fsm(
+            self.reactor, self.deployer, self.max_sleep,
         )
         self.logger = convergence_loop.logger
         self.cluster_status = build_cluster_status_fsm(convergence_loop)
+        if self.watch_paths and platform.supportsINotify():
+            LocalChangeService(
+                self.reactor, self.watch_paths, self.local_changed,
+            ).setServiceParent(self)
         self.reconnecting_factory = ReconnectingClientFactory.forProtocol(
             lambda: AgentAMP(self.reactor, self)
         )
@@ -499,6 +676,13 @@ class AgentLoopService(MultiService, object):
         self.reconnecting_factory.stopTrying()
         self.cluster_status.receive(ClusterStatusInputs.SHUTDOWN)
 
+    def local_changed(self):
+        """
+        Wake up the convergence loop because local state has probably
+        changed.
+        """
+        self.convergence_loop.receive(ConvergenceLoopInputs.WAKEUP)
+
     # IConvergenceAgent methods:
 
     def connected(self, client):
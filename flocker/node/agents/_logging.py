@@ -101,6 +101,17 @@ WAITING_FOR_VOLUME_STATUS_CHANGE = MessageType(
     [VOLUME_ID, STATUS, TARGET_STATUS, NEEDS_ATTACH_DATA, WAIT_TIME],
     u"Waiting for a volume to reach target status.",)
 
+VOLUME_IDS = Field.for_types(
+    u"volume_ids", [list],
+    u"The identifiers of the volumes of interest.")
+POLL_INTERVAL = Field.for_types(
+    u"interval", [float],
+    u"Time, in seconds, until the volumes are polled again.")
+POLLED_VOLUME_STATUS = MessageType(
+    u"flocker:node:agents:blockdevice:aws:volume_status_poll",
+    [VOLUME_IDS, POLL_INTERVAL],
+    u"Polled the status of all the volumes operations are waiting for.",)
+
 BOTO_LOG_HEADER = u'flocker:node:agents:blockdevice:aws:boto_logs'
 # End: Helper datastructures used by AWS storage driver.
 
@@ -160,4 +171,10 @@ OPENSTACK_ACTION = ActionType(
     u"storage driver.")
 
 CINDER_CREATE = u'flocker:node:agents:blockdevice:openstack:create_volume'
+
+POLLED_CINDER_VOLUME_STATUS = MessageType(
+    u"flocker:node:agents:blockdevice:openstack:volume_status_poll",
+    [VOLUME_IDS, POLL_INTERVAL],
+    u"Listed the Cinder volumes to find the status of all the volumes "
+    u"operations are waiting for.",)
 # End: Helper datastructures used by OpenStack storage driver.
@@ -7,10 +7,12 @@ convergence agent that can be re-used against many different kinds of block
 devices.
 """
 
+import os
 from uuid import UUID, uuid4
 from subprocess import CalledProcessError, check_output, STDOUT
 from stat import S_IRWXU, S_IRWXG, S_IRWXO
 from errno import EEXIST
+from select import poll, POLLPRI, POLLERR
 
 from bitmath import GiB
 
@@ -19,18 +21,22 @@ from eliot.serializers import identity
 
 from zope.interface import implementer, Interface
 
-from pyrsistent import PRecord, field
+from pyrsistent import PRecord, PClass, field
 from characteristic import attributes
 
 import psutil
 
 from twisted.python.reflect import safe_repr
-from twisted.internet.defer import succeed, fail, gatherResults
+from twisted.internet.defer import (
+    succeed, fail, gatherResults, maybeDeferred,
+)
+from twisted.internet.utils import getProcessOutputAndValue
 from twisted.python.filepath import FilePath
 from twisted.python.components import proxyForInterface
 
 from .. import (
-    IDeployer, IStateChange, sequentially, in_parallel, run_state_change
+    IDeployer, IResourceStateChange, sequentially, in_parallel,
+    run_state_change,
 )
 from .._deploy import NotInUseDatasets
 
@@ -284,6 +290,33 @@ INVALID_DEVICE_PATH = MessageType(
     u"invalid.",
 )
 
+CACHE_NAME = Field.forTypes(
+    u"cache", [unicode],
+    u"The name of a cache of discovered state.",
+)
+
+CACHE_HITS = Field.forTypes(
+    u"hits", [int],
+    u"The number of lookups answered from a cache so far.",
+)
+
+CACHE_MISSES = Field.forTypes(
+    u"misses", [int],
+    u"The number of lookups which had to load the value so far.",
+)
+
+CACHE_INVALIDATIONS = Field.forTypes(
+    u"invalidations", [int],
+    u"The number of times a cached value was discarded because of a change "
+    u"made through the cache so far.",
+)
+
+CACHE_MISS = MessageType(
+    u"agent:blockdevice:cache:miss",
+    [CACHE_NAME, CACHE_HITS, CACHE_MISSES, CACHE_INVALIDATIONS],
+    u"A cache of discovered state had to load the value.",
+)
+
 
 def _volume_field():
     """
@@ -339,9 +372,20 @@ def _blockdevice_volume_from_datasetid(volumes, dataset_id):
             return volume
 
 
+def _dataset_resources(dataset_id):
+    """
+    :param UUID dataset_id: The identifier of a dataset.
+
+    :return: The ``IResourceStateChange.resources`` of a change to the
+        dataset's volume, so that changes to the same volume are not run at
+        the same time while changes to different volumes are.
+    """
+    return frozenset([(u"dataset", dataset_id)])
+
+
 # Get rid of this in favor of calculating each individual operation in
 # BlockDeviceDeployer.calculate_changes.  FLOC-1772
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class DestroyBlockDeviceDataset(PRecord):
     """
     Destroy the volume for a dataset with a primary manifestation on the node
@@ -360,6 +404,10 @@ class DestroyBlockDeviceDataset(PRecord):
             _logger, dataset_id=self.dataset_id
         )
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.dataset_id)
+
     def run(self, deployer):
         volume = _blockdevice_volume_from_datasetid(
             deployer.block_device_api.list_volumes(), self.dataset_id
@@ -379,7 +427,7 @@ class DestroyBlockDeviceDataset(PRecord):
         )
 
 
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class CreateFilesystem(PRecord):
     """
     Create a filesystem on a block device.
@@ -398,6 +446,10 @@ class CreateFilesystem(PRecord):
             _logger, volume=self.volume, filesystem_type=self.filesystem
         )
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.volume.dataset_id)
+
     def run(self, deployer):
         # FLOC-1816 Make this asynchronous
         device = deployer.block_device_api.get_device_path(
@@ -462,7 +514,7 @@ def _valid_size(size):
     )
 
 
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class MountBlockDevice(PRecord):
     """
     Mount the filesystem mounted from the block device backed by a particular
@@ -480,6 +532,10 @@ class MountBlockDevice(PRecord):
     def eliot_action(self):
         return MOUNT_BLOCK_DEVICE(_logger, dataset_id=self.dataset_id)
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.dataset_id)
+
     def run(self, deployer):
         """
         Run the system ``mount`` tool to mount this change's volume's block
@@ -529,7 +585,7 @@ class MountBlockDevice(PRecord):
         return succeed(None)
 
 
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class UnmountBlockDevice(PRecord):
     """
     Unmount the filesystem mounted from the block device backed by a particular
@@ -544,6 +600,10 @@ class UnmountBlockDevice(PRecord):
     def eliot_action(self):
         return UNMOUNT_BLOCK_DEVICE(_logger, dataset_id=self.dataset_id)
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.dataset_id)
+
     def run(self, deployer):
         """
         Run the system ``unmount`` tool to unmount this change's volume's block
@@ -575,7 +635,7 @@ class UnmountBlockDevice(PRecord):
         return listing
 
 
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class AttachVolume(PRecord):
     """
     Attach an unattached volume to this node (the node of the deployer it is
@@ -590,6 +650,10 @@ class AttachVolume(PRecord):
     def eliot_action(self):
         return ATTACH_VOLUME(_logger, dataset_id=self.dataset_id)
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.dataset_id)
+
     def run(self, deployer):
         """
         Use the deployer's ``IBlockDeviceAPI`` to attach the volume.
@@ -616,7 +680,7 @@ class AttachVolume(PRecord):
         return attaching
 
 
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class DetachVolume(PRecord):
     """
     Detach a volume from the node it is currently attached to.
@@ -630,6 +694,10 @@ class DetachVolume(PRecord):
     def eliot_action(self):
         return DETACH_VOLUME(_logger, dataset_id=self.dataset_id)
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.dataset_id)
+
     def run(self, deployer):
         """
         Use the deployer's ``IBlockDeviceAPI`` to detach the volume.
@@ -650,7 +718,7 @@ class DetachVolume(PRecord):
         return detaching
 
 
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class DestroyVolume(PRecord):
     """
     Destroy the storage (and therefore contents) of a volume.
@@ -663,6 +731,10 @@ class DestroyVolume(PRecord):
     def eliot_action(self):
         return DESTROY_VOLUME(_logger, volume=self.volume)
 
+    @property
+    def resources(self):
+        return _dataset_resources(self.volume.dataset_id)
+
     def run(self, deployer):
         """
         Use the deployer's ``IBlockDeviceAPI`` to destroy the volume.
@@ -713,7 +785,7 @@ def check_allocatable_size(allocation_unit, requested_size):
 
 # Get rid of this in favor of calculating each individual operation in
 # BlockDeviceDeployer.calculate_changes.  FLOC-1771
-@implementer(IStateChange)
+@implementer(IResourceStateChange)
 class CreateBlockDeviceDataset(PRecord):
     """
     An operation to create a new dataset on a newly created volume with a newly
@@ -732,58 +804,85 @@ class CreateBlockDeviceDataset(PRecord):
             dataset=self.dataset, mountpoint=self.mountpoint
         )
 
+    @property
+    def resources(self):
+        return _dataset_resources(UUID(self.dataset.dataset_id))
+
     def run(self, deployer):
         """
         Create a block device, attach it to the local host, create an ``ext4``
         filesystem on the device and mount it.
 
-        Operations are performed synchronously.
+        The volume is created and attached using the deployer's
+        ``IBlockDeviceAsyncAPI`` so that many datasets can be created at
+        once.
 
         See ``IStateChange.run`` for general argument and return type
         documentation.
 
-        :returns: An already fired ``Deferred`` with result ``None`` or a
-            failed ``Deferred`` with a ``DatasetExists`` exception if a
-            blockdevice with the required dataset_id already exists.
+        :returns: A ``Deferred`` that fires with ``None``, or fails with a
+            ``DatasetExists`` exception if a blockdevice with the required
+            dataset_id already exists.
         """
-        api = deployer.block_device_api
-        try:
-            check_for_existing_dataset(api, UUID(hex=self.dataset.dataset_id))
-        except:
-            return fail()
-
-        volume = api.create_volume(
-            dataset_id=UUID(self.dataset.dataset_id),
-            size=allocated_size(
-                allocation_unit=api.allocation_unit(),
-                requested_size=self.dataset.maximum_size,
-            ),
-        )
-
-        # This duplicates AttachVolume now.
-        volume = api.attach_volume(
-            volume.blockdevice_id,
-            attach_to=api.compute_instance_id(),
-        )
-        device = api.get_device_path(volume.blockdevice_id)
+        api = deployer.async_block_device_api
+        dataset_id = UUID(hex=self.dataset.dataset_id)
 
-        create = CreateFilesystem(volume=volume, filesystem=u"ext4")
-        d = run_state_change(create, deployer)
+        listing = api.list_volumes()
 
-        mount = MountBlockDevice(dataset_id=UUID(hex=self.dataset.dataset_id),
-                                 mountpoint=self.mountpoint)
-        d.addCallback(lambda _: run_state_change(mount, deployer))
+        def listed(volumes):
+            for volume in volumes:
+                if volume.dataset_id == dataset_id:
+                    raise DatasetExists(volume)
+            return gatherResults([
+                api.allocation_unit(), api.compute_instance_id(),
+            ])
+        d = listing.addCallback(listed)
+
+        def create((allocation_unit, compute_instance_id)):
+            creating = api.create_volume(
+                dataset_id=dataset_id,
+                size=allocated_size(
+                    allocation_unit=allocation_unit,
+                    requested_size=self.dataset.maximum_size,
+                ),
+            )
+            # This duplicates AttachVolume now.
+            creating.addCallback(
+                lambda volume: api.attach_volume(
+                    volume.blockdevice_id, attach_to=compute_instance_id,
+                )
+            )
+            return creating
+        d.addCallback(create)
+
+        def attached(volume):
+            finding = api.get_device_path(volume.blockdevice_id)
+            finding.addCallback(lambda device: (volume, device))
+            return finding
+        d.addCallback(attached)
+
+        def initialize((volume, device)):
+            create = CreateFilesystem(volume=volume, filesystem=u"ext4")
+            initializing = run_state_change(create, deployer)
+
+            mount = MountBlockDevice(dataset_id=dataset_id,
+                                     mountpoint=self.mountpoint)
+            initializing.addCallback(
+                lambda _: run_state_change(mount, deployer)
+            )
 
-        def passthrough(result):
-            BLOCK_DEVICE_DATASET_CREATED(
-                block_device_path=device,
-                block_device_id=volume.blockdevice_id,
-                dataset_id=volume.dataset_id,
-                block_device_size=volume.size,
-                block_device_compute_instance_id=volume.attached_to,
-            ).write(_logger)
-            return result
-        d.addCallback(passthrough)
+            def passthrough(result):
+                BLOCK_DEVICE_DATASET_CREATED(
+                    block_device_path=device,
+                    block_device_id=volume.blockdevice_id,
+                    dataset_id=volume.dataset_id,
+                    block_device_size=volume.size,
+                    block_device_compute_instance_id=volume.attached_to,
+                ).write(_logger)
+                return result
+            initializing.addCallback(passthrough)
+            return initializing
+        d.addCallback(initialize)
         return d
 
 
@@ -1272,6 +1371,23 @@ class LoopbackBlockDeviceAPI(object):
         See ``IBlockDeviceAPI.attach_volume`` for parameter and return type
         documentation.
         """
+        attached_volume, new_path = self._move_to_attached(
+            blockdevice_id, attach_to
+        )
+        self._allocate_device(new_path)
+        return attached_volume
+
+    def _move_to_attached(self, blockdevice_id, attach_to):
+        """
+        Move an existing ``unattached`` file into a per-node directory.
+
+        :param unicode blockdevice_id: The unique identifier of the volume.
+        :param unicode attach_to: The identifier of the node to attach it to.
+
+        :raises AlreadyAttachedVolume: If the volume is already attached.
+        :returns: A 2-tuple of the attached ``BlockDeviceVolume`` and the
+            ``FilePath`` of its backing file.
+        """
         volume = get_blockdevice_volume(self, blockdevice_id)
         filename = _backing_file_name(volume)
         if volume.attached_to is None:
@@ -1285,28 +1401,33 @@ class LoopbackBlockDeviceAPI(object):
                 pass
             new_path = host_directory.child(filename)
             old_path.moveTo(new_path)
-            self._allocate_device(new_path)
-            attached_volume = volume.set(attached_to=attach_to)
-            return attached_volume
+            return volume.set(attached_to=attach_to), new_path
 
         raise AlreadyAttachedVolume(blockdevice_id)
 
-    def detach_volume(self, blockdevice_id):
+    def _attached_volume(self, blockdevice_id):
         """
-        Move an existing file from a per-host directory into the ``unattached``
-        directory and release the loopback device backed by that file.
+        :param unicode blockdevice_id: The unique identifier of the volume.
+
+        :raises UnattachedVolume: If the volume isn't attached.
+        :returns: A 2-tuple of the ``BlockDeviceVolume`` and the ``FilePath``
+            of its backing file.
         """
         volume = get_blockdevice_volume(self, blockdevice_id)
         if volume.attached_to is None:
             raise UnattachedVolume(blockdevice_id)
+        return volume, self._attached_directory.descendant([
+            volume.attached_to.encode("ascii"),
+            _backing_file_name(volume),
+        ])
 
-        # ``losetup --detach`` only if the file was used for a loop device.
-        if self.get_device_path(blockdevice_id) is not None:
-            check_output([
-                b"losetup", b"--detach",
-                self.get_device_path(blockdevice_id).path
-            ])
+    def _move_to_unattached(self, volume):
+        """
+        Move the backing file of an attached volume into the ``unattached``
+        directory.
 
+        :param BlockDeviceVolume volume: The attached volume.
+        """
         filename = _backing_file_name(volume)
         volume_path = self._attached_directory.descendant([
             volume.attached_to.encode("ascii"),
@@ -1317,6 +1438,22 @@ class LoopbackBlockDeviceAPI(object):
         )
         volume_path.moveTo(new_path)
 
+    def detach_volume(self, blockdevice_id):
+        """
+        Move an existing file from a per-host directory into the ``unattached``
+        directory and release the loopback device backed by that file.
+        """
+        volume, _ = self._attached_volume(blockdevice_id)
+
+        # ``losetup --detach`` only if the file was used for a loop device.
+        if self.get_device_path(blockdevice_id) is not None:
+            check_output([
+                b"losetup", b"--detach",
+                self.get_device_path(blockdevice_id).path
+            ])
+
+        self._move_to_unattached(volume)
+
     def list_volumes(self):
         """
         Return ``BlockDeviceVolume`` instances for all the files in the
@@ -1352,14 +1489,7 @@ class LoopbackBlockDeviceAPI(object):
         return volumes
 
     def get_device_path(self, blockdevice_id):
-        volume = get_blockdevice_volume(self, blockdevice_id)
-        if volume.attached_to is None:
-            raise UnattachedVolume(blockdevice_id)
-
-        volume_path = self._attached_directory.descendant(
-            [volume.attached_to.encode("ascii"),
-             _backing_file_name(volume)]
-        )
+        _, volume_path = self._attached_volume(blockdevice_id)
         # May be None if the file hasn't been used for a loop device.
         path = _device_for_path(volume_path)
         if path is None:
@@ -1374,6 +1504,177 @@ class LoopbackBlockDeviceAPI(object):
         return path
 
 
+def _losetup(reactor, arguments):
+    """
+    Run ``losetup`` as a child process.
+
+    :param reactor: An ``IReactorProcess`` provider.
+    :param list arguments: ``bytes`` command-line arguments to ``losetup``.
+
+    :return: A ``Deferred`` that fires with the ``bytes`` ``losetup`` writes
+        to standard output, or fails with ``CalledProcessError`` if it exits
+        with a non-zero status.
+    """
+    command = [b"losetup"] + arguments
+    running = getProcessOutputAndValue(
+        command[0], arguments, env=os.environ, reactor=reactor,
+    )
+
+    def exited((output, error, status)):
+        if status != 0:
+            raise CalledProcessError(status, command, output + error)
+        return output
+    return running.addCallback(exited)
+
+
+@implementer(IBlockDeviceAsyncAPI)
+class LoopbackBlockDeviceAsyncAPI(object):
+    """
+    An ``IBlockDeviceAsyncAPI`` for the volumes of a
+    ``LoopbackBlockDeviceAPI`` which runs ``losetup`` as a child process
+    rather than blocking a thread until it exits.
+
+    Everything else the loopback backend does is a quick operation on local
+    files, so it is done directly by the ``LoopbackBlockDeviceAPI``.
+
+    :ivar _reactor: The ``IReactorProcess`` provider to run ``losetup`` with.
+    :ivar LoopbackBlockDeviceAPI _sync: The API managing the backing files.
+    :ivar _changed: A callable called with the ``blockdevice_id`` of each
+        volume after it is created, destroyed, attached or detached, or
+        ``None`` after a volume fails to be created.
+    """
+    def __init__(self, reactor, sync, changed=None):
+        """
+        :param changed: See ``_changed``, or ``None`` if nothing needs to
+            know about changes.
+        """
+        self._reactor = reactor
+        self._sync = sync
+        self._changed = changed
+
+    def _changing(self, blockdevice_id, changing):
+        """
+        Report a change to a volume once it has been made.
+
+        :param blockdevice_id: The ``unicode`` unique identifier of the
+            volume, or ``None`` if it isn't known until the change has been
+            made, in which case the identifier of the ``BlockDeviceVolume``
+            ``changing`` fires with is reported.
+        :param Deferred changing: Fires when the change has been made.
+
+        :return: ``changing``.
+        """
+        def changed(result):
+            # Even a failed change may have partly happened.
+            if self._changed is not None:
+                changed_id = blockdevice_id
+                if changed_id is None and isinstance(
+                    result, BlockDeviceVolume
+                ):
+                    changed_id = result.blockdevice_id
+                self._changed(changed_id)
+            return result
+        return changing.addBoth(changed)
+
+    def allocation_unit(self):
+        return succeed(self._sync.allocation_unit())
+
+    def compute_instance_id(self):
+        return succeed(self._sync.compute_instance_id())
+
+    def create_volume(self, dataset_id, size):
+        return self._changing(
+            None, maybeDeferred(self._sync.create_volume, dataset_id, size),
+        )
+
+    def destroy_volume(self, blockdevice_id):
+        return self._changing(
+            blockdevice_id,
+            maybeDeferred(self._sync.destroy_volume, blockdevice_id),
+        )
+
+    def list_volumes(self):
+        return maybeDeferred(self._sync.list_volumes)
+
+    def _device_for_path(self, backing_file):
+        """
+        :param FilePath backing_file: A path which may be associated with a
+            loopback device.
+
+        :return: A ``Deferred`` that fires with a ``FilePath`` to the
+            loopback device if one is found, or ``None`` if no device exists.
+        """
+        listing = _losetup(self._reactor, [b"--all"])
+
+        def listed(output):
+            for device_file, path in _losetup_list_parse(
+                output.decode("utf8")
+            ):
+                if path == backing_file:
+                    return device_file
+        return listing.addCallback(listed)
+
+    def attach_volume(self, blockdevice_id, attach_to):
+        """
+        See ``LoopbackBlockDeviceAPI.attach_volume``.
+        """
+        moving = maybeDeferred(
+            self._sync._move_to_attached, blockdevice_id, attach_to
+        )
+
+        def moved((attached_volume, backing_file)):
+            allocating = _losetup(
+                self._reactor, [b"--find", backing_file.path]
+            )
+            return allocating.addCallback(lambda _: attached_volume)
+        return self._changing(blockdevice_id, moving.addCallback(moved))
+
+    def detach_volume(self, blockdevice_id):
+        """
+        See ``LoopbackBlockDeviceAPI.detach_volume``.
+        """
+        finding = maybeDeferred(self._sync._attached_volume, blockdevice_id)
+
+        def found((volume, backing_file)):
+            # ``losetup --detach`` only if the file was used for a loop
+            # device.
+            d = self._device_for_path(backing_file)
+
+            def detach(device):
+                if device is not None:
+                    return _losetup(
+                        self._reactor, [b"--detach", device.path]
+                    )
+            d.addCallback(detach)
+            d.addCallback(lambda _: self._sync._move_to_unattached(volume))
+            return d
+        return self._changing(blockdevice_id, finding.addCallback(found))
+
+    def get_device_path(self, blockdevice_id):
+        """
+        See ``LoopbackBlockDeviceAPI.get_device_path``.
+        """
+        finding = maybeDeferred(self._sync._attached_volume, blockdevice_id)
+
+        def found((volume, backing_file)):
+            d = self._device_for_path(backing_file)
+
+            def allocate(device):
+                if device is not None:
+                    return device
+                # Only partially attached; see
+                # ``LoopbackBlockDeviceAPI.get_device_path``.
+                allocating = _losetup(
+                    self._reactor, [b"--find", backing_file.path]
+                )
+                allocating.addCallback(
+                    lambda _: self._device_for_path(backing_file)
+                )
+                return allocating
+            return d.addCallback(allocate)
+        return finding.addCallback(found)
+
+
 def _manifestation_from_volume(volume):
     """
     :param BlockDeviceVolume volume: The block device which has the
@@ -1388,6 +1689,21 @@ def _manifestation_from_volume(volume):
     return Manifestation(dataset=dataset, primary=True)
 
 
+def _dataset_exists(cluster_state, dataset_id):
+    """
+    :param DeploymentState cluster_state: The state of the cluster.
+    :param unicode dataset_id: The ID of a dataset.
+
+    :return bool: Whether the dataset has a primary manifestation or is a
+        non-manifest dataset, i.e. whether ``cluster_state.all_datasets``
+        would include it.
+    """
+    return dataset_id in cluster_state.nonmanifest_datasets or any(
+        manifestation.primary
+        for manifestation, node in cluster_state.get_manifestations(dataset_id)
+    )
+
+
 @implementer(IDeployer)
 class BlockDeviceDeployer(PRecord):
     """
@@ -1399,14 +1715,21 @@ class BlockDeviceDeployer(PRecord):
     :ivar FilePath mountroot: The directory where block devices will be
         mounted.
     :ivar _async_block_device_api: An object to override the value of the
-        ``async_block_device_api`` property.  Used by tests.  Should be
-        ``None`` in real-world use.
+        ``async_block_device_api`` property.  Used by tests and by backends
+        with a native ``IBlockDeviceAsyncAPI``; ``None`` otherwise.
+    :ivar threadpool: The ``ThreadPool`` in which the ``block_device_api``
+        is called by ``async_block_device_api``, or ``None`` to use the
+        reactor's.
+    :ivar mount_table: A ``MountTableCache`` from which to load the mounted
+        filesystems, or ``None`` to load them afresh for each discovery.
     """
     hostname = field(type=unicode, mandatory=True)
     node_uuid = field(type=UUID, mandatory=True)
     block_device_api = field(mandatory=True)
     _async_block_device_api = field(mandatory=True, initial=None)
     mountroot = field(type=FilePath, initial=FilePath(b"/flocker"))
+    mount_table = field(mandatory=True, initial=None)
+    threadpool = field(mandatory=True, initial=None)
 
     @property
     def async_block_device_api(self):
@@ -1414,7 +1737,8 @@ class BlockDeviceDeployer(PRecord):
         Get an ``IBlockDeviceAsyncAPI`` provider which can manipulate volumes
         for this deployer.
 
-        During real operation, this is a threadpool-based wrapper around the
+        During real operation, this is either the backend's native
+        implementation or a threadpool-based wrapper around the
         ``IBlockDeviceAPI`` provider.  For testing purposes it can be
         overridden with a different object entirely (and this large amount of
         support code for this is necessary because this class is a ``PRecord``
@@ -1422,10 +1746,13 @@ class BlockDeviceDeployer(PRecord):
         """
         if self._async_block_device_api is None:
             from twisted.internet import reactor
+            threadpool = self.threadpool
+            if threadpool is None:
+                threadpool = reactor.getThreadPool()
             return _SyncToThreadedAsyncAPIAdapter(
                 _sync=self.block_device_api,
                 _reactor=reactor,
-                _threadpool=reactor.getThreadPool(),
+                _threadpool=threadpool,
             )
         return self._async_block_device_api
 
@@ -1445,7 +1772,10 @@ class BlockDeviceDeployer(PRecord):
             all of the mounts on this system that were discovered and related
             to ``volumes``.
         """
-        partitions = psutil.disk_partitions()
+        if self.mount_table is None:
+            partitions = psutil.disk_partitions()
+        else:
+            partitions = self.mount_table.disk_partitions()
         device_to_dataset_id = {
             self.block_device_api.get_device_path(volume.blockdevice_id):
                 volume.dataset_id
@@ -1604,13 +1934,8 @@ class BlockDeviceDeployer(PRecord):
         local_dataset_ids = set(local_state.manifestations.keys())
 
         manifestations_to_create = set()
-        all_dataset_ids = list(
-            dataset.dataset_id
-            for dataset, node
-            in cluster_state.all_datasets()
-        )
         for dataset_id in configured_dataset_ids.difference(local_dataset_ids):
-            if dataset_id in all_dataset_ids:
+            if _dataset_exists(cluster_state, dataset_id):
                 continue
             else:
                 manifestation = configured_manifestations[dataset_id]
@@ -1780,19 +2105,142 @@ class BlockDeviceDeployer(PRecord):
         ]
 
 
-class ProcessLifetimeCache(proxyForInterface(IBlockDeviceAPI, "_api")):
+# The number of seconds for which ``ProcessLifetimeCache`` reuses the result
+# of ``list_volumes``:
+LIST_VOLUMES_TTL = 10.0
+
+
+class CacheMetrics(PClass):
+    """
+    Statistics about how well a cache of discovered state works.
+
+    :ivar int hits: The number of lookups answered from the cache.
+    :ivar int misses: The number of lookups which had to load the value.
+    :ivar int invalidations: The number of times a cached value was
+        discarded because of a change made through the cache.
+    """
+    hits = field(type=int, initial=0)
+    misses = field(type=int, initial=0)
+    invalidations = field(type=int, initial=0)
+
+    def incremented(self, name):
+        """
+        :param str name: The name of the statistic to increment.
+
+        :return CacheMetrics: These statistics with ``name`` incremented.
+        """
+        return self.set(name, getattr(self, name) + 1)
+
+
+class _CacheMetricsMixin(object):
+    """
+    Keep ``CacheMetrics`` for each of several caches.
+
+    :ivar dict metrics: Mapping from the ``unicode`` name of each cache to
+        its ``CacheMetrics``.
+    """
+    def _record(self, name, statistic):
+        """
+        Increment one of the statistics of a cache, logging all of them on a
+        miss.
+
+        :param unicode name: The name of the cache.
+        :param str statistic: The name of the statistic to increment.
+        """
+        metrics = self.metrics[name] = self.metrics[name].incremented(
+            statistic
+        )
+        if statistic == "misses":
+            CACHE_MISS(
+                cache=name, hits=metrics.hits, misses=metrics.misses,
+                invalidations=metrics.invalidations,
+            ).write(_logger)
+
+
+class MountTableCache(_CacheMetricsMixin):
+    """
+    Cache the mounted filesystems, loading them again only once the kernel
+    reports that the mount table has changed.
+
+    The kernel marks ``/proc/self/mountinfo`` as having an exceptional
+    condition, for ``poll``, whenever a filesystem is mounted or unmounted.
+    Polling the file clears the condition again.
+
+    :ivar FilePath mountinfo: The file reporting mount table changes.
+    :ivar _load: A no-argument callable returning the mounted
+        filesystems like ``psutil.disk_partitions``.
+    """
+    def __init__(self, mountinfo=FilePath(b"/proc/self/mountinfo"),
+                 disk_partitions=psutil.disk_partitions):
+        self.mountinfo = mountinfo
+        self._load = disk_partitions
+        self.metrics = {u"disk_partitions": CacheMetrics()}
+        self._mountinfo_file = None
+        self._poll = None
+        self._partitions = None
+
+    def _changed(self):
+        """
+        :return: ``True`` if the mount table may have changed since this was
+            last called, otherwise ``False``.
+        """
+        if self._poll is None:
+            self._mountinfo_file = self.mountinfo.open()
+            self._poll = poll()
+            self._poll.register(self._mountinfo_file, POLLPRI | POLLERR)
+            return True
+        return bool(self._poll.poll(0))
+
+    def disk_partitions(self):
+        """
+        :return: The mounted filesystems, like ``psutil.disk_partitions``.
+        """
+        # Check for changes before loading, so that a change made while
+        # loading is noticed next time.
+        if self._changed() or self._partitions is None:
+            self._record(u"disk_partitions", "misses")
+            self._partitions = self._load()
+        else:
+            self._record(u"disk_partitions", "hits")
+        return list(self._partitions)
+
+
+class ProcessLifetimeCache(proxyForInterface(IBlockDeviceAPI, "_api"),
+                           _CacheMetricsMixin):
     """
     A transparent caching layer around an ``IBlockDeviceAPI`` instance,
     intended to exist for the lifetime of the process.
 
+    The result of ``list_volumes`` is reused for ``list_volumes_ttl``
+    seconds, or until a volume is created, destroyed, attached or detached
+    through this cache.  Changes made by other nodes are therefore noticed
+    only once it expires.
+
     :ivar _api: Wrapped ``IBlockDeviceAPI`` provider.
+    :ivar _clock: ``IReactorTime`` provider used to expire cached volumes.
+    :ivar float list_volumes_ttl: The number of seconds for which the result
+        of ``list_volumes`` is reused.
     :ivar _instance_id: Cached result of ``compute_instance_id``.
     :ivar _device_paths: Mapping from blockdevice ids to cached device path.
-    """
-    def __init__(self, api):
+    :ivar _volumes: ``None``, or a tuple of the time the cached result of
+        ``list_volumes`` expires and that result.
+    :ivar int _generation: The number of changes made through this cache,
+        used to discard volumes listed while a change was being made.
+    """
+    def __init__(self, api, clock=None, list_volumes_ttl=LIST_VOLUMES_TTL):
+        if clock is None:
+            from twisted.internet import reactor as clock
         self._api = api
+        self._clock = clock
+        self.list_volumes_ttl = list_volumes_ttl
         self._instance_id = None
         self._device_paths = {}
+        self._volumes = None
+        self._generation = 0
+        self.metrics = {
+            u"get_device_path": CacheMetrics(),
+            u"list_volumes": CacheMetrics(),
+        }
 
     def compute_instance_id(self):
         """
@@ -1808,16 +2256,95 @@ class ProcessLifetimeCache(proxyForInterface(IBlockDeviceAPI, "_api")):
         Load the device path from a cache if possible.
         """
         if blockdevice_id not in self._device_paths:
+            self._record(u"get_device_path", "misses")
             self._device_paths[blockdevice_id] = self._api.get_device_path(
                 blockdevice_id)
+        else:
+            self._record(u"get_device_path", "hits")
         return self._device_paths[blockdevice_id]
 
+    def list_volumes(self):
+        """
+        Load the volumes from a cache if it hasn't expired.
+        """
+        now = self._clock.seconds()
+        cached = self._volumes
+        if cached is not None and now < cached[0]:
+            self._record(u"list_volumes", "hits")
+            return list(cached[1])
+        self._record(u"list_volumes", "misses")
+        generation = self._generation
+        volumes = self._api.list_volumes()
+        # Changes may be made from other threads.  Volumes listed while one
+        # was being made might not reflect it, so don't reuse them.
+        if generation == self._generation:
+            self._volumes = (now + self.list_volumes_ttl, list(volumes))
+        return volumes
+
+    def _changed_volumes(self, method, *args):
+        """
+        Call a method of the wrapped API which changes the volumes, then
+        discard the cached volumes.
+
+        :param method: The method to call.
+        :param args: The arguments to pass to it.
+
+        :return: The result of the call.
+        """
+        try:
+            return method(*args)
+        finally:
+            # Even a failed change may have partly happened.
+            self.invalidate()
+
+    def invalidate(self, blockdevice_id=None):
+        """
+        Discard the cached volumes, for example because a volume was changed
+        without going through this cache.
+
+        :param blockdevice_id: ``None``, or the ``unicode`` identifier of a
+            volume whose cached device path is also discarded.
+        """
+        if blockdevice_id is not None:
+            try:
+                del self._device_paths[blockdevice_id]
+            except KeyError:
+                pass
+            else:
+                self._record(u"get_device_path", "invalidations")
+        self._generation += 1
+        if self._volumes is not None:
+            self._volumes = None
+            self._record(u"list_volumes", "invalidations")
+
+    def create_volume(self, dataset_id, size):
+        """
+        Clear the cached volumes.
+        """
+        return self._changed_volumes(
+            self._api.create_volume, dataset_id, size
+        )
+
+    def destroy_volume(self, blockdevice_id):
+        """
+        Clear the cached volumes.
+        """
+        return self._changed_volumes(self._api.destroy_volume, blockdevice_id)
+
+    def attach_volume(self, blockdevice_id, attach_to):
+        """
+        Clear the cached volumes.
+        """
+        return self._changed_volumes(
+            self._api.attach_volume, blockdevice_id, attach_to
+        )
+
     def detach_volume(self, blockdevice_id):
         """
-        Clear the cached device path, if it was cached.
+        Clear the cached device path, if it was cached, and the cached
+        volumes.
         """
         try:
-            del self._device_paths[blockdevice_id]
-        except KeyError:
-            pass
-        return self._api.detach_volume(blockdevice_id)
+            return self._api.detach_volume(blockdevice_id)
+        finally:
+            self.invalidate(blockdevice_id)
@@ -9,7 +9,7 @@ from uuid import UUID
 
 from bitmath import Byte, GiB
 
-from eliot import Message
+from eliot import Message, write_failure
 
 from pyrsistent import PRecord, field
 
@@ -25,12 +25,15 @@ from novaclient.client import Client as NovaClient
 from novaclient.exceptions import NotFound as NovaNotFound
 from novaclient.exceptions import ClientException as NovaClientException
 
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.threads import blockingCallFromThread, deferToThreadPool
 from twisted.python.filepath import FilePath
 
 from zope.interface import implementer, Interface
 
 from ...common import (
-    interface_decorator, get_all_ips, ipaddress_from_string
+    interface_decorator, get_all_ips, ipaddress_from_string,
+    dedicated_threadpool,
 )
 from .blockdevice import (
     IBlockDeviceAPI, BlockDeviceVolume, UnknownVolume, AlreadyAttachedVolume,
@@ -38,7 +41,7 @@ from .blockdevice import (
 )
 from ._logging import (
     NOVA_CLIENT_EXCEPTION, KEYSTONE_HTTP_ERROR, COMPUTE_INSTANCE_ID_NOT_FOUND,
-    OPENSTACK_ACTION, CINDER_CREATE
+    OPENSTACK_ACTION, CINDER_CREATE, POLLED_CINDER_VOLUME_STATUS,
 )
 
 # The key name used for identifying the Flocker cluster_id in the metadata for
@@ -52,6 +55,15 @@ DATASET_ID_LABEL = u'flocker-dataset-id'
 # The longest time we're willing to wait for a Cinder API call to complete.
 CINDER_TIMEOUT = 600
 
+# The most volumes to ask Cinder for at once when listing the volumes of a
+# cluster.
+LIST_VOLUMES_PAGE_SIZE = 500
+
+# The shortest and longest intervals, in seconds, between listings of the
+# volumes by ``BatchedVolumeStateMonitor``.
+VOLUME_STATE_POLL_INTERVAL = 1.0
+VOLUME_STATE_MAX_POLL_INTERVAL = 5.0
+
 
 def _openstack_logged_method(method_name, original_name):
     """
@@ -144,10 +156,15 @@ class ICinderVolumeManager(Interface):
         :rtype: :class:`Volume`
         """
 
-    def list():
+    def list(detailed=True, search_opts=None):
         """
         Lists all volumes.
 
+        :param bool detailed: Whether to include the details of each volume.
+        :param dict search_opts: Options to search with, for example
+            ``metadata`` to only list volumes with matching metadata, or
+            ``limit`` and ``offset`` to list a page of volumes after the
+            first ``offset`` volumes.
         :rtype: list of :class:`Volume`
         """
 
@@ -302,25 +319,47 @@ class VolumeStateMonitor:
         Raise an exception if a non-valid state is reached or if the
         desired state is not reached within the supplied time limit.
         """
-        # Could be more efficient.  FLOC-1831
-        for listed_volume in self.volume_manager.list():
-            if listed_volume.id == self.expected_volume.id:
-                # Could miss the expected status because race conditions.
-                # FLOC-1832
-                current_state = listed_volume.status
-                if current_state == self.desired_state:
-                    return listed_volume
-                elif current_state in self.transient_states:
-                    # Once an intermediate state is reached, the prior
-                    # states become invalid.
-                    idx = self.transient_states.index(current_state)
-                    if idx > 0:
-                        self.transient_states = self.transient_states[idx:]
-                else:
-                    raise UnexpectedStateException(
-                        self.expected_volume, self.desired_state,
-                        current_state)
-        elapsed_time = time.time() - self.start_time
+        # This lists every volume for each waiting operation.
+        # ``BatchedVolumeStateMonitor`` shares one listing between all of
+        # them.  FLOC-1831
+        listed_volume = None
+        for volume in self.volume_manager.list():
+            if volume.id == self.expected_volume.id:
+                listed_volume = volume
+                break
+        return self.examine(listed_volume, time.time() - self.start_time)
+
+    def examine(self, listed_volume, elapsed_time):
+        """
+        Test whether a listing of the expected volume shows it has reached
+        the desired state.
+
+        :param listed_volume: The listed ``Volume`` with the same ``id`` as
+            ``expected_volume``, or ``None`` if it was not listed.
+        :param float elapsed_time: The time, in seconds, since waiting began.
+
+        :raises: UnexpectedStateException: If ``listed_volume`` is in an
+            invalid state.
+        :raises TimeoutException: If ``elapsed_time`` exceeds ``time_limit``.
+        :returns: ``listed_volume`` if it has the desired state, otherwise
+            ``None``.
+        """
+        if listed_volume is not None:
+            # Could miss the expected status because race conditions.
+            # FLOC-1832
+            current_state = listed_volume.status
+            if current_state == self.desired_state:
+                return listed_volume
+            elif current_state in self.transient_states:
+                # Once an intermediate state is reached, the prior
+                # states become invalid.
+                idx = self.transient_states.index(current_state)
+                if idx > 0:
+                    self.transient_states = self.transient_states[idx:]
+            else:
+                raise UnexpectedStateException(
+                    self.expected_volume, self.desired_state,
+                    current_state)
         if elapsed_time > self.time_limit:
             raise TimeoutException(
                 self.expected_volume, self.desired_state, elapsed_time)
@@ -368,6 +407,277 @@ def wait_for_volume_state(volume_manager, expected_volume, desired_state,
     return poll_until(waiter.reached_desired_state, 1)
 
 
+class _VolumeStateWaiter(object):
+    """
+    An operation waiting for a volume to reach a state.
+
+    :ivar VolumeStateMonitor monitor: Tracks the states the volume is
+        allowed to pass through.
+    :ivar float started: The time, according to the reactor, at which
+        waiting began.
+    :ivar Deferred result: Fires with the listed ``Volume`` once it reaches
+        the desired state.
+    :ivar status: The ``Volume.status`` most recently listed, or ``None``.
+    """
+    def __init__(self, monitor, started):
+        self.monitor = monitor
+        self.started = started
+        self.result = Deferred()
+        self.status = None
+
+
+class BatchedVolumeStateMonitor(object):
+    """
+    Wait for volumes to reach states on behalf of many operations at once,
+    listing the volumes with a single ``ICinderVolumeManager.list`` call per
+    interval rather than one per waiting operation.
+
+    Polls are scheduled with the reactor while any operation is waiting and
+    the listing runs in a threadpool of its own: the waiting operations
+    block threads of their own threadpool, which must not keep the listing
+    they wait for from running.  The interval doubles
+    after each poll in which no waiting volume changed state, up to
+    ``max_interval``, and starts again from ``interval`` when one does or a
+    new operation starts waiting.
+
+    :ivar reactor: The reactor to schedule polls with.
+    :ivar ICinderVolumeManager volume_manager: An API for listing volumes.
+    :ivar float interval: The shortest interval, in seconds, between polls.
+    :ivar float max_interval: The longest interval, in seconds, between
+        polls.
+    :ivar _list_volumes: A no-argument callable returning the listed
+        volumes, or a ``Deferred`` that fires with them.
+    :ivar _threadpool: The ``ThreadPool`` which ``_list_in_thread`` lists the
+        volumes in, or ``None`` until it is first needed.
+    :ivar list _waiters: The ``_VolumeStateWaiter``\ s still waiting.
+    :ivar _call: The ``IDelayedCall`` of the next poll, or ``None``.
+    :ivar bool _polling: Whether a listing is in progress.
+    :ivar _last_poll: The time, according to the reactor, at which the most
+        recent poll began, or ``None`` if there hasn't been one.
+    :ivar float _interval: The current interval between polls.
+    """
+    def __init__(self, reactor, volume_manager,
+                 interval=VOLUME_STATE_POLL_INTERVAL,
+                 max_interval=VOLUME_STATE_MAX_POLL_INTERVAL,
+                 list_volumes=None):
+        """
+        :param list_volumes: A no-argument callable returning the listed
+            volumes, or a ``Deferred`` that fires with them.  By default
+            ``volume_manager.list`` is called in a threadpool of its own.
+        """
+        self.reactor = reactor
+        self.volume_manager = volume_manager
+        self.interval = interval
+        self.max_interval = max_interval
+        if list_volumes is None:
+            list_volumes = self._list_in_thread
+        self._list_volumes = list_volumes
+        self._threadpool = None
+        self._waiters = []
+        self._call = None
+        self._polling = False
+        self._last_poll = None
+        self._interval = interval
+
+    def wait_for(self, expected_volume, desired_state, transient_states=(),
+                 time_limit=CINDER_TIMEOUT):
+        """
+        Wait for a ``Volume`` with the same ``id`` as ``expected_volume`` to
+        be listed and to have a ``status`` value of ``desired_state``.
+
+        This must be called in the reactor thread.  The first check happens
+        at the next poll, which is straight away unless a poll began less
+        than ``interval`` seconds ago.
+
+        :param Volume expected_volume: The ``Volume`` to wait for.
+        :param unicode desired_state: The ``Volume.status`` to wait for.
+        :param transient_states: A sequence of valid intermediate states.
+        :param int time_limit: The maximum time, in seconds, to wait for the
+            ``expected_volume`` to have ``desired_state``.
+
+        :return: A ``Deferred`` that fires with the listed ``Volume`` that
+            matches ``expected_volume``, or fails with
+            ``UnexpectedStateException`` or ``TimeoutException`` as
+            ``wait_for_volume_state`` would raise them.
+        """
+        waiter = _VolumeStateWaiter(
+            VolumeStateMonitor(
+                self.volume_manager, expected_volume, desired_state,
+                transient_states, time_limit,
+            ),
+            self.reactor.seconds(),
+        )
+        self._waiters.append(waiter)
+        self._interval = self.interval
+        delay = 0
+        if self._last_poll is not None:
+            delay = max(
+                0, self._last_poll + self.interval - self.reactor.seconds()
+            )
+        self._schedule(delay)
+        return waiter.result
+
+    def wait_for_volume_state(self, expected_volume, desired_state,
+                              transient_states=(),
+                              time_limit=CINDER_TIMEOUT):
+        """
+        Like ``wait_for``, but block the calling thread until the volume
+        reaches the desired state.  This must not be called in the reactor
+        thread.
+
+        :returns: The listed ``Volume`` that matches ``expected_volume``.
+        """
+        return blockingCallFromThread(
+            self.reactor, self.wait_for, expected_volume, desired_state,
+            transient_states, time_limit,
+        )
+
+    def _list_in_thread(self):
+        """
+        List the volumes in a single-thread threadpool used only for the
+        listing, since the threads of any shared threadpool may all be
+        blocked in ``wait_for_volume_state``.
+
+        :return: A ``Deferred`` that fires with the listed volumes.
+        """
+        if self._threadpool is None:
+            self._threadpool = dedicated_threadpool(
+                self.reactor, b"cinder-volume-state", 1,
+            )
+        return deferToThreadPool(
+            self.reactor, self._threadpool, self.volume_manager.list,
+        )
+
+    def _schedule(self, delay):
+        """
+        Make sure a poll happens within ``delay`` seconds, unless one is
+        already in progress; another is scheduled when it finishes.
+
+        :param float delay: The longest time, in seconds, until the poll.
+        """
+        if self._polling:
+            return
+        if self._call is None:
+            self._call = self.reactor.callLater(delay, self._poll)
+        elif self._call.getTime() - self.reactor.seconds() > delay:
+            self._call.reset(delay)
+
+    def _poll(self):
+        """
+        List the volumes and dispatch the result to the operations which
+        were waiting when the listing began.
+        """
+        self._call = None
+        self._polling = True
+        self._last_poll = self.reactor.seconds()
+        waiters = list(self._waiters)
+        listing = maybeDeferred(self._list_volumes)
+        listing.addCallbacks(
+            self._dispatch, self._fail,
+            callbackArgs=(waiters,), errbackArgs=(waiters,),
+        )
+        listing.addErrback(write_failure)
+        listing.addBoth(self._poll_done)
+
+    def _dispatch(self, volumes, waiters):
+        """
+        Check whether each waiting volume has reached its desired state.
+
+        :param volumes: The listed ``Volume``\ s.
+        :param list waiters: The ``_VolumeStateWaiter``\ s to check.
+        """
+        listed = {volume.id: volume for volume in volumes}
+        now = self.reactor.seconds()
+        changed = False
+        for waiter in waiters:
+            listed_volume = listed.get(waiter.monitor.expected_volume.id)
+            status = getattr(listed_volume, "status", None)
+            if status != waiter.status:
+                waiter.status = status
+                changed = True
+            try:
+                result = waiter.monitor.examine(
+                    listed_volume, now - waiter.started
+                )
+            except (UnexpectedStateException, TimeoutException):
+                self._waiters.remove(waiter)
+                waiter.result.errback()
+            else:
+                if result is not None:
+                    self._waiters.remove(waiter)
+                    waiter.result.callback(result)
+        if changed:
+            self._interval = self.interval
+        else:
+            self._interval = min(self._interval * 2, self.max_interval)
+        POLLED_CINDER_VOLUME_STATUS(
+            volume_ids=[
+                unicode(waiter.monitor.expected_volume.id)
+                for waiter in waiters
+            ],
+            interval=float(self._interval),
+        ).write()
+
+    def _fail(self, reason, waiters):
+        """
+        Fail every operation which was waiting for the listing.
+
+        :param Failure reason: Why the volumes could not be listed.
+        :param list waiters: The ``_VolumeStateWaiter``\ s to fail.
+        """
+        for waiter in waiters:
+            self._waiters.remove(waiter)
+            waiter.result.errback(reason)
+
+    def _poll_done(self, ignored):
+        """
+        Schedule the next poll if any operation is still waiting.
+        """
+        self._polling = False
+        if self._waiters:
+            self._schedule(self._interval)
+
+
+def _iter_volumes(volume_manager, search_opts,
+                  page_size=LIST_VOLUMES_PAGE_SIZE):
+    """
+    Iterate over the volumes matching some search options, requesting them
+    a page at a time so that only one page is held in memory at once.
+
+    Pages are requested with ``limit`` and ``offset``, which is how the
+    Cinder v1 API pages; it ignores ``marker``.  Cinder APIs which ignore
+    ``limit`` return every volume in the first page, so listing stops at a
+    page which isn't full.  APIs which ignore ``offset`` return the same page
+    again; in that case every volume is listed at once instead, so that the
+    listing is never cut short.
+
+    :param ICinderVolumeManager volume_manager: An API for listing volumes.
+    :param dict search_opts: Options to search with.
+    :param int page_size: The most volumes to request at once.
+
+    :return: An iterator of ``Volume``.
+    """
+    listed = set()
+    offset = 0
+    while True:
+        page = volume_manager.list(
+            search_opts=dict(search_opts, limit=page_size, offset=offset),
+        )
+        new = [volume for volume in page if volume.id not in listed]
+        for volume in new:
+            listed.add(volume.id)
+            yield volume
+        if len(page) != page_size:
+            return
+        if not new:
+            for volume in volume_manager.list(search_opts=search_opts):
+                if volume.id not in listed:
+                    listed.add(volume.id)
+                    yield volume
+            return
+        offset += len(page)
+
+
 def _extract_nova_server_addresses(addresses):
     """
     :param dict addresses: A ``dict`` mapping OpenStack network names
@@ -395,7 +705,7 @@ class CinderBlockDeviceAPI(object):
     def __init__(self,
                  cinder_volume_manager,
                  nova_volume_manager, nova_server_manager,
-                 cluster_id):
+                 cluster_id, volume_state_monitor=None):
         """
         :param ICinderVolumeManager cinder_volume_manager: A client for
             interacting with Cinder API.
@@ -406,11 +716,37 @@ class CinderBlockDeviceAPI(object):
         :param UUID cluster_id: An ID that will be included in the names of
             Cinder block devices in order to associate them with a particular
             Flocker cluster.
+        :param BatchedVolumeStateMonitor volume_state_monitor: Used to wait
+            for volumes to change state, or ``None`` to poll for each
+            operation with ``wait_for_volume_state``.  The methods of an API
+            with a monitor must not be called in the reactor thread.
         """
         self.cinder_volume_manager = cinder_volume_manager
         self.nova_volume_manager = nova_volume_manager
         self.nova_server_manager = nova_server_manager
         self.cluster_id = cluster_id
+        self.volume_state_monitor = volume_state_monitor
+
+    def _wait_for_volume_state(self, expected_volume, desired_state,
+                               transient_states):
+        """
+        Wait for a volume to reach a state, using the
+        ``volume_state_monitor`` if there is one.
+
+        See ``wait_for_volume_state`` for the parameters and result.
+        """
+        if self.volume_state_monitor is None:
+            return wait_for_volume_state(
+                volume_manager=self.cinder_volume_manager,
+                expected_volume=expected_volume,
+                desired_state=desired_state,
+                transient_states=transient_states,
+            )
+        return self.volume_state_monitor.wait_for_volume_state(
+            expected_volume=expected_volume,
+            desired_state=desired_state,
+            transient_states=transient_states,
+        )
 
     def allocation_unit(self):
         """
@@ -476,8 +812,7 @@ class CinderBlockDeviceAPI(object):
         )
         Message.new(message_type=CINDER_CREATE,
                     blockdevice_id=requested_volume.id).write()
-        created_volume = wait_for_volume_state(
-            volume_manager=self.cinder_volume_manager,
+        created_volume = self._wait_for_volume_state(
             expected_volume=requested_volume,
             desired_state=u'available',
             transient_states=(u'creating',),
@@ -491,12 +826,21 @@ class CinderBlockDeviceAPI(object):
         Return ``BlockDeviceVolume`` instances for all the Cinder Volumes that
         have the expected ``cluster_id`` in their metadata.
 
+        Cinder is asked for only those volumes, a page at a time.  The
+        metadata is checked here too since not every Cinder API supports
+        searching by it.
+
         See:
 
         http://docs.rackspace.com/cbs/api/v1.0/cbs-devguide/content/GET_getVolumesDetail_v1__tenant_id__volumes_detail_volumes.html
         """
+        search_opts = {
+            u"metadata": {CLUSTER_ID_LABEL: unicode(self.cluster_id)},
+        }
         flocker_volumes = []
-        for cinder_volume in self.cinder_volume_manager.list():
+        for cinder_volume in _iter_volumes(
+            self.cinder_volume_manager, search_opts
+        ):
             if _is_cluster_volume(self.cluster_id, cinder_volume):
                 flocker_volume = _blockdevicevolume_from_cinder_volume(
                     cinder_volume
@@ -527,8 +871,7 @@ class CinderBlockDeviceAPI(object):
             # Have Nova assign a device file for us.
             device=None,
         )
-        attached_volume = wait_for_volume_state(
-            volume_manager=self.cinder_volume_manager,
+        attached_volume = self._wait_for_volume_state(
             expected_volume=nova_volume,
             desired_state=u'in-use',
             transient_states=(u'available', u'attaching',),
@@ -554,8 +897,7 @@ class CinderBlockDeviceAPI(object):
             raise UnattachedVolume(blockdevice_id)
 
         # This'll blow up if the volume is deleted from elsewhere.  FLOC-1882.
-        wait_for_volume_state(
-            volume_manager=self.cinder_volume_manager,
+        self._wait_for_volume_state(
             expected_volume=cinder_volume,
             desired_state=u'available',
             transient_states=(u'in-use', u'detaching')
@@ -837,13 +1179,17 @@ def get_nova_v2_client(session, region):
     )
 
 
-def cinder_from_configuration(region, cluster_id, **config):
+def cinder_from_configuration(region, cluster_id, reactor=None, **config):
     """
     Build a ``CinderBlockDeviceAPI`` using configuration and credentials
     in ``config``.
 
     :param str region: The Openstack region to access.
     :param cluster_id: The unique identifier for the cluster to access.
+    :param reactor: If not ``None``, the reactor with which a
+        ``BatchedVolumeStateMonitor`` waits for volumes to change state on
+        behalf of all operations at once.  The API must then only be used
+        outside the reactor thread.
     :param config: A dictionary of configuration options for Openstack.
     """
     session = get_keystone_session(**config)
@@ -859,9 +1205,15 @@ def cinder_from_configuration(region, cluster_id, **config):
     logging_nova_server_manager = _LoggingNovaServerManager(
         _nova_servers=nova_client.servers
     )
+    volume_state_monitor = None
+    if reactor is not None:
+        volume_state_monitor = BatchedVolumeStateMonitor(
+            reactor, logging_cinder
+        )
     return CinderBlockDeviceAPI(
         cinder_volume_manager=logging_cinder,
         nova_volume_manager=logging_nova_volume_manager,
         nova_server_manager=logging_nova_server_manager,
         cluster_id=cluster_id,
+        volume_state_monitor=volume_state_monitor,
     )
@@ -6,6 +6,7 @@ An EBS implementation of the ``IBlockDeviceAPI``.
 """
 
 from subprocess import check_output
+import sys
 import threading
 import time
 import logging
@@ -18,6 +19,7 @@ from zope.interface import implementer
 from boto import ec2
 from boto import config
 from boto.ec2.connection import EC2Connection
+from boto.ec2.volume import Volume
 from boto.utils import get_instance_metadata
 from boto.exception import EC2ResponseError
 from twisted.python.constants import (
@@ -36,7 +38,7 @@ from ...control import pmap_field
 from ._logging import (
     AWS_ACTION, BOTO_EC2RESPONSE_ERROR, NO_AVAILABLE_DEVICE,
     NO_NEW_DEVICE_IN_OS, WAITING_FOR_VOLUME_STATUS_CHANGE,
-    BOTO_LOG_HEADER, IN_USE_DEVICES,
+    BOTO_LOG_HEADER, IN_USE_DEVICES, POLLED_VOLUME_STATUS,
 )
 
 DATASET_ID_LABEL = u'flocker-dataset-id'
@@ -46,6 +48,18 @@ BOTO_NUM_RETRIES = u'20'
 VOLUME_STATE_CHANGE_TIMEOUT = 300
 MAX_ATTACH_RETRIES = 3
 
+# It typically takes a few seconds for anything to happen to a volume, so
+# wait this many seconds after an operation before first checking on it:
+VOLUME_STATE_INITIAL_DELAY = 5.0
+# The shortest and longest intervals, in seconds, between polls of the states
+# of volumes being waited for:
+VOLUME_STATE_POLL_INTERVAL = 1.0
+VOLUME_STATE_MAX_POLL_INTERVAL = 5.0
+
+# The most volumes EC2 returns for each ``DescribeVolumes`` request made to
+# list the volumes of a cluster:
+LIST_VOLUMES_PAGE_SIZE = 500
+
 # http://docs.aws.amazon.com/AWSEC2/latest/APIReference/errors-overview.html
 # for error details:
 NOT_FOUND = u'InvalidVolume.NotFound'
@@ -301,23 +315,63 @@ def _boto_logged_method(method_name, original_name):
         """
         original = getattr(self, original_name)
         method = getattr(original, method_name)
-
-        # Trace IBlockDeviceAPI ``method`` as Eliot Action.
-        # See https://clusterhq.atlassian.net/browse/FLOC-2054
-        # for ensuring all method arguments are serializable.
-        with AWS_ACTION(operation=[method_name, args, kwargs]):
-            try:
-                return method(*args, **kwargs)
-            except EC2ResponseError as e:
-                BOTO_EC2RESPONSE_ERROR(
-                    aws_code=e.code,
-                    aws_message=e.message,
-                    aws_request_id=e.request_id,
-                ).write()
-                raise
+        return _run_boto_with_logging(method_name, method, args, kwargs)
     return _run_with_logging
 
 
+def _run_boto_with_logging(method_name, method, args, kwargs):
+    """
+    Call a function using boto, logging additional information about any
+    ``EC2ResponseError`` it raises.
+
+    :param str method_name: The name to log the call with.
+    :param method: The function to call.
+    :param tuple args: Positional arguments for ``method``.
+    :param dict kwargs: Keyword arguments for ``method``.
+
+    :return: The result of ``method``.
+    """
+    # Trace IBlockDeviceAPI ``method`` as Eliot Action.
+    # See https://clusterhq.atlassian.net/browse/FLOC-2054
+    # for ensuring all method arguments are serializable.
+    with AWS_ACTION(operation=[method_name, args, kwargs]):
+        try:
+            return method(*args, **kwargs)
+        except EC2ResponseError as e:
+            BOTO_EC2RESPONSE_ERROR(
+                aws_code=e.code,
+                aws_message=e.message,
+                aws_request_id=e.request_id,
+            ).write()
+            raise
+
+
+def _get_volume_page(connection, filters, max_results, next_token=None):
+    """
+    Get one page of the volumes matching some filters.
+
+    ``EC2Connection.get_all_volumes`` can't request the results a page at a
+    time, so this makes the ``DescribeVolumes`` request itself.
+
+    :param boto.ec2.connection.EC2Connection connection: The connection to
+        make the request with.
+    :param dict filters: Map EC2 filter names to the values to match.
+    :param int max_results: The most volumes to return.
+    :param next_token: The ``next_token`` of the previous page, or ``None``
+        for the first page.
+
+    :return: A ``boto.resultset.ResultSet`` of ``boto.ec2.volume.Volume``.
+        Its ``next_token`` is ``None`` if this is the last page.
+    """
+    params = {"MaxResults": str(max_results)}
+    if next_token is not None:
+        params["NextToken"] = next_token
+    connection.build_filter_params(params, filters)
+    return connection.get_list(
+        "DescribeVolumes", params, [("item", Volume)], verb="POST",
+    )
+
+
 def boto_logger(*args, **kwargs):
     """
     Decorator to log all callable boto.ec2.connection.EC2Connection
@@ -350,6 +404,15 @@ class _LoggedBotoConnection(PRecord):
     """
     connection = field(mandatory=True)
 
+    def get_volume_page(self, filters, max_results, next_token=None):
+        """
+        See ``_get_volume_page``.
+        """
+        return _run_boto_with_logging(
+            "get_volume_page", _get_volume_page,
+            (self.connection, filters, max_results, next_token), {},
+        )
+
 
 class _EC2(PRecord):
     """
@@ -488,6 +551,249 @@ def _wait_for_volume_state_change(operation,
                                          wait_time=(time.time() - start_time))
 
 
+def _updated_from(fetched):
+    """
+    Create a function to update a volume's state from a copy fetched as
+    part of a batch, for ``_should_finish``.
+
+    :param fetched: The ``boto.ec2.volume.Volume`` fetched from EC2, or
+        ``None`` if EC2 returned nothing for the volume.  Like
+        ``Volume.update``, the volume is then left alone.
+
+    :return: A one-argument function which updates the given volume.
+    """
+    def update(volume):
+        if fetched is not None:
+            volume._update(fetched)
+    return update
+
+
+def _failed_update(error):
+    """
+    Create a function to update a volume's state which fails, for
+    ``_should_finish``.
+
+    :param EC2ResponseError error: The error fetching the volume's state.
+
+    :return: A one-argument function which raises ``error``.
+    """
+    def update(volume):
+        raise error
+    return update
+
+
+class _VolumeStateWaiter(object):
+    """
+    An operation waiting for its volume to change state.
+
+    :ivar NamedConstant operation: Operation triggering volume state change.
+        A value from ``VolumeOperations``.
+    :ivar boto.ec2.volume.Volume volume: The volume, updated in place each
+        time its state is polled.
+    :ivar int timeout: Seconds to wait for the operation to succeed, from
+        the first check.
+    :ivar float ready_at: The time at which to first check the volume.
+    :ivar start_time: The time of the first check, or ``None``.
+    :ivar threading.Event finished: Set once the wait is over.
+    :ivar error: ``None``, or the ``sys.exc_info()`` tuple of the exception
+        which ended the wait.
+    """
+    def __init__(self, operation, volume, timeout, ready_at):
+        self.operation = operation
+        self.volume = volume
+        self.timeout = timeout
+        self.ready_at = ready_at
+        self.start_time = None
+        self.finished = threading.Event()
+        self.error = None
+
+
+class VolumeStatePoller(object):
+    """
+    Wait for volumes to change state on behalf of many operations at once,
+    polling the states of all of their volumes with a single
+    ``get_all_volumes`` call per interval.
+
+    A thread polls while any operation is waiting.  The interval doubles
+    after each poll in which no volume changed state, up to
+    ``max_interval``, and starts again from ``interval`` when one does or a
+    new operation starts waiting.
+
+    Each wait behaves like ``_wait_for_volume_state_change``: the first
+    check happens ``initial_delay`` seconds after the wait starts, and the
+    timeout counts from that check.
+
+    :ivar connection: The EC2 connection to poll with.
+    :ivar float initial_delay: Seconds to wait before first checking on a
+        volume.
+    :ivar float interval: The shortest interval, in seconds, between polls.
+    :ivar float max_interval: The longest interval, in seconds, between
+        polls.
+    :ivar _lock: A ``threading.Lock`` protecting ``_waiters``, ``_thread``
+        and ``_interval``.
+    :ivar list _waiters: The ``_VolumeStateWaiter``\ s still waiting.
+    :ivar _thread: The polling ``threading.Thread``, or ``None`` if nothing
+        is waiting.
+    :ivar float _interval: The current interval between polls.
+    """
+    def __init__(self, connection,
+                 initial_delay=VOLUME_STATE_INITIAL_DELAY,
+                 interval=VOLUME_STATE_POLL_INTERVAL,
+                 max_interval=VOLUME_STATE_MAX_POLL_INTERVAL):
+        self.connection = connection
+        self.initial_delay = initial_delay
+        self.interval = interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._thread = None
+        self._interval = interval
+
+    def wait_for(self, operation, volume,
+                 timeout=VOLUME_STATE_CHANGE_TIMEOUT):
+        """
+        Wait for a given volume to change state from ``start_status`` via
+        ``transient_status`` to ``end_status``.
+
+        :param NamedConstant operation: Operation triggering volume state
+            change.  A value from ``VolumeOperations``.
+        :param boto.ec2.volume.Volume volume: Volume to check status for.
+        :param int timeout: Seconds to wait for volume operation to succeed.
+
+        :raises Exception: When input volume fails to reach expected backend
+            state for given operation within timeout seconds.
+        """
+        waiter = _VolumeStateWaiter(
+            operation, volume, timeout, time.time() + self.initial_delay,
+        )
+        with self._lock:
+            self._waiters.append(waiter)
+            self._interval = self.interval
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ebs-volume-state-poller",
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        waiter.finished.wait()
+        if waiter.error is not None:
+            raise waiter.error[0], waiter.error[1], waiter.error[2]
+
+    def _run(self):
+        """
+        Poll until nothing is waiting.
+        """
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._thread = None
+                    return
+                interval = self._interval
+            time.sleep(interval)
+            self.poll()
+
+    def _finish(self, waiter, error):
+        """
+        End a wait.
+
+        :param _VolumeStateWaiter waiter: The wait to end.
+        :param error: ``None`` if the volume reached its end state, otherwise
+            the ``sys.exc_info()`` tuple of the exception ending the wait.
+        """
+        with self._lock:
+            self._waiters.remove(waiter)
+        waiter.error = error
+        waiter.finished.set()
+
+    def _updates(self, volume_ids):
+        """
+        Fetch the states of some volumes.
+
+        :param list volume_ids: The identifiers of the volumes.
+
+        :return: A ``dict`` mapping each volume identifier to a function
+            updating that volume for ``_should_finish``.
+        """
+        try:
+            volumes = self.connection.get_all_volumes(volume_ids=volume_ids)
+        except EC2ResponseError as e:
+            if e.code != NOT_FOUND or len(volume_ids) == 1:
+                return {
+                    volume_id: _failed_update(e) for volume_id in volume_ids
+                }
+            # At least one of the volumes doesn't exist.  Find out which
+            # ones, so that waits for the others are unaffected.
+            updates = {}
+            for volume_id in volume_ids:
+                updates.update(self._updates([volume_id]))
+            return updates
+        # Only use results for the volumes asked about, like
+        # ``Volume.update``.
+        fetched = {
+            volume.id: volume for volume in volumes
+            if volume.id in volume_ids
+        }
+        return {
+            volume_id: _updated_from(fetched.get(volume_id))
+            for volume_id in volume_ids
+        }
+
+    def poll(self):
+        """
+        Check on every volume which is due to be checked, ending the waits
+        that are over.
+        """
+        now = time.time()
+        with self._lock:
+            due = [
+                waiter for waiter in self._waiters if waiter.ready_at <= now
+            ]
+        if not due:
+            return
+        volume_ids = sorted(set(waiter.volume.id for waiter in due))
+        try:
+            updates = self._updates(volume_ids)
+        except Exception:
+            error = sys.exc_info()
+            for waiter in due:
+                self._finish(waiter, error)
+            return
+
+        changed = False
+        for waiter in due:
+            volume = waiter.volume
+            if waiter.start_time is None:
+                waiter.start_time = now
+            status = volume.status
+            try:
+                finished = _should_finish(
+                    waiter.operation, volume, updates[volume.id],
+                    waiter.start_time, waiter.timeout,
+                )
+            except Exception:
+                self._finish(waiter, sys.exc_info())
+                continue
+            changed = changed or volume.status != status
+            if finished:
+                self._finish(waiter, None)
+            else:
+                state_flow = VOLUME_STATE_TABLE.table[waiter.operation]
+                WAITING_FOR_VOLUME_STATUS_CHANGE(
+                    volume_id=volume.id, status=volume.status,
+                    target_status=state_flow.end_state.value,
+                    needs_attach_data=state_flow.sets_attach,
+                    wait_time=int(time.time() - waiter.start_time),
+                ).write()
+
+        with self._lock:
+            if changed:
+                self._interval = self.interval
+            else:
+                self._interval = min(self._interval * 2, self.max_interval)
+            interval = self._interval
+        POLLED_VOLUME_STATUS(volume_ids=volume_ids, interval=interval).write()
+
+
 def _get_device_size(device):
     """
     Helper function to fetch the size of given block device.
@@ -517,7 +823,8 @@ def _get_device_size(device):
     return device_size
 
 
-def _wait_for_new_device(base, size, time_limit=60):
+def _wait_for_new_device(base, size, time_limit=60, expected=None,
+                         reserved=None):
     """
     Helper function to wait for up to 60s for new
     EBS block device (`/dev/sd*` or `/dev/xvd*`) to
@@ -530,19 +837,36 @@ def _wait_for_new_device(base, size, time_limit=60):
         to manifest in the OS.
     :param int time_limit: Time, in seconds, to wait for
         new device to manifest. Defaults to 60s.
+    :param FilePath expected: ``None``, or the block device file to choose
+        if several new devices appear at once.
+    :param reserved: ``None``, or a no-argument callable returning the
+        ``set`` of block device files which the volumes being attached at
+        the same time are expected to appear as.  Those devices are never
+        chosen, even once they are no longer reserved.
 
     :returns: The path of the new block device file.
     :rtype: ``FilePath``
     """
+    skipped = set()
     start_time = time.time()
     elapsed_time = time.time() - start_time
     while elapsed_time < time_limit:
+        if reserved is not None:
+            skipped |= reserved()
+        found = []
         for device in list(set(FilePath(b"/sys/block").children()) -
                            set(base)):
-            device_name = FilePath.basename(device)
+            device_name = device.basename()
+            device_path = FilePath(b"/dev").child(device_name)
+            if device_path in skipped:
+                continue
             if (device_name.startswith((b"sd", b"xvd")) and
                     _get_device_size(device_name) == size):
-                return FilePath(b"/dev").child(device_name)
+                found.append(device_path)
+        if expected in found:
+            return expected
+        if found:
+            return found[0]
         time.sleep(0.1)
         elapsed_time = time.time() - start_time
 
@@ -558,6 +882,27 @@ def _wait_for_new_device(base, size, time_limit=60):
     return None
 
 
+def _iter_volumes(connection, filters, page_size=LIST_VOLUMES_PAGE_SIZE):
+    """
+    Iterate over the volumes matching some filters, requesting them a page
+    at a time so that only one page is held in memory at once.
+
+    :param connection: A ``_LoggedBotoConnection``.
+    :param dict filters: Map EC2 filter names to the values to match.
+    :param int page_size: The most volumes to request at once.
+
+    :return: An iterator of ``boto.ec2.volume.Volume``.
+    """
+    next_token = None
+    while True:
+        page = connection.get_volume_page(filters, page_size, next_token)
+        for volume in page:
+            yield volume
+        next_token = page.next_token
+        if not next_token:
+            return
+
+
 def _is_cluster_volume(cluster_id, ebs_volume):
     """
     Helper function to check if given volume belongs to
@@ -596,7 +941,12 @@ class EBSBlockDeviceAPI(object):
         self.connection = ec2_client.connection
         self.zone = ec2_client.zone
         self.cluster_id = cluster_id
+        # Guards the choice of device names for attaching volumes.
         self.lock = threading.Lock()
+        # Device names chosen for volumes which are still being attached, so
+        # not yet reliably reported by EC2.
+        self._attaching_devices = set()
+        self.volume_state_poller = VolumeStatePoller(self.connection)
 
     def allocation_unit(self):
         """
@@ -642,7 +992,7 @@ class EBSBlockDeviceAPI(object):
 
         Algorithm:
         1. Get all ``Block devices`` currently in use by given instance:
-            a) List all volumes visible to this instance.
+            a) List all volumes attached to this instance.
             b) Gather device IDs of all devices attached to (a).
         2. Devices available for EBS volume usage are ``/dev/sd[f-p]``.
            Find the first device from this set that is currently not
@@ -697,8 +1047,8 @@ class EBSBlockDeviceAPI(object):
                                     metadata)
 
         # Wait for created volume to reach 'available' state.
-        _wait_for_volume_state_change(VolumeOperations.CREATE,
-                                      requested_volume)
+        self.volume_state_poller.wait_for(VolumeOperations.CREATE,
+                                          requested_volume)
 
         # Return created volume in BlockDeviceVolume format.
         return _blockdevicevolume_from_ebs_volume(requested_volume)
@@ -706,9 +1056,21 @@ class EBSBlockDeviceAPI(object):
     def list_volumes(self):
         """
         Return all volumes that belong to this Flocker cluster.
+
+        EC2 only returns the volumes in this availability zone which are
+        tagged with the cluster's identifier, a page at a time.
         """
+        filters = {
+            "tag:" + CLUSTER_ID_LABEL: unicode(self.cluster_id),
+            "availability-zone": self.zone,
+        }
+        volumes = []
         try:
-            ebs_volumes = self.connection.get_all_volumes()
+            for ebs_volume in _iter_volumes(self.connection, filters):
+                if _is_cluster_volume(self.cluster_id, ebs_volume):
+                    volumes.append(
+                        _blockdevicevolume_from_ebs_volume(ebs_volume)
+                    )
         except EC2ResponseError as e:
             # Work around some internal race-condition in EBS by retrying,
             # since this error makes no sense:
@@ -716,13 +1078,6 @@ class EBSBlockDeviceAPI(object):
                 return self.list_volumes()
             else:
                 raise
-
-        volumes = []
-        for ebs_volume in ebs_volumes:
-            if _is_cluster_volume(self.cluster_id, ebs_volume):
-                volumes.append(
-                    _blockdevicevolume_from_ebs_volume(ebs_volume)
-                )
         return volumes
 
     def attach_volume(self, blockdevice_id, attach_to):
@@ -748,6 +1103,40 @@ class EBSBlockDeviceAPI(object):
                 ebs_volume.status != VolumeStates.AVAILABLE.value):
             raise AlreadyAttachedVolume(blockdevice_id)
 
+        device = self._attach_to_device(blockdevice_id, attach_to, volume)
+        if device is None:
+            return
+        try:
+            self.volume_state_poller.wait_for(
+                VolumeOperations.ATTACH, ebs_volume
+            )
+        finally:
+            with self.lock:
+                self._attaching_devices.discard(device)
+
+        attached_volume = volume.set('attached_to', attach_to)
+        return attached_volume
+
+    def _attach_to_device(self, blockdevice_id, attach_to, volume):
+        """
+        Choose a device name, attach a volume at it and wait for the device
+        to appear in the OS.
+
+        Only choosing the device name and asking EC2 to attach the volume are
+        done while holding ``lock``, so volumes can be attached at the same
+        time.  The device name stays reserved in ``_attaching_devices`` until
+        ``attach_volume`` finishes.
+
+        :param unicode blockdevice_id: EBS UUID for volume to be attached.
+        :param unicode attach_to: Instance id of AWS Compute instance to
+            attached the blockdevice to.
+        :param BlockDeviceVolume volume: The volume to attach.
+
+        :raises AttachedUnexpectedDevice: See ``attach_volume``.
+
+        :return: The ``unicode`` device name the volume was attached at, or
+            ``None`` if no device name is free.
+        """
         ignore_devices = pset([])
         attach_attempts = 0
         while True:
@@ -755,14 +1144,19 @@ class EBSBlockDeviceAPI(object):
                 # begin lock scope
 
                 blockdevices = FilePath(b"/sys/block").children()
-                volumes = self.connection.get_all_volumes()
-                device = self._next_device(attach_to, volumes, ignore_devices)
+                volumes = _iter_volumes(
+                    self.connection, {"attachment.instance-id": attach_to},
+                )
+                device = self._next_device(
+                    attach_to, volumes,
+                    ignore_devices | self._attaching_devices,
+                )
 
                 if device is None:
                     # XXX: Handle lack of free devices in ``/dev/sd[f-p]``.
                     # (https://clusterhq.atlassian.net/browse/FLOC-1887).
                     # No point in attempting an ``attach_volume``, return.
-                    return
+                    return None
 
                 try:
                     self.connection.attach_volume(blockdevice_id,
@@ -777,47 +1171,77 @@ class EBSBlockDeviceAPI(object):
                         if attach_attempts == MAX_ATTACH_RETRIES:
                             raise
                         ignore_devices = ignore_devices.add(device)
+                        continue
                     else:
                         raise
-                else:
-                    # Wait for new device to manifest in the OS. Since there
-                    # is currently no standardized protocol across Linux guests
-                    # in EC2 for mapping `device` to the name device driver
-                    # picked (http://docs.aws.amazon.com/AWSEC2/latest/
-                    # UserGuide/device_naming.html), wait for new block device
-                    # to be available to the OS, and interpret it as ours.
-                    # Wait under lock scope to reduce false positives.
-                    device_path = _wait_for_new_device(
-                        blockdevices, volume.size
-                    )
-                    # We do, however, expect the attached device name to follow
-                    # a certain simple pattern.  Verify that now and signal an
-                    # error immediately if the assumption is violated.  If we
-                    # let it go by, a later call to ``get_device_path`` will
-                    # quietly produce the wrong results.
-                    #
-                    # To make this explicit, we *expect* that the device will
-                    # *always* be what we *expect* the device to be (sorry).
-                    # This check is only here in case we're wrong to make the
-                    # system fail in a less damaging way.
-                    if _expected_device(device) != device_path:
-                        # We also don't want anything to re-discover the volume
-                        # in an attached state since that might also result in
-                        # use of ``get_device_path`` (producing an incorrect
-                        # result).  This is a best-effort.  It's possible the
-                        # agent will crash after attaching the volume and
-                        # before detaching it here, leaving the system in a bad
-                        # state.  This is one reason we need a better solution
-                        # in the long term.
-                        self.detach_volume(blockdevice_id)
-                        raise AttachedUnexpectedDevice(device, device_path)
-                    break
+                self._attaching_devices.add(device)
                 # end lock scope
 
-        _wait_for_volume_state_change(VolumeOperations.ATTACH, ebs_volume)
+            try:
+                self._check_new_device(
+                    blockdevice_id, device, blockdevices, volume.size,
+                )
+            except:
+                with self.lock:
+                    self._attaching_devices.discard(device)
+                raise
+            return device
 
-        attached_volume = volume.set('attached_to', attach_to)
-        return attached_volume
+    def _check_new_device(self, blockdevice_id, device, blockdevices, size):
+        """
+        Wait for the device of a volume being attached to appear in the OS.
+
+        :param unicode blockdevice_id: EBS UUID for volume being attached.
+        :param unicode device: The device name the volume is attached at.
+        :param list blockdevices: The block devices which existed before
+            the volume was attached.
+        :param int size: The size of the volume.
+
+        :raises AttachedUnexpectedDevice: See ``attach_volume``.
+        """
+        # Wait for new device to manifest in the OS. Since there is currently
+        # no standardized protocol across Linux guests in EC2 for mapping
+        # `device` to the name device driver picked
+        # (http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/
+        # device_naming.html), wait for a new block device to be available to
+        # the OS, and interpret it as ours.  Other volumes may be being
+        # attached at the same time, so the devices they expect don't count.
+        expected = _expected_device(device)
+        device_path = _wait_for_new_device(
+            blockdevices, size, expected=expected,
+            reserved=lambda: self._reserved_devices(device),
+        )
+        # We do, however, expect the attached device name to follow a
+        # certain simple pattern.  If another device appears instead, or
+        # none does, signal an error now.  If we let it go by, a later call to
+        # ``get_device_path`` will quietly produce the wrong results.
+        #
+        # To make this explicit, we *expect* that the device will *always* be
+        # what we *expect* the device to be (sorry).  This check is only here
+        # in case we're wrong to make the system fail in a less damaging way.
+        if expected != device_path:
+            # We also don't want anything to re-discover the volume in an
+            # attached state since that might also result in use of
+            # ``get_device_path`` (producing an incorrect result).  This is a
+            # best-effort.  It's possible the agent will crash after
+            # attaching the volume and before detaching it here, leaving the
+            # system in a bad state.  This is one reason we need a better
+            # solution in the long term.
+            self.detach_volume(blockdevice_id)
+            raise AttachedUnexpectedDevice(device, device_path)
+
+    def _reserved_devices(self, device):
+        """
+        :param unicode device: The device name of a volume being attached.
+
+        :return: The ``set`` of block device files which the other volumes
+            being attached are expected to appear as.
+        """
+        with self.lock:
+            return {
+                _expected_device(other) for other in self._attaching_devices
+                if other != device
+            }
 
     def detach_volume(self, blockdevice_id):
         """
@@ -836,7 +1260,7 @@ class EBSBlockDeviceAPI(object):
 
         self.connection.detach_volume(blockdevice_id)
 
-        _wait_for_volume_state_change(VolumeOperations.DETACH, ebs_volume)
+        self.volume_state_poller.wait_for(VolumeOperations.DETACH, ebs_volume)
 
     def destroy_volume(self, blockdevice_id):
         """
@@ -853,8 +1277,8 @@ class EBSBlockDeviceAPI(object):
         destroy_result = self.connection.delete_volume(blockdevice_id)
         if destroy_result:
             try:
-                _wait_for_volume_state_change(VolumeOperations.DESTROY,
-                                              ebs_volume)
+                self.volume_state_poller.wait_for(VolumeOperations.DESTROY,
+                                                  ebs_volume)
             except UnknownVolume:
                 return
         else:
@@ -28,7 +28,8 @@ from pyrsistent import (
 
 from twisted.python.runtime import platform
 from twisted.python.filepath import FilePath
-from twisted.trial.unittest import SynchronousTestCase, SkipTest
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase, SkipTest, TestCase
 
 from eliot import start_action, write_traceback, Message, Logger
 from eliot.testing import (
@@ -40,6 +41,7 @@ from .. import blockdevice
 from ...test.istatechange import make_istatechange_tests
 from ..blockdevice import (
     BlockDeviceDeployer, LoopbackBlockDeviceAPI, IBlockDeviceAPI,
+    LoopbackBlockDeviceAsyncAPI,
     BlockDeviceVolume, UnknownVolume, AlreadyAttachedVolume,
     CreateBlockDeviceDataset, UnattachedVolume, DatasetExists,
     DestroyBlockDeviceDataset, UnmountBlockDevice, DetachVolume,
@@ -61,14 +63,18 @@ from ..blockdevice import (
     _backing_file_name,
     ProcessLifetimeCache,
     FilesystemExists,
+    MountTableCache,
+    CacheMetrics,
+    LIST_VOLUMES_TTL,
 )
 
-from ... import run_state_change, in_parallel
+from ... import run_state_change, in_parallel, IResourceStateChange
 from ...testtools import (
     ideployer_tests_factory, to_node, assert_calculated_changes_for_deployer,
 )
 from ....testtools import (
     REALISTIC_BLOCKDEVICE_SIZE, run_process, make_with_init_tests, random_name,
+    CustomException,
 )
 from ....control import (
     Dataset, Manifestation, Node, NodeState, Deployment, DeploymentState,
@@ -306,6 +312,30 @@ class BlockDeviceDeployerAsyncAPITests(SynchronousTestCase):
         )
         self.assertIs(async_api, deployer.async_block_device_api)
 
+    def test_threadpool(self):
+        """
+        When initialized with a ``threadpool``, the attribute evaluates to a
+        ``_SyncToThreadedAsyncAPIAdapter`` using that thread pool instead of
+        the global reactor's.
+        """
+        from twisted.internet import reactor
+        threadpool = NonThreadPool()
+
+        api = UnusableAPI()
+        deployer = BlockDeviceDeployer(
+            hostname=u"192.0.2.1",
+            node_uuid=uuid4(),
+            block_device_api=api,
+            threadpool=threadpool,
+        )
+
+        self.assertEqual(
+            _SyncToThreadedAsyncAPIAdapter(
+                _reactor=reactor, _threadpool=threadpool, _sync=api
+            ),
+            deployer.async_block_device_api,
+        )
+
 
 def assert_discovered_state(case,
                             deployer,
@@ -576,6 +606,45 @@ class BlockDeviceDeployerDiscoverStateTests(SynchronousTestCase):
             },
         )
 
+    def test_mount_table_cache(self):
+        """
+        ``BlockDeviceDeployer.discover_state`` notices a filesystem being
+        mounted even if it loads the mount table from a ``MountTableCache``.
+        """
+        deployer = self.deployer.set(mount_table=MountTableCache())
+        dataset_id = uuid4()
+        new_volume = self.api.create_volume(
+            dataset_id=dataset_id,
+            size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+        )
+        self.api.attach_volume(
+            new_volume.blockdevice_id,
+            attach_to=self.this_node,
+        )
+        device = self.api.get_device_path(new_volume.blockdevice_id)
+        assert_discovered_state(
+            self, deployer,
+            expected_manifestations=[],
+            expected_nonmanifest_datasets=[dataset_id],
+            expected_devices={dataset_id: device},
+        )
+        mountpoint = deployer.mountroot.child(bytes(dataset_id))
+        mountpoint.makedirs()
+        make_filesystem(device, block_device=True)
+        mount(device, mountpoint)
+        expected_manifestation = Manifestation(
+            dataset=Dataset(
+                dataset_id=dataset_id,
+                maximum_size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            ),
+            primary=True,
+        )
+        assert_discovered_state(
+            self, deployer,
+            [expected_manifestation],
+            expected_devices={dataset_id: device},
+        )
+
     def test_only_remote_device(self):
         """
         ``BlockDeviceDeployer.discover_state`` does not consider remotely
@@ -2162,6 +2231,164 @@ class LoopbackBlockDeviceAPITests(
     """
 
 
+class LoopbackBlockDeviceAsyncAPIInterfaceTests(
+    make_iblockdeviceasyncapi_tests(
+        lambda test_case:
+            LoopbackBlockDeviceAsyncAPI(
+                reactor=None,
+                # As for ``SyncToThreadedAsyncAPIAdapterTests``.
+                sync=LoopbackBlockDeviceAPI.from_path(
+                    root_path=test_case.mktemp(),
+                    compute_instance_id=u"loopback-async-tests",
+                ),
+            )
+    )
+):
+    """
+    Interface adherence tests for ``LoopbackBlockDeviceAsyncAPI``.
+    """
+
+
+class LoopbackBlockDeviceAsyncAPITests(TestCase):
+    """
+    Tests for ``LoopbackBlockDeviceAsyncAPI``.
+    """
+    def setUp(self):
+        from twisted.internet import reactor
+        self.sync = loopbackblockdeviceapi_for_test(
+            self, allocation_unit=LOOPBACK_ALLOCATION_UNIT,
+        )
+        self.changed = []
+        self.api = LoopbackBlockDeviceAsyncAPI(
+            reactor=reactor, sync=self.sync, changed=self.changed.append,
+        )
+        self.this_node = self.sync.compute_instance_id()
+        self.volume = self.sync.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+        )
+
+    def test_attach(self):
+        """
+        ``attach_volume`` attaches the volume to a loopback device and fires
+        with the attached volume, which ``get_device_path`` then finds.
+        """
+        attaching = self.api.attach_volume(
+            self.volume.blockdevice_id, attach_to=self.this_node,
+        )
+
+        def attached(volume):
+            device = self.api.get_device_path(volume.blockdevice_id)
+            return device.addCallback(lambda path: (volume, path))
+        attaching.addCallback(attached)
+
+        def check((volume, path)):
+            self.assertEqual(
+                (self.volume.set(attached_to=self.this_node),
+                 self.sync.get_device_path(self.volume.blockdevice_id),
+                 [self.volume.blockdevice_id]),
+                (volume, path, self.changed),
+            )
+        return attaching.addCallback(check)
+
+    def test_attach_attached(self):
+        """
+        ``attach_volume`` fails with ``AlreadyAttachedVolume`` for a volume
+        which is already attached.
+        """
+        self.sync.attach_volume(
+            self.volume.blockdevice_id, attach_to=self.this_node,
+        )
+        return self.assertFailure(
+            self.api.attach_volume(
+                self.volume.blockdevice_id, attach_to=self.this_node,
+            ),
+            AlreadyAttachedVolume,
+        )
+
+    def test_detach(self):
+        """
+        ``detach_volume`` releases the loopback device of an attached volume
+        and leaves it unattached.
+        """
+        self.sync.attach_volume(
+            self.volume.blockdevice_id, attach_to=self.this_node,
+        )
+        device = self.sync.get_device_path(self.volume.blockdevice_id)
+        detaching = self.api.detach_volume(self.volume.blockdevice_id)
+
+        def check(result):
+            self.assertEqual(
+                (None, [self.volume], [self.volume.blockdevice_id], False),
+                (result, self.sync.list_volumes(), self.changed,
+                 device in [path for path, _ in _losetup_list()]),
+            )
+        return detaching.addCallback(check)
+
+    def test_detach_unattached(self):
+        """
+        ``detach_volume`` fails with ``UnattachedVolume`` for a volume which
+        is not attached.
+        """
+        return self.assertFailure(
+            self.api.detach_volume(self.volume.blockdevice_id),
+            UnattachedVolume,
+        )
+
+    def test_get_device_path_partially_attached(self):
+        """
+        ``get_device_path`` allocates a loopback device for an attached
+        volume which does not have one.
+        """
+        self.sync.attach_volume(
+            self.volume.blockdevice_id, attach_to=self.this_node,
+        )
+        losetup_detach(self.sync.get_device_path(self.volume.blockdevice_id))
+        finding = self.api.get_device_path(self.volume.blockdevice_id)
+
+        def check(path):
+            self.assertIn(path, [device for device, _ in _losetup_list()])
+        return finding.addCallback(check)
+
+    def test_create_destroy(self):
+        """
+        ``create_volume`` and ``destroy_volume`` report the volumes they
+        change.
+        """
+        creating = self.api.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+        )
+
+        def created(volume):
+            destroying = self.api.destroy_volume(volume.blockdevice_id)
+            return destroying.addCallback(lambda _: volume)
+        creating.addCallback(created)
+
+        def check(volume):
+            self.assertEqual(
+                ([volume.blockdevice_id] * 2, [self.volume]),
+                (self.changed, self.sync.list_volumes()),
+            )
+        return creating.addCallback(check)
+
+    def test_create_failed(self):
+        """
+        ``create_volume`` reports a change with no ``blockdevice_id`` if it
+        fails, since the volume may have been partly created.
+        """
+        def create_volume(dataset_id, size):
+            raise CustomException()
+        self.patch(self.sync, "create_volume", create_volume)
+        creating = self.assertFailure(
+            self.api.create_volume(
+                dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            ),
+            CustomException,
+        )
+        return creating.addCallback(
+            lambda _: self.assertEqual([None], self.changed)
+        )
+
+
 class LoopbackBlockDeviceAPIConstructorTests(SynchronousTestCase):
     """
     Implementation specific constructor tests.
@@ -3122,6 +3349,10 @@ class CreateBlockDeviceDatasetImplementationTests(SynchronousTestCase):
             node_uuid=uuid4(),
             hostname=u"192.0.2.10",
             block_device_api=self.api,
+            _async_block_device_api=_SyncToThreadedAsyncAPIAdapter(
+                _sync=self.api, _reactor=NonReactor(),
+                _threadpool=NonThreadPool(),
+            ),
             mountroot=self.mountroot
         )
 
@@ -3275,6 +3506,60 @@ class CreateBlockDeviceDatasetImplementationTests(SynchronousTestCase):
                          ('rwx------', 'rwxrwxrwx'))
 
 
+class BlockDeviceChangeResourcesTests(SynchronousTestCase):
+    """
+    Tests for the ``IResourceStateChange.resources`` of the block device state
+    changes.
+    """
+    def changes(self, dataset_id):
+        """
+        :return: One of each kind of change, all for the given dataset.
+        """
+        volume = _blockdevicevolume_from_dataset_id(
+            dataset_id=dataset_id, size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+        )
+        mountpoint = FilePath(b"/flocker").child(bytes(dataset_id))
+        return [
+            DestroyBlockDeviceDataset(dataset_id=dataset_id),
+            CreateFilesystem(volume=volume, filesystem=u"ext4"),
+            MountBlockDevice(dataset_id=dataset_id, mountpoint=mountpoint),
+            UnmountBlockDevice(dataset_id=dataset_id),
+            AttachVolume(dataset_id=dataset_id),
+            DetachVolume(dataset_id=dataset_id),
+            DestroyVolume(volume=volume),
+            CreateBlockDeviceDataset(
+                dataset=Dataset(
+                    dataset_id=unicode(dataset_id),
+                    maximum_size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+                ),
+                mountpoint=mountpoint,
+            ),
+        ]
+
+    def test_same_dataset(self):
+        """
+        Changes to the same dataset all use the same, single, resource.
+        """
+        changes = self.changes(uuid4())
+        self.assertEqual(
+            ([True] * len(changes), 1),
+            ([IResourceStateChange.providedBy(c) for c in changes],
+             len(reduce(frozenset.union, (c.resources for c in changes)))),
+        )
+
+    def test_different_datasets(self):
+        """
+        Changes to different datasets have no resources in common.
+        """
+        first = self.changes(uuid4())
+        second = self.changes(uuid4())
+        self.assertEqual(
+            [True] * len(first),
+            [a.resources.isdisjoint(b.resources)
+             for a, b in zip(first, second)],
+        )
+
+
 class AttachVolumeInitTests(
     make_with_init_tests(
         record_type=AttachVolume,
@@ -3560,3 +3845,217 @@ class ProcessLifetimeCacheTests(SynchronousTestCase):
 
         self.assertRaises(UnattachedVolume,
                           self.cache.get_device_path, attached_id1)
+
+    def test_get_device_path_metrics(self):
+        """
+        ``ProcessLifetimeCache`` counts the hits, misses and invalidations of
+        cached device paths.
+        """
+        attached_id1, attached_id2 = self.attached_volumes()
+        self.cache.get_device_path(attached_id1)
+        self.cache.get_device_path(attached_id1)
+        self.cache.get_device_path(attached_id2)
+        self.cache.detach_volume(attached_id1)
+        self.assertEqual(
+            CacheMetrics(hits=1, misses=2, invalidations=1),
+            self.cache.metrics[u"get_device_path"],
+        )
+
+    def test_invalidate(self):
+        """
+        ``invalidate`` discards the cached device path of the given volume, and
+        the cached volumes.
+        """
+        attached_id1, attached_id2 = self.attached_volumes()
+        self.cache.get_device_path(attached_id1)
+        self.cache.get_device_path(attached_id2)
+        self.cache.list_volumes()
+        self.cache.invalidate(attached_id1)
+        self.cache.get_device_path(attached_id1)
+        self.cache.get_device_path(attached_id2)
+        self.cache.list_volumes()
+        self.assertEqual(
+            (2, 1, 2),
+            (self.counting_proxy.num_calls("get_device_path", attached_id1),
+             self.counting_proxy.num_calls("get_device_path", attached_id2),
+             self.counting_proxy.num_calls("list_volumes")),
+        )
+
+
+class ProcessLifetimeCacheListVolumesTests(SynchronousTestCase):
+    """
+    Tests for the caching of ``list_volumes`` in ``ProcessLifetimeCache``.
+    """
+    def setUp(self):
+        self.api = loopbackblockdeviceapi_for_test(self)
+        self.counting_proxy = CountingProxy(self.api)
+        self.clock = Clock()
+        self.cache = ProcessLifetimeCache(self.counting_proxy, self.clock)
+        self.volume = self.api.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+        )
+
+    def test_cached(self):
+        """
+        The result of ``list_volumes`` is reused until it expires.
+        """
+        initial = self.cache.list_volumes()
+        self.clock.advance(LIST_VOLUMES_TTL - 1)
+        later = self.cache.list_volumes()
+        self.assertEqual(
+            ([self.volume], later,
+             self.counting_proxy.num_calls("list_volumes"),
+             CacheMetrics(hits=1, misses=1)),
+            (initial, initial, 1, self.cache.metrics[u"list_volumes"]),
+        )
+
+    def test_expires(self):
+        """
+        The volumes are listed again once the cached result expires.
+        """
+        self.cache.list_volumes()
+        self.clock.advance(LIST_VOLUMES_TTL)
+        self.cache.list_volumes()
+        self.assertEqual(
+            (2, CacheMetrics(hits=0, misses=2)),
+            (self.counting_proxy.num_calls("list_volumes"),
+             self.cache.metrics[u"list_volumes"]),
+        )
+
+    def test_ttl(self):
+        """
+        ``ProcessLifetimeCache`` reuses the result of ``list_volumes`` for
+        the given number of seconds.
+        """
+        cache = ProcessLifetimeCache(self.counting_proxy, self.clock, 1.0)
+        cache.list_volumes()
+        self.clock.advance(1.0)
+        cache.list_volumes()
+        self.assertEqual(2, self.counting_proxy.num_calls("list_volumes"))
+
+    def assert_invalidated(self, change):
+        """
+        Assert that a change made through the cache discards the cached
+        volumes, so the next ``list_volumes`` reflects it.
+
+        :param change: A one-argument callable which makes the change using
+            the ``ProcessLifetimeCache`` it is passed.
+        """
+        self.cache.list_volumes()
+        change(self.cache)
+        self.assertEqual(
+            (self.api.list_volumes(), 2,
+             CacheMetrics(hits=0, misses=2, invalidations=1)),
+            (self.cache.list_volumes(),
+             self.counting_proxy.num_calls("list_volumes"),
+             self.cache.metrics[u"list_volumes"]),
+        )
+
+    def test_create_volume(self):
+        """
+        Creating a volume discards the cached volumes.
+        """
+        self.assert_invalidated(
+            lambda cache: cache.create_volume(
+                dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            )
+        )
+
+    def test_destroy_volume(self):
+        """
+        Destroying a volume discards the cached volumes.
+        """
+        self.assert_invalidated(
+            lambda cache: cache.destroy_volume(self.volume.blockdevice_id)
+        )
+
+    def test_attach_volume(self):
+        """
+        Attaching a volume discards the cached volumes.
+        """
+        self.assert_invalidated(
+            lambda cache: cache.attach_volume(
+                self.volume.blockdevice_id,
+                attach_to=cache.compute_instance_id(),
+            )
+        )
+
+    def test_detach_volume(self):
+        """
+        Detaching a volume discards the cached volumes.
+        """
+        self.api.attach_volume(
+            self.volume.blockdevice_id,
+            attach_to=self.api.compute_instance_id(),
+        )
+        self.assert_invalidated(
+            lambda cache: cache.detach_volume(self.volume.blockdevice_id)
+        )
+
+    def test_failed_change(self):
+        """
+        A change which fails still discards the cached volumes, since it may
+        have partly happened.
+        """
+        def change(cache):
+            self.assertRaises(
+                UnknownVolume, cache.destroy_volume, unicode(uuid4()),
+            )
+        self.assert_invalidated(change)
+
+    def test_changed_while_listing(self):
+        """
+        Volumes listed while a change is being made through the cache are
+        not reused.
+        """
+        list_volumes = self.api.list_volumes
+
+        def create_while_listing():
+            volumes = list_volumes()
+            self.cache.create_volume(
+                dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            )
+            return volumes
+        self.patch(self.api, "list_volumes", create_while_listing)
+        self.cache.list_volumes()
+        self.assertEqual(2, len(self.cache.list_volumes()))
+
+
+class MountTableCacheTests(SynchronousTestCase):
+    """
+    Tests for ``MountTableCache``.
+    """
+    def setUp(self):
+        self.loads = []
+        self.cache = MountTableCache(disk_partitions=self.disk_partitions)
+
+    def disk_partitions(self):
+        self.loads.append(None)
+        return [len(self.loads)]
+
+    def test_cached(self):
+        """
+        The mounted filesystems are loaded only once while the mount table
+        doesn't change.
+        """
+        initial = self.cache.disk_partitions()
+        later = self.cache.disk_partitions()
+        self.assertEqual(
+            ([1], [1], 1, CacheMetrics(hits=1, misses=1)),
+            (initial, later, len(self.loads),
+             self.cache.metrics[u"disk_partitions"]),
+        )
+
+    def test_mount_changed(self):
+        """
+        The mounted filesystems are loaded again after a filesystem is
+        mounted.
+        """
+        if getuid() != 0:
+            raise SkipTest("Mounting a filesystem requires root privileges.")
+        self.cache.disk_partitions()
+        mountpoint = FilePath(self.mktemp())
+        mountpoint.makedirs()
+        run_process([b"mount", b"-t", b"tmpfs", b"tmpfs", mountpoint.path])
+        self.addCleanup(run_process, [b"umount", mountpoint.path])
+        self.assertEqual([2], self.cache.disk_partitions())
@@ -4,9 +4,23 @@
 Tests for ``flocker.node.agents.cinder``.
 """
 
-from twisted.trial.unittest import SynchronousTestCase
+from uuid import uuid4
 
-from ..cinder import _openstack_verify_from_config
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.internet.task import Clock
+from twisted.internet.threads import deferToThread
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from ..blockdevice import BlockDeviceVolume
+from ..cinder import (
+    BatchedVolumeStateMonitor, TimeoutException, UnexpectedStateException,
+    CinderBlockDeviceAPI, CLUSTER_ID_LABEL, DATASET_ID_LABEL,
+    _openstack_verify_from_config, _iter_volumes,
+)
+from ..testtools import (
+    FakeCinderVolumeManager, make_icindervolumemanager_tests,
+)
 
 
 class VerifyTests(SynchronousTestCase):
@@ -61,3 +75,328 @@ class VerifyTests(SynchronousTestCase):
             'verify_ca_path': '/a/path'
         }
         self.assertEqual(_openstack_verify_from_config(**config), False)
+
+
+class FakeCinderVolumeManagerInterfaceTests(
+        make_icindervolumemanager_tests(
+            lambda test_case: FakeCinderVolumeManager(Clock())
+        )
+):
+    """
+    ``FakeCinderVolumeManager`` provides ``ICinderVolumeManager``.
+    """
+
+
+class BatchedVolumeStateMonitorTests(SynchronousTestCase):
+    """
+    Tests for ``BatchedVolumeStateMonitor``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.manager = FakeCinderVolumeManager(self.clock)
+        self.poll_times = []
+        self.monitor = BatchedVolumeStateMonitor(
+            self.clock, self.manager, interval=1.0, max_interval=5.0,
+            list_volumes=self.list_volumes,
+        )
+
+    def list_volumes(self):
+        """
+        List the volumes of the fake manager, recording when.
+        """
+        self.poll_times.append(self.clock.seconds())
+        return self.manager.list()
+
+    def test_desired_state(self):
+        """
+        ``BatchedVolumeStateMonitor.wait_for`` returns a ``Deferred`` that
+        fires with the listed volume once it has the desired state.
+        """
+        volume = self.manager.create(size=1)
+        self.manager.change_status(volume.id, u"available", delay=2.5)
+        waiting = self.monitor.wait_for(
+            volume, u"available", transient_states=(u"creating",),
+        )
+        self.clock.advance(2)
+        self.assertNoResult(waiting)
+        self.clock.pump([1, 1])
+        self.assertEqual(
+            self.manager.get(volume.id), self.successResultOf(waiting)
+        )
+
+    def test_one_listing(self):
+        """
+        A single listing of the volumes is dispatched to all the operations
+        waiting when it begins.
+        """
+        volumes = [self.manager.create(size=1) for i in range(3)]
+        for volume in volumes:
+            self.manager.change_status(volume.id, u"available")
+        waiting = [
+            self.monitor.wait_for(volume, u"available")
+            for volume in volumes
+        ]
+        self.clock.advance(0)
+        self.assertEqual(
+            ([self.manager.get(volume.id) for volume in volumes], 1),
+            ([self.successResultOf(d) for d in waiting],
+             self.manager.list_calls),
+        )
+
+    def test_backoff(self):
+        """
+        The interval between polls doubles each time no waiting volume
+        changes state, up to ``max_interval``, and starts again from
+        ``interval`` when one does.
+        """
+        volume = self.manager.create(size=1)
+        self.manager.change_status(volume.id, u"available", delay=14)
+        self.monitor.wait_for(
+            volume, u"available", transient_states=(u"creating",),
+        )
+        self.clock.pump([0] + [1] * 20)
+        self.assertEqual([0, 1, 3, 7, 12, 17], self.poll_times)
+
+    def test_new_wait(self):
+        """
+        When an operation starts waiting, the next poll happens no more than
+        ``interval`` seconds after the previous one.
+        """
+        volumes = [self.manager.create(size=1) for i in range(2)]
+        self.monitor.wait_for(
+            volumes[0], u"available", transient_states=(u"creating",),
+        )
+        self.clock.pump([0, 1, 1, 1, 0.5])
+        self.monitor.wait_for(
+            volumes[1], u"available", transient_states=(u"creating",),
+        )
+        self.clock.pump([0.5] * 4)
+        self.assertEqual([0, 1, 3, 4, 5], self.poll_times)
+
+    def test_idle(self):
+        """
+        Nothing is polled once no operation is waiting.
+        """
+        volume = self.manager.create(size=1)
+        self.manager.change_status(volume.id, u"available")
+        self.monitor.wait_for(volume, u"available")
+        self.clock.advance(0)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_unexpected_state(self):
+        """
+        The ``Deferred`` fails with ``UnexpectedStateException`` if the
+        volume reaches a state which is neither desired nor transient.
+        """
+        volume = self.manager.create(size=1)
+        self.manager.change_status(volume.id, u"error", delay=1)
+        waiting = self.monitor.wait_for(
+            volume, u"available", transient_states=(u"creating",),
+        )
+        self.clock.pump([1, 1])
+        self.failureResultOf(waiting, UnexpectedStateException)
+
+    def test_timeout(self):
+        """
+        The ``Deferred`` fails with ``TimeoutException`` if the volume doesn't
+        reach the desired state within the time limit.
+        """
+        volume = self.manager.create(size=1)
+        waiting = self.monitor.wait_for(
+            volume, u"available", transient_states=(u"creating",),
+            time_limit=10,
+        )
+        self.clock.pump([1] * 10)
+        self.assertNoResult(waiting)
+        self.clock.pump([1] * 5)
+        self.failureResultOf(waiting, TimeoutException)
+
+    def test_listing_error(self):
+        """
+        If the volumes can't be listed, all the operations waiting for the
+        listing fail with the error.
+        """
+        def broken():
+            raise ZeroDivisionError()
+        monitor = BatchedVolumeStateMonitor(
+            self.clock, self.manager, list_volumes=broken,
+        )
+        volumes = [self.manager.create(size=1) for i in range(2)]
+        waiting = [
+            monitor.wait_for(volume, u"available") for volume in volumes
+        ]
+        self.clock.advance(0)
+        for d in waiting:
+            self.failureResultOf(d, ZeroDivisionError)
+
+
+class BatchedVolumeStateMonitorThreadTests(TestCase):
+    """
+    Tests for ``BatchedVolumeStateMonitor`` with the real reactor.
+    """
+    def test_wait_for_volume_state(self):
+        """
+        ``BatchedVolumeStateMonitor.wait_for_volume_state`` blocks a thread
+        until the volume, listed in another thread, reaches the desired
+        state.
+        """
+        manager = FakeCinderVolumeManager(reactor)
+        volume = manager.create(size=1)
+        manager.change_status(volume.id, u"available", delay=0.05)
+        monitor = BatchedVolumeStateMonitor(reactor, manager, interval=0.01)
+        waiting = deferToThread(
+            monitor.wait_for_volume_state, volume, u"available",
+            (u"creating",),
+        )
+        waiting.addCallback(
+            lambda listed: self.assertEqual(
+                (volume.id, u"available"), (listed.id, listed.status),
+            )
+        )
+        return waiting
+
+    def test_threadpool_saturated(self):
+        """
+        The volumes are listed even when every thread of the reactor's
+        threadpool is blocked waiting for a volume state.
+        """
+        manager = FakeCinderVolumeManager(reactor)
+        threadpool = reactor.getThreadPool()
+        volumes = [
+            manager.create(size=1) for i in range(threadpool.max + 2)
+        ]
+        for volume in volumes:
+            manager.change_status(volume.id, u"available", delay=0.05)
+        monitor = BatchedVolumeStateMonitor(reactor, manager, interval=0.01)
+        waiting = gatherResults([
+            deferToThread(
+                monitor.wait_for_volume_state, volume, u"available",
+                (u"creating",), 10,
+            )
+            for volume in volumes
+        ])
+        waiting.addCallback(
+            lambda listed: self.assertEqual(
+                [(volume.id, u"available") for volume in volumes],
+                [(volume.id, volume.status) for volume in listed],
+            )
+        )
+        return waiting
+
+
+class IgnoredSearchVolumeManager(FakeCinderVolumeManager):
+    """
+    A ``FakeCinderVolumeManager`` which, like some Cinder APIs, ignores the
+    options it is asked to search with.
+    """
+    def list(self, detailed=True, search_opts=None):
+        return FakeCinderVolumeManager.list(self, detailed)
+
+
+class IgnoredOffsetVolumeManager(FakeCinderVolumeManager):
+    """
+    A ``FakeCinderVolumeManager`` which lists the first page of volumes
+    whatever page is asked for, like a Cinder API which only pages with
+    ``marker`` being asked for a page by ``offset``.
+    """
+    def list(self, detailed=True, search_opts=None):
+        if search_opts is not None:
+            search_opts = dict(search_opts)
+            search_opts.pop(u"offset", None)
+        return FakeCinderVolumeManager.list(self, detailed, search_opts)
+
+
+class IterVolumesTests(SynchronousTestCase):
+    """
+    Tests for ``_iter_volumes``.
+    """
+    def test_pages(self):
+        """
+        Every matching volume is listed once, requesting a page at a time.
+        """
+        manager = FakeCinderVolumeManager(Clock())
+        volumes = [
+            manager.create(size=1, metadata={u"x": u"1"}) for i in range(7)
+        ]
+        manager.create(size=1, metadata={u"x": u"2"})
+        self.assertEqual(
+            (volumes, 3),
+            (list(_iter_volumes(
+                manager, {u"metadata": {u"x": u"1"}}, page_size=3,
+            )), manager.list_calls),
+        )
+
+    def test_search_ignored(self):
+        """
+        If the search options are ignored, the volumes are only listed once
+        even if a page is full.
+        """
+        manager = IgnoredSearchVolumeManager(Clock())
+        volumes = [manager.create(size=1) for i in range(3)]
+        self.assertEqual(
+            (volumes, 3),
+            (list(_iter_volumes(manager, {}, page_size=3)),
+             manager.list_calls),
+        )
+
+    def test_offset_ignored(self):
+        """
+        If the ``offset`` of a page is ignored every volume is still listed,
+        once.
+        """
+        manager = IgnoredOffsetVolumeManager(Clock())
+        volumes = [manager.create(size=1) for i in range(7)]
+        self.assertEqual(
+            volumes, list(_iter_volumes(manager, {}, page_size=3)),
+        )
+
+
+class CinderListVolumesTests(SynchronousTestCase):
+    """
+    Tests for ``CinderBlockDeviceAPI.list_volumes``.
+    """
+    def volumes(self, manager):
+        """
+        Create a volume belonging to a cluster and one belonging to another
+        cluster.
+
+        :return: A ``CinderBlockDeviceAPI`` for the first cluster, and the
+            ``BlockDeviceVolume`` of its volume.
+        """
+        cluster_id = uuid4()
+        dataset_id = uuid4()
+        volume = manager.create(size=1, metadata={
+            CLUSTER_ID_LABEL: unicode(cluster_id),
+            DATASET_ID_LABEL: unicode(dataset_id),
+        })
+        manager.create(size=1, metadata={
+            CLUSTER_ID_LABEL: unicode(uuid4()),
+            DATASET_ID_LABEL: unicode(uuid4()),
+        })
+        api = CinderBlockDeviceAPI(
+            cinder_volume_manager=manager,
+            nova_volume_manager=None,
+            nova_server_manager=None,
+            cluster_id=cluster_id,
+        )
+        expected = BlockDeviceVolume(
+            blockdevice_id=volume.id, size=1024 ** 3, attached_to=None,
+            dataset_id=dataset_id,
+        )
+        return api, expected
+
+    def test_search_metadata(self):
+        """
+        Only the volumes with the cluster's identifier in their metadata are
+        listed.
+        """
+        api, expected = self.volumes(FakeCinderVolumeManager(Clock()))
+        self.assertEqual([expected], api.list_volumes())
+
+    def test_search_ignored(self):
+        """
+        The volumes of other clusters are not included even if Cinder ignores
+        the metadata search.
+        """
+        api, expected = self.volumes(IgnoredSearchVolumeManager(Clock()))
+        self.assertEqual([expected], api.list_volumes())
@@ -4,10 +4,95 @@
 Tests for ``flocker.node.agents.ebs``.
 """
 
+from uuid import uuid4
+
+from boto.ec2.connection import EC2Connection
+from boto.ec2.volume import AttachmentSet, Volume
+from boto.exception import EC2ResponseError
+from boto.resultset import ResultSet
+
+from eliot.testing import capture_logging, LoggedMessage
+
+from twisted.internet.defer import gatherResults
+from twisted.internet.threads import deferToThread
 from twisted.python.filepath import FilePath
-from twisted.trial.unittest import SynchronousTestCase
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from .. import ebs
+from .._logging import POLLED_VOLUME_STATUS
+from ..blockdevice import BlockDeviceVolume, UnknownVolume
+from ..ebs import (
+    AttachedUnexpectedDevice, _expected_device, VolumeStatePoller,
+    VolumeOperations, UnexpectedStateException, TimeoutException,
+    NOT_FOUND, EBSBlockDeviceAPI, CLUSTER_ID_LABEL, DATASET_ID_LABEL, _EC2,
+    _get_volume_page, _iter_volumes, _wait_for_new_device,
+)
+
+
+class WaitForNewDeviceTests(SynchronousTestCase):
+    """
+    Tests for ``_wait_for_new_device``.
+    """
+    def setUp(self):
+        self.sys_block = FilePath(self.mktemp())
+        self.sys_block.makedirs()
+        self.patch(
+            ebs, "FilePath",
+            lambda path: self.sys_block if path == b"/sys/block"
+            else FilePath(path),
+        )
+        self.patch(ebs, "_get_device_size", lambda device: 1024)
+
+    def add_device(self, name):
+        """
+        Make a block device appear.
+
+        :param bytes name: The name of the device.
+        """
+        self.sys_block.child(name).makedirs()
+
+    def test_expected(self):
+        """
+        The expected device is chosen over other new devices.
+        """
+        self.add_device(b"xvdf")
+        self.add_device(b"xvdk")
+        self.assertEqual(
+            FilePath(b"/dev/xvdk"),
+            _wait_for_new_device(
+                [], 1024, time_limit=1, expected=FilePath(b"/dev/xvdk"),
+            ),
+        )
+
+    def test_unexpected(self):
+        """
+        A new device which isn't reserved is returned straight away even if
+        it isn't the expected one.
+        """
+        self.add_device(b"xvdk")
+        self.patch(ebs.time, "sleep", lambda seconds: self.fail("Slept"))
+        self.assertEqual(
+            FilePath(b"/dev/xvdk"),
+            _wait_for_new_device(
+                [], 1024, expected=FilePath(b"/dev/xvdf"),
+                reserved=lambda: {FilePath(b"/dev/xvdg")},
+            ),
+        )
 
-from ..ebs import AttachedUnexpectedDevice, _expected_device
+    def test_reserved(self):
+        """
+        Devices which were reserved while waiting are never chosen, even
+        once they are no longer reserved.
+        """
+        self.add_device(b"xvdg")
+        reservations = [{FilePath(b"/dev/xvdg")}]
+        self.assertIs(
+            None,
+            _wait_for_new_device(
+                [], 1024, time_limit=0.3, expected=FilePath(b"/dev/xvdf"),
+                reserved=lambda: (reservations or [set()]).pop(),
+            ),
+        )
 
 
 class AttachedUnexpectedDeviceTests(SynchronousTestCase):
@@ -62,3 +147,429 @@ class ExpectedDeviceTests(SynchronousTestCase):
             ValueError,
             _expected_device, b"/dev/hda",
         )
+
+
+NOT_FOUND_BODY = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<Response><Errors><Error>'
+    b'<Code>' + NOT_FOUND.encode("ascii") + b'</Code>'
+    b'<Message>The volume does not exist.</Message>'
+    b'</Error></Errors><RequestID>1</RequestID></Response>'
+)
+
+
+def ebs_volume(volume_id, status):
+    """
+    :param unicode volume_id: The identifier of the volume.
+    :param unicode status: The status of the volume.
+
+    :return: A ``boto.ec2.volume.Volume`` with the given identifier and
+        status.
+    """
+    volume = Volume()
+    volume.id = volume_id
+    volume.status = status
+    return volume
+
+
+class FakeVolumeStatusConnection(object):
+    """
+    Enough of an EC2 connection to poll the status of volumes.
+
+    :ivar dict statuses: Mapping from volume identifiers to the ``list`` of
+        statuses each successive poll finds the volume in.  The last status
+        persists.  Volumes which aren't included don't exist.
+    :ivar list calls: The sorted volume identifiers of each poll.
+    """
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+
+    def get_all_volumes(self, volume_ids):
+        self.calls.append(sorted(volume_ids))
+        if not set(volume_ids) <= set(self.statuses):
+            raise EC2ResponseError(400, "Bad Request", NOT_FOUND_BODY)
+        volumes = []
+        for volume_id in volume_ids:
+            statuses = self.statuses[volume_id]
+            status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+            volumes.append(ebs_volume(volume_id, status))
+        return volumes
+
+
+class VolumeStatePollerTests(TestCase):
+    """
+    Tests for ``VolumeStatePoller``.
+    """
+    def wait_for_creates(self, statuses, volume_ids, timeout=60):
+        """
+        Wait for volumes to be created using a ``VolumeStatePoller`` which
+        polls a ``FakeVolumeStatusConnection``.
+
+        :param dict statuses: The statuses the volumes will be found in.
+        :param list volume_ids: The identifiers of the volumes to wait for.
+        :param int timeout: Seconds to wait for each volume.
+
+        :return: A ``Deferred`` firing with a ``list`` of the volumes and
+            the exception, or ``None``, that ended each wait.
+        """
+        self.connection = FakeVolumeStatusConnection(statuses)
+        self.poller = VolumeStatePoller(
+            self.connection, initial_delay=0.05, interval=0.01,
+            max_interval=0.04,
+        )
+        volumes = [ebs_volume(volume_id, u"") for volume_id in volume_ids]
+
+        def wait(volume):
+            try:
+                self.poller.wait_for(
+                    VolumeOperations.CREATE, volume, timeout=timeout,
+                )
+            except Exception as e:
+                return volume, e
+            return volume, None
+        return gatherResults(
+            [deferToThread(wait, volume) for volume in volumes]
+        )
+
+    def test_batched(self):
+        """
+        The volumes of all the waiting operations are polled together, and
+        each wait ends once its volume reaches the end state.  Each volume
+        is updated with its state.
+        """
+        d = self.wait_for_creates(
+            {u"vol-1": [u"creating", u"available"],
+             u"vol-2": [u"creating", u"creating", u"available"]},
+            [u"vol-1", u"vol-2"],
+        )
+
+        def waited(results):
+            self.assertEqual(
+                ([(u"vol-1", u"available", None),
+                  (u"vol-2", u"available", None)],
+                 [[u"vol-1", u"vol-2"], [u"vol-1", u"vol-2"],
+                  [u"vol-2"]]),
+                ([(volume.id, volume.status, error)
+                  for volume, error in results],
+                 self.connection.calls),
+            )
+        return d.addCallback(waited)
+
+    @capture_logging(None)
+    def test_backoff(self, logger):
+        """
+        The interval between polls doubles each time no volume changes
+        state, up to the maximum interval, and is reset once one does.
+        """
+        d = self.wait_for_creates(
+            {u"vol-1": [u"creating"] * 4 + [u"available"]}, [u"vol-1"],
+        )
+
+        def waited(results):
+            self.assertEqual(
+                [0.01, 0.02, 0.04, 0.04, 0.01],
+                [message.message[u"interval"] for message in
+                 LoggedMessage.of_type(logger.messages, POLLED_VOLUME_STATUS)],
+            )
+        return d.addCallback(waited)
+
+    def test_unknown_volume(self):
+        """
+        If one of the volumes doesn't exist, the wait for it fails with
+        ``UnknownVolume`` and the waits for the others are unaffected.
+        """
+        d = self.wait_for_creates(
+            {u"vol-1": [u"available"]}, [u"vol-1", u"vol-2"],
+        )
+
+        def waited(results):
+            [(volume1, error1), (volume2, error2)] = results
+            self.assertEqual(
+                (None, UnknownVolume, u"available"),
+                (error1, error2.__class__, volume1.status),
+            )
+        return d.addCallback(waited)
+
+    def test_unexpected_state(self):
+        """
+        If a volume reaches a state not expected for the operation, the wait
+        fails with ``UnexpectedStateException``.
+        """
+        d = self.wait_for_creates({u"vol-1": [u"in-use"]}, [u"vol-1"])
+
+        def waited(results):
+            [(volume, error)] = results
+            self.assertEqual(
+                (UnexpectedStateException, u"in-use"),
+                (error.__class__, error.current_state),
+            )
+        return d.addCallback(waited)
+
+    def test_timeout(self):
+        """
+        If a volume doesn't reach the end state within the timeout, the wait
+        fails with ``TimeoutException``.
+        """
+        d = self.wait_for_creates(
+            {u"vol-1": [u"creating"]}, [u"vol-1"], timeout=0,
+        )
+
+        def waited(results):
+            [(volume, error)] = results
+            self.assertIsInstance(error, TimeoutException)
+        return d.addCallback(waited)
+
+    def test_error(self):
+        """
+        If polling fails unexpectedly, the waits fail with the same
+        exception.
+        """
+        d = self.wait_for_creates({}, [u"vol-1"])
+        self.connection.get_all_volumes = lambda volume_ids: 1 / 0
+
+        def waited(results):
+            [(volume, error)] = results
+            self.assertIsInstance(error, ZeroDivisionError)
+        return d.addCallback(waited)
+
+
+def result_set(volumes, next_token=None):
+    """
+    :param list volumes: The volumes in a page of results.
+    :param next_token: The token identifying the next page, or ``None``.
+
+    :return: A ``boto.resultset.ResultSet`` like that of a
+        ``DescribeVolumes`` request.
+    """
+    page = ResultSet()
+    page.extend(volumes)
+    page.next_token = next_token
+    return page
+
+
+class FakePagedVolumesConnection(object):
+    """
+    Enough of a ``_LoggedBotoConnection`` to list volumes a page at a time.
+
+    :ivar list volumes: The ``boto.ec2.volume.Volume``\ s to list.
+    :ivar list calls: The filters, page size and token of each request.
+    """
+    def __init__(self, volumes):
+        self.volumes = volumes
+        self.calls = []
+
+    def get_volume_page(self, filters, max_results, next_token=None):
+        self.calls.append((filters, max_results, next_token))
+        start = int(next_token or 0)
+        end = start + max_results
+        return result_set(
+            self.volumes[start:end],
+            bytes(end) if end < len(self.volumes) else None,
+        )
+
+
+class GetVolumePageTests(SynchronousTestCase):
+    """
+    Tests for ``_get_volume_page``.
+    """
+    def test_request(self):
+        """
+        ``_get_volume_page`` makes a ``DescribeVolumes`` request for a page of
+        the volumes matching the filters.
+        """
+        connection = EC2Connection(
+            aws_access_key_id=b"key", aws_secret_access_key=b"secret",
+        )
+        requests = []
+        page = result_set([])
+
+        def get_list(action, params, markers, verb):
+            requests.append((action, params, markers, verb))
+            return page
+        connection.get_list = get_list
+        self.assertEqual(
+            (page, [(
+                "DescribeVolumes",
+                {"MaxResults": "5", "NextToken": "abc",
+                 "Filter.1.Name": "tag:x", "Filter.1.Value.1": u"y"},
+                [("item", Volume)], "POST",
+            )]),
+            (_get_volume_page(connection, {"tag:x": u"y"}, 5, "abc"),
+             requests),
+        )
+
+
+class IterVolumesTests(SynchronousTestCase):
+    """
+    Tests for ``_iter_volumes``.
+    """
+    def test_pages(self):
+        """
+        Every volume is listed, requesting a page at a time until a page has
+        no ``next_token``.
+        """
+        volumes = [ebs_volume(u"vol-%d" % (i,), u"available")
+                   for i in range(5)]
+        connection = FakePagedVolumesConnection(volumes)
+        self.assertEqual(
+            (volumes, [({}, 2, None), ({}, 2, b"2"), ({}, 2, b"4")]),
+            (list(_iter_volumes(connection, {}, page_size=2)),
+             connection.calls),
+        )
+
+
+class EBSListVolumesTests(SynchronousTestCase):
+    """
+    Tests for ``EBSBlockDeviceAPI.list_volumes``.
+    """
+    def volume(self, cluster_id, dataset_id):
+        """
+        :return: A ``boto.ec2.volume.Volume`` tagged with the given cluster
+            and dataset identifiers.
+        """
+        volume = ebs_volume(u"vol-" + unicode(dataset_id), u"available")
+        volume.size = 1
+        volume.attach_data = AttachmentSet()
+        volume.tags = {
+            CLUSTER_ID_LABEL: unicode(cluster_id),
+            DATASET_ID_LABEL: unicode(dataset_id),
+        }
+        return volume
+
+    def test_filters(self):
+        """
+        Only the volumes in the API's availability zone tagged with its
+        cluster's identifier are requested.  Volumes of other clusters are
+        not listed even if EC2 returns them.
+        """
+        cluster_id = uuid4()
+        dataset_id = uuid4()
+        connection = FakePagedVolumesConnection([
+            self.volume(cluster_id, dataset_id),
+            self.volume(uuid4(), uuid4()),
+        ])
+        api = EBSBlockDeviceAPI(
+            _EC2(zone=b"us-west-2a", connection=connection), cluster_id,
+        )
+        expected = BlockDeviceVolume(
+            blockdevice_id=u"vol-" + unicode(dataset_id),
+            size=1024 ** 3, attached_to=None, dataset_id=dataset_id,
+        )
+        self.assertEqual(
+            ([expected],
+             {"tag:" + CLUSTER_ID_LABEL: unicode(cluster_id),
+              "availability-zone": b"us-west-2a"}),
+            (api.list_volumes(), connection.calls[0][0]),
+        )
+
+
+class FakeAttachConnection(FakePagedVolumesConnection):
+    """
+    Enough of a ``_LoggedBotoConnection`` to attach volumes to an instance
+    with no volumes attached.
+
+    :ivar list attached: The volume, instance and device of each attach.
+    """
+    def __init__(self):
+        FakePagedVolumesConnection.__init__(self, [])
+        self.attached = []
+
+    def attach_volume(self, volume_id, instance_id, device):
+        self.attached.append((volume_id, instance_id, device))
+
+
+class EBSAttachDeviceTests(SynchronousTestCase):
+    """
+    Tests for the choice of device names by
+    ``EBSBlockDeviceAPI.attach_volume``.
+    """
+    def setUp(self):
+        self.connection = FakeAttachConnection()
+        self.api = EBSBlockDeviceAPI(
+            _EC2(zone=b"us-west-2a", connection=self.connection), uuid4(),
+        )
+        self.checked = []
+        self.patch(self.api, "_check_new_device", self.check_new_device)
+
+    def check_new_device(self, blockdevice_id, device, blockdevices, size):
+        """
+        Record the device waited for, and whether ``lock`` was held.
+        """
+        locked = not self.api.lock.acquire(False)
+        if not locked:
+            self.api.lock.release()
+        self.checked.append((blockdevice_id, device, locked))
+
+    def attach(self, blockdevice_id):
+        """
+        Attach a volume to an instance, without waiting for its state.
+        """
+        volume = BlockDeviceVolume(
+            blockdevice_id=blockdevice_id, size=1024 ** 3, attached_to=None,
+            dataset_id=uuid4(),
+        )
+        return self.api._attach_to_device(blockdevice_id, u"i-1", volume)
+
+    def test_concurrent(self):
+        """
+        The lock is not held while waiting for the device to appear, and
+        the device name of a volume still being attached is not chosen for
+        another.
+        """
+        devices = [self.attach(u"vol-1"), self.attach(u"vol-2")]
+        self.assertEqual(
+            ([u"/dev/sdf", u"/dev/sdg"],
+             [(u"vol-1", u"/dev/sdf", False), (u"vol-2", u"/dev/sdg", False)],
+             {u"/dev/sdf", u"/dev/sdg"}),
+            (devices, self.checked, self.api._attaching_devices),
+        )
+
+    def test_reserved_devices(self):
+        """
+        While waiting for the device of a volume, the devices expected for
+        the other volumes being attached are reserved.
+        """
+        reserved_devices = []
+
+        def wait_for_new_device(base, size, expected, reserved):
+            reserved_devices.append(reserved())
+            return expected
+        self.patch(ebs, "_wait_for_new_device", wait_for_new_device)
+        self.attach(u"vol-1")
+        self.attach(u"vol-2")
+        EBSBlockDeviceAPI._check_new_device(
+            self.api, u"vol-2", u"/dev/sdg", [], 1024 ** 3,
+        )
+        self.assertEqual([{FilePath(b"/dev/xvdf")}], reserved_devices)
+
+    def test_unexpected_device_path(self):
+        """
+        If the volume appears as a device other than the expected one, it is
+        detached and ``AttachedUnexpectedDevice`` is raised with that device.
+        """
+        detached = []
+        self.patch(
+            ebs, "_wait_for_new_device",
+            lambda base, size, expected, reserved: FilePath(b"/dev/xvdk"),
+        )
+        self.patch(self.api, "detach_volume", detached.append)
+        exception = self.assertRaises(
+            AttachedUnexpectedDevice,
+            EBSBlockDeviceAPI._check_new_device,
+            self.api, u"vol-1", u"/dev/sdf", [], 1024 ** 3,
+        )
+        self.assertEqual(
+            ([u"vol-1"], u"/dev/sdf", FilePath(b"/dev/xvdk")),
+            (detached, exception.requested, exception.discovered),
+        )
+
+    def test_unexpected_device(self):
+        """
+        The device name of a volume whose device does not appear is released.
+        """
+        def check_new_device(blockdevice_id, device, blockdevices, size):
+            raise AttachedUnexpectedDevice(device, None)
+        self.patch(self.api, "_check_new_device", check_new_device)
+        self.assertRaises(AttachedUnexpectedDevice, self.attach, u"vol-1")
+        self.assertEqual(set(), self.api._attaching_devices)
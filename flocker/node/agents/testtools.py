@@ -4,6 +4,16 @@
 Test helpers for ``flocker.node.agents``.
 """
 
+from collections import OrderedDict
+from uuid import uuid4
+
+from keystoneclient.openstack.common.apiclient.exceptions import (
+    NotFound as CinderNotFound,
+)
+
+from pyrsistent import PClass, field, pmap
+
+from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
 from twisted.trial.unittest import SynchronousTestCase
@@ -57,3 +67,114 @@ def make_inovavolumemanager_tests(client_factory):
             self.client = client_factory(test_case=self)
 
     return Tests
+
+
+class FakeCinderVolume(PClass):
+    """
+    The parts of ``cinderclient.v1.volumes.Volume`` that we use.
+
+    :ivar unicode id: The identifier of the volume.
+    :ivar int size: The size of the volume in GiB.
+    :ivar unicode status: The state of the volume.
+    :ivar metadata: The metadata of the volume.
+    :ivar list attachments: Descriptions of the servers the volume is
+        attached to.
+    """
+    id = field(type=unicode, mandatory=True)
+    size = field(type=int, mandatory=True)
+    status = field(type=unicode, mandatory=True)
+    metadata = field(initial=pmap(), factory=pmap)
+    attachments = field(initial=())
+
+
+@implementer(ICinderVolumeManager)
+class FakeCinderVolumeManager(object):
+    """
+    An in-memory ``ICinderVolumeManager`` whose volumes change state when
+    told to, after a delay.
+
+    :ivar clock: An ``IReactorTime`` provider telling the time.
+    :ivar int list_calls: The number of times the volumes were listed.
+    :ivar OrderedDict _volumes: Map the identifier of each volume to its
+        ``FakeCinderVolume``, in the order they were created.
+    :ivar dict _transitions: Map the identifier of each volume to a ``list``
+        of the times at which it will change state and its new state, in
+        order.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.list_calls = 0
+        self._volumes = OrderedDict()
+        self._transitions = {}
+
+    def change_status(self, volume_id, status, delay=0):
+        """
+        Change the state of a volume.
+
+        :param unicode volume_id: The identifier of the volume.
+        :param unicode status: The new state.
+        :param float delay: Seconds from now until the state changes.
+        """
+        transitions = self._transitions.setdefault(volume_id, [])
+        transitions.append((self.clock.seconds() + delay, status))
+        transitions.sort()
+
+    def _current(self, volume_id):
+        """
+        :return: The ``FakeCinderVolume`` with the given identifier, in its
+            current state.
+        """
+        volume = self._volumes[volume_id]
+        transitions = self._transitions.get(volume_id, [])
+        now = self.clock.seconds()
+        while transitions and transitions[0][0] <= now:
+            volume = volume.set(status=transitions.pop(0)[1])
+        self._volumes[volume_id] = volume
+        return volume
+
+    def create(self, size, metadata=None):
+        volume = FakeCinderVolume(
+            id=unicode(uuid4()), size=size, status=u"creating",
+            metadata=metadata or {},
+        )
+        self._volumes[volume.id] = volume
+        return volume
+
+    def list(self, detailed=True, search_opts=None):
+        self.list_calls += 1
+        if search_opts is None:
+            search_opts = {}
+        metadata = search_opts.get(u"metadata", {})
+        volumes = [
+            volume for volume in (
+                self._current(volume_id) for volume_id in self._volumes
+            )
+            if all(
+                volume.metadata.get(key) == value
+                for (key, value) in metadata.items()
+            )
+        ]
+        # Like the Cinder v1 API, page with ``offset`` rather than
+        # ``marker``:
+        volumes = volumes[search_opts.get(u"offset", 0):]
+        limit = search_opts.get(u"limit")
+        if limit is not None:
+            volumes = volumes[:limit]
+        return volumes
+
+    def delete(self, volume_id):
+        if volume_id not in self._volumes:
+            raise CinderNotFound()
+        del self._volumes[volume_id]
+        self._transitions.pop(volume_id, None)
+
+    def get(self, volume_id):
+        if volume_id not in self._volumes:
+            raise CinderNotFound()
+        return self._current(volume_id)
+
+    def set_metadata(self, volume, metadata):
+        current = self._current(volume.id)
+        self._volumes[volume.id] = current.set(
+            metadata=current.metadata.update(metadata)
+        )
@@ -6,6 +6,7 @@ The command-line ``flocker-*-agent`` tools.
 """
 
 from socket import socket
+from functools import partial
 from contextlib import closing
 import sys
 from time import sleep
@@ -32,17 +33,19 @@ from ..volume.filesystems import zfs
 from ..volume.service import (
     VolumeService, DEFAULT_CONFIG_PATH, FLOCKER_MOUNTPOINT, FLOCKER_POOL)
 
+from ..common import dedicated_threadpool
 from ..common.script import (
     ICommandLineScript,
     flocker_standard_options, FlockerScriptRunner, main_for_service)
 from . import P2PManifestationDeployer, ApplicationNodeDeployer
-from ._loop import AgentLoopService
+from ._loop import AgentLoopService, DEFAULT_MAX_SLEEP
 from ._diagnostics import (
     current_distribution, FlockerDebugArchive, DISTRIBUTION_BY_LABEL,
     lookup_distribution,
 )
 from .agents.blockdevice import (
-    LoopbackBlockDeviceAPI, BlockDeviceDeployer, ProcessLifetimeCache,
+    LoopbackBlockDeviceAPI, LoopbackBlockDeviceAsyncAPI, BlockDeviceDeployer,
+    ProcessLifetimeCache, MountTableCache,
 )
 from ..ca import ControlServicePolicy, NodeCredential
 
@@ -206,7 +209,16 @@ def validate_configuration(configuration):
                 "required": [
                     "backend",
                 ],
-            }
+            },
+            "convergence": {
+                "type": "object",
+                "properties": {
+                    "max-sleep": {
+                        "type": "number",
+                        "minimum": 1,
+                    },
+                },
+            },
         }
     }
 
@@ -418,6 +430,13 @@ class BackendDescription(PRecord):
     :ivar deployer_type: A constant from ``DeployerType`` indicating which kind
         of ``IDeployer`` the API object returned by ``api_factory`` is usable
         with.
+    :ivar int threads: The most threads in which a ``DeployerType.block``
+        backend's API object is called at once.
+    :ivar async_api_factory: ``None``, or an object which can be called with a
+        reactor, the API object returned by ``api_factory`` and a callable to
+        report changed volumes to, and which returns an
+        ``IBlockDeviceAsyncAPI`` provider for the same volumes that does not
+        need any threads.
     """
     name = field(type=unicode, mandatory=True)
     needs_reactor = field(type=bool, mandatory=True)
@@ -431,6 +450,8 @@ class BackendDescription(PRecord):
             value in DeployerType.iterconstants(), "Unknown deployer_type"
         ),
     )
+    threads = field(type=int, initial=10, mandatory=True)
+    async_api_factory = field(initial=None, mandatory=True)
 
 from .agents.cinder import cinder_from_configuration
 from .agents.ebs import aws_from_configuration
@@ -452,28 +473,61 @@ _DEFAULT_BACKENDS = [
         # XXX compute_instance_id is the wrong type
         api_factory=LoopbackBlockDeviceAPI.from_path,
         deployer_type=DeployerType.block,
+        async_api_factory=LoopbackBlockDeviceAsyncAPI,
     ),
     BackendDescription(
-        name=u"openstack", needs_reactor=False, needs_cluster_id=True,
+        name=u"openstack", needs_reactor=True, needs_cluster_id=True,
         api_factory=cinder_from_configuration,
         deployer_type=DeployerType.block,
+        # Each call blocks on the cloud's HTTP API.
+        threads=20,
     ),
     BackendDescription(
         name=u"aws", needs_reactor=False, needs_cluster_id=True,
         api_factory=aws_from_configuration,
         deployer_type=DeployerType.block,
+        threads=20,
     ),
 ]
 
+
+def _block_device_deployer(api, async_api_factory=None, **kw):
+    """
+    Create a ``BlockDeviceDeployer`` which caches what it learns from an
+    ``IBlockDeviceAPI`` provider.
+
+    :param api: The ``IBlockDeviceAPI`` provider.
+    :param async_api_factory: ``None``, or a callable which is passed ``api``
+        and a callable to report changed volumes to, and which returns the
+        ``IBlockDeviceAsyncAPI`` provider for the deployer to use.
+    :param kw: Other fields of the ``BlockDeviceDeployer``.
+
+    :return: The ``BlockDeviceDeployer``.
+    """
+    cache = ProcessLifetimeCache(api)
+    async_api = None
+    if async_api_factory is not None:
+        # Volumes changed asynchronously don't pass through the cache.
+        async_api = async_api_factory(api, changed=cache.invalidate)
+    return BlockDeviceDeployer(
+        block_device_api=cache, _async_block_device_api=async_api,
+        mount_table=MountTableCache(), **kw
+    )
+
+
 _DEFAULT_DEPLOYERS = {
     DeployerType.p2p: lambda api, **kw:
         P2PManifestationDeployer(volume_service=api, **kw),
-    DeployerType.block: lambda api, **kw:
-        BlockDeviceDeployer(block_device_api=ProcessLifetimeCache(api),
-                            **kw),
+    DeployerType.block: _block_device_deployer,
 }
 
 
+# Directories where entries being added or removed suggest that the local
+# state of a dataset agent has changed.  udev creates and removes nodes in
+# /dev as block devices are attached and detached.
+_DEFAULT_WATCH_PATHS = pvector([FilePath(b"/dev")])
+
+
 class AgentService(PRecord):
     """
     :ivar backends: ``BackendDescription`` instances describing how to use each
@@ -489,6 +543,10 @@ class AgentService(PRecord):
     :ivar api_args: Extra arguments to pass to the factory from ``backends``.
     :ivar get_external_ip: Typically ``_get_external_ip``, but
         overrideable for tests.
+    :ivar max_sleep: The longest delay, in seconds, between iterations of the
+        convergence loop while nothing is changing.
+    :ivar watch_paths: ``FilePath``\ s of directories whose entries being
+        added or removed wakes up the convergence loop.
     """
     backends = field(
         factory=pvector, initial=_DEFAULT_BACKENDS, mandatory=True,
@@ -510,6 +568,11 @@ class AgentService(PRecord):
     backend_name = field(type=unicode, mandatory=True)
     api_args = field(type=PMap, factory=pmap, mandatory=True)
 
+    max_sleep = field(type=float, initial=DEFAULT_MAX_SLEEP, mandatory=True)
+    watch_paths = field(
+        factory=pvector, initial=_DEFAULT_WATCH_PATHS, mandatory=True,
+    )
+
     @classmethod
     def from_configuration(cls, configuration):
         """
@@ -531,6 +594,10 @@ class AgentService(PRecord):
         api_args = configuration['dataset']
         backend_name = api_args.pop('backend')
 
+        max_sleep = configuration.get('convergence', {}).get(
+            'max-sleep', DEFAULT_MAX_SLEEP
+        )
+
         return cls(
             control_service_host=host,
             control_service_port=port,
@@ -540,6 +607,8 @@ class AgentService(PRecord):
 
             backend_name=backend_name.decode("ascii"),
             api_args=api_args,
+
+            max_sleep=float(max_sleep),
         )
 
     def get_backend(self):
@@ -614,8 +683,20 @@ class AgentService(PRecord):
             self.control_service_host, self.control_service_port,
         )
         node_uuid = self.node_credential.uuid
+        kwargs = {}
+        if backend.deployer_type == DeployerType.block:
+            if backend.async_api_factory is not None:
+                kwargs["async_api_factory"] = partial(
+                    backend.async_api_factory, self.reactor,
+                )
+            else:
+                # Keep slow storage calls from waiting behind, or holding
+                # up, anything else using the reactor's threadpool.
+                kwargs["threadpool"] = dedicated_threadpool(
+                    self.reactor, backend.name, backend.threads,
+                )
         return deployer_factory(
-            api=api, hostname=address, node_uuid=node_uuid,
+            api=api, hostname=address, node_uuid=node_uuid, **kwargs
         )
 
     def get_loop_service(self, deployer):
@@ -631,6 +712,7 @@ class AgentService(PRecord):
             reactor=self.reactor,
             deployer=deployer,
             host=self.control_service_host, port=self.control_service_port,
+            max_sleep=self.max_sleep, watch_paths=tuple(self.watch_paths),
             context_factory=self.get_tls_context().context_factory,
         )
 
@@ -21,7 +21,10 @@ from ..testtools import (
 )
 from ...testtools import CustomException
 
-from .. import IStateChange, sequentially, in_parallel, run_state_change
+from .. import (
+    IStateChange, IResourceStateChange, ChangeScheduler, sequentially,
+    in_parallel, run_state_change,
+)
 
 from .istatechange import (
     DummyStateChange, RunSpyStateChange, make_istatechange_tests,
@@ -97,6 +100,16 @@ class BrokenAction(PRecord):
         raise self.exception
 
 
+@implementer(IResourceStateChange)
+class ResourceAction(ControllableAction):
+    """
+    A ``ControllableAction`` which uses some resources.
+    """
+    def __init__(self, result, resources):
+        ControllableAction.__init__(self, result=result)
+        self.resources = frozenset(resources)
+
+
 class DummyStateChangeIStateChangeTests(
         make_istatechange_tests(
             DummyStateChange, dict(value=1), dict(value=2)
@@ -464,3 +477,151 @@ class RunStateChangeTests(SynchronousTestCase):
         action._logger = logger
         failure = self.failureResultOf(run_state_change(action, DEPLOYER))
         self.assertEqual(failure.getErrorMessage(), "Oh no")
+
+    def test_shared_resources(self):
+        """
+        Changes run in parallel which share a resource are run one after the
+        other.
+        """
+        changes = [
+            ResourceAction(result=Deferred(), resources=[u"a"]),
+            ResourceAction(result=Deferred(), resources=[u"a", u"b"]),
+        ]
+        result = run_state_change(in_parallel(changes), DEPLOYER)
+        [started] = [change for change in changes if change.called]
+        started.result.callback(None)
+        [change.result.callback(None)
+         for change in changes if change is not started]
+        self.successResultOf(result)
+        self.assertEqual([True, True], [change.called for change in changes])
+
+    def test_scheduler(self):
+        """
+        ``run_state_change`` runs each change with the given
+        ``ChangeScheduler``.
+        """
+        changes = [
+            ControllableAction(result=Deferred()),
+            ControllableAction(result=Deferred()),
+        ]
+        run_state_change(
+            in_parallel(changes), DEPLOYER, ChangeScheduler(limit=1),
+        )
+        self.assertEqual(
+            [False, True], sorted(change.called for change in changes),
+        )
+
+
+class ChangeSchedulerTests(SynchronousTestCase):
+    """
+    Tests for ``ChangeScheduler``.
+    """
+    def setUp(self):
+        self.scheduler = ChangeScheduler()
+        self.started = []
+        self.running = {}
+
+    def operation(self, name, resources):
+        """
+        Submit an operation which runs until ``finish`` is called for it.
+
+        :param unicode name: A name for the operation.
+        :param resources: The resources of the operation.
+
+        :return: The ``Deferred`` returned by ``ChangeScheduler.run``.
+        """
+        def run(argument):
+            self.started.append(argument)
+            self.running[argument] = Deferred()
+            return self.running[argument]
+        return self.scheduler.run(resources, run, name)
+
+    def finish(self, name, result=None):
+        """
+        Finish an operation started by ``operation``.
+        """
+        self.running.pop(name).callback(result)
+
+    def test_independent(self):
+        """
+        Operations which have no resources in common run at the same time.
+        """
+        self.operation(u"first", [u"a"])
+        self.operation(u"second", [u"b"])
+        self.operation(u"third", [])
+        self.assertEqual([u"first", u"second", u"third"], self.started)
+
+    def test_conflicting(self):
+        """
+        An operation which has resources in common with a running operation
+        is run once that operation has finished, and its result is the result
+        of the function it was submitted with.
+        """
+        first = self.operation(u"first", [u"a", u"b"])
+        second = self.operation(u"second", [u"b"])
+        started = list(self.started)
+        self.finish(u"first", 1)
+        self.finish(u"second", 2)
+        self.assertEqual(
+            ([u"first"], [u"first", u"second"], 1, 2),
+            (started, self.started,
+             self.successResultOf(first), self.successResultOf(second)),
+        )
+
+    def test_order(self):
+        """
+        An operation does not overtake an earlier waiting operation with
+        which it has resources in common.
+        """
+        self.operation(u"first", [u"a"])
+        self.operation(u"second", [u"a", u"b"])
+        self.operation(u"third", [u"b"])
+        self.finish(u"first")
+        started = list(self.started)
+        self.finish(u"second")
+        self.assertEqual(
+            ([u"first", u"second"], [u"first", u"second", u"third"]),
+            (started, self.started),
+        )
+
+    def test_limit(self):
+        """
+        No more than ``limit`` operations run at once.
+        """
+        self.scheduler = ChangeScheduler(limit=2)
+        for name in [u"first", u"second", u"third"]:
+            self.operation(name, [name])
+        started = list(self.started)
+        self.finish(u"second")
+        self.assertEqual(
+            ([u"first", u"second"], [u"first", u"second", u"third"]),
+            (started, self.started),
+        )
+
+    def test_failure(self):
+        """
+        The resources of an operation which fails are released, and the
+        failure is the result of the operation.
+        """
+        def broken():
+            raise CustomException()
+        failed = self.scheduler.run([u"a"], broken)
+        self.operation(u"second", [u"a"])
+        self.failureResultOf(failed, CustomException)
+        self.assertEqual([u"second"], self.started)
+
+    def test_reentrant(self):
+        """
+        Operations which finish immediately may submit further operations on
+        the same resources.
+        """
+        results = []
+
+        def submit(count):
+            if count:
+                self.scheduler.run(
+                    [u"a"], submit, count - 1,
+                ).addCallback(results.append)
+            return count
+        self.scheduler.run([u"a"], submit, 3).addCallback(results.append)
+        self.assertEqual([0, 1, 2, 3], sorted(results))
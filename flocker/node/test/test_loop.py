@@ -5,6 +5,7 @@ Tests for ``flocker.node._loop``.
 """
 
 from itertools import repeat
+from unittest import skipUnless
 from uuid import uuid4
 
 from eliot.testing import validate_logging, assertHasAction, assertHasMessage
@@ -12,7 +13,10 @@ from machinist import LOG_FSM_TRANSITION
 
 from pyrsistent import pset
 
-from twisted.trial.unittest import SynchronousTestCase
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+from twisted.internet import reactor as real_reactor
+from twisted.python.filepath import FilePath
+from twisted.python.runtime import platform
 from twisted.test.proto_helpers import StringTransport, MemoryReactorClock
 from twisted.internet.protocol import Protocol, ReconnectingClientFactory
 from twisted.internet.defer import succeed, Deferred, fail
@@ -27,8 +31,10 @@ from .._loop import (
     _StatusUpdate, _ConnectedToControlService, ConvergenceLoopInputs,
     ConvergenceLoopStates, build_convergence_loop_fsm, AgentLoopService,
     LOG_SEND_TO_CONTROL_SERVICE,
-    LOG_CONVERGE, LOG_CALCULATED_ACTIONS,
+    LOG_CONVERGE, LOG_CALCULATED_ACTIONS, DEFAULT_MAX_SLEEP,
+    LocalChangeService,
     )
+from .. import in_parallel, sequentially, _loop
 from ..testtools import ControllableDeployer, ControllableAction, to_node
 from ...control import (
     NodeState, Deployment, Manifestation, Dataset, DeploymentState,
@@ -587,6 +593,31 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
             (deployer.calculate_inputs, action.called),
             ([(local_state, configuration, expected_local_state)], True))
 
+    def test_convergence_changes_limited(self):
+        """
+        No more than ``MAX_CONCURRENT_CHANGES`` of the calculated changes run
+        at once.
+        """
+        local_state = NodeState(hostname=u'192.0.2.123')
+        actions = [
+            ControllableAction(result=Deferred())
+            for i in range(_loop.MAX_CONCURRENT_CHANGES + 1)
+        ]
+        deployer = ControllableDeployer(
+            local_state.hostname, [succeed(local_state)],
+            [in_parallel(changes=actions)],
+        )
+        loop = build_convergence_loop_fsm(Clock(), deployer)
+        loop.receive(_ClientStatusUpdate(
+            client=self.make_amp_client([local_state]),
+            configuration=object(), state=DeploymentState(nodes=[])))
+        started = [action for action in actions if action.called]
+        started[0].result.callback(None)
+        self.assertEqual(
+            (_loop.MAX_CONCURRENT_CHANGES, True),
+            (len(started), all(action.called for action in actions)),
+        )
+
     def assert_full_logging(self, logger):
         """
         A convergence action is logged inside the finite state maching
@@ -903,6 +934,193 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
              [(NodeStateCommand, dict(state_changes=(local_state2,)))]))
 
 
+def next_delay(reactor):
+    """
+    :param Clock reactor: A reactor with exactly one delayed call.
+
+    :return: The number of seconds until the delayed call is due.
+    """
+    [call] = reactor.getDelayedCalls()
+    return call.getTime() - reactor.seconds()
+
+
+class ConvergenceLoopScheduleTests(SynchronousTestCase):
+    """
+    Tests for how the FSM created by ``build_convergence_loop_fsm`` schedules
+    iterations.
+    """
+    def setUp(self):
+        self.local_state = NodeState(hostname=u'192.0.2.123')
+        self.configuration = Deployment(nodes=[to_node(self.local_state)])
+        self.state = DeploymentState(nodes=[self.local_state])
+        self.reactor = Clock()
+        self.client = FakeAMPClient()
+        self.client.register_response(
+            command=NodeStateCommand,
+            kwargs=dict(state_changes=(self.local_state,)),
+            response={"result": None},
+        )
+
+    def start_loop(self, actions, max_sleep=DEFAULT_MAX_SLEEP):
+        """
+        Start a convergence loop which always discovers the same local state.
+
+        :param list actions: The ``IStateChange``\ s to calculate for each
+            iteration.
+        :param float max_sleep: The ceiling on the delay between iterations.
+
+        :return: The started convergence loop FSM.
+        """
+        self.deployer = ControllableDeployer(
+            self.local_state.hostname,
+            [succeed(self.local_state) for action in actions], actions,
+        )
+        loop = build_convergence_loop_fsm(
+            self.reactor, self.deployer, max_sleep,
+        )
+        loop.receive(_ClientStatusUpdate(
+            client=self.client, configuration=self.configuration,
+            state=self.state))
+        return loop
+
+    def delays(self, count):
+        """
+        Let ``count`` scheduled iterations run.
+
+        :return: The delay before each of those iterations.
+        """
+        result = []
+        for i in range(count):
+            result.append(next_delay(self.reactor))
+            self.reactor.advance(result[-1])
+        return result
+
+    def test_idle_backoff(self):
+        """
+        Once the local state has been acknowledged, the delay before each
+        iteration that does nothing doubles, up to the ``max_sleep``
+        ceiling.
+        """
+        self.start_loop([in_parallel(changes=[]) for i in range(8)], 10.0)
+        self.assertEqual(
+            [1.0, 1.0, 2.0, 4.0, 8.0, 10.0, 10.0], self.delays(7),
+        )
+
+    def test_nested_no_op(self):
+        """
+        Nested compositions of changes which contain no changes count as
+        doing nothing.
+        """
+        self.start_loop([
+            sequentially(changes=[in_parallel(changes=[])]) for i in range(4)
+        ])
+        self.assertEqual([1.0, 1.0, 2.0], self.delays(3))
+
+    def test_busy_resets_backoff(self):
+        """
+        An iteration which runs some changes resets the delay to one second.
+        """
+        self.start_loop(
+            [in_parallel(changes=[]) for i in range(4)] +
+            [no_action(), in_parallel(changes=[]), in_parallel(changes=[])]
+        )
+        self.assertEqual(
+            [1.0, 1.0, 2.0, 4.0, 1.0, 1.0], self.delays(6),
+        )
+
+    def test_error_resets_backoff(self):
+        """
+        An iteration which fails resets the delay to one second.
+        """
+        self.start_loop(
+            [in_parallel(changes=[]) for i in range(4)] +
+            [ControllableAction(result=fail(CustomException())),
+             in_parallel(changes=[])]
+        )
+        delays = self.delays(5)
+        self.flushLoggedErrors(CustomException)
+        self.assertEqual([1.0, 1.0, 2.0, 4.0, 1.0], delays)
+
+    def test_status_update_while_sleeping(self):
+        """
+        A status update received while waiting for the next iteration starts
+        that iteration immediately, using the new configuration, and resets
+        the delay.
+        """
+        loop = self.start_loop([in_parallel(changes=[]) for i in range(5)])
+        self.delays(3)
+        configuration = Deployment()
+        loop.receive(_ClientStatusUpdate(
+            client=self.client, configuration=configuration,
+            state=self.state))
+        self.assertEqual(0, next_delay(self.reactor))
+        self.reactor.advance(0)
+        self.assertEqual(
+            (configuration, 1.0),
+            (self.deployer.calculate_inputs[-1][1],
+             next_delay(self.reactor)),
+        )
+
+    def test_status_update_while_converging(self):
+        """
+        A status update received during an iteration causes the next
+        iteration to start as soon as the current one finishes.
+        """
+        action = ControllableAction(result=Deferred())
+        loop = self.start_loop(
+            [in_parallel(changes=[]) for i in range(3)] + [action]
+        )
+        self.delays(3)
+        loop.receive(_ClientStatusUpdate(
+            client=self.client, configuration=self.configuration,
+            state=self.state))
+        action.result.callback(None)
+        self.assertEqual(0, next_delay(self.reactor))
+
+    def test_wakeup_while_sleeping(self):
+        """
+        A ``WAKEUP`` input received while waiting for the next iteration
+        starts that iteration immediately and resets the delay.
+        """
+        loop = self.start_loop([in_parallel(changes=[]) for i in range(5)])
+        self.delays(3)
+        loop.receive(ConvergenceLoopInputs.WAKEUP)
+        self.assertEqual(0, next_delay(self.reactor))
+        self.reactor.advance(0)
+        self.assertEqual(
+            (5, 1.0),
+            (len(self.deployer.calculate_inputs), next_delay(self.reactor)),
+        )
+
+    def test_wakeup_while_stopped(self):
+        """
+        A ``WAKEUP`` input is ignored by a stopped FSM.
+        """
+        loop = build_convergence_loop_fsm(
+            self.reactor, ControllableDeployer(u"192.168.1.1", [], []),
+        )
+        loop.receive(ConvergenceLoopInputs.WAKEUP)
+        self.assertEqual(
+            (ConvergenceLoopStates.STOPPED, []),
+            (loop.state, self.reactor.getDelayedCalls()),
+        )
+
+    def test_stop_while_sleeping(self):
+        """
+        A stop input received while waiting for the next iteration stops the
+        FSM without waiting for the delay to pass.
+        """
+        loop = self.start_loop([in_parallel(changes=[]) for i in range(4)])
+        self.delays(3)
+        loop.receive(ConvergenceLoopInputs.STOP)
+        self.reactor.advance(0)
+        self.assertEqual(
+            (ConvergenceLoopStates.STOPPED, [], 4),
+            (loop.state, self.reactor.getDelayedCalls(),
+             len(self.deployer.calculate_inputs)),
+        )
+
+
 class AgentLoopServiceTests(SynchronousTestCase):
     """
     Tests for ``AgentLoopService``.
@@ -985,6 +1203,69 @@ class AgentLoopServiceTests(SynchronousTestCase):
         self.assertEqual(fsm.inputted, [_StatusUpdate(configuration=config,
                                                       state=state)])
 
+    def test_local_changed(self):
+        """
+        When ``local_changed()`` is called a ``ConvergenceLoopInputs.WAKEUP``
+        input is passed to the convergence loop FSM.
+        """
+        service = self.service
+        service.convergence_loop = fsm = StubFSM()
+        service.local_changed()
+        self.assertEqual(fsm.inputted, [ConvergenceLoopInputs.WAKEUP])
+
+    def test_max_sleep(self):
+        """
+        The convergence loop uses the ``max_sleep`` given to the service.
+        """
+        built = []
+
+        def build(reactor, deployer, max_sleep):
+            built.append((reactor, deployer, max_sleep))
+            fsm = StubFSM()
+            fsm.logger = None
+            return fsm
+        self.patch(_loop, "build_convergence_loop_fsm", build)
+        AgentLoopService(
+            reactor=self.reactor, deployer=self.deployer, host=u"example.com",
+            port=1234, max_sleep=5.0, context_factory=ClientContextFactory())
+        self.assertEqual([(self.reactor, self.deployer, 5.0)], built)
+
+    def test_no_watch_paths(self):
+        """
+        Without any ``watch_paths`` the service has no children.
+        """
+        self.assertEqual([], list(self.service))
+
+    @skipUnless(platform.supportsINotify(),
+                "inotify is not supported on this platform.")
+    def test_watch_paths(self):
+        """
+        With ``watch_paths`` the service has a ``LocalChangeService`` child
+        which watches them and calls ``local_changed``.
+        """
+        paths = (FilePath(b"/dev"),)
+        service = AgentLoopService(
+            reactor=self.reactor, deployer=self.deployer, host=u"example.com",
+            port=1234, watch_paths=paths,
+            context_factory=ClientContextFactory())
+        [child] = list(service)
+        self.assertEqual(
+            (LocalChangeService, self.reactor, paths, service.local_changed),
+            (child.__class__, child.reactor, child.paths, child.changed),
+        )
+
+    def test_watch_paths_unsupported(self):
+        """
+        Where ``inotify`` isn't supported ``watch_paths`` are not watched and
+        the service has no children.
+        """
+        self.patch(_loop.platform, "supportsINotify", lambda: False)
+        service = AgentLoopService(
+            reactor=self.reactor, deployer=self.deployer, host=u"example.com",
+            port=1234, watch_paths=(FilePath(b"/dev"),),
+            context_factory=ClientContextFactory())
+        self.assertEqual([], list(service))
+
 
 def _build_service(test):
     """
@@ -997,6 +1278,46 @@ def _build_service(test):
     return service
 
 
+class LocalChangeServiceTests(TestCase):
+    """
+    Tests for ``LocalChangeService``.
+    """
+    if not platform.supportsINotify():
+        skip = "inotify is not supported on this platform."
+
+    def setUp(self):
+        self.directory = FilePath(self.mktemp())
+        self.directory.makedirs()
+        self.changed = Deferred()
+        self.service = LocalChangeService(
+            real_reactor, [self.directory],
+            lambda: self.changed.callback(None),
+        )
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+
+    def test_created(self):
+        """
+        Creating an entry in a watched directory is reported.
+        """
+        self.directory.child(b"device").touch()
+        return self.changed
+
+    def test_removed(self):
+        """
+        Removing an entry from a watched directory is reported.
+        """
+        child = self.directory.child(b"device")
+        child.touch()
+        self.changed.addCallback(lambda ignored: self._removed(child))
+        return self.changed
+
+    def _removed(self, child):
+        self.changed = Deferred()
+        child.remove()
+        return self.changed
+
+
 class AgentLoopServiceInterfaceTests(
         iconvergence_agent_tests_factory(_build_service)):
     """
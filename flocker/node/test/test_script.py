@@ -32,10 +32,11 @@ from ..script import (
     AgentService, BackendDescription, get_configuration,
     DeployerType, _get_external_ip, LOG_GET_EXTERNAL_IP
 )
+from ..agents.blockdevice import ProcessLifetimeCache
 from ..agents.cinder import CinderBlockDeviceAPI
 from ..agents.ebs import EBSBlockDeviceAPI
 
-from .._loop import AgentLoopService
+from .._loop import AgentLoopService, DEFAULT_MAX_SLEEP
 from ...testtools import MemoryCoreReactor, random_name
 from ...ca.testtools import get_credential_sets
 
@@ -226,6 +227,20 @@ class AgentServiceFromConfigurationTests(SynchronousTestCase):
             ),
         )
 
+    def test_max_sleep(self):
+        """
+        ``AgentService.from_configuration`` loads the ceiling on the delay
+        between convergence loop iterations from the ``convergence`` section
+        of the configuration.
+        """
+        setup_config(self)
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        config = get_configuration(options)
+        config[u"convergence"] = {u"max-sleep": 120}
+        agent_service = AgentService.from_configuration(config)
+        self.assertEqual(120.0, agent_service.max_sleep)
+
 
 class AgentServiceGetAPITests(SynchronousTestCase):
     """
@@ -460,6 +475,68 @@ class AgentServiceDeployerTests(SynchronousTestCase):
             deployer,
         )
 
+    def block_agent_service(self, **kwargs):
+        """
+        :param kwargs: Extra fields of the ``BackendDescription``.
+
+        :return: An ``AgentService`` using a ``DeployerType.block`` backend
+            and the default deployers.
+        """
+        return self.agent_service.set(
+            "get_external_ip", lambda host, port: u"192.0.2.7",
+        ).set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=None, deployer_type=DeployerType.block,
+                    **kwargs
+                ),
+            ],
+        )
+
+    def test_block_threadpool(self):
+        """
+        The API of a ``DeployerType.block`` backend is called in a thread
+        pool of its own, sized by the backend's ``threads`` and stopped when
+        the reactor shuts down.
+        """
+        agent_service = self.block_agent_service(threads=3)
+        deployer = agent_service.get_deployer(DUMMY_API)
+        threadpool = deployer.threadpool
+        self.reactor.fireSystemEvent("shutdown")
+        self.assertEqual(
+            (3, self.agent_service.backend_name, False),
+            (threadpool.max, threadpool.name, threadpool.started),
+        )
+
+    def test_block_async_api(self):
+        """
+        A ``DeployerType.block`` backend's ``async_api_factory`` is called
+        with the reactor, the API and a callable which invalidates the
+        deployer's cache, to create the deployer's asynchronous API.  No
+        thread pool is used.
+        """
+        calls = []
+        async_api = object()
+
+        def async_api_factory(reactor, api, changed):
+            calls.append((reactor, api, changed))
+            return async_api
+
+        agent_service = self.block_agent_service(
+            async_api_factory=async_api_factory,
+        )
+        deployer = agent_service.get_deployer(DUMMY_API)
+        [(reactor, api, changed)] = calls
+        cache = deployer.block_device_api
+        self.assertEqual(
+            (self.reactor, DUMMY_API, ProcessLifetimeCache,
+             cache.invalidate, None, async_api),
+            (reactor, api, cache.__class__, changed, deployer.threadpool,
+             deployer.async_block_device_api),
+        )
+
 
 class AgentServiceLoopTests(SynchronousTestCase):
     """
@@ -482,6 +559,8 @@ class AgentServiceLoopTests(SynchronousTestCase):
                 deployer=deployer,
                 host=self.host,
                 port=self.port,
+                max_sleep=DEFAULT_MAX_SLEEP,
+                watch_paths=(FilePath(b"/dev"),),
                 context_factory=context_factory,
             ),
             loop_service,
@@ -917,6 +996,24 @@ class ValidateConfigurationTests(SynchronousTestCase):
         self.assertRaises(
             ValidationError, validate_configuration, self.configuration)
 
+    def test_valid_max_sleep(self):
+        """
+        No exception is raised when validating a configuration with a
+        ceiling on the delay between convergence loop iterations.
+        """
+        self.configuration['convergence'] = {u"max-sleep": 120}
+        # Nothing is raised
+        validate_configuration(self.configuration)
+
+    def test_error_on_small_max_sleep(self):
+        """
+        The ceiling on the delay between convergence loop iterations must be
+        at least one second.
+        """
+        self.configuration['convergence'] = {u"max-sleep": 0.5}
+        self.assertRaises(
+            ValidationError, validate_configuration, self.configuration)
+
 
 class DatasetAgentOptionsTests(
         make_amp_agent_options_tests(DatasetAgentOptions)
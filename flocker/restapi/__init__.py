@@ -6,6 +6,7 @@ Infrastructure for publishing a REST HTTP API.
 
 from ._infrastructure import (
     structured, EndpointResponse, user_documentation, private_api,
+    conditional,
     )
 
 from ._error import makeBadRequest as make_bad_request
@@ -13,5 +14,5 @@ from ._error import makeBadRequest as make_bad_request
 
 __all__ = [
     "structured", "EndpointResponse", "user_documentation",
-    "make_bad_request", "private_api",
+    "make_bad_request", "private_api", "conditional",
 ]
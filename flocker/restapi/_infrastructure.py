@@ -6,23 +6,27 @@ This module implements tools for exposing Python methods as API endpoints.
 from __future__ import absolute_import
 
 __all__ = [
-    "EndpointResponse", "structured", "user_documentation",
+    "EndpointResponse", "structured", "user_documentation", "conditional",
     ]
 
 from functools import wraps
+from random import random
+from weakref import WeakKeyDictionary
 
 from json import loads, dumps
 
+from jsonschema.exceptions import ValidationError
+
 from pyrsistent import PRecord, field, pvector
 
 from twisted.internet.defer import maybeDeferred
-from twisted.web.http import OK, INTERNAL_SERVER_ERROR
+from twisted.web.http import OK, INTERNAL_SERVER_ERROR, NOT_MODIFIED
 
 from eliot import Logger, writeFailure, Action
 from eliot.twisted import DeferredContext
 
 from ._error import DECODING_ERROR, BadRequest, InvalidRequestJSON
-from ._logging import LOG_SYSTEM, REQUEST, JSON_REQUEST
+from ._logging import LOG_SYSTEM, REQUEST, JSON_REQUEST, INVALID_RESPONSE
 from ._schema import getValidator
 
 _ASCENDING = b"ascending"
@@ -64,6 +68,30 @@ def _get_logger(self):
         return logger
 
 
+def _output_validation_rate(self):
+    """
+    Find the fraction of responses of an endpoint to validate.
+
+    The object the endpoint is a method of may have an
+    ``output_validation_rate`` attribute giving the fraction of responses to
+    validate, chosen at random.  By default every response is validated.
+
+    :return: The fraction of responses to validate.
+    """
+    return getattr(self, "output_validation_rate", 1)
+
+
+def _should_validate(rate):
+    """
+    Decide whether to validate the output of an endpoint for one response.
+
+    :param rate: The fraction of responses to validate.
+
+    :return bool: Whether to validate the response.
+    """
+    return rate >= 1 or random() < rate
+
+
 def _logging(original):
     """
     Decorate a method which implements an API endpoint to add Eliot-based
@@ -151,12 +179,21 @@ def _serialize(outputValidator):
         of a Klein route endpoint that may return a Deferred.
     """
     def deco(original):
-        def success(result, request):
+        def success(result, request, rate, logger):
             code = OK
             if isinstance(result, EndpointResponse):
                 code = result.code
                 result = result.result
-            outputValidator.validate(result)
+            if _should_validate(rate):
+                try:
+                    outputValidator.validate(result)
+                except ValidationError as e:
+                    # Only a sample of responses is validated, so failing
+                    # this one would make errors appear at random; the
+                    # mismatch is logged for the sample to show instead.
+                    if rate >= 1:
+                        raise
+                    INVALID_RESPONSE(error=e.message).write(logger)
             request.responseHeaders.setRawHeaders(
                 b"content-type", [b"application/json"])
             request.setResponseCode(code)
@@ -164,7 +201,10 @@ def _serialize(outputValidator):
 
         def doit(self, request, **routeArguments):
             result = maybeDeferred(original, self, request, **routeArguments)
-            result.addCallback(success, request)
+            result.addCallback(
+                success, request, _output_validation_rate(self),
+                _get_logger(self),
+            )
             return result
 
         return doit
@@ -188,7 +228,11 @@ def structured(inputSchema, outputSchema, schema_store=None,
         original(foo="bar")
 
     The encoded form of the object returned by C{original} will define the
-    response body.
+    response body.  It is validated against C{outputSchema}, unless the
+    object the endpoint is a method of has an ``output_validation_rate``
+    attribute below ``1``, in which case only that fraction of responses is
+    validated and a response which doesn't match is logged rather than
+    failed.
 
     :param inputSchema: JSON Schema describing the request body.
     :param outputSchema: JSON Schema describing the response body.
@@ -254,6 +298,118 @@ def structured(inputSchema, outputSchema, schema_store=None,
     return deco
 
 
+def _none_match(request, etag):
+    """
+    Determine whether the entity tag of the current representation of a
+    resource matches the ``If-None-Match`` header of a request for it.
+
+    :param request: The request.
+    :param bytes etag: The quoted entity tag of the representation.
+
+    :return: ``True`` if the client already has the representation.
+    """
+    for header in request.requestHeaders.getRawHeaders(
+            b"if-none-match", []):
+        for tag in header.split(b","):
+            tag = tag.strip()
+            if tag.startswith(b"W/"):
+                tag = tag[2:]
+            if tag in (etag, b"*"):
+                return True
+    return False
+
+
+def _preferred_wait(request, maximum):
+    """
+    Find how long a client is prepared to wait for a response, according to
+    the ``wait`` preference of its ``Prefer`` header (RFC 7240).
+
+    :param request: The request.
+    :param maximum: The most seconds to wait, whatever the client prefers.
+
+    :return: The number of seconds to wait, ``0`` if the client didn't ask
+        to wait.
+    """
+    for header in request.requestHeaders.getRawHeaders(b"prefer", []):
+        for preference in header.split(b","):
+            name, _, value = preference.split(b";")[0].partition(b"=")
+            if name.strip().lower() == b"wait":
+                try:
+                    wait = float(value.strip())
+                except ValueError:
+                    continue
+                return max(0, min(wait, maximum))
+    return 0
+
+
+def conditional(get_etag, wait_for_change=None, maximum_wait=60):
+    """
+    Decorate a ``structured`` Klein-style ``GET`` endpoint method so that its
+    responses carry an ``ETag`` header and conditional requests are honored.
+
+    A request with an ``If-None-Match`` header matching the current entity
+    tag gets an empty ``NOT_MODIFIED`` response.  The body of the most recent
+    successful response is kept along with its entity tag and served again
+    for as long as the entity tag stays the same.  Either way the endpoint is
+    not called, so neither the response nor its validation and encoding are
+    repeated.
+
+    A conditional request which also asks to wait using the ``Prefer``
+    header is a long poll: rather than a ``NOT_MODIFIED`` response straight
+    away it gets the new response as soon as the entity tag changes, or a
+    ``NOT_MODIFIED`` response once it has waited as long as it asked to.
+
+    :param get_etag: A one-argument callable which is called with the object
+        the endpoint is a method of and returns the current entity tag as
+        ``bytes``, including quotes.  The entity tag must change whenever the
+        result of the endpoint might.
+    :param wait_for_change: ``None`` if long polls aren't supported.
+        Otherwise a two-argument callable which is called with the object
+        the endpoint is a method of and a number of seconds, and returns a
+        cancellable ``Deferred`` which fires once the entity tag may have
+        changed or once that many seconds have passed.
+    :param maximum_wait: The most seconds a long poll waits for.
+    """
+    def deco(original):
+        bodies = WeakKeyDictionary()
+
+        def respond(self, request, wait, routeArguments):
+            etag = get_etag(self)
+            if _none_match(request, etag):
+                if wait:
+                    waiting = wait_for_change(self, wait)
+                    waiting.addCallback(
+                        lambda _: respond(self, request, 0, routeArguments))
+                    return waiting
+                request.responseHeaders.setRawHeaders(b"etag", [etag])
+                request.setResponseCode(NOT_MODIFIED)
+                return b""
+            cached = bodies.get(self)
+            if cached is not None and cached[0] == etag:
+                request.responseHeaders.setRawHeaders(b"etag", [etag])
+                request.responseHeaders.setRawHeaders(
+                    b"content-type", [b"application/json"])
+                return cached[1]
+
+            def rendered(body):
+                if request.code == OK:
+                    request.responseHeaders.setRawHeaders(b"etag", [etag])
+                    bodies[self] = (etag, body)
+                return body
+            result = maybeDeferred(original, self, request, **routeArguments)
+            result.addCallback(rendered)
+            return result
+
+        @wraps(original)
+        def conditionally(self, request, **routeArguments):
+            wait = 0
+            if wait_for_change is not None:
+                wait = _preferred_wait(request, maximum_wait)
+            return respond(self, request, wait, routeArguments)
+        return conditionally
+    return deco
+
+
 class UserDocumentation(PRecord):
     """
     """
@@ -7,9 +7,10 @@ This module defines the Eliot log events emitted by the API implementation.
 __all__ = [
     "JSON_REQUEST",
     "REQUEST",
+    "INVALID_RESPONSE",
     ]
 
-from eliot import Field, ActionType
+from eliot import Field, ActionType, MessageType
 
 LOG_SYSTEM = u"api"
 
@@ -38,3 +39,10 @@ JSON_REQUEST = ActionType(
     [JSON],
     [RESPONSE_CODE, JSON],
     u"A request containing JSON request and response bodies.")
+INVALID_RESPONSE = MessageType(
+    LOG_SYSTEM + u":invalid_response",
+    [Field.forTypes(
+        u"error", [unicode, bytes],
+        u"Why the response body doesn't match the output schema.")],
+    u"A response body which was sampled for validation doesn't match the "
+    u"output schema.  It was sent anyway.")
@@ -8,24 +8,28 @@ from klein import Klein
 
 from eliot import ActionType
 from eliot.testing import (
-    assertHasAction, capture_logging, LoggedAction, validateLogging,
+    assertHasAction, capture_logging, LoggedAction, LoggedMessage,
+    validateLogging,
 )
 
 from pyrsistent import pvector
 
 from twisted.python.constants import Names, NamedConstant
 from twisted.python.failure import Failure
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import succeed, fail, Deferred
 from twisted.web.http_headers import Headers
 from twisted.web.http import (
     BAD_REQUEST, INTERNAL_SERVER_ERROR, PAYMENT_REQUIRED, GONE,
-    NOT_ALLOWED, NOT_FOUND, OK)
+    NOT_ALLOWED, NOT_FOUND, NOT_MODIFIED, OK)
 
 from twisted.trial.unittest import SynchronousTestCase
 
+from .. import _infrastructure
 from .._infrastructure import (
-    EndpointResponse, user_documentation, structured, UserDocumentation)
-from .._logging import REQUEST, JSON_REQUEST
+    EndpointResponse, user_documentation, structured, UserDocumentation,
+    conditional,
+)
+from .._logging import REQUEST, JSON_REQUEST, INVALID_RESPONSE
 from .._error import DECODING_ERROR_DESCRIPTION, BadRequest
 
 from ..testtools import (EventChannel, dumps, loads,
@@ -703,3 +707,282 @@ class TracingTests(SynchronousTestCase):
             Headers({b"X-Eliot-Task-Id": [b"garbage!"]}), b"")
         render(app.app.resource(), request)
         self.assertTrue(app.called)
+
+
+class ConditionalTests(SynchronousTestCase):
+    """
+    Tests for ``conditional``.
+    """
+    class Application(object):
+        app = Klein()
+        etag = b'"1"'
+        calls = 0
+        code = OK
+
+        @app.route(b"/foo")
+        @conditional(lambda self: self.etag)
+        @structured({}, {})
+        def foo(self):
+            self.calls += 1
+            return EndpointResponse(self.code, [self.calls])
+
+    def get(self, app, headers=None):
+        """
+        Issue a ``GET`` request for the conditional endpoint.
+
+        :param app: The ``Application``.
+        :param dict headers: Request headers.
+
+        :return: The rendered request.
+        """
+        request = dummyRequest(b"GET", b"/foo", Headers(headers or {}), b"")
+        render(app.app.resource(), request)
+        return request
+
+    def test_etag(self):
+        """
+        A successful response includes the entity tag.
+        """
+        request = self.get(self.Application())
+        self.assertEqual(
+            (OK, [b'"1"'], [1]),
+            (request.code, request.responseHeaders.getRawHeaders(b"etag"),
+             loads(request._responseBody)),
+        )
+
+    def test_error_no_etag(self):
+        """
+        An unsuccessful response doesn't include an entity tag.
+        """
+        app = self.Application()
+        app.code = GONE
+        request = self.get(app)
+        self.assertEqual(
+            (GONE, None),
+            (request.code, request.responseHeaders.getRawHeaders(b"etag")),
+        )
+
+    def test_not_modified(self):
+        """
+        A request with an ``If-None-Match`` header including the current
+        entity tag gets an empty ``NOT_MODIFIED`` response without calling the
+        endpoint.
+        """
+        app = self.Application()
+        request = self.get(
+            app, {b"if-none-match": [b'"0", W/"1"']})
+        self.assertEqual(
+            (NOT_MODIFIED, [b'"1"'], b"", 0),
+            (request.code, request.responseHeaders.getRawHeaders(b"etag"),
+             request._responseBody, app.calls),
+        )
+
+    def test_modified(self):
+        """
+        A request with an ``If-None-Match`` header which doesn't include the
+        current entity tag gets the full response.
+        """
+        app = self.Application()
+        request = self.get(app, {b"if-none-match": [b'"0"']})
+        self.assertEqual(
+            (OK, [1]), (request.code, loads(request._responseBody)),
+        )
+
+    def test_cached(self):
+        """
+        While the entity tag is unchanged the body of the last response is
+        served again without calling the endpoint.
+        """
+        app = self.Application()
+        self.get(app)
+        request = self.get(app)
+        self.assertEqual(
+            (OK, [b"application/json"], [1], 1),
+            (request.code,
+             request.responseHeaders.getRawHeaders(b"content-type"),
+             loads(request._responseBody), app.calls),
+        )
+
+    def test_changed(self):
+        """
+        Once the entity tag changes the endpoint is called again.
+        """
+        app = self.Application()
+        self.get(app)
+        app.etag = b'"2"'
+        request = self.get(app)
+        self.assertEqual(
+            ([b'"2"'], [2]),
+            (request.responseHeaders.getRawHeaders(b"etag"),
+             loads(request._responseBody)),
+        )
+
+
+class LongPollTests(SynchronousTestCase):
+    """
+    Tests for ``conditional`` with ``wait_for_change``.
+    """
+    class Application(object):
+        app = Klein()
+        etag = b'"1"'
+
+        def __init__(self):
+            self.waits = []
+
+        def wait(self, seconds):
+            waiting = Deferred()
+            self.waits.append((seconds, waiting))
+            return waiting
+
+        @app.route(b"/foo")
+        @conditional(lambda self: self.etag,
+                     lambda self, seconds: self.wait(seconds),
+                     maximum_wait=10)
+        @structured({}, {})
+        def foo(self):
+            return [self.etag]
+
+    def get(self, app, prefer):
+        """
+        Issue a conditional ``GET`` request for the current entity tag.
+
+        :param app: The ``Application``.
+        :param bytes prefer: The ``Prefer`` header.
+
+        :return: The request, which may not be rendered yet.
+        """
+        request = dummyRequest(b"GET", b"/foo", Headers({
+            b"if-none-match": [app.etag], b"prefer": [prefer],
+        }), b"")
+        render(app.app.resource(), request)
+        return request
+
+    def test_waits(self):
+        """
+        A conditional request which prefers to wait doesn't get a response
+        until the entity tag changes.
+        """
+        app = self.Application()
+        request = self.get(app, b"respond-async, wait=5")
+        self.assertEqual(([5], False), (
+            [seconds for seconds, _ in app.waits], request._finished))
+
+    def test_changed(self):
+        """
+        Once the entity tag changes the waiting request gets the new
+        response.
+        """
+        app = self.Application()
+        request = self.get(app, b"wait=5")
+        app.etag = b'"2"'
+        app.waits[0][1].callback(None)
+        self.assertEqual(
+            (OK, [b'"2"'], [u'"2"']),
+            (request.code, request.responseHeaders.getRawHeaders(b"etag"),
+             loads(request._responseBody)),
+        )
+
+    def test_timed_out(self):
+        """
+        If the wait ends without the entity tag changing the waiting request
+        gets a ``NOT_MODIFIED`` response.
+        """
+        app = self.Application()
+        request = self.get(app, b"wait=5")
+        app.waits[0][1].callback(None)
+        self.assertEqual(
+            (NOT_MODIFIED, True, 1),
+            (request.code, request._finished, len(app.waits)),
+        )
+
+    def test_maximum(self):
+        """
+        Requests don't wait longer than the maximum wait.
+        """
+        app = self.Application()
+        self.get(app, b"wait=1000")
+        self.assertEqual([10], [seconds for seconds, _ in app.waits])
+
+    def test_no_preference(self):
+        """
+        A conditional request which doesn't prefer to wait gets a
+        ``NOT_MODIFIED`` response straight away.
+        """
+        app = self.Application()
+        request = self.get(app, b"respond-async")
+        self.assertEqual(
+            (NOT_MODIFIED, []), (request.code, app.waits),
+        )
+
+
+class OutputValidationSamplingTests(SynchronousTestCase):
+    """
+    Tests for sampling the responses whose output ``structured`` validates.
+    """
+    class Application(object):
+        app = Klein()
+
+        def __init__(self, output_validation_rate, logger):
+            self.output_validation_rate = output_validation_rate
+            self.logger = logger
+
+        @app.route(b"/foo")
+        @structured({}, {u"type": u"integer"})
+        def foo(self):
+            return u"not an integer"
+
+    def get(self, rate, logger):
+        """
+        Request invalid output.
+
+        :param rate: The ``output_validation_rate`` of the application.
+        :param logger: The ``Logger`` of the application.
+
+        :return: The response code.
+        """
+        request = dummyRequest(b"GET", b"/foo", Headers(), b"")
+        render(self.Application(rate, logger).app.resource(), request)
+        return request.code
+
+    @validateLogging(None)
+    def test_all(self, logger):
+        """
+        With a rate of ``1`` every response is validated and a response which
+        doesn't match the schema fails.
+        """
+        self.patch(_infrastructure, "random", lambda: 0.99)
+        self.assertEqual(
+            (INTERNAL_SERVER_ERROR, 1, []),
+            (self.get(1, logger),
+             len(logger.flushTracebacks(ValidationError)),
+             LoggedMessage.of_type(logger.messages, INVALID_RESPONSE)),
+        )
+
+    @validateLogging(None)
+    def test_none(self, logger):
+        """
+        With a rate of ``0`` no response is validated.
+        """
+        self.patch(_infrastructure, "random", lambda: 0)
+        self.assertEqual(
+            (OK, []),
+            (self.get(0, logger),
+             LoggedMessage.of_type(logger.messages, INVALID_RESPONSE)),
+        )
+
+    @validateLogging(None)
+    def test_sampled(self, logger):
+        """
+        Responses are validated when a random number is below the rate.  A
+        sampled response which doesn't match the schema is logged and sent
+        anyway.
+        """
+        results = []
+        for sample in [0.09, 0.1]:
+            self.patch(_infrastructure, "random", lambda: sample)
+            results.append(self.get(0.1, logger))
+        self.assertEqual(
+            ([OK, OK], 1),
+            (results,
+             len(LoggedMessage.of_type(logger.messages, INVALID_RESPONSE))),
+        )